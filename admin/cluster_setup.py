@@ -455,7 +455,7 @@ def make_client(reactor, cluster):
     user_cert = certificates_path.child(b"user.crt")
     user_key = certificates_path.child(b"user.key")
     return FlockerClient(reactor, control_node, REST_API_PORT,
-                         cluster_cert, user_cert, user_key)
+                         cluster_cert, user_cert, user_key, persistent=True)
 
 
 def wait_for_nodes(reactor, client, count):
@@ -10,9 +10,12 @@ from ._client import (
     IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetState,
     DatasetAlreadyExists, FlockerClient, Lease, LeaseAlreadyHeld,
     conditional_create, DatasetsConfiguration, Node, MountedDataset,
+    CreateDataset, MoveDataset, ResizeDataset, DeleteDataset, Watched,
 )
 
 __all__ = ["IFlockerAPIV1Client", "FakeFlockerClient", "Dataset",
            "DatasetState", "DatasetAlreadyExists", "FlockerClient",
            "Lease", "LeaseAlreadyHeld", "conditional_create",
-           "DatasetsConfiguration", "Node", "MountedDataset", ]
+           "DatasetsConfiguration", "Node", "MountedDataset",
+           "CreateDataset", "MoveDataset", "ResizeDataset", "DeleteDataset",
+           "Watched", ]
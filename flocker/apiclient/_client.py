@@ -4,10 +4,12 @@
 Client for the Flocker REST API.
 """
 
+from collections import OrderedDict
 from uuid import UUID, uuid4
 from json import dumps
 from datetime import datetime
 from os import environ
+from urllib import quote, urlencode
 
 from ipaddr import IPv4Address, IPv6Address, IPAddress
 
@@ -20,13 +22,15 @@ from pyrsistent import PClass, field, pmap_field, pmap
 from eliot import ActionType, Field
 from eliot.twisted import DeferredContext
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import Deferred, succeed, fail
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
-    CREATED, OK, CONFLICT, NOT_FOUND, PRECONDITION_FAILED,
+    CREATED, OK, CONFLICT, NOT_FOUND, NOT_MODIFIED, PRECONDITION_FAILED,
+    NOT_ALLOWED,
 )
 from twisted.internet.utils import getProcessOutput
 from twisted.internet.task import deferLater
+from twisted.web.client import HTTPConnectionPool
 
 from treq import json_content, content
 
@@ -52,6 +56,19 @@ _LOG_CONDITIONAL_CREATE = ActionType(
 
 NoneType = type(None)
 
+_GENERATION_HEADER = b"X-Generation"
+
+# The number of idle connections to the control service a persistent
+# ``FlockerClient`` keeps open:
+DEFAULT_POOL_SIZE = 10
+
+# The number of seconds a persistent ``FlockerClient`` keeps an idle
+# connection open:
+DEFAULT_IDLE_TIMEOUT = 60
+
+# The number of listings a caching ``FlockerClient`` remembers:
+DEFAULT_CACHE_SIZE = 100
+
 
 class ServerResponseMissingElementError(Exception):
     """
@@ -236,6 +253,261 @@ class DatasetsConfiguration(PClass):
         return self.datasets.itervalues()
 
 
+class Watched(PClass):
+    """
+    A listing returned by one of the ``watch_*`` methods.
+
+    :ivar generation: The generation of what was listed, to pass to the next
+        call; ``None`` if the server doesn't support waiting for changes, in
+        which case every call returns straight away.
+    :ivar value: The listing, as returned by the corresponding ``list_*``
+        method.
+    """
+    generation = field(type=(int, long, NoneType), mandatory=True)
+    value = field(mandatory=True)
+
+
+def _watched((value, headers)):
+    """
+    :param value: A parsed listing.
+    :param headers: The response headers of the listing.
+
+    :return: A ``Watched`` of the listing.
+    """
+    generation = headers.getRawHeaders(_GENERATION_HEADER, [None])[0]
+    if generation is not None:
+        generation = int(generation)
+    return Watched(generation=generation, value=value)
+
+
+class _ResponseCache(object):
+    """
+    Parsed listings retrieved by a ``FlockerClient``, with the entity tags
+    of the responses they were parsed from.
+
+    A listing younger than the time-to-live is reused as it is.  An older
+    one is revalidated with the server, and reused if the server confirms
+    it hasn't changed.
+
+    :ivar _clock: ``IReactorTime`` provider.
+    :ivar _ttl: The number of seconds a listing is reused without asking
+        the server.
+    :ivar int _size: The largest number of listings to remember.
+    :ivar OrderedDict _entries: Map the key of each listing to a tuple of
+        its entity tag, the time until which it is reused without asking the
+        server, and the parsed listing, least recently used first.
+    :ivar int _epoch: The number of times the cache was cleared.  Listings
+        requested before the latest clearing may predate the change that
+        caused it, so they aren't stored.
+    """
+    def __init__(self, clock, ttl, size):
+        self._clock = clock
+        self._ttl = ttl
+        self._size = size
+        self._entries = OrderedDict()
+        self._epoch = 0
+
+    def clear(self):
+        """
+        Forget every listing, including those still being retrieved.
+        """
+        self._entries.clear()
+        self._epoch += 1
+
+    def get(self, key, retrieve):
+        """
+        :param key: Identifies the listing.
+        :param retrieve: One-argument callable taking the entity tag to send
+            in an ``If-None-Match`` header, or ``None``, and returning a
+            ``Deferred`` firing with a tuple of the parsed listing, or
+            ``None`` if the server says it is unchanged, and the response
+            headers.
+
+        :return: ``Deferred`` firing with the parsed listing.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._entries[key] = entry
+            if self._clock.seconds() < entry[1]:
+                return succeed(entry[2])
+        epoch = self._epoch
+
+        def got_result((result, headers)):
+            if result is None:
+                result = entry[2]
+            if epoch != self._epoch:
+                return result
+            etag = headers.getRawHeaders(b"ETag", [None])[0]
+            self._entries.pop(key, None)
+            if etag is not None:
+                self._entries[key] = (
+                    etag, self._clock.seconds() + self._ttl, result)
+                while len(self._entries) > self._size:
+                    self._entries.popitem(last=False)
+            return result
+        d = retrieve(None if entry is None else entry[0])
+        d.addCallback(got_result)
+        return d
+
+
+class CreateDataset(PClass):
+    """
+    An operation creating a dataset, for ``change_datasets``.
+
+    The fields are the parameters of ``IFlockerAPIV1Client.create_dataset``.
+    """
+    primary = field(type=UUID, mandatory=True)
+    maximum_size = field(type=(int, NoneType), initial=None)
+    dataset_id = field(type=(UUID, NoneType), initial=None)
+    metadata = pmap_field(unicode, unicode)
+
+
+class MoveDataset(PClass):
+    """
+    An operation moving a dataset to another node, for ``change_datasets``.
+
+    :ivar UUID dataset_id: The dataset to move.
+    :ivar UUID primary: The node where the dataset should manifest.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+    primary = field(type=UUID, mandatory=True)
+
+
+class ResizeDataset(PClass):
+    """
+    An operation changing the maximum size of a dataset, for
+    ``change_datasets``.
+
+    :ivar UUID dataset_id: The dataset to resize.
+    :ivar maximum_size: The new size in bytes (as ``int``) or ``None`` for
+        no particular size.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+    maximum_size = field(type=(int, NoneType), mandatory=True)
+
+
+class DeleteDataset(PClass):
+    """
+    An operation deleting a dataset, for ``change_datasets``.
+
+    :ivar UUID dataset_id: The dataset to delete.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+
+
+def _encode_dataset_operation(operation):
+    """
+    :param operation: A ``CreateDataset``, ``MoveDataset``,
+        ``ResizeDataset`` or ``DeleteDataset``.
+
+    :return: The operation as it is sent in a bulk dataset request.
+    """
+    if isinstance(operation, CreateDataset):
+        encoded = {u"operation": u"create",
+                   u"primary": unicode(operation.primary),
+                   u"metadata": dict(operation.metadata)}
+        if operation.dataset_id is not None:
+            encoded[u"dataset_id"] = unicode(operation.dataset_id)
+        if operation.maximum_size is not None:
+            encoded[u"maximum_size"] = operation.maximum_size
+        return encoded
+    encoded = {u"dataset_id": unicode(operation.dataset_id)}
+    if isinstance(operation, MoveDataset):
+        encoded.update(operation=u"move", primary=unicode(operation.primary))
+    elif isinstance(operation, ResizeDataset):
+        encoded.update(
+            operation=u"resize", maximum_size=operation.maximum_size)
+    else:
+        encoded.update(operation=u"delete")
+    return encoded
+
+
+def _matches_dataset(dataset, node_uuid, dataset_id, metadata=pmap()):
+    """
+    :param dataset: A ``Dataset`` or ``DatasetState``.
+    :param node_uuid: ``None`` or the ``UUID`` its primary must be.
+    :param dataset_id: ``None`` or the ``UUID`` it must have.
+    :param metadata: Keys and values its metadata must include.
+
+    :return: Whether the dataset matches.
+    """
+    return (
+        (node_uuid is None or dataset.primary == node_uuid) and
+        (dataset_id is None or dataset.dataset_id == dataset_id) and
+        all(dataset.metadata.get(key) == value
+            for (key, value) in metadata.items())
+    )
+
+
+def _matches_container(container, node_uuid, dataset_id):
+    """
+    :param container: A ``Container`` or ``ContainerState``.
+    :param node_uuid: ``None`` or the ``UUID`` of the node it must be on.
+    :param dataset_id: ``None`` or the ``UUID`` of a dataset it must mount.
+
+    :return: Whether the container matches.
+    """
+    return (
+        (node_uuid is None or container.node_uuid == node_uuid) and
+        (dataset_id is None or
+         any(volume.dataset_id == dataset_id
+             for volume in container.volumes or ()))
+    )
+
+
+def _unicode_or_none(value):
+    """
+    :return: ``None`` if ``value`` is ``None``, otherwise it as ``unicode``.
+    """
+    if value is None:
+        return None
+    return unicode(value)
+
+
+def _by_metadata_path(key, value):
+    """
+    :param unicode key: A metadata key.
+    :param unicode value: A value for it.
+
+    :return: The ``bytes`` to add to the path of the configured datasets to
+        refer to those with the given metadata value.
+    """
+    return b"/by_metadata/%s/%s" % (
+        quote(key.encode("utf-8"), safe=b""),
+        quote(value.encode("utf-8"), safe=b""))
+
+
+def _check_unique_key(metadata, unique_key):
+    """
+    :param metadata: The metadata of a dataset to be created.
+    :param unique_key: ``None`` or a metadata key whose value must be unique.
+
+    :raise ValueError: If ``metadata`` has no value for ``unique_key``.
+    """
+    if unique_key is not None and unique_key not in metadata:
+        raise ValueError(
+            "The metadata has no value for the unique key {!r}.".format(
+                unique_key))
+
+
+def _if_unsupported(reason, fallback, *args):
+    """
+    Errback for requests to the metadata lookup routes, which older servers
+    don't provide and which only support indexed metadata keys.
+
+    :param Failure reason: The failure of the request.
+    :param fallback: Called with ``args`` if the server responded that the
+        route is unknown, to get the result some other way.
+
+    :return: The result of ``fallback``, or ``reason`` if the request failed
+        for another reason.
+    """
+    reason.trap(ResponseError)
+    if reason.value.code not in (NOT_FOUND, NOT_ALLOWED):
+        return reason
+    return fallback(*args)
+
+
 class IFlockerAPIV1Client(Interface):
     """
     The Flocker REST API v1 client.
@@ -245,7 +517,8 @@ class IFlockerAPIV1Client(Interface):
     matching ``list_datasets_configuration`` call.
     """
     def create_dataset(primary, maximum_size=None, dataset_id=None,
-                       metadata=pmap(), configuration_tag=None):
+                       metadata=pmap(), configuration_tag=None,
+                       unique_key=None):
         """
         Create a new dataset in the configuration.
 
@@ -257,10 +530,17 @@ class IFlockerAPIV1Client(Interface):
             stored as dataset metadata.
         :param configuration_tag: If not ``None``, should be
             ``DatasetsConfiguration.tag``.
+        :param unique_key: If not ``None``, an indexed metadata key, such as
+            ``u"name"``.  The dataset is only created if no other dataset
+            which hasn't been deleted has the same value for it in its
+            metadata; the check and the creation are atomic.  For keys the
+            server doesn't index, or servers predating the index, the
+            configuration is checked instead, as by ``conditional_create``.
 
         :return: ``Deferred`` that fires after the configuration has been
             updated with resulting ``Dataset``, or errbacking with
-            ``DatasetAlreadyExists``.
+            ``DatasetAlreadyExists``, or with ``ValueError`` if ``metadata``
+            has no value for ``unique_key``.
         """
 
     def move_dataset(primary, dataset_id, configuration_tag=None):
@@ -288,21 +568,72 @@ class IFlockerAPIV1Client(Interface):
         been deleted, after the configuration has been updated.
         """
 
-    def list_datasets_configuration():
+    def list_datasets_configuration(node_uuid=None, dataset_id=None,
+                                    metadata=pmap(), page_size=None):
         """
         Return the configured datasets, excluding any datasets that
         have been deleted.
 
+        :param node_uuid: If not ``None``, only return datasets whose
+            primary is the node with this ``UUID``.
+        :param dataset_id: If not ``None``, only return the dataset with this
+            ``UUID``.
+        :param metadata: Only return datasets whose metadata has all of these
+            ``unicode`` keys and values.
+        :param page_size: If not ``None``, retrieve the datasets this many at
+            a time.
+
         :return: ``Deferred`` firing with a ``DatasetsConfiguration``.
         """
 
-    def list_datasets_state():
+    def list_datasets_by_metadata(key, value):
+        """
+        Look up the configured datasets, excluding any datasets that have
+        been deleted, which have a particular metadata value.
+
+        :param unicode key: A metadata key.  Unless the server indexes it,
+            as it does ``u"name"``, all the datasets are listed to find the
+            matching ones.
+        :param unicode value: The value it must have.
+
+        :return: ``Deferred`` firing with a ``list`` of ``Dataset``.
+        """
+
+    def list_datasets_state(node_uuid=None, dataset_id=None,
+                            page_size=None):
         """
         Return the actual datasets in the cluster.
 
+        :param node_uuid: If not ``None``, only return datasets manifest on
+            the node with this ``UUID``.
+        :param dataset_id: If not ``None``, only return the dataset with this
+            ``UUID``.
+        :param page_size: If not ``None``, retrieve the datasets this many at
+            a time.
+
         :return: ``Deferred`` firing with iterable of ``DatasetState``.
         """
 
+    def change_datasets(operations, configuration_tag=None):
+        """
+        Apply many operations on datasets in one request, saving the
+        configuration once.
+
+        Each operation is applied to the configuration left by those before
+        it; one that fails doesn't prevent the others.
+
+        :param operations: A sequence of ``CreateDataset``, ``MoveDataset``,
+            ``ResizeDataset`` and ``DeleteDataset``.
+        :param configuration_tag: If not ``None``, should be
+            ``DatasetsConfiguration.tag``.
+
+        :return: ``Deferred`` firing with a ``list`` with, for each
+            operation in order, the resulting ``Dataset`` or the exception
+            the operation failed with: ``DatasetAlreadyExists`` or a
+            ``ResponseError``.  If the configuration has changed it instead
+            errbacks with ``ConfigurationChanged``.
+        """
+
     def acquire_lease(dataset_id, node_uuid, expires):
         """
         Acquire a lease on a dataset on a given node.
@@ -367,18 +698,86 @@ class IFlockerAPIV1Client(Interface):
             exists.
         """
 
-    def list_containers_configuration():
+    def list_containers_configuration(node_uuid=None, dataset_id=None,
+                                      page_size=None):
         """
+        :param node_uuid: If not ``None``, only return containers configured
+            on the node with this ``UUID``.
+        :param dataset_id: If not ``None``, only return containers which
+            mount the dataset with this ``UUID``.
+        :param page_size: If not ``None``, retrieve the containers this many
+            at a time.
+
         :return: ``Deferred`` firing with ``iterable`` of ``Container``.
         """
 
-    def list_containers_state():
+    def list_containers_state(node_uuid=None, dataset_id=None,
+                              page_size=None):
         """
         Return the actual containers in the cluster.
 
+        :param node_uuid: If not ``None``, only return containers running on
+            the node with this ``UUID``.
+        :param dataset_id: If not ``None``, only return containers which
+            mount the dataset with this ``UUID``.
+        :param page_size: If not ``None``, retrieve the containers this many
+            at a time.
+
         :return: ``Deferred`` firing with ``iterable`` of ``ContainerState``.
         """
 
+    def watch_datasets_configuration(generation=None):
+        """
+        Return the configured datasets once they change.
+
+        The server doesn't hold a request open indefinitely, so the result
+        may also be unchanged; callers loop, passing the generation of each
+        result to the next call.
+
+        :param generation: The ``generation`` of an earlier result, or
+            ``None`` to return the current datasets straight away.
+
+        :return: ``Deferred`` firing with a ``Watched`` whose value is the
+            ``DatasetsConfiguration`` ``list_datasets_configuration`` would
+            return.
+        """
+
+    def watch_datasets_state(generation=None):
+        """
+        Return the actual datasets in the cluster once they change, like
+        ``watch_datasets_configuration``.
+
+        :return: ``Deferred`` firing with a ``Watched`` whose value is what
+            ``list_datasets_state`` would return.
+        """
+
+    def watch_containers_configuration(generation=None):
+        """
+        Return the configured containers once they change, like
+        ``watch_datasets_configuration``.
+
+        :return: ``Deferred`` firing with a ``Watched`` whose value is what
+            ``list_containers_configuration`` would return.
+        """
+
+    def watch_containers_state(generation=None):
+        """
+        Return the actual containers in the cluster once they change, like
+        ``watch_datasets_configuration``.
+
+        :return: ``Deferred`` firing with a ``Watched`` whose value is what
+            ``list_containers_state`` would return.
+        """
+
+    def watch_nodes(generation=None):
+        """
+        Return the active cluster nodes once they change, like
+        ``watch_datasets_configuration``.
+
+        :return: ``Deferred`` firing with a ``Watched`` whose value is what
+            ``list_nodes`` would return.
+        """
+
     def delete_container(name):
         """
         :param unicode name: The name of the container to be deleted.
@@ -410,8 +809,46 @@ class FakeFlockerClient(object):
             nodes = []
         self._nodes = nodes
         self._this_node_uuid = this_node_uuid
+        # Map "configuration" and "state" to their generation and the
+        # Deferreds waiting for it to change:
+        self._generations = {u"configuration": 0, u"state": 0}
+        self._waiting = {u"configuration": [], u"state": []}
         self.synchronize_state()
 
+    def _changed(self, kind=u"configuration"):
+        """
+        Record a change to the configuration or state, returning from the
+        ``watch_*`` calls waiting for one.
+
+        :param unicode kind: ``u"configuration"`` or ``u"state"``.
+        """
+        self._generations[kind] += 1
+        waiting, self._waiting[kind] = self._waiting[kind], []
+        for d in waiting:
+            d.callback(None)
+
+    def _watch(self, kind, generation, get):
+        """
+        :param unicode kind: ``u"configuration"`` or ``u"state"``.
+        :param generation: The generation to wait for a change from, or
+            ``None``.
+        :param get: No-argument callable returning a ``Deferred`` that fires
+            with the current listing.
+
+        :return: ``Deferred`` firing with a ``Watched`` of the listing once
+            the generation differs from ``generation``.  Unlike the server
+            the fake waits indefinitely.
+        """
+        if generation == self._generations[kind]:
+            d = Deferred(canceller=self._waiting[kind].remove)
+            self._waiting[kind].append(d)
+        else:
+            d = succeed(None)
+        d.addCallback(lambda _: get())
+        d.addCallback(lambda value: Watched(
+            generation=self._generations[kind], value=value))
+        return d
+
     def _ensure_matching_tag(self, configuration_tag):
         """
         If the configuration tag doesn't match current config, raise
@@ -422,9 +859,11 @@ class FakeFlockerClient(object):
                 raise ConfigurationChanged()
 
     def create_dataset(self, primary, maximum_size=None, dataset_id=None,
-                       metadata=pmap(), configuration_tag=None):
+                       metadata=pmap(), configuration_tag=None,
+                       unique_key=None):
         try:
             self._ensure_matching_tag(configuration_tag)
+            _check_unique_key(metadata, unique_key)
         except:
             return fail()
 
@@ -434,10 +873,15 @@ class FakeFlockerClient(object):
             dataset_id = uuid4()
         if dataset_id in self._configured_datasets:
             return fail(DatasetAlreadyExists())
+        if unique_key is not None and any(
+                dataset.metadata.get(unique_key) == metadata[unique_key]
+                for dataset in self._configured_datasets.values()):
+            return fail(DatasetAlreadyExists())
         result = Dataset(primary=primary, maximum_size=maximum_size,
                          dataset_id=dataset_id, metadata=metadata)
         self._configured_datasets = self._configured_datasets.set(
             dataset_id, result)
+        self._changed()
         return succeed(result)
 
     def delete_dataset(self, dataset_id, configuration_tag=None):
@@ -449,6 +893,7 @@ class FakeFlockerClient(object):
         dataset = self._configured_datasets[dataset_id]
         self._configured_datasets = self._configured_datasets.remove(
             dataset_id)
+        self._changed()
         return succeed(dataset)
 
     def move_dataset(self, primary, dataset_id, configuration_tag=None):
@@ -459,17 +904,64 @@ class FakeFlockerClient(object):
 
         self._configured_datasets = self._configured_datasets.transform(
             [dataset_id, "primary"], primary)
+        self._changed()
         return succeed(self._configured_datasets[dataset_id])
 
-    def list_datasets_configuration(self):
+    def change_datasets(self, operations, configuration_tag=None):
+        try:
+            self._ensure_matching_tag(configuration_tag)
+        except:
+            return fail()
+
+        results = []
+        for operation in operations:
+            if isinstance(operation, CreateDataset):
+                d = self.create_dataset(
+                    primary=operation.primary,
+                    maximum_size=operation.maximum_size,
+                    dataset_id=operation.dataset_id,
+                    metadata=operation.metadata)
+            elif operation.dataset_id not in self._configured_datasets:
+                d = fail(ResponseError(NOT_FOUND, u"Dataset not found."))
+            elif isinstance(operation, MoveDataset):
+                d = self.move_dataset(operation.primary, operation.dataset_id)
+            elif isinstance(operation, ResizeDataset):
+                self._configured_datasets = (
+                    self._configured_datasets.transform(
+                        [operation.dataset_id, "maximum_size"],
+                        operation.maximum_size))
+                self._changed()
+                d = succeed(self._configured_datasets[operation.dataset_id])
+            else:
+                d = self.delete_dataset(operation.dataset_id)
+            d.addErrback(lambda reason: reason.value)
+            d.addCallback(results.append)
+        return succeed(results)
+
+    def list_datasets_configuration(self, node_uuid=None, dataset_id=None,
+                                    metadata=pmap(), page_size=None):
         return succeed(DatasetsConfiguration(
             # Since the tag is opaque object, using the actual configuration
             # is a fine way to have a matching tag.
             tag=self._configured_datasets,
-            datasets=self._configured_datasets))
+            datasets={
+                key: dataset
+                for (key, dataset) in self._configured_datasets.items()
+                if _matches_dataset(dataset, node_uuid, dataset_id, metadata)
+            }))
 
-    def list_datasets_state(self):
-        return succeed(self._state_datasets)
+    def list_datasets_by_metadata(self, key, value):
+        return succeed([
+            dataset for dataset in self._configured_datasets.values()
+            if dataset.metadata.get(key) == value
+        ])
+
+    def list_datasets_state(self, node_uuid=None, dataset_id=None,
+                            page_size=None):
+        return succeed([
+            dataset for dataset in self._state_datasets
+            if _matches_dataset(dataset, node_uuid, dataset_id)
+        ])
 
     def synchronize_state(self):
         """
@@ -492,6 +984,7 @@ class FakeFlockerClient(object):
                 volumes=container.volumes,
             ) for container in self._configured_containers.values()
         ]
+        self._changed(u"state")
 
     def acquire_lease(self, dataset_id, node_uuid, expires):
         try:
@@ -540,18 +1033,45 @@ class FakeFlockerClient(object):
         self._configured_containers = self._configured_containers.set(
             name, result
         )
+        self._changed()
         return succeed(result)
 
-    def list_containers_configuration(self):
-        return succeed(self._configured_containers.values())
+    def list_containers_configuration(self, node_uuid=None, dataset_id=None,
+                                      page_size=None):
+        return succeed([
+            container for container in self._configured_containers.values()
+            if _matches_container(container, node_uuid, dataset_id)
+        ])
 
-    def list_containers_state(self):
-        return succeed(self._state_containers)
+    def list_containers_state(self, node_uuid=None, dataset_id=None,
+                              page_size=None):
+        return succeed([
+            container for container in self._state_containers
+            if _matches_container(container, node_uuid, dataset_id)
+        ])
 
     def delete_container(self, name):
         self._configured_containers = self._configured_containers.remove(name)
+        self._changed()
         return succeed(None)
 
+    def watch_datasets_configuration(self, generation=None):
+        return self._watch(
+            u"configuration", generation, self.list_datasets_configuration)
+
+    def watch_datasets_state(self, generation=None):
+        return self._watch(u"state", generation, self.list_datasets_state)
+
+    def watch_containers_configuration(self, generation=None):
+        return self._watch(
+            u"configuration", generation, self.list_containers_configuration)
+
+    def watch_containers_state(self, generation=None):
+        return self._watch(u"state", generation, self.list_containers_state)
+
+    def watch_nodes(self, generation=None):
+        return self._watch(u"state", generation, self.list_nodes)
+
     def this_node_uuid(self):
         return succeed(self._this_node_uuid)
 
@@ -576,9 +1096,20 @@ class NotFound(Exception):
 class FlockerClient(object):
     """
     A client for the Flocker V1 REST API.
+
+    By default every request is sent over a new connection.  A persistent
+    client instead keeps connections open between requests, sparing most
+    requests the TCP and TLS handshakes; ``close`` closes them.
+
+    A caching client remembers the parsed listings of dataset and container
+    configuration and of nodes, and reuses them while the server confirms
+    they haven't changed.  Any change the client itself makes forgets them.
     """
     def __init__(self, reactor, host, port,
-                 ca_cluster_path, cert_path, key_path):
+                 ca_cluster_path, cert_path, key_path, persistent=False,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, cache_ttl=None,
+                 cache_size=DEFAULT_CACHE_SIZE):
         """
         :param reactor: Reactor to use for connections.
         :param bytes host: Host to connect to.
@@ -586,15 +1117,56 @@ class FlockerClient(object):
         :param FilePath ca_cluster_path: Path to cluster's CA certificate.
         :param FilePath cert_path: Path to user certificate.
         :param FilePath key_path: Path to user private key.
+        :param bool persistent: Whether to keep connections open between
+            requests.
+        :param int pool_size: The largest number of idle connections to keep
+            open, if persistent.
+        :param idle_timeout: The number of seconds an idle connection is kept
+            open, if persistent.
+        :param cache_ttl: ``None`` to not cache listings, or the number of
+            seconds a cached listing is reused before asking the server
+            whether it has changed.
+        :param int cache_size: The largest number of listings to cache.
         """
         self._reactor = reactor
+        self._pool = HTTPConnectionPool(reactor, persistent=persistent)
+        self._pool.maxPersistentPerHost = pool_size
+        self._pool.cachedConnectionTimeout = idle_timeout
         self._treq = treq_with_authentication(reactor, ca_cluster_path,
-                                              cert_path, key_path)
+                                              cert_path, key_path,
+                                              pool=self._pool)
         self._base_url = b"https://%s:%d/v1" % (host, port)
+        if cache_ttl is None:
+            self._cache = None
+        else:
+            self._cache = _ResponseCache(reactor, cache_ttl, cache_size)
+
+    def _cached(self, key, retrieve):
+        """
+        Retrieve a listing, reusing it from the cache if possible.
+
+        :param key: Identifies the listing.
+        :param retrieve: As for ``_ResponseCache.get``.
+
+        :return: ``Deferred`` firing with the parsed listing.
+        """
+        if self._cache is None:
+            d = retrieve(None)
+            d.addCallback(lambda (result, headers): result)
+            return d
+        return self._cache.get(key, retrieve)
+
+    def close(self):
+        """
+        Close the connections kept open between requests.
+
+        :return: ``Deferred`` firing once they are closed.
+        """
+        return self._pool.closeCachedConnections()
 
     def _request_with_headers(
             self, method, path, body, success_codes, error_codes=None,
-            configuration_tag=None):
+            configuration_tag=None, if_none_match=None):
         """
         Send a HTTP request to the Flocker API, return decoded JSON body and
         headers.
@@ -608,11 +1180,17 @@ class FlockerClient(object):
             raised if it is present, or ``None`` to set no errors.
         :param configuration_tag: If not ``None``, include value as
             ``X-If-Configuration-Matches`` header.
+        :param bytes if_none_match: If not ``None``, include value as
+            ``If-None-Match`` header.
 
         :return: ``Deferred`` firing a tuple of (decoded JSON,
-            response headers).
+            response headers), with ``None`` instead of the decoded JSON if
+            the server responded that it matched ``if_none_match``.
         """
         url = self._base_url + path
+        if method != b"GET" and self._cache is not None:
+            # The change may show up in any listing:
+            self._cache.clear()
         action = _LOG_HTTP_REQUEST(url=url, method=method, request_body=body)
 
         if error_codes is None:
@@ -624,6 +1202,9 @@ class FlockerClient(object):
             raise ResponseError(code, body)
 
         def got_response(response):
+            if response.code == NOT_MODIFIED and if_none_match is not None:
+                action.addSuccessFields(response_code=response.code)
+                return None, response.headers
             if response.code in success_codes:
                 action.addSuccessFields(response_code=response.code)
                 d = json_content(response)
@@ -645,14 +1226,12 @@ class FlockerClient(object):
         if configuration_tag is not None:
             headers["X-If-Configuration-Matches"] = [
                 configuration_tag.encode("utf-8")]
+        if if_none_match is not None:
+            headers["If-None-Match"] = [if_none_match]
 
         with action.context():
             request = DeferredContext(self._treq.request(
-                method, url,
-                data=data, headers=headers,
-                # Keep tests from having dirty reactor problems:
-                persistent=False
-                ))
+                method, url, data=data, headers=headers))
         request.addCallback(got_response)
 
         def got_body(result):
@@ -694,21 +1273,64 @@ class FlockerClient(object):
         return request
 
     def create_dataset(self, primary, maximum_size=None, dataset_id=None,
-                       metadata=pmap(), configuration_tag=None):
+                       metadata=pmap(), configuration_tag=None,
+                       unique_key=None):
+        try:
+            _check_unique_key(metadata, unique_key)
+        except ValueError:
+            return fail()
         dataset = {u"primary": unicode(primary),
                    u"metadata": dict(metadata)}
         if dataset_id is not None:
             dataset[u"dataset_id"] = unicode(dataset_id)
         if maximum_size is not None:
             dataset[u"maximum_size"] = maximum_size
-        request = self._request(b"POST", b"/configuration/datasets",
+        path = b"/configuration/datasets"
+        if unique_key is not None:
+            path += _by_metadata_path(unique_key, metadata[unique_key])
+        request = self._request(b"POST", path,
                                 dataset, {CREATED},
                                 {CONFLICT: DatasetAlreadyExists,
                                  PRECONDITION_FAILED: ConfigurationChanged},
                                 configuration_tag=configuration_tag)
         request.addCallback(self._parse_configuration_dataset)
+        if unique_key is not None:
+            request.addErrback(
+                _if_unsupported, self._create_unique_unindexed, primary,
+                maximum_size, dataset_id, metadata, configuration_tag,
+                unique_key)
         return request
 
+    def _create_unique_unindexed(self, primary, maximum_size, dataset_id,
+                                 metadata, configuration_tag, unique_key):
+        """
+        Create a dataset with a unique metadata value by checking the listed
+        configuration, for servers which can't do so atomically themselves.
+
+        The parameters are those of ``create_dataset``.
+
+        :return: ``Deferred`` firing like that returned by
+            ``create_dataset``.
+        """
+        value = metadata[unique_key]
+
+        def condition(configuration):
+            for dataset in configuration.datasets.values():
+                if dataset.metadata.get(unique_key) == value:
+                    raise DatasetAlreadyExists()
+
+        if configuration_tag is None:
+            return conditional_create(
+                self, self._reactor, condition, primary, maximum_size,
+                dataset_id, metadata)
+        # The tag already ensures the configuration hasn't changed since the
+        # caller looked at it, so a change is theirs to retry:
+        listing = self.list_datasets_configuration()
+        listing.addCallback(condition)
+        listing.addCallback(lambda _: self.create_dataset(
+            primary, maximum_size, dataset_id, metadata, configuration_tag))
+        return listing
+
     def move_dataset(self, primary, dataset_id, configuration_tag=None):
         request = self._request(
             b"POST", b"/configuration/datasets/%s" % (dataset_id,),
@@ -718,25 +1340,178 @@ class FlockerClient(object):
         request.addCallback(self._parse_configuration_dataset)
         return request
 
-    def list_datasets_configuration(self):
-        request = self._request_with_headers(
-            b"GET", b"/configuration/datasets", None, {OK})
-        # In order to accomodate the client running against older versions of
-        # flocker, put an artificial tag of None in if we are running against
-        # an older server.
+    def _list(self, path, query, page_size, wait_for_generation=None,
+              if_none_match=None):
+        """
+        Retrieve every item of a listing, following its pages if a page size
+        is given.
+
+        :param bytes path: Path of the listing to add to base URL.
+        :param dict query: Map ``bytes`` query parameter names to ``unicode``
+            values, or to ``None`` to leave the parameter out.
+        :param page_size: ``None`` or the number of items to retrieve per
+            request.
+        :param wait_for_generation: ``None`` or the generation the server
+            should wait for a change from before listing.
+        :param if_none_match: ``None`` or the entity tag of a previous
+            response to the first request.
+
+        :return: ``Deferred`` firing with a tuple of the ``list`` of decoded
+            JSON items, or ``None`` if the listing is unchanged since the
+            response tagged ``if_none_match``, and the response headers of
+            the first request.
+        """
+        parameters = {
+            name: value.encode("utf-8")
+            for (name, value) in query.items() if value is not None
+        }
+        if page_size is not None:
+            parameters[b"limit"] = b"%d" % (page_size,)
+        items = []
+        unchanged = []
+
+        def get_page(cursor):
+            page_parameters = parameters.copy()
+            if cursor is not None:
+                page_parameters[b"cursor"] = cursor
+            elif wait_for_generation is not None:
+                # Only the first page waits, later ones carry on from it:
+                page_parameters[b"wait_for_generation"] = b"%d" % (
+                    wait_for_generation,)
+            url = path
+            if page_parameters:
+                url += b"?" + urlencode(sorted(page_parameters.items()))
+            d = self._request_with_headers(
+                b"GET", url, None, {OK},
+                if_none_match=if_none_match if cursor is None else None)
+            d.addCallback(got_page, cursor is None)
+            return d
+
+        def got_page((results, headers), first):
+            if results is None:
+                unchanged.append(True)
+                return headers
+            items.extend(results)
+            next_cursor = headers.getRawHeaders(b"X-Next-Cursor", [None])[0]
+            if next_cursor is None:
+                return headers
+            d = get_page(next_cursor)
+            if first:
+                d.addCallback(lambda _: headers)
+            return d
+
+        d = get_page(None)
+        d.addCallback(lambda headers: (None if unchanged else items, headers))
+        return d
+
+    def change_datasets(self, operations, configuration_tag=None):
+        request = self._request(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                _encode_dataset_operation(operation)
+                for operation in operations]},
+            {OK}, {PRECONDITION_FAILED: ConfigurationChanged},
+            configuration_tag=configuration_tag)
+
+        def parse_result(result):
+            if u"dataset" in result:
+                return self._parse_configuration_dataset(result[u"dataset"])
+            if result[u"status"] == CONFLICT:
+                return DatasetAlreadyExists(result)
+            return ResponseError(result[u"status"], result)
         request.addCallback(
-            lambda (results, headers):
-            DatasetsConfiguration(
+            lambda response: [
+                parse_result(result) for result in response[u"results"]])
+        return request
+
+    def _list_datasets_configuration(self, node_uuid=None, dataset_id=None,
+                                     metadata=pmap(), page_size=None,
+                                     wait_for_generation=None,
+                                     if_none_match=None):
+        """
+        Retrieve the configured datasets.
+
+        :return: ``Deferred`` firing with a tuple of the
+            ``DatasetsConfiguration``, or ``None`` if it is unchanged since
+            the response tagged ``if_none_match``, and the response headers.
+        """
+        query = {b"node_uuid": _unicode_or_none(node_uuid),
+                 b"dataset_id": _unicode_or_none(dataset_id),
+                 b"deleted": u"false"}
+        for key, value in metadata.items():
+            query[b"metadata." + key.encode("utf-8")] = value
+        request = self._list(
+            b"/configuration/datasets", query, page_size,
+            wait_for_generation, if_none_match)
+
+        # Older servers ignore the query, so the results are filtered here as
+        # well.
+        def got_results((results, headers)):
+            if results is None:
+                return None, headers
+            datasets = [
+                self._parse_configuration_dataset(d)
+                for d in results if not d['deleted']
+            ]
+            # In order to accomodate the client running against older
+            # versions of flocker, put an artificial tag of None in if we are
+            # running against an older server.
+            return DatasetsConfiguration(
                 tag=headers.getRawHeaders('X-Configuration-Tag', [None])[0],
                 datasets={
-                    UUID(d['dataset_id']): self._parse_configuration_dataset(d)
-                    for d in results if not d['deleted']
-                })
-        )
+                    dataset.dataset_id: dataset for dataset in datasets
+                    if _matches_dataset(
+                        dataset, node_uuid, dataset_id, metadata)
+                }), headers
+        request.addCallback(got_results)
+        return request
+
+    def list_datasets_configuration(self, node_uuid=None, dataset_id=None,
+                                    metadata=pmap(), page_size=None):
+        return self._cached(
+            (b"/configuration/datasets", node_uuid, dataset_id,
+             frozenset(metadata.items()), page_size),
+            lambda if_none_match: self._list_datasets_configuration(
+                node_uuid, dataset_id, metadata, page_size,
+                if_none_match=if_none_match))
+
+    def watch_datasets_configuration(self, generation=None):
+        request = self._list_datasets_configuration(
+            wait_for_generation=generation)
+        request.addCallback(_watched)
+        return request
+
+    def list_datasets_by_metadata(self, key, value):
+        path = b"/configuration/datasets" + _by_metadata_path(key, value)
+
+        def retrieve(if_none_match):
+            request = self._request_with_headers(
+                b"GET", path, None, {OK}, if_none_match=if_none_match)
+            request.addCallback(
+                lambda (results, headers): (None if results is None else [
+                    self._parse_configuration_dataset(d) for d in results],
+                    headers))
+            return request
+        request = self._cached((path,), retrieve)
+        request.addCallback(list)
+        request.addErrback(
+            _if_unsupported, lambda: self.list_datasets_configuration(
+                metadata={key: value}).addCallback(list))
         return request
 
-    def list_datasets_state(self):
-        request = self._request(b"GET", b"/state/datasets", None, {OK})
+    def _list_datasets_state(self, node_uuid=None, dataset_id=None,
+                             page_size=None, wait_for_generation=None):
+        """
+        Retrieve the actual datasets in the cluster.
+
+        :return: ``Deferred`` firing with a tuple of the ``list`` of
+            ``DatasetState`` and the response headers.
+        """
+        request = self._list(
+            b"/state/datasets",
+            {b"node_uuid": _unicode_or_none(node_uuid),
+             b"dataset_id": _unicode_or_none(dataset_id)},
+            page_size, wait_for_generation)
 
         def parse_dataset_state(dataset_dict):
             primary = dataset_dict.get(u"primary")
@@ -752,7 +1527,21 @@ class FlockerClient(object):
                                 path=path)
 
         request.addCallback(
-            lambda results: [parse_dataset_state(d) for d in results])
+            lambda (results, headers): ([
+                dataset for dataset in map(parse_dataset_state, results)
+                if _matches_dataset(dataset, node_uuid, dataset_id)],
+                headers))
+        return request
+
+    def list_datasets_state(self, node_uuid=None, dataset_id=None,
+                            page_size=None):
+        request = self._list_datasets_state(node_uuid, dataset_id, page_size)
+        request.addCallback(lambda (datasets, headers): datasets)
+        return request
+
+    def watch_datasets_state(self, generation=None):
+        request = self._list_datasets_state(wait_for_generation=generation)
+        request.addCallback(_watched)
         return request
 
     def _parse_lease(self, dictionary):
@@ -831,44 +1620,121 @@ class FlockerClient(object):
         d.addCallback(self._parse_configuration_container)
         return d
 
-    def list_containers_configuration(self):
-        d = self._request(b"GET", b"/configuration/containers", None, {OK})
-        d.addCallback(
-            lambda containers: list(
-                self._parse_configuration_container(container_dict)
-                for container_dict in containers
-            )
-        )
+    def _list_containers(self, path, node_uuid, dataset_id, page_size,
+                         parse, wait_for_generation=None, if_none_match=None):
+        """
+        Retrieve a listing of containers.
+
+        :param bytes path: Path of the listing to add to base URL.
+        :param node_uuid: ``None`` or the ``UUID`` of the node containers
+            must be on.
+        :param dataset_id: ``None`` or the ``UUID`` of a dataset containers
+            must mount.
+        :param page_size: ``None`` or the number of containers to retrieve
+            per request.
+        :param parse: One-argument callable converting the decoded JSON of a
+            container.
+        :param wait_for_generation: ``None`` or the generation the server
+            should wait for a change from before listing.
+        :param if_none_match: ``None`` or the entity tag of a previous
+            response.
+
+        :return: ``Deferred`` firing with a tuple of a ``list`` of the
+            matching parsed containers, or ``None`` if they are unchanged
+            since the response tagged ``if_none_match``, and the response
+            headers.
+        """
+        d = self._list(
+            path,
+            {b"node_uuid": _unicode_or_none(node_uuid),
+             b"dataset_id": _unicode_or_none(dataset_id)},
+            page_size, wait_for_generation, if_none_match)
+
+        # Older servers ignore the query, so the results are filtered here as
+        # well.
+        def got_results((containers, headers)):
+            if containers is None:
+                return None, headers
+            return [
+                container for container in map(parse, containers)
+                if _matches_container(container, node_uuid, dataset_id)
+            ], headers
+        d.addCallback(got_results)
         return d
 
-    def list_containers_state(self):
-        d = self._request(b"GET", b"/state/containers", None, {OK})
-
-        def parse(container):
-            try:
-                return ContainerState(
-                    node_uuid=UUID(container[u'node_uuid']),
-                    name=container[u'name'],
-                    image=DockerImage.from_string(container[u'image']),
-                    running=container[u'running'],
-                    volumes=_parse_volumes(container.get(u'volumes'))
-                )
-            except KeyError as e:
-                raise ServerResponseMissingElementError(e.args[0], container)
-        d.addCallback(
-            lambda containers: [parse(container) for container in containers])
+    def list_containers_configuration(self, node_uuid=None, dataset_id=None,
+                                      page_size=None):
+        d = self._cached(
+            (b"/configuration/containers", node_uuid, dataset_id, page_size),
+            lambda if_none_match: self._list_containers(
+                b"/configuration/containers", node_uuid, dataset_id,
+                page_size, self._parse_configuration_container,
+                if_none_match=if_none_match))
+        d.addCallback(list)
+        return d
 
+    def watch_containers_configuration(self, generation=None):
+        d = self._list_containers(
+            b"/configuration/containers", None, None, None,
+            self._parse_configuration_container, generation)
+        d.addCallback(_watched)
         return d
 
-    def list_nodes(self):
-        request = self._request(
-            b"GET", b"/state/nodes", None, {OK}
-        )
+    def _parse_container_state(self, container):
+        """
+        Convert a dictionary decoded from JSON with a container's state.
+
+        :param container: Dictionary describing a container.
+        :return: ``ContainerState`` instance.
+        """
+        try:
+            return ContainerState(
+                node_uuid=UUID(container[u'node_uuid']),
+                name=container[u'name'],
+                image=DockerImage.from_string(container[u'image']),
+                running=container[u'running'],
+                volumes=_parse_volumes(container.get(u'volumes'))
+            )
+        except KeyError as e:
+            raise ServerResponseMissingElementError(e.args[0], container)
+
+    def list_containers_state(self, node_uuid=None, dataset_id=None,
+                              page_size=None):
+        d = self._list_containers(
+            b"/state/containers", node_uuid, dataset_id, page_size,
+            self._parse_container_state)
+        d.addCallback(lambda (containers, headers): containers)
+        return d
+
+    def watch_containers_state(self, generation=None):
+        d = self._list_containers(
+            b"/state/containers", None, None, None,
+            self._parse_container_state, generation)
+        d.addCallback(_watched)
+        return d
+
+    def _list_nodes(self, wait_for_generation=None, if_none_match=None):
+        """
+        Retrieve the active cluster nodes.
+
+        :param wait_for_generation: ``None`` or the generation the server
+            should wait for a change from before listing.
+        :param if_none_match: ``None`` or the entity tag of a previous
+            response.
 
-        def to_nodes(result):
+        :return: ``Deferred`` firing with a tuple of the ``list`` of ``Node``,
+            or ``None`` if they are unchanged since the response tagged
+            ``if_none_match``, and the response headers.
+        """
+        request = self._list(
+            b"/state/nodes", {}, None, wait_for_generation, if_none_match)
+
+        def to_nodes((result, headers)):
             """
             Turn the list of dicts into ``Node`` instances.
             """
+            if result is None:
+                return None, headers
             nodes = []
             for node_dict in result:
                 node = Node(
@@ -876,11 +1742,24 @@ class FlockerClient(object):
                     public_address=IPAddress(node_dict['host']),
                 )
                 nodes.append(node)
-            return nodes
+            return nodes, headers
         request.addCallback(to_nodes)
 
         return request
 
+    def list_nodes(self):
+        request = self._cached(
+            (b"/state/nodes",),
+            lambda if_none_match: self._list_nodes(
+                if_none_match=if_none_match))
+        request.addCallback(list)
+        return request
+
+    def watch_nodes(self, generation=None):
+        request = self._list_nodes(generation)
+        request.addCallback(_watched)
+        return request
+
     def delete_container(self, name):
         request = self._request(
             b"DELETE", b"/configuration/containers/%s" % (
@@ -914,7 +1793,9 @@ def conditional_create(client, reactor, condition, *args, **kwargs):
     This is useful for ensuring e.g. uniqueness of metadata across
     datasets. Conditional creation will be used to ensure that if the
     configuration changes the create won't happen; in this case the whole
-    check-and-create will be retried, up to 20 times.
+    check-and-create will be retried, up to 20 times.  For uniqueness of an
+    indexed metadata key such as ``name``, passing ``unique_key`` to
+    ``create_dataset`` is cheaper and never needs retrying.
 
     All parameters are the same as
     ``IFlockerAPIV1Client.create_dataset_configuration`` except the
@@ -23,8 +23,9 @@ from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.web.http import BAD_REQUEST
-from twisted.internet.defer import gatherResults
+from twisted.web.http import BAD_REQUEST, NOT_FOUND
+from twisted.internet.defer import Deferred, gatherResults, succeed
+from twisted.web.http_headers import Headers
 from twisted.python.runtime import platform
 from twisted.python.procutils import which
 
@@ -33,7 +34,8 @@ from .._client import (
     DatasetState, FlockerClient, ResponseError, _LOG_HTTP_REQUEST,
     Lease, LeaseAlreadyHeld, Node, Container, ContainerAlreadyExists,
     DatasetsConfiguration, ConfigurationChanged, conditional_create,
-    _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset,
+    _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset, CreateDataset,
+    MoveDataset, ResizeDataset, DeleteDataset, _ResponseCache,
 )
 from ...ca import rest_api_context_factory
 from ...ca.testtools import get_credential_sets
@@ -42,6 +44,7 @@ from ...testtools import (
 )
 from ...control._persistence import ConfigurationPersistenceService
 from ...control._clusterstate import ClusterStateService
+from ...control import httpapi
 from ...control.httpapi import create_api_service
 from ...control import (
     NodeState, NonManifestDatasets, Dataset as ModelDataset, ChangeSource,
@@ -104,6 +107,210 @@ def make_clientv1_tests():
             creating.addCallback(created)
             return creating
 
+        def create_datasets(self):
+            """
+            Create three datasets, two on ``node_1`` named ``a`` and ``b`` and
+            one on ``node_2`` named ``a``.
+
+            :return: ``Deferred`` firing with a ``list`` of the created
+                ``Dataset`` instances.
+            """
+            return gatherResults([
+                self.client.create_dataset(
+                    primary=node.uuid, metadata={u"name": name})
+                for (node, name) in [(self.node_1, u"a"),
+                                     (self.node_1, u"b"),
+                                     (self.node_2, u"a")]
+            ])
+
+        def test_list_dataset_configuration_filtered(self):
+            """
+            ``list_datasets_configuration`` only lists the datasets matching
+            the given node, dataset identifier and metadata.
+            """
+            creating = self.create_datasets()
+
+            def created(datasets):
+                d = gatherResults([
+                    self.client.list_datasets_configuration(
+                        node_uuid=self.node_1.uuid),
+                    self.client.list_datasets_configuration(
+                        dataset_id=datasets[1].dataset_id),
+                    self.client.list_datasets_configuration(
+                        metadata={u"name": u"a"}),
+                    self.client.list_datasets_configuration(
+                        node_uuid=self.node_2.uuid, metadata={u"name": u"b"}),
+                ])
+                d.addCallback(
+                    lambda results: self.assertEqual(
+                        [set(datasets[:2]), {datasets[1]},
+                         {datasets[0], datasets[2]}, set()],
+                        [set(result) for result in results]))
+                return d
+            creating.addCallback(created)
+            return creating
+
+        def test_list_dataset_configuration_paged(self):
+            """
+            Given a page size, ``list_datasets_configuration`` still lists all
+            the datasets along with the configuration tag.
+            """
+            creating = self.create_datasets()
+
+            def created(datasets):
+                d = self.client.list_datasets_configuration(page_size=1)
+                d.addCallback(self.assertEqual,
+                              DatasetsConfiguration(
+                                  tag=self.get_configuration_tag(),
+                                  datasets={dataset.dataset_id: dataset
+                                            for dataset in datasets}))
+                return d
+            creating.addCallback(created)
+            return creating
+
+        def test_list_datasets_by_metadata(self):
+            """
+            ``list_datasets_by_metadata`` returns the datasets with the given
+            metadata value.
+            """
+            creating = self.create_datasets()
+
+            def created(datasets):
+                d = self.client.list_datasets_by_metadata(u"name", u"a")
+                d.addCallback(lambda result: self.assertEqual(
+                    {datasets[0], datasets[2]}, set(result)))
+                return d
+            creating.addCallback(created)
+            return creating
+
+        def test_create_unique(self):
+            """
+            Given a ``unique_key``, ``create_dataset`` creates a dataset if no
+            other dataset has its value for that key.
+            """
+            name = u"my volume"
+            creating = self.client.create_dataset(
+                primary=self.node_1.uuid, metadata={u"name": name},
+                unique_key=u"name")
+
+            def created(dataset):
+                d = self.client.list_datasets_by_metadata(u"name", name)
+                d.addCallback(self.assertEqual, [dataset])
+                return d
+            creating.addCallback(created)
+            return creating
+
+        def test_create_unique_conflict(self):
+            """
+            Given a ``unique_key``, ``create_dataset`` fails with
+            ``DatasetAlreadyExists`` if another dataset has its value for
+            that key.
+            """
+            creating = self.create_datasets()
+            creating.addCallback(
+                lambda _: self.client.create_dataset(
+                    primary=self.node_2.uuid, metadata={u"name": u"b"},
+                    unique_key=u"name"))
+            return self.assertFailure(creating, DatasetAlreadyExists)
+
+        def test_create_unique_missing(self):
+            """
+            ``create_dataset`` fails with ``ValueError`` if the metadata has
+            no value for the ``unique_key``.
+            """
+            return self.assertFailure(
+                self.client.create_dataset(
+                    primary=self.node_1.uuid, metadata={u"label": u"a"},
+                    unique_key=u"name"),
+                ValueError)
+
+        def test_list_datasets_by_unindexed_metadata(self):
+            """
+            ``list_datasets_by_metadata`` returns the datasets with the given
+            value for a metadata key the server doesn't index.
+            """
+            creating = gatherResults([
+                self.client.create_dataset(
+                    primary=self.node_1.uuid, metadata={u"label": label})
+                for label in [u"a", u"b"]])
+
+            def created(datasets):
+                d = self.client.list_datasets_by_metadata(u"label", u"a")
+                d.addCallback(self.assertEqual, datasets[:1])
+                return d
+            creating.addCallback(created)
+            return creating
+
+        def test_create_unique_unindexed(self):
+            """
+            Given a ``unique_key`` the server doesn't index, ``create_dataset``
+            creates a dataset if no other dataset has its value for that key,
+            and otherwise fails with ``DatasetAlreadyExists``.
+            """
+            def create(label):
+                return self.client.create_dataset(
+                    primary=self.node_1.uuid, metadata={u"label": label},
+                    unique_key=u"label")
+            creating = create(u"a")
+            creating.addCallback(lambda _: create(u"b"))
+            creating.addCallback(lambda _: create(u"a"))
+            return self.assertFailure(creating, DatasetAlreadyExists)
+
+        def test_change_datasets(self):
+            """
+            ``change_datasets`` applies each operation and returns its
+            result, or the error it failed with.
+            """
+            creating = gatherResults([
+                self.client.create_dataset(
+                    primary=self.node_1.uuid, maximum_size=DATASET_SIZE)
+                for i in range(2)])
+            new_id = uuid4()
+
+            def created(datasets):
+                moved, resized = datasets
+                expected = [
+                    Dataset(dataset_id=new_id, primary=self.node_2.uuid,
+                            maximum_size=None, metadata={u"name": u"new"}),
+                    moved.set(primary=self.node_2.uuid),
+                    resized.set(maximum_size=DATASET_SIZE * 2),
+                ]
+                d = self.client.change_datasets([
+                    CreateDataset(primary=self.node_2.uuid,
+                                  dataset_id=new_id,
+                                  metadata={u"name": u"new"}),
+                    MoveDataset(dataset_id=moved.dataset_id,
+                                primary=self.node_2.uuid),
+                    ResizeDataset(dataset_id=resized.dataset_id,
+                                  maximum_size=DATASET_SIZE * 2),
+                    DeleteDataset(dataset_id=uuid4()),
+                    CreateDataset(primary=self.node_1.uuid,
+                                  dataset_id=new_id),
+                ])
+
+                def changed(results):
+                    self.assertEqual(
+                        (expected, NOT_FOUND, DatasetAlreadyExists),
+                        (results[:3], results[3].code, type(results[4])))
+                    return self.client.list_datasets_configuration()
+                d.addCallback(changed)
+                d.addCallback(
+                    lambda configuration: self.assertEqual(
+                        set(expected), set(configuration)))
+                return d
+            creating.addCallback(created)
+            return creating
+
+        def test_change_datasets_conflicting_tag(self):
+            """
+            If a conflicting tag is given to ``change_datasets`` then
+            ``ConfigurationChanged`` is raised.
+            """
+            d = self.client.change_datasets(
+                [CreateDataset(primary=self.node_1.uuid)],
+                configuration_tag=u"willnotmatch")
+            return self.assertFailure(d, ConfigurationChanged)
+
         def assert_creates(self, client, dataset_id=None, maximum_size=None,
                            configuration_tag=None, **create_kwargs):
             """
@@ -367,6 +574,31 @@ def make_clientv1_tests():
                               states))
             return d
 
+        def test_dataset_state_filtered(self):
+            """
+            ``list_datasets_state`` only lists the datasets matching the given
+            node and dataset identifier, however many are retrieved at a time.
+            """
+            creating = self.create_datasets()
+
+            def created(datasets):
+                self.synchronize_state()
+                d = gatherResults([
+                    self.client.list_datasets_state(
+                        node_uuid=self.node_1.uuid, page_size=1),
+                    self.client.list_datasets_state(
+                        dataset_id=datasets[2].dataset_id),
+                ])
+                d.addCallback(
+                    lambda results: self.assertEqual(
+                        [{dataset.dataset_id for dataset in datasets[:2]},
+                         {datasets[2].dataset_id}],
+                        [{state.dataset_id for state in result}
+                         for result in results]))
+                return d
+            creating.addCallback(created)
+            return creating
+
         def test_acquire_lease_result(self):
             """
             ``acquire_lease`` returns a ``Deferred`` firing with ``Lease``
@@ -523,6 +755,28 @@ def make_clientv1_tests():
 
             return d
 
+        def test_container_filtered(self):
+            """
+            ``list_containers_configuration`` and ``list_containers_state``
+            only list the containers on the given node.
+            """
+            expected, d = create_container_for_test(self, self.client)
+            d.addCallback(
+                lambda _: create_container_for_test(self, self.client)[1])
+            d.addCallback(lambda _ignored: self.synchronize_state())
+            d.addCallback(lambda _ignored: gatherResults([
+                self.client.list_containers_configuration(
+                    node_uuid=expected.node_uuid, page_size=1),
+                self.client.list_containers_state(
+                    node_uuid=expected.node_uuid),
+            ]))
+            d.addCallback(
+                lambda results: self.assertEqual(
+                    [[expected.name], [expected.name]],
+                    [[container.name for container in result]
+                     for result in results]))
+            return d
+
         def test_container_volumes(self):
             """
             Mounted datasets are included in response messages.
@@ -642,6 +896,68 @@ def make_clientv1_tests():
             )
             return d
 
+        def test_watch_listings(self):
+            """
+            Without a generation the ``watch_*`` methods return the current
+            listings straight away, with a generation.
+            """
+            creating = self.create_datasets()
+
+            def created(_):
+                return gatherResults([
+                    gatherResults([
+                        self.client.watch_datasets_configuration(),
+                        self.client.watch_datasets_state(),
+                        self.client.watch_containers_configuration(),
+                        self.client.watch_containers_state(),
+                        self.client.watch_nodes(),
+                    ]),
+                    gatherResults([
+                        self.client.list_datasets_configuration(),
+                        self.client.list_datasets_state(),
+                        self.client.list_containers_configuration(),
+                        self.client.list_containers_state(),
+                        self.client.list_nodes(),
+                    ]),
+                ])
+            creating.addCallback(created)
+
+            def got_results((watched, listed)):
+                self.assertEqual(
+                    ([True] * 5, [
+                        set(result) for result in
+                        [listed[0].datasets.values()] + listed[1:]]),
+                    ([isinstance(result.generation, (int, long))
+                      for result in watched],
+                     [set(result.value) for result in watched]))
+            creating.addCallback(got_results)
+            return creating
+
+        def test_watch_change(self):
+            """
+            Given the generation of an earlier result, ``watch_datasets_state``
+            returns the state once it changes, with a new generation.
+            """
+            d = self.client.watch_datasets_state()
+
+            def got_initial(initial):
+                watching = self.client.watch_datasets_state(
+                    initial.generation)
+                creating = self.assert_creates(
+                    self.client, primary=self.node_1.uuid,
+                    maximum_size=DATASET_SIZE)
+                creating.addCallback(lambda dataset: (
+                    self.synchronize_state(), dataset)[1])
+
+                def check((dataset, changed)):
+                    self.assertEqual(
+                        (True, [dataset.dataset_id]),
+                        (changed.generation != initial.generation,
+                         [state.dataset_id for state in changed.value]))
+                return gatherResults([creating, watching]).addCallback(check)
+            d.addCallback(got_initial)
+            return d
+
         def test_this_node_uuid(self):
             """
             ``this_node_uuid`` returns ``Deferred`` firing the UUID of the
@@ -703,6 +1019,9 @@ class FlockerClientTests(make_clientv1_tests()):
     """
     Interface tests for ``FlockerClient``.
     """
+    # Extra arguments for the ``FlockerClient`` under test:
+    client_arguments = {}
+
     @skipUnless(platform.isLinux(),
                 "flocker-node-era currently requires Linux.")
     @skipUnless(which("flocker-node-era"),
@@ -752,10 +1071,13 @@ class FlockerClientTests(make_clientv1_tests()):
         self.addCleanup(api_service.stopService)
 
         credential_set.copy_to(credentials_path, user=True)
-        return FlockerClient(reactor, b"127.0.0.1", self.port,
-                             credentials_path.child(b"cluster.crt"),
-                             credentials_path.child(b"user.crt"),
-                             credentials_path.child(b"user.key"))
+        client = FlockerClient(reactor, b"127.0.0.1", self.port,
+                               credentials_path.child(b"cluster.crt"),
+                               credentials_path.child(b"user.crt"),
+                               credentials_path.child(b"user.key"),
+                               **self.client_arguments)
+        self.addCleanup(client.close)
+        return client
 
     def synchronize_state(self):
         deployment = self.persistence_service.get()
@@ -855,6 +1177,39 @@ class FlockerClientTests(make_clientv1_tests()):
                           states))
         return d
 
+    def test_unindexed_server(self):
+        """
+        Against a server which answers metadata lookups with a 404 HTTP
+        response, as those predating the metadata index do, names are looked
+        up and kept unique by checking the configuration instead.
+        """
+        self.patch(httpapi, "INDEXED_METADATA_KEYS", frozenset())
+
+        def create(name):
+            return self.client.create_dataset(
+                primary=self.node_1.uuid, metadata={u"name": name},
+                unique_key=u"name")
+        d = create(u"a")
+        d.addCallback(lambda dataset: gatherResults([
+            self.client.list_datasets_by_metadata(u"name", u"a"),
+            self.assertFailure(create(u"a"), DatasetAlreadyExists),
+        ]).addCallback(
+            lambda (found, _): self.assertEqual([dataset], found)))
+        return d
+
+    def test_create_unique_unindexed_tag(self):
+        """
+        If a ``configuration_tag`` is given with a ``unique_key`` the server
+        doesn't index, ``create_dataset`` fails with ``ConfigurationChanged``
+        if the configuration has changed since, rather than retrying.
+        """
+        tag = self.get_configuration_tag()
+        d = self.client.create_dataset(primary=self.node_1.uuid)
+        d.addCallback(lambda _: self.client.create_dataset(
+            primary=self.node_1.uuid, metadata={u"label": u"a"},
+            configuration_tag=tag, unique_key=u"label"))
+        return self.assertFailure(d, ConfigurationChanged)
+
     def test_this_node_uuid_retry(self):
         """
         ``this_node_uuid`` retries if the node UUID is unknown.
@@ -888,6 +1243,186 @@ class FlockerClientTests(make_clientv1_tests()):
                                   ResponseError)
 
 
+class PersistentFlockerClientTests(FlockerClientTests):
+    """
+    Interface tests for a ``FlockerClient`` which keeps connections open.
+    """
+    client_arguments = {"persistent": True, "pool_size": 1}
+
+    def idle_connections(self):
+        """
+        :return: The ``list`` of connections the client keeps open.
+        """
+        return [connection
+                for connections in self.client._pool._connections.values()
+                for connection in connections]
+
+    def test_connection_reused(self):
+        """
+        Consecutive requests are sent over the same connection.
+        """
+        connections = []
+        d = self.client.list_nodes()
+        d.addCallback(lambda _: connections.append(self.idle_connections()))
+        d.addCallback(lambda _: self.client.list_nodes())
+        d.addCallback(lambda _: connections.append(self.idle_connections()))
+        d.addCallback(lambda _: self.assertEqual(
+            (1, connections[0]), (len(connections[0]), connections[1])))
+        return d
+
+    def test_close(self):
+        """
+        ``FlockerClient.close`` closes the connections kept open.
+        """
+        d = self.client.list_nodes()
+        d.addCallback(lambda _: self.client.close())
+        d.addCallback(lambda _: self.assertEqual([], self.idle_connections()))
+        return d
+
+
+class CachingFlockerClientTests(FlockerClientTests):
+    """
+    Interface tests for a ``FlockerClient`` which caches listings.
+    """
+    client_arguments = {"cache_ttl": 0}
+
+    def test_unchanged_reused(self):
+        """
+        A listing the server confirms is unchanged is not parsed again.
+        """
+        listings = []
+        d = self.client.create_dataset(primary=self.node_1.uuid)
+        d.addCallback(lambda _: self.client.list_datasets_configuration())
+        d.addCallback(listings.append)
+        d.addCallback(lambda _: self.client.list_datasets_configuration())
+        d.addCallback(listings.append)
+        d.addCallback(lambda _: self.assertIs(listings[0], listings[1]))
+        return d
+
+    def test_change_forgets(self):
+        """
+        A change made through the client is seen in the next listing, however
+        long cached listings are otherwise reused.
+        """
+        self.client._cache._ttl = 1000
+        d = self.client.list_datasets_configuration()
+        d.addCallback(
+            lambda _: self.client.create_dataset(primary=self.node_1.uuid))
+
+        def created(dataset):
+            listed = self.client.list_datasets_configuration()
+            listed.addCallback(lambda configuration: self.assertEqual(
+                [dataset], list(configuration)))
+            return listed
+        d.addCallback(created)
+        return d
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Tests for ``_ResponseCache``.
+    """
+    def setUp(self):
+        super(ResponseCacheTests, self).setUp()
+        self.clock = Clock()
+        self.cache = _ResponseCache(self.clock, 10, 2)
+        self.requests = []
+
+    def retrieve(self, result, etag=b'"1"'):
+        """
+        :return: A ``retrieve`` callable for ``_ResponseCache.get`` which
+            records the entity tags it is given and returns ``result``.
+        """
+        headers = Headers()
+        if etag is not None:
+            headers.setRawHeaders(b"ETag", [etag])
+
+        def retrieve(if_none_match):
+            self.requests.append(if_none_match)
+            return succeed((result, headers))
+        return retrieve
+
+    def get(self, key, result, **kwargs):
+        """
+        :return: The listing ``_ResponseCache.get`` returns for ``key``.
+        """
+        return self.successResultOf(
+            self.cache.get(key, self.retrieve(result, **kwargs)))
+
+    def test_reused(self):
+        """
+        A listing is reused without asking the server until the time-to-live
+        has passed.
+        """
+        listing = [1]
+        self.assertEqual(
+            (listing, listing, [None]),
+            (self.get(u"a", listing), self.get(u"a", [2]), self.requests))
+
+    def test_revalidated(self):
+        """
+        After the time-to-live a listing is revalidated with its entity tag,
+        and reused for as long again if the server confirms it is unchanged.
+        """
+        listing = [1]
+        self.get(u"a", listing)
+        self.clock.advance(10)
+        result = self.get(u"a", None)
+        self.clock.advance(5)
+        self.assertEqual(
+            (listing, listing, [None, b'"1"']),
+            (result, self.get(u"a", [2]), self.requests))
+
+    def test_changed(self):
+        """
+        A listing which has changed replaces the cached one.
+        """
+        self.get(u"a", [1])
+        self.clock.advance(10)
+        self.get(u"a", [2], etag=b'"2"')
+        self.assertEqual([2], self.get(u"a", [3]))
+
+    def test_untagged(self):
+        """
+        Listings without an entity tag are not cached.
+        """
+        self.get(u"a", [1], etag=None)
+        self.assertEqual(([2], [None, None]),
+                         (self.get(u"a", [2]), self.requests))
+
+    def test_size(self):
+        """
+        Once more listings than the size are cached, the least recently used
+        is forgotten.
+        """
+        for key in [u"a", u"b", u"a", u"c", u"a", u"b"]:
+            self.get(key, [key])
+        self.assertEqual([None, None, None, None], self.requests)
+
+    def test_clear(self):
+        """
+        ``_ResponseCache.clear`` forgets every listing.
+        """
+        self.get(u"a", [1])
+        self.cache.clear()
+        self.assertEqual([2], self.get(u"a", [2]))
+
+    def test_clear_in_flight(self):
+        """
+        A listing requested before ``_ResponseCache.clear`` is returned but
+        not stored, since it may predate the change that cleared the cache.
+        """
+        retrieving = Deferred()
+        result = self.cache.get(u"a", lambda if_none_match: retrieving)
+        self.cache.clear()
+        headers = Headers({b"ETag": [b'"1"']})
+        retrieving.callback(([u"stale"], headers))
+        self.assertEqual(
+            ([u"stale"], [u"fresh"], [None]),
+            (self.successResultOf(result), self.get(u"a", [u"fresh"]),
+             self.requests))
+
+
 class ConditionalCreateTests(TestCase):
     """
     Tests for ``conditional_create``.
@@ -118,7 +118,8 @@ def rest_api_context_factory(ca_certificate, control_credential):
         ca_certificate, control_credential, b"user-")
 
 
-def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path):
+def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path,
+                             pool=None):
     """
     Create a ``treq``-API object that implements the REST API TLS
     authentication.
@@ -130,6 +131,8 @@ def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path):
     :param FilePath ca_path: Absolute path to the public cluster certificate.
     :param FilePath user_cert_path: Absolute path to the user certificate.
     :param FilePath user_key_path: Absolute path to the user private key.
+    :param HTTPConnectionPool pool: The pool of connections to use, or
+        ``None`` for a new connection for every request.
 
     :return: ``treq`` compatible object.
     """
@@ -137,4 +140,4 @@ def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path):
     user_credential = UserCredential.from_files(user_cert_path, user_key_path)
     policy = ControlServicePolicy(
         ca_certificate=ca, client_credential=user_credential.credential)
-    return HTTPClient(Agent(reactor, contextFactory=policy))
+    return HTTPClient(Agent(reactor, contextFactory=policy, pool=pool))
@@ -0,0 +1,253 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_benchmarks -*-
+
+"""
+Micro-benchmarks for the control service's handling of large clusters.
+"""
+
+from timeit import default_timer
+from uuid import UUID
+
+from pyrsistent import PClass, field
+
+from twisted.python.filepath import FilePath
+
+from ._model import (
+    Application, AttachedVolume, Dataset, Deployment, DeploymentState,
+    DockerImage, Manifestation, Node, NodeState, Port,
+)
+from ._persistence import wire_decode, splicing_wire_encode, FragmentCache
+from ._binary_codec import binary_decode, binary_encode
+from ._protocol import (
+    _FRAGMENT_CLASSES, _BINARY_FRAGMENT_CLASSES, _FRAGMENT_CACHE_SIZE,
+)
+
+_IMAGE = DockerImage.from_string(u"clusterhq/postgresql:9.4")
+
+
+def _uuid(node_index, item_index):
+    """
+    :return: A ``UUID`` that is the same every time it is asked for with the
+        same arguments, so that benchmark runs are comparable.
+    """
+    return UUID(int=(node_index << 64) | item_index)
+
+
+def synthetic_cluster(node_count, datasets_per_node=5):
+    """
+    Build the configuration and state of a cluster in which every node is
+    configured with, and actually has, some datasets each used by an
+    application.
+
+    :param int node_count: The number of nodes in the cluster.
+    :param int datasets_per_node: The number of datasets on each node.
+
+    :return: A tuple of ``Deployment`` and ``DeploymentState``.
+    """
+    nodes = []
+    node_states = []
+    for node_index in range(node_count):
+        node_uuid = _uuid(node_index, 0)
+        manifestations = {}
+        applications = []
+        for dataset_index in range(datasets_per_node):
+            dataset_id = unicode(_uuid(node_index, dataset_index + 1))
+            manifestation = Manifestation(
+                dataset=Dataset(
+                    dataset_id=dataset_id,
+                    maximum_size=1024 * 1024 * 1024,
+                    metadata={u"name": u"dataset-{}".format(dataset_id)},
+                ),
+                primary=True,
+            )
+            manifestations[dataset_id] = manifestation
+            applications.append(Application(
+                name=u"app-{}-{}".format(node_index, dataset_index),
+                image=_IMAGE,
+                ports={Port(internal_port=5432,
+                            external_port=10000 + dataset_index)},
+                volume=AttachedVolume(
+                    manifestation=manifestation,
+                    mountpoint=FilePath(b"/var/lib/postgresql"),
+                ),
+            ))
+        nodes.append(Node(
+            uuid=node_uuid, applications=applications,
+            manifestations=manifestations,
+        ))
+        node_states.append(NodeState(
+            uuid=node_uuid,
+            hostname=u"10.{}.{}.{}".format(
+                node_index >> 16, (node_index >> 8) & 0xff, node_index & 0xff),
+            applications=applications,
+            manifestations=manifestations,
+            paths={
+                dataset_id: FilePath(b"/flocker").child(
+                    dataset_id.encode("ascii"))
+                for dataset_id in manifestations
+            },
+            devices={
+                UUID(dataset_id): FilePath(b"/dev/xvd{}".format(index))
+                for index, dataset_id in enumerate(manifestations)
+            },
+        ))
+    state = DeploymentState(
+        nodes=node_states,
+        node_uuid_to_era={node.uuid: _uuid(node_count + 1, index)
+                          for index, node in enumerate(nodes)},
+    )
+    return Deployment(nodes=nodes), state
+
+
+class CodecMeasurement(PClass):
+    """
+    How one encoding fared with one object.
+
+    :ivar unicode name: The name of the encoding.
+    :ivar int size: The length of the encoded bytes.
+    :ivar float encode_seconds: The time taken to encode the object.
+    :ivar float decode_seconds: The time taken to decode the encoded bytes.
+    :ivar float reencode_seconds: The time taken to encode the object again
+        after a change to one of its nodes.
+    """
+    name = field(type=unicode, mandatory=True)
+    size = field(type=int, mandatory=True)
+    encode_seconds = field(type=float, mandatory=True)
+    decode_seconds = field(type=float, mandatory=True)
+    reencode_seconds = field(type=float, mandatory=True)
+
+
+_CODECS = [
+    (u"json", splicing_wire_encode, wire_decode, _FRAGMENT_CLASSES),
+    (u"binary", binary_encode, binary_decode, _BINARY_FRAGMENT_CLASSES),
+]
+
+
+def _change_one_node(state):
+    """
+    :param DeploymentState state: A cluster state with at least one node.
+
+    :return: ``state`` with the hostname of one of its nodes changed.
+    """
+    node = next(iter(state.nodes))
+    return state.update_node(node.set(hostname=u"192.0.2.1"))
+
+
+def _measure(name, encode, decode, fragment_classes, obj, timer):
+    """
+    Encode and decode an object, checking it survives the round trip, then
+    encode it again after changing one node.
+
+    :param encode: Two-argument callable which encodes an object to bytes
+        given a ``FragmentCache``.
+    :param fragment_classes: The classes whose encodings the
+        ``FragmentCache`` remembers.
+
+    :return: A ``CodecMeasurement``.
+    """
+    fragments = FragmentCache(fragment_classes, _FRAGMENT_CACHE_SIZE)
+    changed = _change_one_node(obj)
+    start = timer()
+    data = encode(obj, fragments)
+    encoded = timer()
+    decoded = decode(data)
+    decoded_time = timer()
+    encode(changed, fragments)
+    finished = timer()
+    if decoded != obj:
+        raise AssertionError(
+            "{} encoding did not round-trip".format(name))
+    return CodecMeasurement(
+        name=name, size=len(data),
+        encode_seconds=encoded - start,
+        decode_seconds=decoded_time - encoded,
+        reencode_seconds=finished - decoded_time,
+    )
+
+
+def compare_wire_codecs(node_count, timer=default_timer):
+    """
+    Measure the wire encodings of the state of a synthetic cluster, as sent
+    to the agents on every change.
+
+    :param int node_count: The number of nodes in the cluster.
+    :param timer: A no-argument callable returning the current time in
+        seconds.
+
+    :return: A ``list`` of ``CodecMeasurement``, one per encoding.
+    """
+    _, state = synthetic_cluster(node_count)
+    return [
+        _measure(name, encode, decode, fragment_classes, state, timer)
+        for (name, encode, decode, fragment_classes) in _CODECS
+    ]
+
+
+class NodeOperationsMeasurement(PClass):
+    """
+    How long operations on single nodes took in a cluster of a given size.
+
+    :ivar int node_count: The number of nodes in the cluster.
+    :ivar float get_node_seconds: The mean time taken by
+        ``DeploymentState.get_node``.
+    :ivar float update_node_seconds: The mean time taken by
+        ``DeploymentState.update_node`` given a changed node.
+    :ivar float update_configuration_seconds: The mean time taken by
+        ``Deployment.update_node`` given a changed node.
+    """
+    node_count = field(type=int, mandatory=True)
+    get_node_seconds = field(type=float, mandatory=True)
+    update_node_seconds = field(type=float, mandatory=True)
+    update_configuration_seconds = field(type=float, mandatory=True)
+
+
+def _mean_seconds(operation, arguments, timer):
+    """
+    :param operation: One-argument callable to time.
+    :param list arguments: The arguments to call it with, once each.
+    :param timer: A no-argument callable returning the current time in
+        seconds.
+
+    :return: The mean time taken by a call, in seconds.
+    """
+    start = timer()
+    for argument in arguments:
+        operation(argument)
+    return (timer() - start) / len(arguments)
+
+
+def measure_node_operations(node_counts, repeat=100, timer=default_timer):
+    """
+    Measure how the cost of looking up and updating one node grows with the
+    size of the cluster.
+
+    :param node_counts: The numbers of nodes in the clusters to measure.
+    :param int repeat: The number of times to perform each operation in each
+        cluster.
+    :param timer: A no-argument callable returning the current time in
+        seconds.
+
+    :return: A ``list`` of ``NodeOperationsMeasurement``, one per cluster.
+    """
+    measurements = []
+    for node_count in node_counts:
+        configuration, state = synthetic_cluster(node_count)
+        node_states = list(state.nodes)
+        node_states = [node_states[i % node_count] for i in range(repeat)]
+        nodes = list(configuration.nodes)
+        nodes = [nodes[i % node_count] for i in range(repeat)]
+        measurements.append(NodeOperationsMeasurement(
+            node_count=node_count,
+            get_node_seconds=_mean_seconds(
+                lambda node_state: state.get_node(node_state.uuid),
+                node_states, timer),
+            update_node_seconds=_mean_seconds(
+                lambda node_state: state.update_node(
+                    node_state.set(hostname=u"192.0.2.1")),
+                node_states, timer),
+            update_configuration_seconds=_mean_seconds(
+                lambda node: configuration.update_node(
+                    node.set(applications=[])),
+                nodes, timer),
+        ))
+    return measurements
@@ -0,0 +1,445 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_binary_codec -*-
+
+"""
+A compact binary encoding of the configuration model.
+
+This is an alternative to the JSON based ``wire_encode`` for use on the AMP
+channel between the control service and the convergence agents, which is only
+used once both ends have agreed to it.  It encodes the same objects as
+``wire_encode`` and decodes them to the same values, but:
+
+* every value is prefixed by a single byte type tag rather than being wrapped
+  in a dictionary with a class marker;
+* ``UUID`` instances are written as 16 raw bytes the first time they are seen
+  and as a reference to that first occurrence afterwards;
+* strings are length-prefixed and, like ``UUID`` instances, written in full
+  only the first time they are seen;
+* integers and lengths are written as variable length integers.
+
+Given a ``FragmentCache`` the encodings of instances of the classes it is for
+are written as self-contained fragments, with their own strings and ``UUID``
+instances, so that they can be reused when encoding other objects that
+contain the same instances.
+
+The encoded bytes start with ``BINARY_MAGIC``, which can never start a JSON
+document, so decoders can tell the two encodings apart.
+"""
+
+from calendar import timegm
+from datetime import datetime
+from struct import Struct
+from uuid import UUID
+
+from pyrsistent import PRecord, PClass, PMap, PSet, PVector, pmap
+
+from pytz import UTC
+
+from twisted.python.filepath import FilePath
+
+from ._persistence import _CONFIG_CLASS_MAP
+
+# Prefix of all binary encoded data:
+BINARY_MAGIC = b"\x00FLB1"
+
+# Type tags:
+_NONE = b"N"
+_TRUE = b"T"
+_FALSE = b"F"
+_INTEGER = b"I"
+_FLOAT = b"D"
+_BYTES = b"B"
+_NEW_STRING = b"S"
+_STRING_REFERENCE = b"s"
+_NEW_UUID = b"U"
+_UUID_REFERENCE = b"u"
+_LIST = b"L"
+_DICT = b"d"
+_PMAP = b"M"
+_CLASS = b"C"
+_FILEPATH = b"P"
+_DATETIME = b"t"
+_FRAGMENT = b"X"
+
+_DOUBLE = Struct(">d")
+_BYTE = [chr(i) for i in range(256)]
+
+
+class BinaryDecodeError(Exception):
+    """
+    Data could not be decoded with ``binary_decode``.
+    """
+
+
+def _zigzag(value):
+    """
+    Map signed integers to non-negative ones so small magnitudes stay small.
+    """
+    if value >= 0:
+        return value << 1
+    return ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    """
+    Reverse ``_zigzag``.
+    """
+    if value & 1:
+        return -((value + 1) >> 1)
+    return value >> 1
+
+
+class _Encoder(object):
+    """
+    Encode a single object graph.
+
+    :ivar FragmentCache _fragments: The fragments to reuse and add to, or
+        ``None``.
+    :ivar list _chunks: The encoded ``bytes`` so far.
+    :ivar dict _strings: Map strings which have been written to their index.
+    :ivar dict _uuids: Map ``UUID`` instances which have been written to their
+        index.
+    """
+    def __init__(self, fragments=None):
+        self._fragments = fragments
+        self._chunks = []
+        self._strings = {}
+        self._uuids = {}
+
+    def result(self):
+        """
+        :return bytes: Everything encoded so far.
+        """
+        return b"".join(self._chunks)
+
+    def _write_varint(self, value):
+        """
+        Write a non-negative integer using 7 bits per byte.
+        """
+        write = self._chunks.append
+        while value >= 0x80:
+            write(_BYTE[(value & 0x7f) | 0x80])
+            value >>= 7
+        write(_BYTE[value])
+
+    def _write_bytes(self, value):
+        """
+        Write length-prefixed bytes.
+        """
+        self._write_varint(len(value))
+        self._chunks.append(value)
+
+    def _write_string(self, value):
+        """
+        Write a ``unicode`` string, or a reference to an earlier occurrence of
+        it.
+        """
+        index = self._strings.get(value)
+        if index is None:
+            self._strings[value] = len(self._strings)
+            self._chunks.append(_NEW_STRING)
+            self._write_bytes(value.encode("utf-8"))
+        else:
+            self._chunks.append(_STRING_REFERENCE)
+            self._write_varint(index)
+
+    def _write_uuid(self, value):
+        """
+        Write a ``UUID``, or a reference to an earlier occurrence of it.
+        """
+        index = self._uuids.get(value)
+        if index is None:
+            self._uuids[value] = len(self._uuids)
+            self._chunks.append(_NEW_UUID)
+            self._chunks.append(value.bytes)
+        else:
+            self._chunks.append(_UUID_REFERENCE)
+            self._write_varint(index)
+
+    def _write_items(self, tag, items, count):
+        """
+        Write a tagged sequence of key/value pairs.
+        """
+        self._chunks.append(tag)
+        self._write_varint(count)
+        for key, value in items:
+            self.write(key)
+            self.write(value)
+
+    def _write_class(self, obj, fields):
+        """
+        Write an instance of one of the serializable classes.
+
+        :param obj: The instance.
+        :param dict fields: Its field values by name.
+        """
+        self._chunks.append(_CLASS)
+        self._write_string(obj.__class__.__name__)
+        self._write_varint(len(fields))
+        for name, value in fields.iteritems():
+            self._write_string(name)
+            self.write(value)
+
+    def _write_none(self, obj):
+        self._chunks.append(_NONE)
+
+    def _write_bool(self, obj):
+        self._chunks.append(_TRUE if obj else _FALSE)
+
+    def _write_tagged_bytes(self, obj):
+        self._chunks.append(_BYTES)
+        self._write_bytes(obj)
+
+    def _write_integer(self, obj):
+        self._chunks.append(_INTEGER)
+        self._write_varint(_zigzag(obj))
+
+    def _write_float(self, obj):
+        self._chunks.append(_FLOAT)
+        self._chunks.append(_DOUBLE.pack(obj))
+
+    def _write_record(self, obj):
+        self._write_class(obj, obj)
+
+    def _write_pclass(self, obj):
+        self._write_class(obj, obj.evolver().data)
+
+    def _write_pmap(self, obj):
+        self._write_items(_PMAP, obj.iteritems(), len(obj))
+
+    def _write_dict(self, obj):
+        self._write_items(_DICT, obj.iteritems(), len(obj))
+
+    def _write_list(self, obj):
+        self._chunks.append(_LIST)
+        self._write_varint(len(obj))
+        write = self.write
+        for item in obj:
+            write(item)
+
+    def _write_filepath(self, obj):
+        path = obj.path
+        if isinstance(path, unicode):
+            # Decoded as bytes, like ``wire_decode`` does:
+            path = path.encode("utf-8")
+        self._chunks.append(_FILEPATH)
+        self._write_bytes(path)
+
+    def _write_datetime(self, obj):
+        if obj.tzinfo is None:
+            raise ValueError("Datetime without a timezone: {}".format(obj))
+        self._chunks.append(_DATETIME)
+        self._write_varint(_zigzag(timegm(obj.utctimetuple())))
+
+    def write(self, obj):
+        """
+        Encode an object.
+
+        :param obj: An object from the configuration model, or one of the
+            simpler types it is built from.
+        """
+        kind = type(obj)
+        try:
+            writer = _WRITERS[kind]
+        except KeyError:
+            writer = _WRITERS[kind] = _writer_for(kind)
+        fragments = self._fragments
+        if fragments is not None and kind in fragments.classes:
+            fragment = fragments.get(obj)
+            if fragment is None:
+                encoder = _Encoder(fragments)
+                writer(encoder, obj)
+                fragment = encoder.result()
+                fragments.put(obj, fragment)
+            self._chunks.append(_FRAGMENT)
+            self._write_bytes(fragment)
+        else:
+            writer(self, obj)
+
+
+# Ordered so that subclasses come before their base classes, e.g. ``bool``
+# before ``int`` and ``PRecord`` before ``PMap``:
+_WRITERS_BY_BASE = [
+    (type(None), _Encoder._write_none),
+    (bool, _Encoder._write_bool),
+    (unicode, _Encoder._write_string),
+    (bytes, _Encoder._write_tagged_bytes),
+    ((int, long), _Encoder._write_integer),
+    (float, _Encoder._write_float),
+    (UUID, _Encoder._write_uuid),
+    (PRecord, _Encoder._write_record),
+    (PClass, _Encoder._write_pclass),
+    (PMap, _Encoder._write_pmap),
+    (dict, _Encoder._write_dict),
+    ((PSet, PVector, set, frozenset, list, tuple), _Encoder._write_list),
+    (FilePath, _Encoder._write_filepath),
+    (datetime, _Encoder._write_datetime),
+]
+
+# Map types to the ``_Encoder`` method that writes their instances, filled in
+# as new types are encountered:
+_WRITERS = {}
+
+
+def _writer_for(kind):
+    """
+    Find the ``_Encoder`` method which writes instances of a type.
+
+    :param type kind: The type of an object to encode.
+    :raise TypeError: If instances of the type cannot be encoded.
+    """
+    for base, writer in _WRITERS_BY_BASE:
+        if issubclass(kind, base):
+            return writer
+    raise TypeError("{!r} is not binary encodable".format(kind))
+
+
+class _Decoder(object):
+    """
+    Decode a single object graph.
+
+    :ivar bytes _data: The data being decoded.
+    :ivar int _position: The offset of the next byte to decode.
+    :ivar list _strings: The strings decoded so far, by index.
+    :ivar list _uuids: The ``UUID`` instances decoded so far, by index.
+    """
+    def __init__(self, data, position=0):
+        self._data = data
+        self._position = position
+        self._strings = []
+        self._uuids = []
+        self._readers = {
+            _NONE: lambda: None,
+            _TRUE: lambda: True,
+            _FALSE: lambda: False,
+            _INTEGER: lambda: _unzigzag(self._read_varint()),
+            _FLOAT: self._read_float,
+            _BYTES: self._read_bytes,
+            _NEW_STRING: self._read_new_string,
+            _STRING_REFERENCE: lambda: self._strings[self._read_varint()],
+            _NEW_UUID: self._read_new_uuid,
+            _UUID_REFERENCE: lambda: self._uuids[self._read_varint()],
+            _LIST: self._read_list,
+            _DICT: lambda: dict(self._read_items()),
+            _PMAP: lambda: pmap(self._read_items()),
+            _CLASS: self._read_class,
+            _FILEPATH: lambda: FilePath(self._read_bytes()),
+            _DATETIME: lambda: datetime.fromtimestamp(
+                _unzigzag(self._read_varint()), UTC),
+            _FRAGMENT: lambda: _Decoder(self._read_bytes()).read_all(),
+        }
+
+    def _take(self, length):
+        """
+        Consume some bytes.
+        """
+        start = self._position
+        end = self._position = start + length
+        if end > len(self._data):
+            raise BinaryDecodeError("Unexpected end of data")
+        return self._data[start:end]
+
+    def _read_varint(self):
+        data = self._data
+        position = self._position
+        try:
+            byte = ord(data[position])
+            if byte < 0x80:
+                # The common case of a small integer:
+                self._position = position + 1
+                return byte
+            result = 0
+            shift = 0
+            while byte >= 0x80:
+                result |= (byte & 0x7f) << shift
+                shift += 7
+                position += 1
+                byte = ord(data[position])
+        except IndexError:
+            raise BinaryDecodeError("Unexpected end of data")
+        self._position = position + 1
+        return result | (byte << shift)
+
+    def _read_float(self):
+        return _DOUBLE.unpack(self._take(_DOUBLE.size))[0]
+
+    def _read_bytes(self):
+        return self._take(self._read_varint())
+
+    def _read_new_string(self):
+        value = self._read_bytes().decode("utf-8")
+        self._strings.append(value)
+        return value
+
+    def _read_new_uuid(self):
+        value = UUID(bytes=self._take(16))
+        self._uuids.append(value)
+        return value
+
+    def _read_list(self):
+        return [self.read() for _ in xrange(self._read_varint())]
+
+    def _read_items(self):
+        return [(self.read(), self.read())
+                for _ in xrange(self._read_varint())]
+
+    def _read_class(self):
+        class_name = self.read()
+        try:
+            cls = _CONFIG_CLASS_MAP[class_name]
+        except KeyError:
+            raise BinaryDecodeError(
+                "Unknown class {!r}".format(class_name))
+        return cls.create(dict(self._read_items()))
+
+    def read(self):
+        """
+        Decode the next object.
+        """
+        position = self._position
+        try:
+            tag = self._data[position]
+        except IndexError:
+            raise BinaryDecodeError("Unexpected end of data")
+        self._position = position + 1
+        try:
+            reader = self._readers[tag]
+        except KeyError:
+            raise BinaryDecodeError("Unknown type tag {!r}".format(tag))
+        return reader()
+
+    def read_all(self):
+        """
+        Decode the one object which makes up all the data.
+        """
+        result = self.read()
+        if self._position != len(self._data):
+            raise BinaryDecodeError("Trailing data")
+        return result
+
+
+def binary_encode(obj, fragments=None):
+    """
+    Encode the given model object into bytes using the binary format.
+
+    :param obj: An object from the configuration model, e.g. ``Deployment``.
+    :param FragmentCache fragments: If not ``None``, the encodings of
+        previously encoded objects, which encodings of parts of ``obj`` are
+        added to.
+    :return bytes: Encoded object, starting with ``BINARY_MAGIC``.
+    """
+    encoder = _Encoder(fragments)
+    encoder.write(obj)
+    return BINARY_MAGIC + encoder.result()
+
+
+def binary_decode(data):
+    """
+    Decode the given model object from bytes produced by ``binary_encode``.
+
+    :param bytes data: Encoded object.
+    :raise BinaryDecodeError: If the data is not validly encoded.
+    """
+    if not data.startswith(BINARY_MAGIC):
+        raise BinaryDecodeError("Not binary encoded data")
+    return _Decoder(data, len(BINARY_MAGIC)).read_all()
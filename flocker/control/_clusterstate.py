@@ -5,15 +5,17 @@ Combine and retrieve current cluster state.
 """
 
 from datetime import datetime, timedelta
+from heapq import heappush, heappop
+from itertools import count
 
 from twisted.python.versions import Version
 from twisted.python.deprecate import deprecated
 from twisted.application.service import MultiService
-from twisted.application.internet import TimerService
 
 from pyrsistent import PClass, field, pmap
 
 from . import DeploymentState, ChangeSource
+from ._generations import GenerationWaiters
 
 # Allowed inactivity period before updates are expired
 EXPIRATION_TIME = timedelta(seconds=120)
@@ -51,34 +53,138 @@ class ClusterStateService(MultiService):
     Eventually we'll probably want a better policy:
     https://clusterhq.atlassian.net/browse/FLOC-1896
 
+    Rather than polling every wiper, each is given a deadline in a heap and
+    the service only wakes up when the earliest deadline is reached.  Sources
+    don't report activity as it happens, so a wiper whose source has been
+    active since its deadline was set is put back with a new deadline at
+    that point.
+
     :ivar DeploymentState _deployment_state: The current known cluster state.
+    :ivar int _generation: The generation of ``_deployment_state``,
+        incremented whenever it is replaced by a different object.
+    :ivar GenerationWaiters _generation_waiters: Those waiting for
+        ``_generation`` to change.
+    :ivar list _change_callbacks: Callables to call with each change of
+        ``_deployment_state``; see ``register``.
     :ivar PMap _information_wipers: Map (wiper class, wiper key) to
         ``_WiperAndSource``.
+    :ivar list _expiry_heap: Heap of (deadline, sequence number, key of
+        ``_information_wipers``).  Entries whose deadline doesn't match
+        ``_expiry_deadlines`` are stale and ignored.
+    :ivar dict _expiry_deadlines: Map keys of ``_information_wipers`` to the
+        deadline of their live entry in ``_expiry_heap``.
+    :ivar _expiry_call: The ``IDelayedCall`` which will next wipe expired
+        state, or ``None``.
     :ivar _clock: ``IReactorTime`` provider.
     """
     def __init__(self, reactor):
         MultiService.__init__(self)
         self._deployment_state = DeploymentState()
-        timer = TimerService(1, self._wipe_expired)
-        timer.clock = reactor
-        timer.setServiceParent(self)
+        self._generation = 1
+        self._generation_waiters = GenerationWaiters()
+        self._change_callbacks = []
         self._information_wipers = pmap()
+        self._expiry_heap = []
+        self._expiry_deadlines = {}
+        self._expiry_sequence = count()
+        self._expiry_call = None
         self._clock = reactor
 
+    def startService(self):
+        MultiService.startService(self)
+        self._wipe_expired()
+
+    def stopService(self):
+        if self._expiry_call is not None:
+            self._expiry_call.cancel()
+            self._expiry_call = None
+        return MultiService.stopService(self)
+
+    def _now(self):
+        """
+        :return: The current time as a UTC ``datetime``.
+        """
+        return datetime.utcfromtimestamp(self._clock.seconds())
+
+    def _add_deadline(self, key, deadline):
+        """
+        Make sure the wiper with the given key is checked no later than the
+        given deadline.
+
+        :param key: A key of ``_information_wipers``.
+        :param datetime deadline: When the wiper expires.
+        """
+        scheduled = self._expiry_deadlines.get(key)
+        if scheduled is None or deadline < scheduled:
+            self._expiry_deadlines[key] = deadline
+            heappush(self._expiry_heap,
+                     (deadline, next(self._expiry_sequence), key))
+
+    def _schedule_wipe(self):
+        """
+        Arrange for ``_wipe_expired`` to be called at the earliest deadline,
+        if the service is running.
+        """
+        if self._expiry_call is not None:
+            self._expiry_call.cancel()
+            self._expiry_call = None
+        if self.running and self._expiry_heap:
+            delay = (self._expiry_heap[0][0] - self._now()).total_seconds()
+            self._expiry_call = self._clock.callLater(
+                max(delay, 0), self._wipe_expired)
+
     def _wipe_expired(self):
         """
         Clear any expired state from memory.
         """
-        current_time = datetime.utcfromtimestamp(self._clock.seconds())
+        self._expiry_call = None
+        current_time = self._now()
         evolver = self._information_wipers.evolver()
-        for key, wipe in self._information_wipers.items():
+        original_state = self._deployment_state
+        while self._expiry_heap and self._expiry_heap[0][0] <= current_time:
+            deadline, _, key = heappop(self._expiry_heap)
+            if self._expiry_deadlines.get(key) != deadline:
+                continue
+            del self._expiry_deadlines[key]
+            wipe = evolver[key]
             last_activity = wipe.last_activity()
             if current_time - last_activity >= EXPIRATION_TIME:
                 self._deployment_state = wipe.update_cluster_state(
                     self._deployment_state
                 )
                 evolver.remove(key)
+            else:
+                self._add_deadline(key, last_activity + EXPIRATION_TIME)
         self._information_wipers = evolver.persistent()
+        self._update_generation(original_state, expired=True)
+        self._schedule_wipe()
+
+    def _update_generation(self, original_state, expired=False):
+        """
+        Increment the generation if the state has been replaced, and tell
+        those waiting for or registered for changes.
+
+        Changes which don't alter the state leave it as the same object, so
+        comparing identity is enough and avoids comparing the whole state.
+
+        :param DeploymentState original_state: The state before the changes.
+        :param bool expired: Whether the changes wiped expired information.
+        """
+        if self._deployment_state is not original_state:
+            self._generation += 1
+            for callback in self._change_callbacks:
+                callback(original_state, self._deployment_state, expired)
+            self._generation_waiters.changed(self._generation)
+
+    def register(self, change_callback):
+        """
+        Register a function to be called whenever the cluster state changes.
+
+        :param change_callback: Callable taking the previous and the new
+            ``DeploymentState`` and a ``bool`` which is ``True`` if the
+            change wiped information that had expired.
+        """
+        self._change_callbacks.append(change_callback)
 
     def manifestation_path(self, node_uuid, dataset_id):
         """
@@ -100,6 +206,23 @@ class ClusterStateService(MultiService):
         """
         return self._deployment_state
 
+    def state_generation(self):
+        """
+        :return int: The generation of the cluster state returned by
+            ``as_deployment``.  Each different state gets a higher generation.
+        """
+        return self._generation
+
+    def wait_for_state_change(self, generation):
+        """
+        :param int generation: A generation of the cluster state, as returned
+            by ``state_generation``.
+
+        :return: A cancellable ``Deferred`` that fires with the current
+            generation once it is no longer ``generation``.
+        """
+        return self._generation_waiters.wait(generation, self._generation)
+
     def apply_changes_from_source(self, source, changes):
         """
         Apply some changes to the cluster state.
@@ -113,16 +236,23 @@ class ClusterStateService(MultiService):
         # XXX: Multiple nodes may report being primary for a dataset. Enforce
         # consistency here. See
         # https://clusterhq.atlassian.net/browse/FLOC-1303
+        original_state = self._deployment_state
         for change in changes:
             self._deployment_state = change.update_cluster_state(
                 self._deployment_state
             )
+        self._update_generation(original_state)
+        earliest = self._expiry_heap[0][0] if self._expiry_heap else None
+        deadline = source.last_activity() + EXPIRATION_TIME
         for change in changes:
             wiper = change.get_information_wipe()
             key = (wiper.__class__, wiper.key())
             self._information_wipers = self._information_wipers.set(
                 key, _WiperAndSource(wiper=wiper, source=source)
             )
+            self._add_deadline(key, deadline)
+        if earliest is None or deadline < earliest:
+            self._schedule_wipe()
 
     @deprecated(v1_0, "ClusterStateService.apply_changes_from_source")
     def apply_changes(self, changes):
@@ -0,0 +1,233 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_diffing -*-
+
+"""
+Code to calculate the difference between objects. This is particularly useful
+for computing the difference between deeply nested ``PClass`` objects such as
+``Deployment`` and ``DeploymentState``.
+
+Diffs are themselves serializable so they can be sent over the wire in place
+of the (potentially much larger) objects they describe a change to.
+"""
+
+from pyrsistent import PClass, PMap, PSet, PVector, field, pvector
+
+from ._model import pvector_field
+
+
+def _get(structure, key):
+    """
+    Look up a child of a persistent structure.
+
+    :param structure: A ``PClass``, ``PMap`` or ``PRecord``.
+    :param key: The attribute name or key of the child.
+
+    :return: The child.
+    """
+    if isinstance(structure, PClass):
+        return getattr(structure, key)
+    return structure[key]
+
+
+def _transform_path(structure, path, operation):
+    """
+    Replace the object found at the end of a path with the result of calling a
+    function on it, rebuilding every object along the path.
+
+    This differs from ``pyrsistent``'s ``transform`` in that the structures
+    along the path are changed using ``set``, so the value at the end of the
+    path may be an unset optional ``PClass`` field.
+
+    :param structure: The root of the structure to transform.
+    :param path: A sequence of attribute names and keys leading from
+        ``structure`` to the object to change.
+    :param operation: A one-argument callable which takes the object at the
+        end of ``path`` and returns its replacement.
+
+    :return: The transformed structure.
+    """
+    if not path:
+        return operation(structure)
+    key = path[0]
+    return structure.set(
+        key, _transform_path(_get(structure, key), path[1:], operation)
+    )
+
+
+class _Set(PClass):
+    """
+    A diff operation replacing the object at a path with a new value.
+
+    :ivar PVector path: The path to the object to replace.  An empty path
+        replaces the root object.
+    :ivar value: The new value.
+    """
+    path = field(type=PVector, factory=pvector, mandatory=True)
+    value = field(mandatory=True)
+
+    def apply(self, obj):
+        if not self.path:
+            return self.value
+        return _transform_path(
+            obj, self.path[:-1],
+            lambda parent: parent.set(self.path[-1], self.value),
+        )
+
+
+class _Remove(PClass):
+    """
+    A diff operation removing an item from the object at a path.
+
+    :ivar PVector path: The path to a ``PSet``, ``PMap`` or ``PClass``.
+    :ivar item: The element, key or attribute name to remove.
+    """
+    path = field(type=PVector, factory=pvector, mandatory=True)
+    item = field(mandatory=True)
+
+    def apply(self, obj):
+        return _transform_path(
+            obj, self.path, lambda parent: parent.remove(self.item)
+        )
+
+
+class _Add(PClass):
+    """
+    A diff operation adding an element to the ``PSet`` at a path.
+
+    :ivar PVector path: The path to the ``PSet``.
+    :ivar item: The element to add.
+    """
+    path = field(type=PVector, factory=pvector, mandatory=True)
+    item = field(mandatory=True)
+
+    def apply(self, obj):
+        return _transform_path(
+            obj, self.path, lambda parent: parent.add(self.item)
+        )
+
+
+class _Diff(PClass):
+    """
+    A sequence of operations which transform one object into another.
+
+    :ivar PVector changes: The ``_Set``, ``_Remove`` and ``_Add`` operations
+        to apply, in order.
+    """
+    changes = pvector_field(object)
+
+    def apply(self, obj):
+        """
+        Apply this diff to an object.
+
+        :param obj: The object the diff was computed against (or one equal to
+            it).
+
+        :return: The object the diff was computed to.
+        """
+        for change in self.changes:
+            obj = change.apply(obj)
+        return obj
+
+
+def _create_diffs_for_mappings(current_path, mapping_a, mapping_b):
+    """
+    Compute the operations that turn one ``PMap`` into another.
+    """
+    resulting_diffs = []
+    for key, value_b in mapping_b.iteritems():
+        if key not in mapping_a:
+            resulting_diffs.append(_Set(path=current_path.append(key),
+                                        value=value_b))
+        else:
+            resulting_diffs.extend(_create_diffs_for(
+                current_path.append(key), mapping_a[key], value_b,
+            ))
+    for key in mapping_a:
+        if key not in mapping_b:
+            resulting_diffs.append(_Remove(path=current_path, item=key))
+    return resulting_diffs
+
+
+def _create_diffs_for_pclasses(current_path, object_a, object_b):
+    """
+    Compute the operations that turn one ``PClass`` into another of the same
+    type.
+    """
+    resulting_diffs = []
+    for name in object_a._pclass_fields:
+        has_a = hasattr(object_a, name)
+        has_b = hasattr(object_b, name)
+        if has_a and has_b:
+            resulting_diffs.extend(_create_diffs_for(
+                current_path.append(name),
+                getattr(object_a, name), getattr(object_b, name),
+            ))
+        elif has_b:
+            resulting_diffs.append(_Set(path=current_path.append(name),
+                                        value=getattr(object_b, name)))
+        elif has_a:
+            resulting_diffs.append(_Remove(path=current_path, item=name))
+    return resulting_diffs
+
+
+def _create_diffs_for_sets(current_path, set_a, set_b):
+    """
+    Compute the operations that turn one ``PSet`` into another.
+    """
+    resulting_diffs = []
+    for item in set_a.difference(set_b):
+        resulting_diffs.append(_Remove(path=current_path, item=item))
+    for item in set_b.difference(set_a):
+        resulting_diffs.append(_Add(path=current_path, item=item))
+    return resulting_diffs
+
+
+def _create_diffs_for(current_path, subobj_a, subobj_b):
+    """
+    Compute the operations that turn one object into another.
+
+    Persistent containers of the same type are descended into so that only the
+    parts which actually differ are included.  Anything else which differs is
+    replaced wholesale.
+
+    :param PVector current_path: The path from the root object to the objects
+        being compared.
+    :param subobj_a: The object to compute the diff from.
+    :param subobj_b: The object to compute the diff to.
+
+    :return: A ``list`` of diff operations.
+    """
+    if subobj_a is subobj_b:
+        return []
+    elif type(subobj_a) is not type(subobj_b):
+        pass
+    elif isinstance(subobj_a, PClass):
+        return _create_diffs_for_pclasses(current_path, subobj_a, subobj_b)
+    elif isinstance(subobj_a, PMap):
+        # This includes ``PRecord`` and ``CheckedPMap`` instances.
+        return _create_diffs_for_mappings(current_path, subobj_a, subobj_b)
+    elif isinstance(subobj_a, PSet):
+        return _create_diffs_for_sets(current_path, subobj_a, subobj_b)
+    if subobj_a == subobj_b:
+        return []
+    return [_Set(path=current_path, value=subobj_b)]
+
+
+def create_diff(object_a, object_b):
+    """
+    Constructs a diff from ``object_a`` to ``object_b``.
+
+    :param object_a: The desired input object.
+    :param object_b: The desired output object.
+
+    :return: A ``_Diff`` that will convert ``object_a`` into ``object_b``
+        when applied.
+    """
+    changes = _create_diffs_for(pvector(), object_a, object_b)
+    return _Diff(changes=changes)
+
+
+# Ensure that the representation of a ``_Diff`` is entirely serializable:
+DIFF_SERIALIZABLE_CLASSES = [
+    _Set, _Remove, _Add, _Diff
+]
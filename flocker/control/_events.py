@@ -0,0 +1,229 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_events -*-
+
+"""
+A stream of the changes made to the cluster configuration and state, for
+consumers which want to follow every change rather than poll the listings.
+
+Events are derived by comparing the configuration or state before and after
+each change.  As with the views in ``_views``, nodes which are still the same
+objects haven't changed, so only the items of replaced nodes are compared.
+
+Each event has a cursor.  A consumer which reconnects with the cursor of the
+last event it saw is sent the events that followed, provided they are still
+remembered; otherwise it is told to start again from the listings.
+"""
+
+from collections import deque
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from pyrsistent import PClass, field
+
+# The number of recent events remembered for consumers which reconnect:
+EVENT_HISTORY = 1000
+
+_EPOCH = datetime.fromtimestamp(0, UTC)
+
+
+class ChangeEvent(PClass):
+    """
+    A change to the cluster configuration or state.
+
+    :ivar int sequence: The position of the event in its ``EventLog``.
+    :ivar unicode type: The kind of change.
+    :ivar data: JSON-encodable details of the change.
+    """
+    sequence = field(type=(int, long), mandatory=True)
+    type = field(type=unicode, mandatory=True)
+    data = field(type=dict, mandatory=True)
+
+
+def _nodes_by_uuid(model):
+    """
+    :param model: A ``Deployment`` or ``DeploymentState``.
+
+    :return: A ``dict`` mapping the UUID of each node to the node.
+    """
+    return {node.uuid: node for node in model.nodes}
+
+
+def dataset_configuration_events(old, new, node_datasets):
+    """
+    :param Deployment old: The configuration before a change.
+    :param Deployment new: The configuration after it.
+    :param node_datasets: One-argument callable returning the ``list`` of
+        datasets, as API ``dict`` instances, configured on a node.
+
+    :return: A ``list`` of (type, data) tuples for the datasets which were
+        added or changed, with their new configuration, and for those which
+        were removed.
+    """
+    old_nodes = _nodes_by_uuid(old)
+    previous = {}
+    current = {}
+    for node in new.nodes:
+        old_node = old_nodes.pop(node.uuid, None)
+        if old_node is node:
+            continue
+        for item in node_datasets(node):
+            current[item[u"dataset_id"]] = item
+        if old_node is not None:
+            for item in node_datasets(old_node):
+                previous[item[u"dataset_id"]] = item
+    for old_node in old_nodes.values():
+        for item in node_datasets(old_node):
+            previous[item[u"dataset_id"]] = item
+    events = [
+        (u"dataset_configuration", item)
+        for dataset_id, item in sorted(current.items())
+        if previous.get(dataset_id) != item
+    ]
+    events.extend(
+        (u"dataset_removed", {u"dataset_id": dataset_id})
+        for dataset_id in sorted(set(previous) - set(current)))
+    return events
+
+
+def _lease_data(lease):
+    """
+    :param Lease lease: A lease.
+
+    :return: The ``dict`` describing it in events.  Unlike the lease
+        listing the expiration is given as a time, in seconds since the
+        epoch, since events may be read some time after they happened.
+    """
+    expiration = lease.expiration
+    if expiration is not None:
+        expiration = (expiration - _EPOCH).total_seconds()
+    return {u"dataset_id": unicode(lease.dataset_id),
+            u"node_uuid": unicode(lease.node_id),
+            u"expiration": expiration}
+
+
+def lease_events(old, new):
+    """
+    :param Leases old: The leases before a change.
+    :param Leases new: The leases after it.
+
+    :return: A ``list`` of (type, data) tuples for the leases which were
+        acquired or renewed and for those which were released.
+    """
+    if old is new:
+        return []
+    events = [
+        (u"lease", _lease_data(lease))
+        for dataset_id, lease in sorted(new.items())
+        if old.get(dataset_id) != lease
+    ]
+    events.extend(
+        (u"lease_released", {u"dataset_id": unicode(dataset_id)})
+        for dataset_id in sorted(set(old) - set(new)))
+    return events
+
+
+def node_state_events(old, new, expired):
+    """
+    :param DeploymentState old: The cluster state before a change.
+    :param DeploymentState new: The cluster state after it.
+    :param bool expired: Whether the change wiped expired information.
+
+    :return: A ``list`` of (type, data) tuples for the nodes whose state was
+        updated, or whose information expired, and for those which were
+        removed.
+    """
+    old_nodes = _nodes_by_uuid(old)
+    events = []
+    for node in sorted(new.nodes, key=lambda node: node.uuid):
+        old_node = old_nodes.pop(node.uuid, None)
+        if old_node is node:
+            continue
+        if expired:
+            events.append((u"node_expired", {u"uuid": unicode(node.uuid)}))
+        else:
+            events.append((u"node_state", {u"uuid": unicode(node.uuid),
+                                           u"host": node.hostname}))
+    for node_uuid in sorted(old_nodes):
+        events.append((u"node_expired" if expired else u"node_removed",
+                       {u"uuid": unicode(node_uuid)}))
+    return events
+
+
+class EventLog(object):
+    """
+    The most recent events and the consumers following them.
+
+    :ivar unicode prefix: Identifies this log in cursors, so that cursors
+        given out before the control service restarted aren't mistaken for
+        ones of this log.
+    :ivar int _sequence: The sequence number of the latest event.
+    :ivar deque _events: The most recent ``ChangeEvent`` instances.
+    :ivar list _subscribers: One-argument callables to call with each new
+        event.
+    """
+    def __init__(self, size=EVENT_HISTORY):
+        """
+        :param int size: The number of recent events to remember.
+        """
+        self.prefix = uuid4().hex.decode("ascii")
+        self._sequence = 0
+        self._events = deque(maxlen=size)
+        self._subscribers = []
+
+    def append(self, events):
+        """
+        Record new events and pass them on to subscribers.
+
+        :param events: Iterable of (type, data) tuples.
+        """
+        for type, data in events:
+            self._sequence += 1
+            event = ChangeEvent(sequence=self._sequence, type=type, data=data)
+            self._events.append(event)
+            for subscriber in list(self._subscribers):
+                subscriber(event)
+
+    def cursor(self, event=None):
+        """
+        :param ChangeEvent event: An event of this log, or ``None`` for the
+            latest event.
+
+        :return: The ``unicode`` cursor for resuming after ``event``.
+        """
+        sequence = self._sequence if event is None else event.sequence
+        return u"%s-%d" % (self.prefix, sequence)
+
+    def since(self, cursor):
+        """
+        :param unicode cursor: A cursor returned by ``cursor``, or ``None``
+            to start from now.
+
+        :return: The ``list`` of remembered events after ``cursor``, or
+            ``None`` if some of them have been forgotten or ``cursor`` isn't
+            one of this log's.
+        """
+        if cursor is None:
+            return []
+        prefix, _, sequence = cursor.rpartition(u"-")
+        if prefix != self.prefix or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self._sequence or (
+                self._events and sequence < self._events[0].sequence - 1):
+            return None
+        return [event for event in self._events if event.sequence > sequence]
+
+    def subscribe(self, subscriber):
+        """
+        :param subscriber: One-argument callable to call with each new
+            ``ChangeEvent``.
+        """
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        """
+        :param subscriber: A callable previously passed to ``subscribe``.
+        """
+        self._subscribers.remove(subscriber)
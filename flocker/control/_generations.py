@@ -0,0 +1,142 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_generations -*-
+
+"""
+Track successive versions ("generations") of an object so that the difference
+between any recent generation and the latest one can be computed, and wait
+for a new generation to be published.
+"""
+
+from repoze.lru import LRUCache
+
+from twisted.internet.defer import Deferred, succeed
+
+from ._diffing import create_diff
+
+
+class GenerationTracker(object):
+    """
+    Assign increasing generation numbers to successive distinct versions of
+    an object and compute diffs from recent generations to the latest one.
+
+    :ivar int _latest_generation: The generation of ``_latest_object``, or
+        ``0`` if nothing has been inserted yet.
+    :ivar _latest_object: The most recently inserted object.
+    :ivar LRUCache _objects: Map recent generations to the object with that
+        generation.
+    :ivar LRUCache _diffs: Map recent generations to a ``_Diff`` from the
+        object with that generation to ``_latest_object``.
+    """
+    def __init__(self, cache_size):
+        """
+        :param int cache_size: The number of most recent generations to
+            remember.  Diffs can only be computed from these.
+        """
+        self._latest_generation = 0
+        self._latest_object = None
+        self._objects = LRUCache(cache_size)
+        self._diffs = LRUCache(cache_size)
+
+    def insert_latest(self, obj):
+        """
+        Record the latest version of the tracked object.
+
+        :param obj: The latest version of the object.
+
+        :return int: The generation of ``obj``.  If ``obj`` is equal to the
+            previously inserted latest object the generation is unchanged.
+        """
+        if self._latest_generation == 0 or obj != self._latest_object:
+            self._latest_generation += 1
+            self._latest_object = obj
+            self._objects.put(self._latest_generation, obj)
+            # Every cached diff ends at the previous latest object:
+            self._diffs.clear()
+        return self._latest_generation
+
+    def insert_with_generation(self, obj, generation):
+        """
+        Record the latest version of the tracked object, whose generation has
+        been assigned by whatever published it.
+
+        Unlike ``insert_latest`` this doesn't compare ``obj`` with the
+        previous latest object, which for large objects is expensive.
+
+        :param obj: The latest version of the object.
+        :param int generation: The generation of ``obj``.  It must be no
+            lower than the generation of any object inserted before.
+
+        :return int: ``generation``.
+        """
+        if generation < self._latest_generation:
+            raise ValueError(
+                "Generation {} is older than the latest generation {}".format(
+                    generation, self._latest_generation))
+        if generation != self._latest_generation:
+            self._latest_generation = generation
+            self._latest_object = obj
+            self._objects.put(generation, obj)
+            self._diffs.clear()
+        return generation
+
+    @property
+    def latest_generation(self):
+        """
+        The generation of the latest object.
+        """
+        return self._latest_generation
+
+    def get_diff_from_generation(self, generation):
+        """
+        Compute the diff from the object with the given generation to the
+        latest object.
+
+        :param int generation: The generation to compute a diff from.
+
+        :return: A ``_Diff`` or ``None`` if the object with the given
+            generation is unknown (too old or never seen by this tracker).
+        """
+        diff = self._diffs.get(generation)
+        if diff is None:
+            obj = self._objects.get(generation)
+            if obj is None:
+                return None
+            diff = create_diff(obj, self._latest_object)
+            self._diffs.put(generation, diff)
+        return diff
+
+
+class GenerationWaiters(object):
+    """
+    ``Deferred`` instances waiting for the generation of an object to change.
+
+    :ivar list _waiting: The ``Deferred`` instances to fire when the
+        generation next changes.
+    """
+    def __init__(self):
+        self._waiting = []
+
+    def wait(self, generation, current):
+        """
+        :param int generation: The generation to wait for a change from.
+        :param int current: The current generation.
+
+        :return: A ``Deferred`` that fires with the current generation once
+            it differs from ``generation``; straight away if it already
+            does.  Cancelling it stops the wait.
+        """
+        if generation != current:
+            return succeed(current)
+        d = Deferred(canceller=self._waiting.remove)
+        self._waiting.append(d)
+        return d
+
+    def changed(self, current):
+        """
+        Fire the ``Deferred`` instances waiting for a change.
+
+        :param int current: The new current generation.
+        """
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(current)
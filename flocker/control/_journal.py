@@ -0,0 +1,145 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_journal -*-
+
+"""
+Crash-safe files for the persistence of cluster configuration.
+
+A journal is a file of records, appended to as changes are made.  Each record
+is written on its own line, preceded by a checksum, and flushed to disk before
+the append returns.  A record only partly written when the process or machine
+crashed fails its checksum, so it and anything following it are dropped when
+the journal is next opened.
+"""
+
+import os
+from zlib import crc32
+
+
+def _fsync_directory(path):
+    """
+    Flush the entries of a directory to disk, so that renames within it
+    survive a crash.
+
+    :param FilePath path: The directory.
+    """
+    fd = os.open(path.path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """
+    Replace the contents of a file such that after a crash it has either its
+    old or its new contents, never a mixture.
+
+    :param FilePath path: The file to write.
+    :param bytes data: Its new contents.
+    """
+    temporary = path.temporarySibling()
+    with open(temporary.path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary.path, path.path)
+    _fsync_directory(path.parent())
+
+
+def _frame(record):
+    """
+    :param bytes record: A record without newlines.
+
+    :return: The line the record is stored as in a journal.
+    """
+    return b"%08x %s\n" % (crc32(record) & 0xffffffff, record)
+
+
+def read_journal(path):
+    """
+    Read the records of a journal.
+
+    :param FilePath path: The journal.
+
+    :return: A tuple of the ``list`` of intact records, as ``bytes``, and the
+        length of the part of the file holding them.  Anything after that is
+        the remains of an interrupted append.
+    """
+    if not path.exists():
+        return [], 0
+    records = []
+    valid_length = 0
+    for line in path.getContent().splitlines(True):
+        if not line.endswith(b"\n"):
+            break
+        checksum, _, record = line[:-1].partition(b" ")
+        if checksum != b"%08x" % (crc32(record) & 0xffffffff,):
+            break
+        records.append(record)
+        valid_length += len(line)
+    return records, valid_length
+
+
+class Journal(object):
+    """
+    An open journal, to which records can be appended.
+
+    :ivar FilePath path: The journal file.
+    """
+    def __init__(self, path, file):
+        """
+        Use ``Journal.create`` or ``Journal.open`` instead.
+        """
+        self.path = path
+        self._file = file
+
+    @classmethod
+    def create(cls, path, records):
+        """
+        Replace the journal at a path with one holding some records.
+
+        :param FilePath path: The journal file.
+        :param records: The records, as ``bytes`` without newlines, the new
+            journal starts with.
+
+        :return: The new ``Journal``.
+        """
+        atomic_write(path, b"".join(_frame(record) for record in records))
+        return cls(path, open(path.path, "ab"))
+
+    @classmethod
+    def open(cls, path, valid_length):
+        """
+        Open an existing journal for appending, dropping the remains of an
+        interrupted append.
+
+        :param FilePath path: The journal file.
+        :param int valid_length: The length of the intact part of the journal,
+            as returned by ``read_journal``.
+
+        :return: The ``Journal``.
+        """
+        f = open(path.path, "r+b")
+        f.seek(0, os.SEEK_END)
+        if f.tell() != valid_length:
+            f.truncate(valid_length)
+            f.flush()
+            os.fsync(f.fileno())
+        f.seek(valid_length)
+        return cls(path, f)
+
+    def append(self, record):
+        """
+        Append a record, returning once it is on disk.
+
+        :param bytes record: The record, which must not contain newlines.
+        """
+        self._file.write(_frame(record))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Close the journal.  No more records can be appended.
+        """
+        self._file.close()
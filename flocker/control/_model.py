@@ -14,13 +14,14 @@ from uuid import UUID
 from warnings import warn
 from hashlib import md5
 from datetime import datetime, timedelta
+from weakref import ref
 
 from characteristic import attributes
 from twisted.python.filepath import FilePath
 
 from pyrsistent import (
-    pmap, PClass, PRecord, field, PMap, CheckedPSet, CheckedPMap, discard,
-    optional as optional_type, CheckedPVector
+    pmap, pset, PClass, PRecord, field, PMap, CheckedPSet, CheckedPMap,
+    discard, optional as optional_type, CheckedPVector
     )
 
 from zope.interface import Interface, implementer
@@ -43,14 +44,13 @@ def _sequence_field(checked_class, suffix, item_type, optional, initial):
         __type__ = item_type
     TheType.__name__ = item_type.__name__.capitalize() + suffix
 
-    if optional:
-        def factory(argument):
-            if argument is None:
-                return None
-            else:
-                return TheType(argument)
-    else:
-        factory = TheType
+    def factory(argument):
+        if optional and argument is None:
+            return None
+        if type(argument) is TheType:
+            # Already checked, and rebuilding it means hashing every item:
+            return argument
+        return TheType(argument)
     return field(type=optional_type(TheType) if optional else TheType,
                  factory=factory, mandatory=True,
                  initial=factory(initial))
@@ -72,6 +72,80 @@ def pset_field(item_type, optional=False, initial=()):
                            initial)
 
 
+class _UUIDIndexedPSet(CheckedPSet):
+    """
+    A ``CheckedPSet`` of objects with a ``uuid`` attribute, at most one per
+    UUID, stored in a ``PMap`` keyed by UUID rather than by the objects
+    themselves.
+
+    Hashing a large ``PClass`` such as ``Node`` is expensive and not cached,
+    so keying by UUID makes lookups and updates cost ``O(log n)`` rather than
+    requiring a scan.
+
+    Adding an object replaces any object with the same UUID.
+    """
+    def __new__(cls, initial=()):
+        if type(initial) is PMap:
+            return super(CheckedPSet, cls).__new__(cls, initial)
+        evolver = cls.Evolver(cls, pset())
+        for item in initial:
+            evolver.add(item)
+        return evolver.persistent()
+
+    def __contains__(self, item):
+        existing = self._map.get(getattr(item, "uuid", None))
+        return existing is not None and (existing is item or existing == item)
+
+    def __iter__(self):
+        return self._map.itervalues()
+
+    def get(self, uuid, default=None):
+        """
+        :param UUID uuid: The UUID of the object to find.
+        :param default: The result if there is no such object.
+
+        :return: The object with the given UUID, or ``default``.
+        """
+        return self._map.get(uuid, default)
+
+    def remove(self, item):
+        if item in self:
+            return self.evolver().remove(item).persistent()
+        raise KeyError("Element '%s' not present in PSet" % (item,))
+
+    def discard(self, item):
+        if item in self:
+            return self.evolver().remove(item).persistent()
+        return self
+
+    def evolver(self):
+        return self.Evolver(self.__class__, self)
+
+    class Evolver(CheckedPSet.Evolver):
+        __slots__ = ()
+
+        def add(self, item):
+            self._check([item])
+            self._pmap_evolver[item.uuid] = item
+            return self
+
+        def remove(self, item):
+            del self._pmap_evolver[item.uuid]
+            return self
+
+
+def uuid_indexed_pset_field(item_type):
+    """
+    Create a checked ``PSet`` field for objects identified by their ``uuid``
+    attribute, such as ``Node`` or ``NodeState``.
+
+    :param item_type: The required type for the items in the set.
+
+    :return: A ``field`` containing a ``_UUIDIndexedPSet`` of the given type.
+    """
+    return _sequence_field(_UUIDIndexedPSet, "PSet", item_type, False, ())
+
+
 def pvector_field(item_type, optional=False, initial=()):
     """
     Create checked ``PVector`` field.
@@ -119,14 +193,13 @@ def pmap_field(
     TheMap.__name__ = (key_type.__name__.capitalize() +
                        value_type.__name__.capitalize() + "PMap")
 
-    if optional:
-        def factory(argument):
-            if argument is None:
-                return None
-            else:
-                return TheMap(argument)
-    else:
-        factory = TheMap
+    def factory(argument):
+        if optional and argument is None:
+            return None
+        if type(argument) is TheMap:
+            # Already checked, and rebuilding it means hashing every item:
+            return argument
+        return TheMap(argument)
 
     if initial is _UNDEFINED:
         initial = TheMap()
@@ -486,15 +559,119 @@ def _get_node(default_factory):
              is found.
     """
     def get_node(deployment, uuid, **defaults):
-        nodes = list(
-            node for node in deployment.nodes if node.uuid == uuid
-        )
-        if len(nodes) == 0:
+        node = deployment.nodes.get(uuid)
+        if node is None:
             return default_factory(uuid=uuid, **defaults)
-        return nodes[0]
+        return node
     return get_node
 
 
+class _DatasetIndexes(object):
+    """
+    The dataset indexes of ``Deployment`` and ``DeploymentState`` instances,
+    remembered by identity for as long as the instances exist.
+
+    A dataset index is a ``PMap`` mapping each dataset identifier to a
+    ``PMap`` from the UUIDs of the nodes the dataset is on to its
+    ``Manifestation`` on that node.
+
+    :ivar dict _indexes: Map ``id`` of an instance to a weak reference to the
+        instance and its index.
+    """
+    def __init__(self):
+        self._indexes = {}
+
+    def get(self, deployment):
+        """
+        :param deployment: A ``Deployment`` or ``DeploymentState``.
+
+        :return: The index of ``deployment``, built if necessary.
+        """
+        entry = self._indexes.get(id(deployment))
+        if entry is not None and entry[0]() is deployment:
+            return entry[1]
+        index = {}
+        for node in deployment.nodes:
+            for dataset_id, manifestation in _manifestation_items(node):
+                index.setdefault(dataset_id, {})[node.uuid] = manifestation
+        index = pmap({dataset_id: pmap(on_nodes)
+                      for (dataset_id, on_nodes) in index.items()})
+        self._put(deployment, index)
+        return index
+
+    def _put(self, deployment, index):
+        key = id(deployment)
+
+        def forget(reference):
+            if self._indexes.get(key, (None,))[0] is reference:
+                del self._indexes[key]
+        self._indexes[key] = (ref(deployment, forget), index)
+
+    def derive(self, original, updated, old_node, new_node):
+        """
+        Remember the index of a ``Deployment`` or ``DeploymentState`` which
+        differs from another only in one node, if the index of the other is
+        known, at the cost of only that node's manifestations.
+
+        :param original: The ``Deployment`` or ``DeploymentState`` before the
+            change.
+        :param updated: The same after the change.
+        :param old_node: The node in ``original``, or ``None``.
+        :param new_node: The node in ``updated``, or ``None``.
+        """
+        entry = self._indexes.get(id(original))
+        if entry is None or entry[0]() is not original:
+            return
+        index = entry[1]
+        if updated is not original:
+            old = dict(_manifestation_items(old_node))
+            new = dict(_manifestation_items(new_node))
+            node_uuid = (old_node or new_node).uuid
+            evolver = index.evolver()
+            for dataset_id in old:
+                if dataset_id not in new:
+                    on_nodes = evolver[dataset_id].remove(node_uuid)
+                    if on_nodes:
+                        evolver[dataset_id] = on_nodes
+                    else:
+                        del evolver[dataset_id]
+            for dataset_id, manifestation in new.items():
+                if old.get(dataset_id) is not manifestation:
+                    on_nodes = (evolver[dataset_id]
+                                if dataset_id in evolver else pmap())
+                    evolver[dataset_id] = on_nodes.set(
+                        node_uuid, manifestation)
+            index = evolver.persistent()
+        self._put(updated, index)
+
+
+def _manifestation_items(node):
+    """
+    :param node: A ``Node``, ``NodeState`` or ``None``.
+
+    :return: The (dataset identifier, ``Manifestation``) pairs of the node.
+    """
+    if node is None or node.manifestations is None:
+        return ()
+    return node.manifestations.items()
+
+
+_dataset_indexes = _DatasetIndexes()
+
+
+def _get_dataset_manifestations(deployment, dataset_id):
+    """
+    Find the manifestations of a dataset in a ``Deployment`` or
+    ``DeploymentState``, using an index built once per instance.
+
+    :param unicode dataset_id: The dataset identifier.
+
+    :return: A ``PMap`` mapping the UUIDs of the nodes the dataset is on to
+        its ``Manifestation`` on that node.
+    """
+    return _dataset_indexes.get(deployment).get(dataset_id, pmap())
+
+
 LEASE_ACTION_ACQUIRE = u"acquire"
 LEASE_ACTION_RELEASE = u"release"
 
@@ -669,7 +846,8 @@ class Deployment(PClass):
     a number of cooperating nodes.
 
     :ivar PSet nodes: A set containing ``Node`` instances
-        describing the configuration of each cooperating node.
+        describing the configuration of each cooperating node, at most one
+        per UUID.
     :ivar Leases leases: A map of configured ``Lease``s.
     :ivar PersistentState persistent_state: The non-discoverable persistent
         state of the cluster. (Note: XXX This should idealy be a sibling to the
@@ -677,11 +855,12 @@ class Deployment(PClass):
         refactoring doesn't seem worth it currently, and can be done later if
         ever).
     """
-    nodes = pset_field(Node)
+    nodes = uuid_indexed_pset_field(Node)
     leases = field(type=Leases, mandatory=True, initial=Leases())
     persistent_state = field(type=PersistentState, initial=PersistentState())
 
     get_node = _get_node(Node)
+    get_dataset_manifestations = _get_dataset_manifestations
 
     def applications(self):
         """
@@ -704,10 +883,10 @@ class Deployment(PClass):
 
         :return Deployment: Updated with new ``Node``.
         """
-        return self.set(
-            'nodes',
-            [n for n in self.nodes if not same_node(n, node)] + [node]
-        )
+        updated = self.set('nodes', self.nodes.add(node))
+        _dataset_indexes.derive(
+            self, updated, self.nodes.get(node.uuid), node)
+        return updated
 
     def move_application(self, application, target_node):
         """
@@ -1029,9 +1208,10 @@ class UpdateNodeStateEra(PClass):
         Record the node's era and discard the ``NodeState`` if it doesn't
         match the era.
         """
-        if cluster_state.node_uuid_to_era.get(self.uuid) != self.era:
-            # Discard the NodeState:
-            cluster_state = cluster_state.remove_node(self.uuid)
+        if cluster_state.node_uuid_to_era.get(self.uuid) == self.era:
+            return cluster_state
+        # Discard the NodeState:
+        cluster_state = cluster_state.remove_node(self.uuid)
         cluster_state = cluster_state.transform(
             ["node_uuid_to_era", self.uuid], self.era)
         return cluster_state
@@ -1059,11 +1239,9 @@ class _WipeNodeState(PClass):
     attributes = pset_field(str)
 
     def update_cluster_state(self, cluster_state):
-        nodes = {n for n in cluster_state.nodes
-                 if n.uuid == self.node_uuid}
-        if not nodes:
+        original_node = cluster_state.nodes.get(self.node_uuid)
+        if original_node is None:
             return cluster_state
-        [original_node] = nodes
         updated_node = original_node.evolver()
         for attribute in self.attributes:
             updated_node = updated_node.set(attribute, None)
@@ -1071,7 +1249,12 @@ class _WipeNodeState(PClass):
         final_nodes = cluster_state.nodes.discard(original_node)
         if updated_node._provides_information():
             final_nodes = final_nodes.add(updated_node)
-        return cluster_state.set("nodes", final_nodes)
+        else:
+            updated_node = None
+        updated = cluster_state.set("nodes", final_nodes)
+        _dataset_indexes.derive(
+            cluster_state, updated, original_node, updated_node)
+        return updated
 
     def key(self):
         return (self.node_uuid, self.attributes)
@@ -1082,7 +1265,7 @@ class DeploymentState(PClass):
     A ``DeploymentState`` describes the state of the nodes in the cluster.
 
     :ivar PSet nodes: A set containing ``NodeState`` instances describing the
-        state of each cooperating node.
+        state of each cooperating node, at most one per UUID.
     :ivar PMap node_uuid_to_era: Mapping between a node's UUID and its era.
     :ivar PMap nonmanifest_datasets: A mapping from dataset identifiers (as
         ``unicode``) to corresponding ``Dataset`` instances.  This mapping
@@ -1098,13 +1281,14 @@ class DeploymentState(PClass):
         initialized to meaningful values (see
         https://clusterhq.atlassian.net/browse/FLOC-1247).
     """
-    nodes = pset_field(NodeState)
+    nodes = uuid_indexed_pset_field(NodeState)
     node_uuid_to_era = pmap_field(UUID, UUID)
     nonmanifest_datasets = pmap_field(
         unicode, Dataset, invariant=_keys_match_dataset_id
     )
 
     get_node = _get_node(NodeState)
+    get_dataset_manifestations = _get_dataset_manifestations
 
     def update_node(self, node_state):
         """
@@ -1122,10 +1306,11 @@ class DeploymentState(PClass):
 
         :return DeploymentState: Updated with new ``NodeState``.
         """
-        nodes = {n for n in self.nodes if same_node(n, node_state)}
-        if not nodes:
-            return self.transform(["nodes"], lambda s: s.add(node_state))
-        [original_node] = nodes
+        original_node = self.nodes.get(node_state.uuid)
+        if original_node is None:
+            updated = self.set("nodes", self.nodes.add(node_state))
+            _dataset_indexes.derive(self, updated, None, node_state)
+            return updated
         updated_node = original_node.evolver()
         for key, value in node_state.items():
             # XXX This is an optimization to avoid calling ``set`` unless the
@@ -1137,9 +1322,10 @@ class DeploymentState(PClass):
         # XXX This is an optimization to avoid calling ``set``
         # unless the value has changed. ``set`` is slow.
         if updated_node != original_node:
-            return self.set(
-                "nodes", self.nodes.discard(original_node).add(
-                    updated_node))
+            updated = self.set("nodes", self.nodes.add(updated_node))
+            _dataset_indexes.derive(
+                self, updated, original_node, updated_node)
+            return updated
         else:
             return self
 
@@ -1151,8 +1337,12 @@ class DeploymentState(PClass):
 
         :return: Updated ``DeploymentState``.
         """
-        return self.set(nodes={node for node in self.nodes
-                               if node.uuid != node_uuid})
+        node = self.nodes.get(node_uuid)
+        if node is None:
+            return self
+        updated = self.set(nodes=self.nodes.remove(node))
+        _dataset_indexes.derive(self, updated, node, None)
+        return updated
 
     def all_datasets(self):
         """
@@ -1179,6 +1369,10 @@ class NonManifestDatasets(PClass):
     datasets = pmap_field(unicode, Dataset, invariant=_keys_match_dataset_id)
 
     def update_cluster_state(self, cluster_state):
+        if cluster_state.nonmanifest_datasets == self.datasets:
+            # Leave the state as the same object so it's easy to tell that
+            # nothing changed:
+            return cluster_state
         return cluster_state.set(nonmanifest_datasets=self.datasets)
 
     def get_information_wipe(self):
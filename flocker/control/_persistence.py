@@ -5,7 +5,8 @@ Persistence of cluster configuration.
 """
 
 from json import dumps, loads, JSONEncoder
-from uuid import UUID
+from json.encoder import encode_basestring_ascii
+from uuid import UUID, uuid4
 from calendar import timegm
 from datetime import datetime
 from hashlib import sha256
@@ -14,14 +15,22 @@ from eliot import Logger, write_traceback, MessageType, Field, ActionType
 
 from pyrsistent import PRecord, PVector, PMap, PSet, pmap, PClass
 
+from repoze.lru import LRUCache
+
 from pytz import UTC
 
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service, MultiService
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, succeed, maybeDeferred
+from twisted.internet.interfaces import IReactorThreads
 from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 
 from ._model import SERIALIZABLE_CLASSES, Deployment, Configuration
+from ._diffing import DIFF_SERIALIZABLE_CLASSES, create_diff
+from ._journal import Journal, atomic_write, read_journal
+from ._generations import GenerationWaiters
 
 # The class at the root of the configuration tree.
 ROOT_CLASS = Deployment
@@ -34,8 +43,18 @@ _CLASS_MARKER = u"$__class__$"
 # always integers.
 _CONFIG_VERSION = 4
 
+# The version of the format of the configuration journal:
+_JOURNAL_VERSION = 1
+
+# The number of changes recorded in the configuration journal after which
+# the whole configuration is written out again and the journal restarted:
+_COMPACTION_THRESHOLD = 1000
+
 # Map of serializable class names to classes
-_CONFIG_CLASS_MAP = {cls.__name__: cls for cls in SERIALIZABLE_CLASSES}
+_CONFIG_CLASS_MAP = {
+    cls.__name__: cls
+    for cls in SERIALIZABLE_CLASSES + DIFF_SERIALIZABLE_CLASSES
+}
 
 
 class ConfigurationMigrationError(Exception):
@@ -205,6 +224,241 @@ def wire_encode(obj):
     return dumps(obj, cls=_ConfigurationEncoder)
 
 
+class FragmentCache(object):
+    """
+    Remember the encodings of recently encoded objects of certain classes.
+
+    The configuration model is immutable, so the parts of a large object
+    which are unchanged between two of its versions (e.g. the ``NodeState``
+    of nodes other than the one that changed in a ``DeploymentState``) are
+    typically the very same objects.  Objects are therefore remembered by
+    identity, which is much cheaper to check than equality.  A remembered
+    object is kept alive so its identity can't be reused by another object.
+
+    :ivar frozenset classes: The classes whose instances are remembered when
+        encountered inside the object being encoded.
+    :ivar int hits: The number of times ``get`` found an encoding.
+    :ivar int misses: The number of times ``get`` found no encoding.
+    :ivar LRUCache _fragments: Map the ``id`` of objects to a tuple of the
+        object and its encoding.
+    """
+    def __init__(self, classes, size):
+        """
+        :param classes: The classes whose instances to remember.
+        :param int size: The maximum number of encodings to remember.
+        """
+        self.classes = frozenset(classes)
+        self.hits = 0
+        self.misses = 0
+        self._fragments = LRUCache(size)
+
+    def get(self, obj):
+        """
+        :param obj: An object that may have been encoded before.
+
+        :return: The remembered encoding of ``obj`` or ``None``.
+        """
+        entry = self._fragments.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, obj, fragment):
+        """
+        Remember the encoding of an object.
+
+        :param obj: An immutable object.
+        :param bytes fragment: Its encoding.
+        """
+        self._fragments.put(id(obj), (obj, fragment))
+
+
+def _encode_json_key(key):
+    """
+    Encode a dictionary key the way ``json.dumps`` does.
+    """
+    if isinstance(key, basestring):
+        return encode_basestring_ascii(key)
+    # Numbers, booleans and None become strings:
+    return encode_basestring_ascii(dumps(key))
+
+
+class _SplicingEncoder(object):
+    """
+    Encode the configuration model to JSON like ``_ConfigurationEncoder``,
+    splicing in the remembered encodings of objects found in a
+    ``FragmentCache``.
+
+    :ivar FragmentCache _fragments: The encodings to reuse and add to.
+    :ivar list _chunks: The encoded ``bytes`` so far.
+    """
+    def __init__(self, fragments):
+        self._fragments = fragments
+        self._chunks = []
+
+    def result(self):
+        """
+        :return bytes: Everything encoded so far.
+        """
+        return b"".join(self._chunks)
+
+    def _write_items(self, items, class_name=None):
+        """
+        Write a JSON object.
+
+        :param items: Iterable of key/value pairs.
+        :param unicode class_name: If not ``None``, a value for the
+            ``_CLASS_MARKER`` key.
+        """
+        write = self._chunks.append
+        if class_name is None:
+            separator = b"{"
+        else:
+            write(b'{"' + _CLASS_MARKER.encode("ascii") + b'":')
+            write(encode_basestring_ascii(class_name))
+            separator = b","
+        for key, value in items:
+            write(separator)
+            write(_encode_json_key(key))
+            write(b":")
+            self.write(value)
+            separator = b","
+        if separator == b"{":
+            write(b"{")
+        write(b"}")
+
+    def _write_none(self, obj):
+        self._chunks.append(b"null")
+
+    def _write_bool(self, obj):
+        self._chunks.append(b"true" if obj else b"false")
+
+    def _write_string(self, obj):
+        self._chunks.append(encode_basestring_ascii(obj))
+
+    def _write_integer(self, obj):
+        self._chunks.append(str(obj))
+
+    def _write_float(self, obj):
+        self._chunks.append(dumps(obj))
+
+    def _write_list(self, obj):
+        write = self._chunks.append
+        separator = b"["
+        for item in obj:
+            write(separator)
+            self.write(item)
+            separator = b","
+        if separator == b"[":
+            write(b"[")
+        write(b"]")
+
+    def _write_dict(self, obj):
+        self._write_items(obj.iteritems())
+
+    def _write_record(self, obj):
+        self._write_items(obj.iteritems(), obj.__class__.__name__)
+
+    def _write_pclass(self, obj):
+        self._write_items(
+            obj.evolver().data.iteritems(), obj.__class__.__name__)
+
+    def _write_pmap(self, obj):
+        self._write_items([(u"values", obj.items())], u"PMap")
+
+    def _write_filepath(self, obj):
+        self._write_items([(u"path", obj.path.decode("utf-8"))], u"FilePath")
+
+    def _write_uuid(self, obj):
+        self._write_items([(u"hex", unicode(obj))], u"UUID")
+
+    def _write_datetime(self, obj):
+        if obj.tzinfo is None:
+            raise ValueError(
+                "Datetime without a timezone: {}".format(obj))
+        self._write_items(
+            [(u"seconds", timegm(obj.utctimetuple()))], u"datetime")
+
+    def write(self, obj):
+        """
+        Encode an object, reusing or remembering its encoding if it is an
+        instance of one of the classes the ``FragmentCache`` is for.
+
+        :param obj: An object from the configuration model, or one of the
+            simpler types it is built from.
+        """
+        kind = type(obj)
+        if kind in self._fragments.classes:
+            fragment = self._fragments.get(obj)
+            if fragment is None:
+                encoder = _SplicingEncoder(self._fragments)
+                _splicing_writer(kind)(encoder, obj)
+                fragment = encoder.result()
+                self._fragments.put(obj, fragment)
+            self._chunks.append(fragment)
+        else:
+            _splicing_writer(kind)(self, obj)
+
+
+# Ordered as the checks made by ``json.dumps`` and then
+# ``_ConfigurationEncoder.default``:
+_SPLICING_WRITERS_BY_BASE = [
+    (basestring, _SplicingEncoder._write_string),
+    (type(None), _SplicingEncoder._write_none),
+    (bool, _SplicingEncoder._write_bool),
+    ((int, long), _SplicingEncoder._write_integer),
+    (float, _SplicingEncoder._write_float),
+    ((list, tuple), _SplicingEncoder._write_list),
+    (dict, _SplicingEncoder._write_dict),
+    (PRecord, _SplicingEncoder._write_record),
+    (PClass, _SplicingEncoder._write_pclass),
+    (PMap, _SplicingEncoder._write_pmap),
+    ((PSet, PVector, set), _SplicingEncoder._write_list),
+    (FilePath, _SplicingEncoder._write_filepath),
+    (UUID, _SplicingEncoder._write_uuid),
+    (datetime, _SplicingEncoder._write_datetime),
+]
+
+# Map types to the ``_SplicingEncoder`` method that writes their instances,
+# filled in as new types are encountered:
+_SPLICING_WRITERS = {}
+
+
+def _splicing_writer(kind):
+    """
+    Find the ``_SplicingEncoder`` method which writes instances of a type.
+
+    :param type kind: The type of an object to encode.
+    :raise TypeError: If instances of the type cannot be encoded.
+    """
+    writer = _SPLICING_WRITERS.get(kind)
+    if writer is None:
+        for base, writer in _SPLICING_WRITERS_BY_BASE:
+            if issubclass(kind, base):
+                break
+        else:
+            raise TypeError("{!r} is not JSON serializable".format(kind))
+        _SPLICING_WRITERS[kind] = writer
+    return writer
+
+
+def splicing_wire_encode(obj, fragments):
+    """
+    Encode the given model object into bytes like ``wire_encode``, reusing
+    the encodings of parts of it that were encoded before.
+
+    :param obj: An object from the configuration model, e.g. ``Deployment``.
+    :param FragmentCache fragments: The encodings of previously encoded
+        objects, which encodings of parts of ``obj`` are added to.
+    :return bytes: Encoded object.
+    """
+    encoder = _SplicingEncoder(fragments)
+    encoder.write(obj)
+    return encoder.result()
+
+
 def wire_decode(data):
     """
     Decode the given model object from bytes.
@@ -245,8 +499,16 @@ def to_unserialized_json(obj):
 _DEPLOYMENT_FIELD = Field(u"configuration", to_unserialized_json)
 _LOG_STARTUP = MessageType(u"flocker-control:persistence:startup",
                            [_DEPLOYMENT_FIELD])
-_LOG_SAVE = ActionType(u"flocker-control:persistence:save",
-                       [_DEPLOYMENT_FIELD], [])
+# Saves only log the generation and hash: serializing the whole
+# configuration for the log would cost the reactor thread more than the rest
+# of the save.
+_LOG_SAVE = ActionType(
+    u"flocker-control:persistence:save",
+    [Field.for_types(u"generation", [int, long],
+                     u"The generation of the saved configuration."),
+     Field.for_types(u"configuration_hash", [bytes],
+                     u"The hash of the saved configuration.")],
+    [])
 
 _UPGRADE_SOURCE_FIELD = Field.for_types(
     u"source_version", [int], u"Configuration version to upgrade from.")
@@ -260,6 +522,28 @@ _LOG_EXPIRE = MessageType(
     [Field(u"dataset_id", unicode), Field(u"node_id", unicode)],
     u"A lease for a dataset has expired.")
 
+_LOG_COMPACT = ActionType(
+    u"flocker-control:persistence:compact",
+    [Field.for_types(u"journal_records", [int, long],
+                     u"The number of changes in the journal being replaced.")],
+    [],
+    u"The whole configuration is being written out and the journal of "
+    u"changes to it restarted.")
+
+_LOG_JOURNAL_DISCARDED = MessageType(
+    u"flocker-control:persistence:journal-discarded",
+    [Field.for_types(u"discarded_bytes", [int, long],
+                     u"The length of the discarded part of the journal.")],
+    u"Part or all of the configuration journal was discarded at startup, "
+    u"either because a crash interrupted writing it or because it predates "
+    u"the configuration it would apply to.")
+
+_LOG_WRITTEN = MessageType(
+    u"flocker-control:persistence:written",
+    [Field.for_types(u"saves", [int, long],
+                     u"The number of saves made durable by the write.")],
+    u"The configuration was written to disk, completing one or more saves.")
+
 _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED = MessageType(
     u"flocker-control:persistence:unchanged-deployment-not-saved",
     [],
@@ -328,34 +612,137 @@ def update_leases(transform, persistence_service):
     return succeed(new_leases)
 
 
+def _journal_header(snapshot_hash, tag):
+    """
+    :param bytes snapshot_hash: The SHA256 hash of the stored configuration.
+    :param bytes tag: The tag of the stored configuration.
+
+    :return: The first record of a journal of changes to that configuration.
+    """
+    return dumps({u"version": _JOURNAL_VERSION, u"snapshot": snapshot_hash,
+                  u"tag": tag}, sort_keys=True)
+
+
+def _parse_journal_header(record):
+    """
+    :param bytes record: The first record of a journal.
+
+    :return: The ``dict`` encoded by ``_journal_header``, or ``None`` if the
+        record isn't a header in the current format.
+    """
+    try:
+        header = loads(record)
+    except ValueError:
+        return None
+    if (not isinstance(header, dict) or
+            header.get(u"version") != _JOURNAL_VERSION):
+        return None
+    return header
+
+
 class ConfigurationPersistenceService(MultiService):
     """
     Persist configuration to disk, and load it back.
 
+    The whole configuration is stored in ``current_configuration.json``, as
+    of some point in the past.  Each change saved since then is appended as a
+    diff to ``configuration_journal``, so saving costs time in proportion to
+    the size of the change rather than of the configuration.  The journal
+    starts with a header naming the SHA256 hash of the
+    ``current_configuration.json`` its diffs apply to.  Once the journal is
+    long enough the whole configuration is written out again and a new
+    journal started; a journal whose header doesn't match the stored
+    configuration was superseded in that way and is ignored.  Each change,
+    and the header, also record the configuration's tag.
+
+    When the reactor supports threads, writing happens in a dedicated thread.
+    Saves made while a write is in progress are written together by the next
+    one, with a single diff and a single ``fsync`` (a group commit).
+
+    If a write fails, its saves and any made since fail too, and the
+    configuration last written becomes current again.
+
     :ivar Deployment _deployment: The current desired deployment configuration.
-    :ivar bytes _hash: A SHA256 hash of the configuration.
+    :ivar Deployment _written: The configuration most recently written to
+        disk.
+    :ivar bytes _hash: The tag of ``_deployment``; a SHA256 hash of the
+        previous tag and a random value whenever the configuration changes,
+        so unrelated to its contents.
+    :ivar bytes _written_hash: The tag of ``_written``.
+    :ivar int _generation: The generation of ``_deployment``.
+    :ivar int _written_generation: The generation of ``_written``.
+    :ivar int _last_generation: The generation most recently given to a
+        configuration.  Generations of saves whose write failed are not
+        given out again.
+    :ivar GenerationWaiters _generation_waiters: Those waiting for
+        ``_generation`` to change.
+    :ivar ThreadPool _threadpool: The single thread writes happen in, or
+        ``None`` if they happen in the reactor thread.
+    :ivar list _unwritten: ``Deferred`` results of saves whose changes are not
+        yet being written.
+    :ivar bool _writing: ``True`` while a write is in progress.
+    :ivar list _idle: ``Deferred`` instances to fire once no write is in
+        progress or waiting.
+    :ivar Journal _journal: The open configuration journal.
+    :ivar int _journal_records: The number of changes in ``_journal``.
+    :ivar int _compaction_threshold: The number of changes in the journal
+        after which the configuration is written out in full.
     """
     logger = Logger()
 
-    def __init__(self, reactor, path):
+    def __init__(self, reactor, path,
+                 compaction_threshold=_COMPACTION_THRESHOLD):
         """
-        :param reactor: Reactor to use for thread pool.
+        :param reactor: Reactor to use for thread pool.  If it does not
+            provide ``IReactorThreads`` writes happen synchronously.
         :param FilePath path: Directory where desired deployment will be
             persisted.
+        :param int compaction_threshold: The number of changes recorded in
+            the journal after which the configuration is written out in full.
         """
         MultiService.__init__(self)
         self._path = path
         self._config_path = self._path.child(b"current_configuration.json")
+        self._journal_path = self._path.child(b"configuration_journal")
+        self._journal = None
+        self._journal_records = 0
+        self._compaction_threshold = compaction_threshold
+        self._reactor = reactor
+        self._threadpool = None
+        self._unwritten = []
+        self._writing = False
+        self._idle = []
         self._change_callbacks = []
+        self._generation = 0
+        self._last_generation = 0
+        self._generation_waiters = GenerationWaiters()
         LeaseService(reactor, self).setServiceParent(self)
 
     def startService(self):
         if not self._path.exists():
             self._path.makedirs()
         self.load_configuration()
+        if IReactorThreads.providedBy(self._reactor):
+            self._threadpool = ThreadPool(
+                minthreads=1, maxthreads=1,
+                name="flocker-control-persistence")
+            self._threadpool.start()
         MultiService.startService(self)
         _LOG_STARTUP(configuration=self.get()).write(self.logger)
 
+    def stopService(self):
+        d = maybeDeferred(MultiService.stopService, self)
+        d.addCallback(lambda _: self._when_idle())
+
+        def stop(_):
+            if self._threadpool is not None:
+                self._threadpool.stop()
+                self._threadpool = None
+            self._journal.close()
+            self._journal = None
+        d.addCallback(stop)
+        return d
+
     def _process_v1_config(self, file_name, archive_name):
         """
         Check if a v1 configuration file exists and upgrade it if necessary.
@@ -390,6 +777,44 @@ class ConfigurationPersistenceService(MultiService):
         """
         return self._hash
 
+    def configuration_generation(self):
+        """
+        :return int: The generation of the configuration returned by ``get``.
+            Each saved configuration gets a new, higher generation; if
+            writing it fails the generation reverts to that of the
+            configuration last written.
+        """
+        return self._generation
+
+    def written_configuration(self):
+        """
+        Retrieve the configuration most recently written to disk.
+
+        Unlike ``get`` this never includes saves whose write may yet fail.
+
+        :return Deployment: The written configuration.
+        """
+        return self._written
+
+    def written_configuration_generation(self):
+        """
+        :return int: The generation of the configuration returned by
+            ``written_configuration``.
+        """
+        return self._written_generation
+
+    def wait_for_configuration_change(self, generation):
+        """
+        :param int generation: A generation of the configuration, as returned
+            by ``configuration_generation``.
+
+        :return: A cancellable ``Deferred`` that fires with the current
+            generation once it is no longer ``generation``, which happens as
+            soon as ``get`` returns a new configuration or, after a failed
+            write, the configuration last written again.
+        """
+        return self._generation_waiters.wait(generation, self._generation)
+
     def load_configuration(self):
         """
         Load the persisted configuration, upgrading the configuration format
@@ -409,6 +834,7 @@ class ConfigurationPersistenceService(MultiService):
 
         # We can now safely attempt to detect and process a >v1 configuration
         # file as normal.
+        snapshot_hash = None
         if self._config_path.exists():
             config_json = self._config_path.getContent()
             config_dict = loads(config_json)
@@ -421,55 +847,200 @@ class ConfigurationPersistenceService(MultiService):
                     config_json = migrate_configuration(
                         config_version, _CONFIG_VERSION,
                         config_json, ConfigurationMigration)
-            config = wire_decode(config_json)
-            self._deployment = config.deployment
-            self._sync_save(config.deployment)
+            else:
+                # Only a journal written against exactly this file applies
+                # to it.  An upgraded configuration is always written out
+                # anew, along with a new journal.
+                snapshot_hash = sha256(config_json).hexdigest()
+            self._deployment = wire_decode(config_json).deployment
         else:
             self._deployment = Deployment()
-            self._sync_save(self._deployment)
 
-    def register(self, change_callback):
+        records, valid_length = read_journal(self._journal_path)
+        header = _parse_journal_header(records[0]) if records else None
+        if (snapshot_hash is not None and header is not None and
+                header[u"snapshot"] == snapshot_hash):
+            tag = header[u"tag"].encode("ascii")
+            for record in records[1:]:
+                tag, _, diff = record.partition(b" ")
+                self._deployment = wire_decode(diff).apply(self._deployment)
+            discarded = self._journal_path.getsize() - valid_length
+            if discarded:
+                _LOG_JOURNAL_DISCARDED(
+                    discarded_bytes=discarded).write(self.logger)
+            self._journal = Journal.open(self._journal_path, valid_length)
+            self._journal_records = len(records) - 1
+        else:
+            if self._journal_path.exists():
+                _LOG_JOURNAL_DISCARDED(
+                    discarded_bytes=self._journal_path.getsize(),
+                ).write(self.logger)
+            tag = self._compact(self._deployment)
+        self._hash = self._written_hash = tag
+        self._written = self._deployment
+        self._last_generation += 1
+        self._generation = self._written_generation = self._last_generation
+
+    def register(self, change_callback, with_configurations=False):
         """
         Register a function to be called whenever the configuration changes.
 
         :param change_callback: Callable that takes no arguments, will be
-            called when configuration changes.
+            called when a changed configuration has been written.
+        :param bool with_configurations: If ``True``, ``change_callback`` is
+            instead called with the ``Deployment`` written before and the
+            one just written.  Saves written together are seen as a single
+            change.
         """
+        if not with_configurations:
+            callback = change_callback
+            change_callback = lambda previous, written: callback()
         self._change_callbacks.append(change_callback)
 
-    def _sync_save(self, deployment):
+    def _compact(self, deployment, tag=None):
         """
-        Save and flush new configuration to disk synchronously.
+        Write out the whole configuration and start a new, empty journal.
+
+        The configuration is safely on disk before the new journal replaces
+        the old one, so after a crash in between the old journal is found not
+        to match the configuration and ignored.
+
+        :param Deployment deployment: The configuration to write.
+        :param bytes tag: The tag of the configuration, or ``None`` to use
+            the hash of the written data.
+
+        :return: The tag of the written configuration.
+        """
+        with _LOG_COMPACT(self.logger, journal_records=self._journal_records):
+            config = Configuration(
+                version=_CONFIG_VERSION, deployment=deployment)
+            data = wire_encode(config)
+            atomic_write(self._config_path, data)
+            digest = sha256(data).hexdigest()
+            if tag is None:
+                tag = digest
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = Journal.create(
+                self._journal_path, [_journal_header(digest, tag)])
+            self._journal_records = 0
+        return tag
+
+    def _sync_save(self, previous, deployment, tag):
         """
-        config = Configuration(version=_CONFIG_VERSION, deployment=deployment)
-        data = wire_encode(config)
-        self._hash = sha256(data).hexdigest()
-        self._config_path.setContent(data)
+        Save and flush new configuration to disk synchronously, as a change
+        appended to the journal or, if the journal is long enough, in full.
+
+        This is called in the writer thread, so it doesn't change any state
+        used by the reactor thread.
+
+        :param Deployment previous: The configuration last written.
+        :param Deployment deployment: The configuration to write.
+        :param bytes tag: The tag of ``deployment``.
+        """
+        if self._journal_records >= self._compaction_threshold:
+            self._compact(deployment, tag)
+            return
+        self._journal.append(
+            tag + b" " + wire_encode(create_diff(previous, deployment)))
+        self._journal_records += 1
+
+    def _write(self):
+        """
+        Start writing the configuration, unless there are no unwritten saves
+        or a write is already in progress, in which case it is left for when
+        that write finishes.
+        """
+        if self._writing or not self._unwritten:
+            return
+        saves, self._unwritten = self._unwritten, []
+        arguments = (self._written, self._deployment, self._hash)
+        generation = self._generation
+        self._writing = True
+        if self._threadpool is None:
+            d = maybeDeferred(self._sync_save, *arguments)
+        else:
+            d = deferToThreadPool(
+                self._reactor, self._threadpool, self._sync_save, *arguments)
+
+        def written(_):
+            self._writing = False
+            self._written = arguments[1]
+            self._written_hash = arguments[2]
+            self._written_generation = generation
+            _LOG_WRITTEN(saves=len(saves)).write(self.logger)
+            for callback in self._change_callbacks:
+                try:
+                    callback(*arguments[:2])
+                except:
+                    # Second argument will be ignored in next Eliot release,
+                    # so not bothering with particular value.
+                    write_traceback(self.logger, u"")
+            for save in saves:
+                save.callback(None)
+
+        def failed(reason):
+            # Saves made since were based on the configuration that couldn't
+            # be written, so they are abandoned along with it:
+            self._writing = False
+            abandoned, self._unwritten = saves + self._unwritten, []
+            self._deployment = self._written
+            self._hash = self._written_hash
+            if self._generation != self._written_generation:
+                self._generation = self._written_generation
+                self._generation_waiters.changed(self._generation)
+            for save in abandoned:
+                save.errback(reason)
+
+        def next_write(_):
+            self._write()
+            if not self._writing:
+                idle, self._idle = self._idle, []
+                for waiting in idle:
+                    waiting.callback(None)
+        d.addCallbacks(written, failed)
+        d.addCallback(next_write)
+
+    def _when_idle(self):
+        """
+        :return: A ``Deferred`` that fires once no write is in progress or
+            waiting.
+        """
+        if not self._writing and not self._unwritten:
+            return succeed(None)
+        d = Deferred()
+        self._idle.append(d)
+        return d
 
     def save(self, deployment):
         """
         Save and flush new deployment to disk.
 
+        ``get`` returns the new deployment straight away, but registered
+        callbacks are only called once it has been written.  If writing
+        fails, ``get`` returns the configuration last written again.
+
         :return Deferred: Fires when write is finished.
         """
         if deployment == self._deployment:
             _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED().write(self.logger)
-            return succeed(None)
-
-        with _LOG_SAVE(self.logger, configuration=deployment):
-            self._sync_save(deployment)
-            self._deployment = deployment
+            # It may still be being written:
+            return self._when_idle()
+
+        self._deployment = deployment
+        self._last_generation += 1
+        self._generation = self._last_generation
+        self._hash = sha256(self._hash + uuid4().bytes).hexdigest()
+        with _LOG_SAVE(self.logger, generation=self._generation,
+                       configuration_hash=self._hash):
             # At some future point this will likely involve talking to a
             # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
             # guarantee immediate saving of the data.
-            for callback in self._change_callbacks:
-                try:
-                    callback()
-                except:
-                    # Second argument will be ignored in next Eliot release, so
-                    # not bothering with particular value.
-                    write_traceback(self.logger, u"")
-            return succeed(None)
+            d = Deferred()
+            self._unwritten.append(d)
+            self._write()
+        self._generation_waiters.changed(self._generation)
+        return d
 
     def get(self):
         """
@@ -0,0 +1,176 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_projection -*-
+
+"""
+Project the cluster configuration and state down to the parts a single node's
+convergence agents need.
+
+The deployers only act on their own node.  Beyond that they look at:
+
+* the applications on other nodes which expose ports, to set up proxies;
+* the hostnames of nodes such applications run on, or datasets move to;
+* manifestations elsewhere of datasets that are, or should be, on this node;
+* leases on those datasets.
+
+Everything else is dropped from what is sent to the agents on that node.
+"""
+
+from ._model import Leases
+
+
+def _relevant_dataset_ids(node_uuid, configuration, state):
+    """
+    Find the datasets which the given node's agents need to know about.
+
+    :param UUID node_uuid: The node the projection is for.
+    :param Deployment configuration: The cluster configuration.
+    :param DeploymentState state: The cluster state.
+
+    :return: A ``set`` of ``unicode`` dataset identifiers that are configured
+        for, or known to be present on, the node.
+    """
+    relevant = set(configuration.get_node(node_uuid).manifestations)
+    node_state = state.nodes.get(node_uuid)
+    if node_state is not None and node_state.manifestations is not None:
+        relevant.update(node_state.manifestations)
+        relevant.update(node_state.paths)
+        relevant.update(unicode(dataset_id) for dataset_id in
+                        node_state.devices)
+    return relevant
+
+
+def _project_node(node, relevant):
+    """
+    Project the configuration of a node other than the one the projection is
+    for.
+
+    :param Node node: The node configuration.
+    :param set relevant: The relevant dataset identifiers.
+
+    :return: The projected ``Node`` (``node`` itself if nothing is dropped),
+        or ``None`` if nothing about the node is of interest.
+    """
+    applications = [
+        application for application in node.applications
+        if application.ports
+    ]
+    dataset_ids = relevant.union(
+        application.volume.manifestation.dataset_id
+        for application in applications
+        if application.volume is not None
+    )
+    manifestations = {
+        dataset_id: manifestation
+        for (dataset_id, manifestation) in node.manifestations.items()
+        if dataset_id in dataset_ids
+    }
+    if not applications and not manifestations:
+        return None
+    if (len(applications) == len(node.applications) and
+            len(manifestations) == len(node.manifestations)):
+        return node
+    return node.set(applications=applications, manifestations=manifestations)
+
+
+def _project_node_state(node_state, relevant):
+    """
+    Project the state of a node other than the one the projection is for.
+
+    Only its hostname and the manifestations of relevant datasets are kept.
+
+    :param NodeState node_state: The node state.
+    :param set relevant: The relevant dataset identifiers.
+
+    :return: The projected ``NodeState``.
+    """
+    if node_state.manifestations is None:
+        return node_state.set(applications=None)
+
+    def only_relevant(mapping, key=lambda dataset_id: dataset_id):
+        return {
+            dataset_id: value for (dataset_id, value) in mapping.items()
+            if key(dataset_id) in relevant
+        }
+    return node_state.set(
+        applications=None,
+        manifestations=only_relevant(node_state.manifestations),
+        paths=only_relevant(node_state.paths),
+        devices=only_relevant(node_state.devices, unicode),
+    )
+
+
+def project_configuration(node_uuid, configuration, relevant):
+    """
+    Project the cluster configuration for a node.
+
+    :param UUID node_uuid: The node the projection is for.
+    :param Deployment configuration: The cluster configuration.
+    :param set relevant: The relevant dataset identifiers, as returned by
+        ``_relevant_dataset_ids``.
+
+    :return: The projected ``Deployment``.
+    """
+    nodes = []
+    for node in configuration.nodes:
+        if node.uuid != node_uuid:
+            node = _project_node(node, relevant)
+        if node is not None:
+            nodes.append(node)
+    leases = Leases({
+        dataset_id: lease
+        for (dataset_id, lease) in configuration.leases.items()
+        if lease.node_id == node_uuid or unicode(dataset_id) in relevant
+    })
+    return configuration.set(nodes=nodes, leases=leases)
+
+
+def project_state(node_uuid, state, configuration, relevant):
+    """
+    Project the cluster state for a node.
+
+    :param UUID node_uuid: The node the projection is for.
+    :param DeploymentState state: The cluster state.
+    :param Deployment configuration: The projected configuration for the
+        node.  The state of every node it mentions is kept.
+    :param set relevant: The relevant dataset identifiers, as returned by
+        ``_relevant_dataset_ids``.
+
+    :return: The projected ``DeploymentState``.
+    """
+    configured = {node.uuid for node in configuration.nodes}
+    nodes = []
+    for node_state in state.nodes:
+        if node_state.uuid != node_uuid:
+            node_state = _project_node_state(node_state, relevant)
+            if (node_state.uuid not in configured and
+                    not node_state.manifestations):
+                continue
+        nodes.append(node_state)
+    era = state.node_uuid_to_era.get(node_uuid)
+    return state.set(
+        nodes=nodes,
+        node_uuid_to_era={} if era is None else {node_uuid: era},
+        nonmanifest_datasets={
+            dataset_id: dataset
+            for (dataset_id, dataset) in state.nonmanifest_datasets.items()
+            if dataset_id in relevant
+        },
+    )
+
+
+def project_for_node(node_uuid, configuration, state):
+    """
+    Project the cluster configuration and state for the agents on a node.
+
+    :param UUID node_uuid: The node the projection is for.
+    :param Deployment configuration: The cluster configuration.
+    :param DeploymentState state: The cluster state.
+
+    :return: A tuple of the projected ``Deployment`` and ``DeploymentState``.
+    """
+    relevant = _relevant_dataset_ids(node_uuid, configuration, state)
+    projected_configuration = project_configuration(
+        node_uuid, configuration, relevant)
+    projected_state = project_state(
+        node_uuid, state, projected_configuration, relevant)
+    return projected_configuration, projected_state
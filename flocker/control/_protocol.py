@@ -23,23 +23,52 @@ Interactions:
   cluster-wide state representation (the state of all of the nodes) and sends a
   ``ClusterStatusCommand`` to all convergence agents.
 
+* Every distinct configuration and cluster state is assigned a generation.
+  Once a convergence agent has acknowledged a ``ClusterStatusCommand`` the
+  control service only sends it a ``ClusterStatusDiffCommand`` describing the
+  changes since the generations it acknowledged.  If the agent does not have
+  the generations the diff is based on it rejects the diff and the control
+  service falls back to sending a full ``ClusterStatusCommand``.
+
+* When a convergence agent connects it sends a ``CapabilitiesCommand`` listing
+  the optional protocol features it supports and the control service replies
+  with its own.  Features supported by both ends, such as the compact binary
+  encoding of configuration and state (see ``_binary_codec``) and zlib
+  compression of it, are used for the rest of the connection.  Peers which
+  don't know the command carry on without optional features.
+
+* Once a convergence agent has identified its node with a
+  ``SetNodeEraCommand`` the configuration and state sent to it are projected
+  down to the parts relevant to that node (see ``_projection``).
+
 Eliot contexts are transferred along with AMP commands, allowing tracing
 of logged actions across processes (see
 http://eliot.readthedocs.org/en/0.6.0/threads.html).
 
-:var _wire_encode_cache: ``LRUCache`` mapping serializable objects to
+:var _wire_encode_cache: ``FragmentCache`` mapping serializable objects to
     their ``wire_encode`` output.
+:var _wire_fragments: ``FragmentCache`` of the encodings of parts of the
+    objects in ``_wire_encode_cache``.
+:var _binary_encode_cache: ``FragmentCache`` mapping serializable objects to
+    their ``binary_encode`` output.
+:var _binary_fragments: ``FragmentCache`` of the binary encodings of parts of
+    the objects in ``_binary_encode_cache``.
+:var _compressed_wire_cache: ``FragmentCache`` mapping serializable objects
+    to their compressed ``wire_encode`` output.
+:var _compressed_binary_cache: ``FragmentCache`` mapping serializable objects
+    to their compressed ``binary_encode`` output.
 """
 
 from datetime import timedelta
-from io import BytesIO
 from itertools import count
+from timeit import default_timer
+import zlib
 from twisted.internet.defer import maybeDeferred
 from uuid import UUID
 from functools import partial
 
 from eliot import (
-    Logger, ActionType, Action, Field, MessageType,
+    Logger, ActionType, Action, Field, MessageType, writeFailure,
 )
 from eliot.twisted import DeferredContext
 
@@ -49,26 +78,66 @@ from repoze.lru import LRUCache
 
 from characteristic import with_cmp
 
-from zope.interface import Interface, Attribute
+from zope.interface import Interface, Attribute, implementer
 
 from twisted.application.service import Service
 from twisted.protocols.amp import (
-    Argument, Command, Integer, CommandLocator, AMP, Unicode,
-    MAX_VALUE_LENGTH,
+    Argument, Command, Integer, CommandLocator, AMP, AmpBox, Unicode, ListOf,
+    MAX_VALUE_LENGTH, UnhandledCommand, RemoteAmpError, UnknownRemoteError,
 )
+from twisted.python.failure import Failure
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.task import LoopingCall
 from twisted.internet.protocol import ServerFactory
 from twisted.application.internet import StreamServerEndpointService
 from twisted.protocols.tls import TLSMemoryBIOFactory
 
-from ._persistence import wire_encode, wire_decode
+from ._persistence import (
+    wire_decode, splicing_wire_encode, FragmentCache,
+)
+from ._binary_codec import binary_encode, binary_decode, BINARY_MAGIC
+from ._diffing import _Diff
+from ._generations import GenerationTracker
+from ._projection import project_for_node
 from ._model import (
     Deployment, DeploymentState, ChangeSource, UpdateNodeStateEra,
-    BlockDeviceOwnership, DatasetAlreadyOwned,
+    BlockDeviceOwnership, DatasetAlreadyOwned, Node, NodeState,
+    Manifestation,
 )
 
 PING_INTERVAL = timedelta(seconds=30)
 
+# Capability indicating support for the binary encoding of
+# ``SerializableArgument`` values:
+BINARY_WIRE_FORMAT = u"binary-wire-format-1"
+
+# Capability indicating support for zlib compressed ``SerializableArgument``
+# values:
+ZLIB_COMPRESSION = u"zlib-compression-1"
+
+# The optional protocol features this implementation supports:
+SUPPORTED_CAPABILITIES = frozenset([BINARY_WIRE_FORMAT, ZLIB_COMPRESSION])
+
+# Prefix of compressed ``SerializableArgument`` values, which can start
+# neither JSON nor ``BINARY_MAGIC``:
+ZLIB_MAGIC = b"\x00FLZ1"
+
+# The configuration and state are encoded once and sent to every agent, so
+# it's worth the time for zlib's default level of compression:
+_COMPRESSION_LEVEL = 6
+
+# The number of past configuration and state generations the control service
+# remembers in order to compute diffs for agents which are behind:
+_GENERATION_CACHE_SIZE = 100
+
+# The number of per-node projections of the configuration and state the
+# control service remembers.  Agents on the same node share a projection.
+_PROJECTION_CACHE_SIZE = 1000
+
+# The number of serialized sets of command arguments the control service
+# remembers.  Agents sent the same arguments share their serialization.
+_SERIALIZED_ARGUMENTS_CACHE_SIZE = 100
+
 
 class Big(Argument):
     """
@@ -92,49 +161,89 @@ class Big(Argument):
         dictionary with indexed key names so that the chunks can be put back
         together in the correct order during deserialization.
 
+        The chunks are sliced straight out of the serialized value, so apart
+        from the chunks themselves no copies of it are made.
+
         See ``IArgumentType`` for argument and return type documentation.
         """
         self.another_argument.toBox(name, strings, objects, proto)
-        value = BytesIO(strings.pop(name))
-        counter = 0
-        while True:
-            nextChunk = value.read(MAX_VALUE_LENGTH)
-            if not nextChunk:
-                break
-            strings["%s.%d" % (name, counter)] = nextChunk
-            counter += 1
+        value = strings.pop(name)
+        for counter, offset in enumerate(
+                xrange(0, len(value), MAX_VALUE_LENGTH)):
+            strings["%s.%d" % (name, counter)] = value[
+                offset:offset + MAX_VALUE_LENGTH]
 
     def fromBox(self, name, strings, objects, proto):
         """
-        During deserialization, the indexed chunks are re-assembled from the
-        ``strings`` dictionary and the combined value is then placed back into
-        the strings dictionary using the expected key name. The ``fromBox``
-        method of the wrapped ``Argument`` is then called supplied with the
-        updated ``strings`` dictionary, deserializes the large value and
-        populates the ``objects`` dictionary with the result.
+        During deserialization, the indexed chunks are removed from the
+        ``strings`` dictionary and joined, and the combined value is then
+        placed back into the strings dictionary using the expected key name.
+        The ``fromBox`` method of the wrapped ``Argument`` is then called
+        supplied with the updated ``strings`` dictionary, deserializes the
+        large value and populates the ``objects`` dictionary with the result.
+
+        The chunks are joined only once, so receiving a value takes time and
+        memory proportional to its size.
 
         See ``IArgumentType`` for argument and return type documentation.
         """
-
-        value = BytesIO()
+        chunks = []
         for counter in count(0):
-            chunk = strings.get("%s.%d" % (name, counter))
+            chunk = strings.pop("%s.%d" % (name, counter), None)
             if chunk is None:
                 break
-            value.write(chunk)
-            strings[name] = value.getvalue()
+            chunks.append(chunk)
+        strings[name] = b"".join(chunks)
         self.another_argument.fromBox(name, strings, objects, proto)
 
 
 # The configuration and state can get pretty big, so don't want too many:
-_wire_encode_cache = LRUCache(50)
+_wire_encode_cache = FragmentCache([], 50)
+_binary_encode_cache = FragmentCache([], 50)
+
+# The parts of the configuration and state which are remembered, so that
+# after a change to one node only that node needs encoding again.  The size
+# allows for a few thousand nodes with a handful of datasets each:
+_FRAGMENT_CLASSES = [Node, NodeState, Manifestation]
+_FRAGMENT_CACHE_SIZE = 50000
+_wire_fragments = FragmentCache(_FRAGMENT_CLASSES, _FRAGMENT_CACHE_SIZE)
+# Binary fragments don't share strings and UUIDs with their surroundings, so
+# fragments as small as a ``Manifestation`` would make the encoding much
+# bigger:
+_BINARY_FRAGMENT_CLASSES = [Node, NodeState]
+_binary_fragments = FragmentCache(
+    _BINARY_FRAGMENT_CLASSES, _FRAGMENT_CACHE_SIZE)
+
+
+def _caching_encode(cache, encode, fragments, obj):
+    """
+    Encode an object to bytes and cache the result, or return cached result
+    if available.
+
+    :param FragmentCache cache: The cache to use.
+    :param encode: Two-argument callable which encodes an object to bytes
+        given a ``FragmentCache`` for its parts.
+    :param FragmentCache fragments: The cache to use for parts of the object.
+    :param obj: Object to encode.
+    :return: Resulting ``bytes``.
+    """
+    result = cache.get(obj)
+    if result is None:
+        result = encode(obj, fragments)
+        cache.put(obj, result)
+    return result
 
 
 def caching_wire_encode(obj):
     """
-    Encode an object to bytes using ``wire_encode`` and cache the result,
+    Encode an object to bytes like ``wire_encode`` and cache the result,
     or return cached result if available.
 
+    The encodings of ``Node``, ``NodeState`` and ``Manifestation`` instances
+    within the object are cached too and spliced into the encoding of later
+    objects containing the same instances, so that after a change to one node
+    only that node is encoded again.
+
     This relies on cached objects being immutable, or at least not being
     modified. Given our usage patterns that is currently the case and
     should continue to be, but worth keeping in mind.
@@ -142,10 +251,73 @@ def caching_wire_encode(obj):
     :param obj: Object to encode.
     :return: Resulting ``bytes``.
     """
-    result = _wire_encode_cache.get(obj)
+    return _caching_encode(
+        _wire_encode_cache, splicing_wire_encode, _wire_fragments, obj)
+
+
+def encode_cache_statistics():
+    """
+    :return: A ``dict`` with the total number of hits (``encode_cache_hits``)
+        and misses (``encode_cache_misses``) of the caches of encoded
+        configurations and states.
+    """
+    caches = [_wire_encode_cache, _binary_encode_cache]
+    return dict(
+        encode_cache_hits=sum(cache.hits for cache in caches),
+        encode_cache_misses=sum(cache.misses for cache in caches),
+    )
+
+
+def caching_binary_encode(obj):
+    """
+    Like ``caching_wire_encode`` but using ``binary_encode``.
+
+    :param obj: Object to encode.
+    :return: Resulting ``bytes``.
+    """
+    return _caching_encode(
+        _binary_encode_cache, binary_encode, _binary_fragments, obj)
+
+
+_compressed_wire_cache = FragmentCache([], 50)
+_compressed_binary_cache = FragmentCache([], 50)
+
+LOG_COMPRESSED = MessageType(
+    "flocker:controlservice:compressed",
+    [Field.forTypes(u"encoding", [unicode], u"The encoding compressed."),
+     Field.forTypes(u"uncompressed_size", [int, long],
+                    u"The size of the encoded bytes."),
+     Field.forTypes(u"compressed_size", [int, long],
+                    u"The size of the compressed bytes."),
+     Field.forTypes(u"ratio", [float],
+                    u"The uncompressed size divided by the compressed size."),
+     Field.forTypes(u"seconds", [float],
+                    u"The time taken to compress.")],
+    u"An encoded configuration or state was compressed to be sent to peers.")
+
+
+def _caching_compress(cache, encoding, encoded, obj):
+    """
+    Compress the encoding of an object and cache the result, or return the
+    cached result if available.
+
+    :param FragmentCache cache: The cache to use.
+    :param unicode encoding: The name of the encoding, for logging.
+    :param bytes encoded: The encoding of ``obj``.
+    :param obj: The encoded object.
+    :return: ``bytes`` starting with ``ZLIB_MAGIC``.
+    """
+    result = cache.get(obj)
     if result is None:
-        result = wire_encode(obj)
-        _wire_encode_cache.put(obj, result)
+        start = default_timer()
+        result = ZLIB_MAGIC + zlib.compress(encoded, _COMPRESSION_LEVEL)
+        LOG_COMPRESSED(
+            encoding=encoding, uncompressed_size=len(encoded),
+            compressed_size=len(result),
+            ratio=float(len(encoded)) / len(result),
+            seconds=default_timer() - start,
+        ).write()
+        cache.put(obj, result)
     return result
 
 
@@ -153,6 +325,11 @@ class SerializableArgument(Argument):
     """
     AMP argument that takes an object that can be serialized by the
     configuration persistence layer.
+
+    Objects are sent using the binary encoding if the peer has agreed to the
+    ``BINARY_WIRE_FORMAT`` capability, and as JSON otherwise.  The result is
+    compressed if the peer has agreed to the ``ZLIB_COMPRESSION`` capability.
+    Any of these are accepted when receiving.
     """
     def __init__(self, *classes):
         """
@@ -163,21 +340,53 @@ class SerializableArgument(Argument):
         Argument.__init__(self)
         self._expected_classes = classes
 
-    def fromString(self, in_bytes):
-        obj = wire_decode(in_bytes)
+    def _check_type(self, obj):
+        """
+        :raise TypeError: If ``obj`` is not of one of the expected types.
+        """
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
             )
+
+    def fromString(self, in_bytes):
+        if in_bytes.startswith(ZLIB_MAGIC):
+            in_bytes = zlib.decompress(buffer(in_bytes, len(ZLIB_MAGIC)))
+        if in_bytes.startswith(BINARY_MAGIC):
+            obj = binary_decode(in_bytes)
+        else:
+            obj = wire_decode(in_bytes)
+        self._check_type(obj)
         return obj
 
     def toString(self, obj):
-        if not isinstance(obj, self._expected_classes):
-            raise TypeError(
-                "{} is none of {}".format(obj, self._expected_classes)
-            )
+        self._check_type(obj)
         return caching_wire_encode(obj)
 
+    def toStringProto(self, obj, proto):
+        """
+        Encode using the binary encoding and compression if ``proto`` has
+        negotiated them.
+
+        :param proto: The ``AMP`` protocol (or locator) the argument is being
+            sent with.  Its ``capabilities`` attribute, if it has one, is the
+            set of capabilities agreed with the peer.
+        """
+        capabilities = getattr(proto, "capabilities", ())
+        self._check_type(obj)
+        if BINARY_WIRE_FORMAT in capabilities:
+            encoding = u"binary"
+            encoded = caching_binary_encode(obj)
+            compressed_cache = _compressed_binary_cache
+        else:
+            encoding = u"json"
+            encoded = caching_wire_encode(obj)
+            compressed_cache = _compressed_wire_cache
+        if ZLIB_COMPRESSION in capabilities:
+            return _caching_compress(
+                compressed_cache, encoding, encoded, obj)
+        return encoded
+
 
 class _EliotActionArgument(Unicode):
     """
@@ -202,6 +411,18 @@ class VersionCommand(Command):
     response = [('major', Integer())]
 
 
+class CapabilitiesCommand(Command):
+    """
+    Exchange the optional protocol features each end of the connection
+    supports.
+
+    Sent by the convergence agent when it connects.  Both ends then use the
+    features they both support.
+    """
+    arguments = [('capabilities', ListOf(Unicode()))]
+    response = [('capabilities', ListOf(Unicode()))]
+
+
 class NoOp(Command):
     """
     Do nothing.  Return nothing.  This merely generates some traffic on the
@@ -220,11 +441,45 @@ class ClusterStatusCommand(Command):
 
     Having both as a single command simplifies the decision making process
     in the convergence agent during startup.
+
+    The generations identify the configuration and state so that later
+    updates can be sent as a ``ClusterStatusDiffCommand`` against them.  They
+    are optional for compatibility with older control services.
     """
     arguments = [('configuration', Big(SerializableArgument(Deployment))),
+                 ('configuration_generation', Integer(optional=True)),
                  ('state', Big(SerializableArgument(DeploymentState))),
+                 ('state_generation', Integer(optional=True)),
+                 ('eliot_context', _EliotActionArgument())]
+    response = []
+
+
+class GenerationMismatch(Exception):
+    """
+    A diff could not be applied because the receiver does not have the
+    generation the diff was computed against.
+    """
+
+
+class ClusterStatusDiffCommand(Command):
+    """
+    Used by the control service to inform a convergence agent of changes to
+    the cluster state and desired configuration since the generations the
+    agent last acknowledged.
+
+    If the agent doesn't have the starting generations it responds with a
+    ``GenerationMismatch`` error and the control service sends a full
+    ``ClusterStatusCommand`` instead.
+    """
+    arguments = [('configuration_diff', Big(SerializableArgument(_Diff))),
+                 ('start_configuration_generation', Integer()),
+                 ('end_configuration_generation', Integer()),
+                 ('state_diff', Big(SerializableArgument(_Diff))),
+                 ('start_state_generation', Integer()),
+                 ('end_state_generation', Integer()),
                  ('eliot_context', _EliotActionArgument())]
     response = []
+    errors = {GenerationMismatch: 'GENERATION_MISMATCH'}
 
 
 class SetNodeEraCommand(Command):
@@ -311,6 +566,10 @@ class ControlServiceLocator(CommandLocator):
     :ivar IClusterStateSource _source: The change source uniquely representing
         the AMP connection for which this locator is being used.
     :ivar _reactor: See ``reactor`` parameter of ``__init__``
+    :ivar UUID node_uuid: The UUID of the node the agent at the other end of
+        the connection runs on, or ``None`` if it has not told us yet.
+    :ivar frozenset capabilities: The optional protocol features agreed with
+        the agent.
     """
     def __init__(self, reactor, control_amp_service, timeout):
         """
@@ -330,6 +589,8 @@ class ControlServiceLocator(CommandLocator):
         # it.
         self._source = ChangeSource()
         self._timeout = timeout
+        self.node_uuid = None
+        self.capabilities = frozenset()
 
         self._reactor = reactor
         self.control_amp_service = control_amp_service
@@ -358,6 +619,11 @@ class ControlServiceLocator(CommandLocator):
     def version(self):
         return {"major": 1}
 
+    @CapabilitiesCommand.responder
+    def negotiate_capabilities(self, capabilities):
+        self.capabilities = SUPPORTED_CAPABILITIES.intersection(capabilities)
+        return {"capabilities": sorted(SUPPORTED_CAPABILITIES)}
+
     @NodeStateCommand.responder
     def node_changed(self, eliot_context, state_changes):
         with eliot_context:
@@ -368,10 +634,11 @@ class ControlServiceLocator(CommandLocator):
 
     @SetNodeEraCommand.responder
     def set_node_era(self, era, node_uuid):
+        self.node_uuid = UUID(node_uuid)
         # Further work will be done in FLOC-3380
         self.control_amp_service.cluster_state.apply_changes_from_source(
             self._source, [UpdateNodeStateEra(era=UUID(era),
-                                              uuid=UUID(node_uuid))])
+                                              uuid=self.node_uuid)])
         # We don't bother sending an update to other nodes because this
         # command will immediately be followed by a ``NodeStateCommand``
         # with more interesting information.
@@ -407,12 +674,86 @@ def timeout_for_protocol(reactor, protocol):
                    lambda: protocol.transport.abortConnection())
 
 
+_serialized_arguments = LRUCache(_SERIALIZED_ARGUMENTS_CACHE_SIZE)
+
+
+def _serialize_arguments(command, arguments, proto):
+    """
+    Serialize some of the arguments of a command as AMP box key/value pairs,
+    or return the serialization made by an earlier call with the same
+    command, argument objects and protocol capabilities.
+
+    :param command: The ``Command`` subclass.
+    :param dict arguments: Map argument names to values.
+    :param proto: The ``AMP`` protocol the arguments are to be sent with.
+
+    :return: The serialized key/value pairs followed by the box terminator,
+        as ``bytes``.
+    """
+    names = sorted(arguments)
+    # The cached entry keeps the argument objects alive, so their ids can't
+    # be reused by other objects while it exists:
+    key = (command, proto.capabilities,
+           tuple((name, id(arguments[name])) for name in names))
+    cached = _serialized_arguments.get(key)
+    if cached is None:
+        box = AmpBox()
+        remaining = dict(arguments)
+        for name, argument in command.arguments:
+            if name in arguments:
+                argument.toBox(name, box, remaining, proto)
+        cached = ([arguments[name] for name in names], box.serialize())
+        _serialized_arguments.put(key, cached)
+    return cached[1]
+
+
+# The arguments of commands sent to many agents whose serialization is
+# shared between the connections to those agents:
+_SHARED_ARGUMENTS = {
+    ClusterStatusCommand: frozenset([b"configuration", b"state"]),
+    ClusterStatusDiffCommand: frozenset([b"configuration_diff",
+                                         b"state_diff"]),
+}
+
+
+class _PreserializedBox(AmpBox):
+    """
+    An ``AmpBox`` whose serialization appends already serialized key/value
+    pairs, so that the same arguments can be sent to many connections
+    without serializing them again for each.
+
+    The box is sent by ``AMP.sendBox`` like any other, so buffering while
+    TLS starts and failing on closed or switched connections are left to
+    Twisted.
+
+    :ivar bytes _serialized: Key/value pairs followed by the box terminator,
+        as returned by ``_serialize_arguments``.
+    """
+    def __init__(self, serialized):
+        AmpBox.__init__(self)
+        self._serialized = serialized
+
+    def serialize(self):
+        # Drop the terminator of this box's own keys, which the shared
+        # serialization ends with instead:
+        return AmpBox.serialize(self)[:-2] + self._serialized
+
+
+@implementer(IPushProducer)
 class ControlAMP(AMP):
     """
     AMP protocol for control service server.
 
+    The protocol registers itself as the producer of its transport, so that
+    the control service can hold back updates while the transport's write
+    buffer is full.
+
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar bool paused: ``True`` while the transport has asked for writes to
+        pause.
+    :ivar int bytes_in_flight: The size of the serialized configuration and
+        state sent to the agent and not yet acknowledged.
     """
     def __init__(self, reactor, control_amp_service):
         """
@@ -426,9 +767,92 @@ class ControlAMP(AMP):
 
         self.control_amp_service = control_amp_service
         self._pinger = Pinger(reactor)
+        self.paused = False
+        self.bytes_in_flight = 0
+
+    @property
+    def node_uuid(self):
+        """
+        The UUID of the node the agent at the other end of this connection
+        runs on, or ``None`` if it is not yet known.
+        """
+        return self.locator.node_uuid
+
+    @property
+    def capabilities(self):
+        """
+        The optional protocol features agreed with the agent.
+        """
+        return self.locator.capabilities
+
+    def callRemote(self, command, **kwargs):
+        """
+        Like ``AMP.callRemote``, except that the serialization of the
+        configuration and state sent with ``ClusterStatusCommand`` and
+        ``ClusterStatusDiffCommand`` is shared with other connections sent
+        the same objects, rather than being rebuilt for each.
+        """
+        shared_names = _SHARED_ARGUMENTS.get(command)
+        if shared_names is None:
+            return AMP.callRemote(self, command, **kwargs)
+        shared_arguments = {
+            name: kwargs.pop(name) for name in shared_names
+        }
+        return self._call_remote_shared(command, shared_arguments, kwargs)
+
+    def _call_remote_shared(self, command, shared_arguments, kwargs):
+        """
+        Send a command some of whose arguments are serialized at most once
+        for all connections with the same capabilities.
+
+        :param command: The ``Command`` subclass to send.
+        :param dict shared_arguments: Arguments likely to be sent to other
+            agents too.
+        :param dict kwargs: Arguments specific to this connection.
+
+        :return: A ``Deferred`` firing like that returned by ``callRemote``.
+        """
+        serialized = _serialize_arguments(command, shared_arguments, self)
+        box = _PreserializedBox(serialized)
+        remaining = dict(kwargs)
+        for name, argument in command.arguments:
+            if name in kwargs:
+                argument.toBox(name, box, remaining, self)
+
+        def answered(result):
+            self.bytes_in_flight -= len(serialized)
+            return result
+
+        def remote_error(reason):
+            reason.trap(RemoteAmpError)
+            error_type = command.reverseErrors.get(
+                reason.value.errorCode, UnknownRemoteError)
+            return Failure(error_type(reason.value.description))
+        # ``Command._doCommand`` sends its boxes the same way; there is no
+        # public API for sending a box that is already built.
+        # ``SharedSerializationTests.test_send_box_command`` checks that
+        # this private method still behaves as relied on here.
+        d = self._sendBoxCommand(command.commandName, box)
+        self.bytes_in_flight += len(serialized)
+        d.addBoth(answered)
+        d.addCallback(command.parseResponse, self)
+        d.addErrback(remote_error)
+        return d
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.control_amp_service.resumed(self)
+
+    def stopProducing(self):
+        # The connection is going away; ``connectionLost`` cleans up.
+        pass
 
     def connectionMade(self):
         AMP.connectionMade(self)
+        self.transport.registerProducer(self, True)
         self.control_amp_service.connected(self)
         self._pinger.start(self, PING_INTERVAL)
 
@@ -445,11 +869,25 @@ class ControlAMP(AMP):
 DEPLOYMENT_CONFIG = Field(u"configuration", caching_wire_encode,
                           u"The cluster configuration")
 CLUSTER_STATE = Field(u"state", caching_wire_encode, u"The cluster state")
+CONFIGURATION_GENERATION = Field.forTypes(
+    u"configuration_generation", [int, long],
+    u"The generation of the cluster configuration.")
+STATE_GENERATION = Field.forTypes(
+    u"state_generation", [int, long],
+    u"The generation of the cluster state.")
+ENCODE_CACHE_HITS = Field.forTypes(
+    u"encode_cache_hits", [int, long],
+    u"The number of times a cached encoding of a whole configuration or "
+    u"state has been reused.")
+ENCODE_CACHE_MISSES = Field.forTypes(
+    u"encode_cache_misses", [int, long],
+    u"The number of times a whole configuration or state had to be "
+    u"encoded.")
 
 LOG_SEND_CLUSTER_STATE = ActionType(
     "flocker:controlservice:send_cluster_state",
-    [],
-    [DEPLOYMENT_CONFIG, CLUSTER_STATE],
+    [CONFIGURATION_GENERATION, STATE_GENERATION],
+    [DEPLOYMENT_CONFIG, CLUSTER_STATE, ENCODE_CACHE_HITS, ENCODE_CACHE_MISSES],
     "Send the configuration and state of the cluster to all agents.")
 
 
@@ -496,18 +934,160 @@ AGENT_UPDATE_DELAYED = MessageType(
     u"progress.",
 )
 
+AGENT_UPDATE_PAUSED = MessageType(
+    "flocker:controlservice:agent_update_paused",
+    [AGENT],
+    u"An update to an agent was delayed because the connection to it can't "
+    u"accept more data yet.",
+)
+
 
-class _UpdateState(PClass):
+LOG_BROADCAST = MessageType(
+    "flocker:controlservice:broadcast",
+    [Field.forTypes(u"requests", [int, long],
+                    u"The number of changes folded into this broadcast."),
+     Field.forTypes(u"total_requests", [int, long],
+                    u"The number of changes since the service started."),
+     Field.forTypes(u"total_broadcasts", [int, long],
+                    u"The number of broadcasts since the service started.")],
+    u"The configuration and state were sent to all agents after one or more "
+    u"changes.",
+)
+
+
+class _BroadcastScheduler(object):
+    """
+    Coalesce requests to send the configuration and state to every agent, so
+    that a burst of changes leads to one encode and fan-out rather than one
+    per change.
+
+    A broadcast happens once no request has arrived for ``window`` seconds,
+    or ``max_staleness`` seconds after the first request it covers, whichever
+    is sooner.  With a ``window`` of zero every request broadcasts at once.
+
+    :ivar _reactor: ``IReactorTime`` provider.
+    :ivar float _window: See above.
+    :ivar float _max_staleness: See above.
+    :ivar _broadcast: No-argument callable which does the broadcast.
+    :ivar _call: The ``IDelayedCall`` of the pending broadcast, or ``None``.
+    :ivar float _first_request: When the first request covered by the pending
+        broadcast was made.
+    :ivar int _pending: The number of requests covered by the pending
+        broadcast.
+    :ivar int requests: The number of requests so far.
+    :ivar int broadcasts: The number of broadcasts so far.  The difference
+        from ``requests`` is the number of requests coalesced.
+    """
+    def __init__(self, reactor, window, max_staleness, broadcast):
+        self._reactor = reactor
+        self._window = window
+        self._max_staleness = max_staleness
+        self._broadcast = broadcast
+        self._call = None
+        self._first_request = None
+        self._pending = 0
+        self.requests = 0
+        self.broadcasts = 0
+
+    def request(self):
+        """
+        Ask for a broadcast reflecting all changes made so far.
+        """
+        self.requests += 1
+        self._pending += 1
+        if self._window <= 0:
+            self._flush()
+            return
+        now = self._reactor.seconds()
+        if self._call is None:
+            self._first_request = now
+        delay = max(0, min(self._window,
+                           self._first_request + self._max_staleness - now))
+        if self._call is None:
+            self._call = self._reactor.callLater(delay, self._flush)
+        else:
+            self._call.reset(delay)
+
+    def stop(self):
+        """
+        Cancel any pending broadcast.
+        """
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+        self._pending = 0
+
+    def _flush(self):
+        """
+        Broadcast now, covering all pending requests.
+        """
+        self._call = None
+        self.broadcasts += 1
+        LOG_BROADCAST(requests=self._pending, total_requests=self.requests,
+                      total_broadcasts=self.broadcasts).write()
+        self._pending = 0
+        self._broadcast()
+
+
+class _SendQueue(object):
+    """
+    The updates to one agent which are in progress or waiting to be sent.
+
+    At most one update is unacknowledged at a time.  Changes made while one
+    is, or while the agent's transport has paused its producer, only mark
+    another update as pending.  That update is built from the latest
+    configuration and state when it is finally sent, so intermediate updates
+    are dropped rather than buffered.
+
+    :ivar response: The pending result of the unacknowledged update, or
+        ``None`` if there is none.
+    :ivar bool pending: ``True`` if another update should be sent once the
+        unacknowledged one is done and the transport accepts more data.
+    :ivar int dropped: The number of updates superseded before being sent.
+    """
+    def __init__(self):
+        self.response = None
+        self.pending = False
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        """
+        The number of updates in progress or waiting to be sent.
+        """
+        return int(self.response is not None) + int(self.pending)
+
+
+class SendQueueStatus(PClass):
+    """
+    The state of the updates to one agent.
+
+    :ivar int depth: The number of updates in progress or waiting to be
+        sent, at most two.
+    :ivar int bytes_in_flight: The size of the serialized configuration and
+        state sent and not yet acknowledged.
+    :ivar int dropped: The number of updates superseded before being sent.
+    :ivar bool paused: ``True`` while the transport can't accept more data.
     """
-    Represent the state related to sending a ``ClusterStatusCommand`` to an
-    agent.
+    depth = field(type=int, mandatory=True)
+    bytes_in_flight = field(type=int, mandatory=True)
+    dropped = field(type=int, mandatory=True)
+    paused = field(type=bool, mandatory=True)
 
-    :ivar response: The pending result of an update that is in progress.
-    :ivar scheduled: ``True`` if another update should be performed as soon as
-        the current one is done, ``False`` otherwise.
+
+class _ConfigAndStateGeneration(PClass):
+    """
+    The generations of a configuration and cluster state sent to an agent.
+
+    :ivar node_uuid: The ``UUID`` of the node the configuration and state were
+        projected for, or ``None`` if they are for the whole cluster.
+        Generations of different projections are unrelated.
+    :ivar int config_generation: The generation of the configuration.
+    :ivar int state_generation: The generation of the cluster state.
     """
-    response = field()
-    next_scheduled = field()
+    node_uuid = field(mandatory=True)
+    config_generation = field(type=int, mandatory=True)
+    state_generation = field(type=int, mandatory=True)
 
 
 class ControlAMPService(Service):
@@ -516,14 +1096,30 @@ class ControlAMPService(Service):
 
     Convergence agents connect to this server.
 
-    :ivar dict _current_command: A dictionary containing information about
-        connections to which state updates are currently in progress.  The keys
-        are protocol instances.  The values are ``_UpdateState`` instances.
+    :ivar dict _send_queues: A dictionary mapping connected protocol
+        instances to the ``_SendQueue`` of updates to them.
+    :ivar dict _last_received_generation: A dictionary mapping protocol
+        instances to the ``_ConfigAndStateGeneration`` most recently
+        acknowledged by the agent on that connection.  Updates to these
+        connections are sent as diffs against those generations.
+    :ivar dict _generation_trackers: A dictionary mapping a node ``UUID``
+        (or ``None`` for the whole cluster) to a tuple of ``GenerationTracker``
+        instances tracking the configuration and state projected for that
+        node.  A node's trackers are dropped once no connection identifies
+        it.
+    :ivar LRUCache _projections: Map a node ``UUID`` and the generations of
+        the whole cluster configuration and state to the projection of that
+        configuration and state for the node, together with its
+        ``_ConfigAndStateGeneration``.  Since the encoding cache is keyed on
+        value, agents which are sent the same projection share its encoding.
+    :ivar _BroadcastScheduler broadcast_scheduler: Coalesces the sending of
+        changed configuration and state to all agents.
     """
     logger = Logger()
 
     def __init__(self, reactor, cluster_state, configuration_service, endpoint,
-                 context_factory):
+                 context_factory, broadcast_window=0,
+                 broadcast_max_staleness=1):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
         :param ClusterStateService cluster_state: Object that records known
@@ -532,9 +1128,17 @@ class ControlAMPService(Service):
             Persistence service for desired cluster configuration.
         :param endpoint: Endpoint to listen on.
         :param context_factory: TLS context factory.
+        :param float broadcast_window: Seconds to wait for further changes
+            before sending changed configuration and state to all agents.
+            Zero sends on every change.
+        :param float broadcast_max_staleness: The most seconds a change waits
+            for further changes before being sent.
         """
         self.connections = set()
-        self._current_command = {}
+        self._send_queues = {}
+        self._last_received_generation = {}
+        self._generation_trackers = {}
+        self._projections = LRUCache(_PROJECTION_CACHE_SIZE)
         self.cluster_state = cluster_state
         self.configuration_service = configuration_service
         self.endpoint_service = StreamServerEndpointService(
@@ -545,26 +1149,123 @@ class ControlAMPService(Service):
                 ServerFactory.forProtocol(lambda: ControlAMP(reactor, self))
             )
         )
+        self.broadcast_scheduler = _BroadcastScheduler(
+            reactor, broadcast_window, broadcast_max_staleness,
+            lambda: self._send_state_to_connections(self.connections))
         # When configuration changes, notify all connected clients:
         self.configuration_service.register(
-            lambda: self._send_state_to_connections(self.connections))
+            self.broadcast_scheduler.request)
 
     def startService(self):
         self.endpoint_service.startService()
 
     def stopService(self):
+        self.broadcast_scheduler.stop()
         self.endpoint_service.stopService()
         for connection in self.connections:
             connection.transport.loseConnection()
 
+    def _trackers(self, node_uuid):
+        """
+        :param node_uuid: The ``UUID`` of a node, or ``None`` for the whole
+            cluster.
+
+        :return: A tuple of the ``GenerationTracker`` instances for the
+            configuration and state projected for the node.
+        """
+        try:
+            return self._generation_trackers[node_uuid]
+        except KeyError:
+            trackers = self._generation_trackers[node_uuid] = (
+                GenerationTracker(_GENERATION_CACHE_SIZE),
+                GenerationTracker(_GENERATION_CACHE_SIZE),
+            )
+            return trackers
+
+    def _insert_cluster_generation(self, configuration, state):
+        """
+        Record the latest configuration and state of the whole cluster.
+
+        Their generations are those assigned by the configuration and cluster
+        state services, so the potentially huge objects never need to be
+        compared with the previous ones.
+
+        :param Deployment configuration: The cluster configuration.
+        :param DeploymentState state: The cluster state.
+
+        :return _ConfigAndStateGeneration: The generations of
+            ``configuration`` and ``state``.
+        """
+        configuration_tracker, state_tracker = self._trackers(None)
+        return _ConfigAndStateGeneration(
+            node_uuid=None,
+            config_generation=configuration_tracker.insert_with_generation(
+                configuration,
+                self.configuration_service.written_configuration_generation()),
+            state_generation=state_tracker.insert_with_generation(
+                state, self.cluster_state.state_generation()),
+        )
+
+    def _insert_generation(self, node_uuid, configuration, state):
+        """
+        Record the latest configuration and state projected for a node.
+
+        :param UUID node_uuid: The node.
+        :param Deployment configuration: The projected configuration.
+        :param DeploymentState state: The projected state.
+
+        :return _ConfigAndStateGeneration: The generations of
+            ``configuration`` and ``state``.
+        """
+        configuration_tracker, state_tracker = self._trackers(node_uuid)
+        return _ConfigAndStateGeneration(
+            node_uuid=node_uuid,
+            config_generation=configuration_tracker.insert_latest(
+                configuration),
+            state_generation=state_tracker.insert_latest(state),
+        )
+
+    def _project(self, node_uuid, configuration, state, generation):
+        """
+        Project the configuration and state of the whole cluster for a node.
+
+        :param node_uuid: The ``UUID`` of the node, or ``None`` if it is
+            unknown in which case nothing is projected.
+        :param Deployment configuration: The cluster configuration.
+        :param DeploymentState state: The cluster state.
+        :param _ConfigAndStateGeneration generation: The generations of
+            ``configuration`` and ``state``.
+
+        :return: A tuple of the projected configuration, the projected state
+            and their ``_ConfigAndStateGeneration``.
+        """
+        if node_uuid is None:
+            return configuration, state, generation
+        key = (node_uuid,
+               generation.config_generation, generation.state_generation)
+        projection = self._projections.get(key)
+        if projection is None:
+            projected_configuration, projected_state = project_for_node(
+                node_uuid, configuration, state)
+            projection = (
+                projected_configuration, projected_state,
+                self._insert_generation(
+                    node_uuid, projected_configuration, projected_state),
+            )
+            self._projections.put(key, projection)
+        return projection
+
     def _send_state_to_connections(self, connections):
         """
         Send desired configuration and cluster state to all given connections.
 
         :param connections: A collection of ``AMP`` instances.
         """
-        configuration = self.configuration_service.get()
+        # Agents only act on configuration that is on disk, so that changes
+        # whose write fails are never converged:
+        configuration = self.configuration_service.written_configuration()
         state = self.cluster_state.as_deployment()
+        generation = self._insert_cluster_generation(configuration, state)
 
         # Connections are separated into three groups to support a scheme which
         # lets us avoid sending certain updates which we know are not
@@ -575,7 +1276,8 @@ class ControlAMPService(Service):
         # brainstorming.
 
         # Collect connections for which there is currently no unacknowledged
-        # update.  These can receive a new update right away.
+        # update and whose transport accepts more data.  These can receive a
+        # new update right away.
         can_update = []
 
         # Collect connections for which there is an unacknowledged update.
@@ -583,6 +1285,11 @@ class ControlAMPService(Service):
         # that acknowledgement is received.
         delayed_update = []
 
+        # Collect connections whose transport has paused its producer because
+        # its write buffer is full.  These should receive another update once
+        # it resumes, rather than growing the buffer further.
+        paused_update = []
+
         # Collect connections which were already set to receive a delayed
         # update and still haven't sent an acknowledgement.  These will still
         # receive a delayed update but we'll also note that we're going to skip
@@ -590,32 +1297,30 @@ class ControlAMPService(Service):
         elided_update = []
 
         for connection in connections:
-            try:
-                update = self._current_command[connection]
-            except KeyError:
-                # There's nothing in the tracking state for this connection.
-                # That means there's no unacknowledged update.  That means we
-                # can send another update right away.
-                can_update.append(connection)
-            else:
+            queue = self._send_queues.setdefault(connection, _SendQueue())
+            if queue.pending:
+                # These connections are already scheduled to receive another
+                # update.  That update will include the most up-to-date
+                # information so we're effectively skipping an update that's
+                # no longer useful.
+                elided_update.append(connection)
+            elif queue.response is not None:
                 # These connections do currently have an unacknowledged update
-                # outstanding.
-                if update.next_scheduled:
-                    # And these connections are also already scheduled to
-                    # receive another update after the one they're currently
-                    # processing.  That update will include the most up-to-date
-                    # information so we're effectively skipping an update
-                    # that's no longer useful.
-                    elided_update.append(connection)
-                else:
-                    # These don't have another update scheduled yet so we'll
-                    # schedule one.
-                    delayed_update.append(connection)
+                # outstanding, so we'll schedule another one.
+                delayed_update.append(connection)
+            elif getattr(connection, "paused", False):
+                paused_update.append(connection)
+            else:
+                # There's no unacknowledged update.  That means we can send
+                # another update right away.
+                can_update.append(connection)
 
         # Make sure to run the logging action inside the caching block.
         # This lets encoding for logging share the cache with encoding for
         # network traffic.
-        with LOG_SEND_CLUSTER_STATE() as action:
+        with LOG_SEND_CLUSTER_STATE(
+                configuration_generation=generation.config_generation,
+                state_generation=generation.state_generation) as action:
             if can_update:
                 # If there are any protocols that can be updated right now,
                 # we also want to see what updates they receive.  Since
@@ -633,63 +1338,158 @@ class ControlAMPService(Service):
                 action.add_success_fields(configuration=None, state=None)
 
             for connection in can_update:
-                self._update_connection(connection, configuration, state)
+                self._update_connection(
+                    connection, configuration, state, generation)
 
             for connection in elided_update:
                 AGENT_UPDATE_ELIDED(agent=connection).write()
+                self._send_queues[connection].dropped += 1
 
             for connection in delayed_update:
-                self._delayed_update_connection(connection)
+                AGENT_UPDATE_DELAYED(agent=connection).write()
+                self._send_queues[connection].pending = True
+
+            for connection in paused_update:
+                AGENT_UPDATE_PAUSED(agent=connection).write()
+                self._send_queues[connection].pending = True
+
+            action.add_success_fields(**encode_cache_statistics())
+
+    def _command_for_connection(self, connection, configuration, state,
+                                generation):
+        """
+        Choose the command and arguments to update an agent with.
 
-    def _update_connection(self, connection, configuration, state):
+        If the agent has acknowledged generations which are still known a
+        ``ClusterStatusDiffCommand`` is used, otherwise a full
+        ``ClusterStatusCommand``.
+
+        :param ControlAMP connection: The connection the command will be
+            sent on.
+        :param Deployment configuration: The cluster configuration to send.
+        :param DeploymentState state: The current cluster state to send.
+        :param _ConfigAndStateGeneration generation: The generations of
+            ``configuration`` and ``state``.
+
+        :return: A tuple of the ``Command`` subclass and a ``dict`` of its
+            arguments (excluding ``eliot_context``).
         """
-        Send a ``ClusterStatusCommand`` to an agent.
+        last_received = self._last_received_generation.get(connection)
+        if (last_received is not None and
+                last_received.node_uuid == generation.node_uuid):
+            configuration_tracker, state_tracker = (
+                self._generation_trackers[generation.node_uuid])
+            configuration_diff = (
+                configuration_tracker.get_diff_from_generation(
+                    last_received.config_generation))
+            state_diff = state_tracker.get_diff_from_generation(
+                last_received.state_generation)
+            if configuration_diff is not None and state_diff is not None:
+                return ClusterStatusDiffCommand, dict(
+                    configuration_diff=configuration_diff,
+                    start_configuration_generation=(
+                        last_received.config_generation),
+                    end_configuration_generation=generation.config_generation,
+                    state_diff=state_diff,
+                    start_state_generation=last_received.state_generation,
+                    end_state_generation=generation.state_generation,
+                )
+        return ClusterStatusCommand, dict(
+            configuration=configuration,
+            configuration_generation=generation.config_generation,
+            state=state,
+            state_generation=generation.state_generation,
+        )
+
+    def _update_connection(self, connection, configuration, state,
+                           generation):
+        """
+        Send a ``ClusterStatusCommand`` or ``ClusterStatusDiffCommand`` to an
+        agent.
+
+        If the connection has identified its node only the projection of the
+        configuration and state for that node is sent.
 
         :param ControlAMP connection: The connection to use to send the
             command.
 
         :param Deployment configuration: The cluster configuration to send.
         :param DeploymentState state: The current cluster state to send.
+        :param _ConfigAndStateGeneration generation: The generations of
+            ``configuration`` and ``state``.
         """
+        # Connections which can't identify their node (such as some test
+        # fakes) get the whole cluster.
+        configuration, state, generation = self._project(
+            getattr(connection, "node_uuid", None),
+            configuration, state, generation,
+        )
+        command, arguments = self._command_for_connection(
+            connection, configuration, state, generation)
+
+        def acknowledged(ignored):
+            self._last_received_generation[connection] = generation
+            return False
+
+        def failed(reason):
+            # Whatever went wrong, we no longer know what the agent has so
+            # the next update must be complete.  If it was a diff that failed
+            # the agent is now behind, so a full update should follow right
+            # away.
+            self._last_received_generation.pop(connection, None)
+            return command is ClusterStatusDiffCommand
+
         action = LOG_SEND_TO_AGENT(agent=connection)
         with action.context():
             # Use ``maybeDeferred`` so if an exception happens,
             # it will be wrapped in a ``Failure`` - see FLOC-3221
             d = DeferredContext(maybeDeferred(
                 connection.callRemote,
-                ClusterStatusCommand,
-                configuration=configuration,
-                state=state,
-                eliot_context=action
+                command,
+                eliot_context=action,
+                **arguments
             ))
             d.addActionFinish()
-            d.result.addErrback(lambda _: None)
+            d.result.addCallbacks(acknowledged, failed)
 
-        update = self._current_command[connection] = _UpdateState(
-            response=d.result,
-            next_scheduled=False,
-        )
+        queue = self._send_queues[connection]
+        queue.response = d.result
 
-        def finished_update(ignored):
-            del self._current_command[connection]
-        update.response.addCallback(finished_update)
+        def finished_update(retry):
+            queue.response = None
+            if retry:
+                queue.pending = True
+            self._send_pending(connection)
+        queue.response.addCallback(finished_update)
 
-    def _delayed_update_connection(self, connection):
+    def _send_pending(self, connection):
         """
-        Send a ``ClusterStatusCommand`` to an agent after it has acknowledged
-        the last one.
+        Send the pending update to an agent, if there is one and nothing
+        stands in its way.
 
-        :param ControlAMP connection: The connection to use to send the
-            command.  This connection is expected to have previously been sent
-            such a command and to not yet have acknowledged it.  Internal state
-            related to this will be used and then updated.
-        """
-        AGENT_UPDATE_DELAYED(agent=connection).write()
-        update = self._current_command[connection]
-        update.response.addCallback(
-            lambda ignored: self._send_state_to_connections([connection]),
+        :param ControlAMP connection: The connection to the agent.
+        """
+        queue = self._send_queues.get(connection)
+        if (queue is None or not queue.pending or
+                queue.response is not None or
+                getattr(connection, "paused", False)):
+            return
+        queue.pending = False
+        self._send_state_to_connections([connection])
+
+    def send_queue_status(self, connection):
+        """
+        :param ControlAMP connection: A connection to an agent.
+
+        :return: The ``SendQueueStatus`` of the updates to the agent.
+        """
+        queue = self._send_queues.get(connection, _SendQueue())
+        return SendQueueStatus(
+            depth=queue.depth,
+            bytes_in_flight=getattr(connection, "bytes_in_flight", 0),
+            dropped=queue.dropped,
+            paused=getattr(connection, "paused", False),
         )
-        self._current_command[connection] = update.set(next_scheduled=True)
 
     def connected(self, connection):
         """
@@ -708,6 +1508,36 @@ class ControlAMPService(Service):
         :param ControlAMP connection: The lost connection.
         """
         self.connections.remove(connection)
+        self._last_received_generation.pop(connection, None)
+        self._send_queues.pop(connection, None)
+        node_uuid = getattr(connection, "node_uuid", None)
+        if node_uuid is not None and not any(
+                getattr(other, "node_uuid", None) == node_uuid
+                for other in self.connections):
+            self._forget_node(node_uuid)
+
+    def _forget_node(self, node_uuid):
+        """
+        Drop what is remembered to update a node no agent is connected from,
+        so that nodes which are gone for good don't hold on to memory.
+
+        A later connection from the node starts with a full update, as any
+        new connection does.
+
+        :param UUID node_uuid: The node.
+        """
+        if self._generation_trackers.pop(node_uuid, None) is not None:
+            # Cached projections refer to the dropped trackers' generations,
+            # which new trackers would assign again to different objects:
+            self._projections.clear()
+
+    def resumed(self, connection):
+        """
+        A connection's transport can accept more data again.
+
+        :param ControlAMP connection: The connection.
+        """
+        self._send_pending(connection)
 
     def node_changed(self, source, state_changes):
         """
@@ -719,7 +1549,7 @@ class ControlAMPService(Service):
             providers representing the state change which has taken place.
         """
         self.cluster_state.apply_changes_from_source(source, state_changes)
-        self._send_state_to_connections(self.connections)
+        self.broadcast_scheduler.request()
 
 
 class IConvergenceAgent(Interface):
@@ -758,6 +1588,17 @@ class IConvergenceAgent(Interface):
 class _AgentLocator(CommandLocator):
     """
     Command locator for convergence agent.
+
+    :ivar Deployment _configuration: The last configuration received, or
+        ``None``.
+    :ivar _configuration_generation: The generation of ``_configuration``, or
+        ``None`` if unknown.
+    :ivar DeploymentState _state: The last cluster state received, or
+        ``None``.
+    :ivar _state_generation: The generation of ``_state``, or ``None`` if
+        unknown.
+    :ivar frozenset capabilities: The optional protocol features agreed with
+        the control service.
     """
     def __init__(self, agent, timeout):
         """
@@ -768,6 +1609,11 @@ class _AgentLocator(CommandLocator):
         CommandLocator.__init__(self)
         self.agent = agent
         self._timeout = timeout
+        self._configuration = None
+        self._configuration_generation = None
+        self._state = None
+        self._state_generation = None
+        self.capabilities = frozenset()
 
     def locateResponder(self, name):
         """
@@ -791,11 +1637,45 @@ class _AgentLocator(CommandLocator):
         return self.agent.logger
 
     @ClusterStatusCommand.responder
-    def cluster_updated(self, eliot_context, configuration, state):
+    def cluster_updated(self, eliot_context, configuration, state,
+                        configuration_generation=None, state_generation=None):
         with eliot_context:
+            self._configuration = configuration
+            self._configuration_generation = configuration_generation
+            self._state = state
+            self._state_generation = state_generation
             self.agent.cluster_updated(configuration, state)
             return {}
 
+    @ClusterStatusDiffCommand.responder
+    def cluster_updated_diff(self, eliot_context,
+                             configuration_diff,
+                             start_configuration_generation,
+                             end_configuration_generation,
+                             state_diff,
+                             start_state_generation,
+                             end_state_generation):
+        with eliot_context:
+            if (start_configuration_generation !=
+                    self._configuration_generation or
+                    start_state_generation != self._state_generation):
+                raise GenerationMismatch(
+                    "Have configuration generation {} and state generation "
+                    "{}, diff starts at {} and {}.".format(
+                        self._configuration_generation,
+                        self._state_generation,
+                        start_configuration_generation,
+                        start_state_generation,
+                    )
+                )
+            self._configuration = configuration_diff.apply(
+                self._configuration)
+            self._configuration_generation = end_configuration_generation
+            self._state = state_diff.apply(self._state)
+            self._state_generation = end_state_generation
+            self.agent.cluster_updated(self._configuration, self._state)
+            return {}
+
 
 class AgentAMP(AMP):
     """
@@ -817,8 +1697,33 @@ class AgentAMP(AMP):
         self.agent = agent
         self._pinger = Pinger(reactor)
 
+    @property
+    def capabilities(self):
+        """
+        The optional protocol features agreed with the control service.
+        """
+        return self.locator.capabilities
+
+    def _negotiate_capabilities(self):
+        """
+        Tell the control service which optional protocol features we support
+        and use those it supports too.
+        """
+        d = self.callRemote(
+            CapabilitiesCommand, capabilities=sorted(SUPPORTED_CAPABILITIES))
+
+        def negotiated(response):
+            self.locator.capabilities = SUPPORTED_CAPABILITIES.intersection(
+                response["capabilities"])
+        d.addCallback(negotiated)
+        # Older control services don't know about capabilities; without any
+        # we carry on as before.
+        d.addErrback(lambda reason: reason.trap(UnhandledCommand))
+        d.addErrback(writeFailure, self.agent.logger)
+
     def connectionMade(self):
         AMP.connectionMade(self)
+        self._negotiate_capabilities()
         self.agent.connected(self)
         self._pinger.start(self, PING_INTERVAL)
 
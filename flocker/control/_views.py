@@ -0,0 +1,236 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_views -*-
+
+"""
+Responses of the HTTP API kept in memory between requests.
+
+The listings of datasets and containers are built from every node of the
+configuration or cluster state, and a change typically replaces only one
+node.  Unchanged nodes are still the same objects, so a view remembers the
+items each node contributed, and their JSON encoding, and only recomputes
+those of nodes which were replaced.
+
+A ``ListQuery`` then selects the items a request asks for from such a view,
+and a ``MetadataIndex`` finds datasets by metadata without a scan.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_right
+from json import dumps, loads
+
+from pyrsistent import PClass, field, pvector_field
+
+from ..restapi import SerializedResult
+
+
+class NodeListView(object):
+    """
+    A JSON array made up of items derived from each node of a ``Deployment``
+    or ``DeploymentState``, followed by items derived from the rest of it.
+
+    :ivar _node_items: One-argument callable returning the ``list`` of items
+        for a node.
+    :ivar _other_items: One-argument callable returning the ``list`` of
+        items for the whole ``Deployment`` or ``DeploymentState`` that come
+        after those of its nodes.
+    :ivar _key: The key of the current result.
+    :ivar dict _nodes: Map the UUID of each node to a tuple of the node, its
+        items and their JSON encoding without the enclosing brackets.
+    :ivar SerializedResult _result: The current result.
+    """
+    def __init__(self, node_items, other_items=lambda model: []):
+        self._node_items = node_items
+        self._other_items = other_items
+        self._key = None
+        self._nodes = {}
+        self._result = None
+
+    def get(self, key, model):
+        """
+        :param key: Identifies ``model``; a different key is given for every
+            different model.
+        :param model: The ``Deployment`` or ``DeploymentState``.
+
+        :return: A ``SerializedResult`` of the ``list`` of items.  It must not
+            be mutated.
+        """
+        if self._result is not None and key == self._key:
+            return self._result
+        nodes = {}
+        result = []
+        fragments = []
+        for node in model.nodes:
+            cached = self._nodes.get(node.uuid)
+            if cached is None or cached[0] is not node:
+                items = self._node_items(node)
+                cached = (node, items, dumps(items)[1:-1])
+            nodes[node.uuid] = cached
+            result.extend(cached[1])
+            if cached[1]:
+                fragments.append(cached[2])
+        other = self._other_items(model)
+        result.extend(other)
+        if other:
+            fragments.append(dumps(other)[1:-1])
+        self._nodes = nodes
+        self._key = key
+        self._result = SerializedResult(
+            result, b"[" + b", ".join(fragments) + b"]")
+        return self._result
+
+
+def encode_cursor(key):
+    """
+    :param list key: The sort key of the last item of a page.
+
+    :return: The cursor for the next page, as ``unicode``.
+    """
+    return urlsafe_b64encode(dumps(key)).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    :param unicode cursor: A cursor returned by ``encode_cursor``.
+
+    :raise ValueError: If ``cursor`` wasn't returned by ``encode_cursor``.
+
+    :return: The sort key encoded in the cursor.
+    """
+    try:
+        key = loads(urlsafe_b64decode(cursor.encode("ascii")))
+    except (TypeError, UnicodeError):
+        raise ValueError(cursor)
+    if not isinstance(key, list):
+        raise ValueError(cursor)
+    return key
+
+
+class ListQuery(PClass):
+    """
+    Which items of a listing to return.
+
+    :ivar predicates: One-argument callables, all of which an item must
+        satisfy to be listed.
+    :ivar sort_key: One-argument callable returning the ``list`` by which
+        items are ordered when paging through them.
+    :ivar limit: The largest number of items to return, or ``None`` for no
+        limit.
+    :ivar cursor: The sort key of the last item of the previous page, or
+        ``None`` for the first page.
+    """
+    predicates = pvector_field(object)
+    sort_key = field(mandatory=True)
+    limit = field(type=(int, type(None)), initial=None)
+    cursor = field(type=(list, type(None)), initial=None)
+
+    def select(self, result):
+        """
+        :param SerializedResult result: The whole listing, as returned by
+            ``NodeListView.get``.
+
+        :return: A tuple of the selected items, as ``result`` itself if
+            nothing was left out or a ``list`` otherwise, and the cursor for
+            the next page or ``None`` if there are no more items.
+        """
+        paged = self.limit is not None or self.cursor is not None
+        if not paged and not self.predicates:
+            return result, None
+        items = [item for item in result.result
+                 if all(predicate(item) for predicate in self.predicates)]
+        if not paged:
+            return items, None
+        items.sort(key=self.sort_key)
+        keys = [self.sort_key(item) for item in items]
+        start = 0 if self.cursor is None else bisect_right(keys, self.cursor)
+        end = len(items) if self.limit is None else start + self.limit
+        next_cursor = None
+        if end < len(items):
+            next_cursor = encode_cursor(keys[end - 1])
+        return items[start:end], next_cursor
+
+
+class MetadataIndex(object):
+    """
+    The datasets of a ``Deployment`` which haven't been deleted, indexed by
+    the values of some of their metadata keys.
+
+    Like ``NodeListView`` it only updates the entries of nodes which were
+    added, replaced or removed.
+
+    :ivar frozenset keys: The indexed metadata keys.
+    :ivar _node_items: One-argument callable returning the ``list`` of
+        datasets, as API ``dict`` instances, configured on a node.
+    :ivar _key: The key of the current index.
+    :ivar dict _nodes: Map the UUID of each node to a tuple of the node and
+        the ``dict`` of its entries, mapping metadata key and value to the
+        ``list`` of its datasets with them.
+    :ivar dict _index: Map tuples of metadata key and value to a ``dict``
+        mapping the UUIDs of nodes to their datasets with that value.
+    """
+    def __init__(self, keys, node_items):
+        self.keys = frozenset(keys)
+        self._node_items = node_items
+        self._key = None
+        self._nodes = {}
+        self._index = {}
+
+    def _node_entries(self, node):
+        """
+        :return: The ``dict`` of entries for the datasets of ``node``.
+        """
+        entries = {}
+        for item in self._node_items(node):
+            if item[u"deleted"]:
+                continue
+            for key, value in item[u"metadata"].items():
+                if key in self.keys:
+                    entries.setdefault((key, value), []).append(item)
+        return entries
+
+    def _remove(self, node_uuid):
+        """
+        Remove the entries of a node from the index.
+        """
+        for entry in self._nodes.pop(node_uuid)[1]:
+            datasets = self._index[entry]
+            del datasets[node_uuid]
+            if not datasets:
+                del self._index[entry]
+
+    def _update(self, deployment):
+        """
+        Bring the index up to date with a deployment.
+        """
+        current = set()
+        for node in deployment.nodes:
+            current.add(node.uuid)
+            cached = self._nodes.get(node.uuid)
+            if cached is not None and cached[0] is node:
+                continue
+            if cached is not None:
+                self._remove(node.uuid)
+            entries = self._node_entries(node)
+            self._nodes[node.uuid] = (node, entries)
+            for entry, items in entries.items():
+                self._index.setdefault(entry, {})[node.uuid] = items
+        for node_uuid in set(self._nodes) - current:
+            self._remove(node_uuid)
+
+    def get(self, key, deployment, metadata_key, value):
+        """
+        :param key: Identifies ``deployment``; a different key is given for
+            every different deployment.
+        :param Deployment deployment: The configuration.
+        :param unicode metadata_key: An indexed metadata key.
+        :param unicode value: The value to look up.
+
+        :return: A ``list`` of the datasets with ``value`` for
+            ``metadata_key``.
+        """
+        if key != self._key:
+            self._update(deployment)
+            self._key = key
+        result = []
+        for items in self._index.get((metadata_key, value), {}).values():
+            result.extend(items)
+        return result
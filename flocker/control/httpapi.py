@@ -19,20 +19,23 @@ from twisted.protocols.tls import TLSMemoryBIOFactory
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
     CONFLICT, CREATED, NOT_FOUND, OK, NOT_ALLOWED as METHOD_NOT_ALLOWED,
-    BAD_REQUEST, PRECONDITION_FAILED,
+    BAD_REQUEST, PRECONDITION_FAILED, NOT_MODIFIED,
 )
 from twisted.web.server import Site
 from twisted.web.resource import Resource
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.task import LoopingCall
 
 from klein import Klein
 
 from pyrsistent import discard
 
+from ..common import timeout
 from ..restapi import (
     EndpointResponse, structured, user_documentation, make_bad_request,
-    private_api
+    private_api, BadRequest,
 )
 from . import (
     Dataset, Manifestation, Application, DockerImage, Port,
@@ -44,6 +47,10 @@ from ._config import (
     ConfigurationError
 )
 from ._persistence import update_leases
+from ._views import NodeListView, ListQuery, MetadataIndex, decode_cursor
+from ._events import (
+    EventLog, dataset_configuration_events, lease_events, node_state_events,
+)
 from ._model import LeaseError
 
 from .. import __version__, REST_API_PORT as _port
@@ -92,10 +99,32 @@ LEASE_HELD = make_bad_request(
     code=CONFLICT, description=u"Lease already held.")
 NODE_BY_ERA_NOT_FOUND = make_bad_request(
     code=NOT_FOUND, description=u"No node found with given era.")
+INVALID_CURSOR = make_bad_request(
+    description=u"The provided cursor is not valid.")
+METADATA_KEY_NOT_INDEXED = make_bad_request(
+    code=NOT_FOUND, description=u"The metadata key is not indexed.")
+DATASET_METADATA_COLLISION = make_bad_request(
+    code=CONFLICT,
+    description=u"A dataset with the given metadata value already exists.")
+
+# Metadata keys whose values datasets can be looked up by, and kept unique
+# on:
+INDEXED_METADATA_KEYS = frozenset([u"name"])
 
 _UNDEFINED_MAXIMUM_SIZE = object()
 
 IF_MATCHES_HEADER = b"X-If-Configuration-Matches"
+NEXT_CURSOR_HEADER = b"X-Next-Cursor"
+GENERATION_HEADER = b"X-Generation"
+
+# How long a request with a wait_for_generation query parameter waits for a
+# change before getting the unchanged response, in seconds.  It is kept well
+# below the idle timeouts of typical HTTP clients and proxies:
+WAIT_FOR_GENERATION_TIMEOUT = 30
+
+# How often something is sent on an idle event stream, in seconds, so that
+# proxies don't close it:
+EVENTS_KEEPALIVE_INTERVAL = 15
 
 
 def get_configuration_tag(api):
@@ -134,6 +163,291 @@ def _if_configuration_matches(original):
     return render_if_matches
 
 
+def get_state_tag(api):
+    """
+    Return tag value for the cluster state.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: Tag as ``bytes``.
+    """
+    # Generations start again when the control service restarts, so they are
+    # qualified by an identifier of this API instance:
+    return b"%s-%d" % (
+        api.state_tag_prefix, api.cluster_state_service.state_generation())
+
+
+def _get_leases_tag(api):
+    """
+    Return tag value for the lease listing.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: Tag as ``bytes``, or ``None`` if the listing includes the time
+        left on expiring leases and so changes as time passes.
+    """
+    leases = api.persistence_service.get().leases
+    if any(lease.expiration is not None for lease in leases.values()):
+        return None
+    return get_configuration_tag(api)
+
+
+def _if_none_match(get_tag):
+    """
+    Decorator for ``GET`` endpoints whose responses only change when a tag
+    does, which adds an ``ETag`` header derived from the tag and responds
+    with ``304 Not Modified`` if it matches an ``If-None-Match`` header.
+
+    :param get_tag: One-argument callable taking the API instance and
+        returning the current tag as ``bytes``, or ``None`` if the response
+        can't be tagged.
+    :return: Decorator.
+    """
+    def decorator(original):
+        @wraps(original)
+        def render_if_none_match(self, request, **route_arguments):
+            tag = get_tag(self)
+            if tag is None:
+                return original(self, request, **route_arguments)
+            etag = b'"%s"' % (tag,)
+            request.responseHeaders.setRawHeaders(b"ETag", [etag])
+            if_none_match = set(
+                value.strip() for header in
+                request.requestHeaders.getRawHeaders(b"If-None-Match", [])
+                for value in header.split(b","))
+            if etag in if_none_match or b"W/" + etag in if_none_match or (
+                    b"*" in if_none_match):
+                request.setResponseCode(NOT_MODIFIED)
+                return b""
+            return original(self, request, **route_arguments)
+        return render_if_none_match
+    return decorator
+
+
+class _WaitTimedOut(Exception):
+    """
+    No change happened while waiting for the generation to change.
+    """
+
+
+def _configuration_generation(api):
+    """
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: The generation of the configuration.
+    """
+    return api.persistence_service.configuration_generation()
+
+
+def _wait_for_configuration_change(api, generation):
+    """
+    :param ConfigurationAPIUserV1 api: API instance.
+    :param int generation: A generation of the configuration.
+    :return: ``Deferred`` firing once the configuration has a different
+        generation.
+    """
+    return api.persistence_service.wait_for_configuration_change(generation)
+
+
+def _state_generation(api):
+    """
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: The generation of the cluster state.
+    """
+    return api.cluster_state_service.state_generation()
+
+
+def _wait_for_state_change(api, generation):
+    """
+    :param ConfigurationAPIUserV1 api: API instance.
+    :param int generation: A generation of the cluster state.
+    :return: ``Deferred`` firing once the cluster state has a different
+        generation.
+    """
+    return api.cluster_state_service.wait_for_state_change(generation)
+
+
+def _wait_for_generation(get_generation, wait_for_change):
+    """
+    Decorator for ``GET`` endpoints whose responses only change along with
+    the configuration or cluster state, which adds an ``X-Generation`` header
+    with its generation and supports long polling: given a
+    ``wait_for_generation`` query parameter equal to the current generation
+    the response is delayed until the generation changes, or until
+    ``WAIT_FOR_GENERATION_TIMEOUT`` passes.
+
+    Any other generation, such as one from before the control service
+    restarted, gets a response straight away.
+
+    :param get_generation: One-argument callable taking the API instance and
+        returning the current generation.
+    :param wait_for_change: Two-argument callable taking the API instance
+        and a generation and returning a cancellable ``Deferred`` that fires
+        once the current generation is a different one.
+    :return: Decorator.
+    """
+    def decorator(original):
+        @wraps(original)
+        def render_when_changed(self, request, **route_arguments):
+            def render(_=None):
+                request.responseHeaders.setRawHeaders(
+                    GENERATION_HEADER, [b"%d" % (get_generation(self),)])
+                return original(self, request, **route_arguments)
+            try:
+                generation = int(request.args[b"wait_for_generation"][-1])
+            except (KeyError, ValueError):
+                # Missing, or invalid and so rejected by the query schema:
+                return render()
+            waiting = wait_for_change(self, generation)
+            # A client disconnecting cancels the wait with CancelledError
+            # instead:
+            timeout(self.clock, waiting, WAIT_FOR_GENERATION_TIMEOUT,
+                    _WaitTimedOut())
+            waiting.addErrback(lambda failure: failure.trap(_WaitTimedOut))
+            waiting.addCallback(render)
+            return waiting
+        return render_when_changed
+    return decorator
+
+
+def _sse_event(cursor, event_type, data):
+    """
+    :return: An event encoded for a ``text/event-stream`` response.
+    """
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (
+        cursor.encode("ascii"), event_type.encode("ascii"), dumps(data))
+
+
+def _json_line_event(cursor, event_type, data):
+    """
+    :return: An event encoded as a line of JSON.
+    """
+    return dumps(
+        {u"cursor": cursor, u"type": event_type, u"data": data}) + b"\n"
+
+
+def _uuid_filter(name):
+    """
+    :param unicode name: A field of the items of a listing which holds a
+        UUID.
+
+    :return: A function taking the value of a query parameter and returning
+        a predicate selecting the items whose field has that value.
+    """
+    def filter_for(value):
+        value = value.lower()
+        return lambda item: item.get(name, u"").lower() == value
+    return filter_for
+
+
+def _volume_filter(value):
+    """
+    :param unicode value: A dataset identifier.
+
+    :return: A predicate selecting the containers using that dataset.
+    """
+    value = value.lower()
+    return lambda item: any(
+        volume[u"dataset_id"].lower() == value
+        for volume in item.get(u"volumes", []))
+
+
+def _deleted_filter(value):
+    """
+    :param unicode value: ``u"true"`` or ``u"false"``.
+
+    :return: A predicate selecting the datasets which have or haven't been
+        deleted.
+    """
+    deleted = value == u"true"
+    return lambda item: item[u"deleted"] == deleted
+
+
+def _metadata_filter(key, value):
+    """
+    :return: A predicate selecting the datasets with the given value for a
+        metadata key.
+    """
+    return lambda item: item[u"metadata"].get(key) == value
+
+
+_METADATA_PARAMETER_PREFIX = u"metadata."
+
+_DATASET_CONFIGURATION_FILTERS = {
+    u"node_uuid": _uuid_filter(u"primary"),
+    u"dataset_id": _uuid_filter(u"dataset_id"),
+    u"deleted": _deleted_filter,
+}
+
+_DATASET_STATE_FILTERS = {
+    u"node_uuid": _uuid_filter(u"primary"),
+    u"dataset_id": _uuid_filter(u"dataset_id"),
+}
+
+_CONTAINER_FILTERS = {
+    u"node_uuid": _uuid_filter(u"node_uuid"),
+    u"dataset_id": _volume_filter,
+}
+
+
+def _dataset_sort_key(item):
+    """
+    :return: The key by which datasets are ordered when paging.
+    """
+    return [item[u"dataset_id"], item.get(u"primary", u"")]
+
+
+def _container_sort_key(item):
+    """
+    :return: The key by which containers are ordered when paging.
+    """
+    return [item[u"name"], item[u"node_uuid"]]
+
+
+def _list_query(query, filters, sort_key):
+    """
+    Interpret the query parameters of a request to a listing endpoint.
+
+    :param dict query: The query parameters, which have been validated
+        against the endpoint's query schema.
+    :param dict filters: Map the names of parameters to functions taking a
+        parameter's value and returning a predicate for the items to list.
+        Parameters naming metadata keys are understood as well.
+    :param sort_key: The key by which items are ordered when paging.
+
+    :return: A ``ListQuery``.
+    """
+    predicates = []
+    for name, value in query.items():
+        if name.startswith(_METADATA_PARAMETER_PREFIX):
+            predicates.append(_metadata_filter(
+                name[len(_METADATA_PARAMETER_PREFIX):], value))
+        elif name in filters:
+            predicates.append(filters[name](value))
+    limit = query.get(u"limit")
+    if limit is not None:
+        limit = int(limit)
+    cursor = query.get(u"cursor")
+    if cursor is not None:
+        try:
+            cursor = decode_cursor(cursor)
+        except ValueError:
+            raise INVALID_CURSOR
+    return ListQuery(
+        predicates=predicates, sort_key=sort_key, limit=limit, cursor=cursor)
+
+
+def _list_response(listing, query, headers=pmap()):
+    """
+    :param SerializedResult listing: The whole listing.
+    :param ListQuery query: The items to select from it.
+    :param headers: Mapping of additional headers to send.
+
+    :return: An ``EndpointResponse`` with the selected items.
+    """
+    result, next_cursor = query.select(listing)
+    if next_cursor is not None:
+        headers = headers.set(NEXT_CURSOR_HEADER, next_cursor.encode("ascii"))
+    return EndpointResponse(OK, result, headers=headers)
+
+
 class ConfigurationAPIUserV1(object):
     """
     A user accessing the API.
@@ -141,6 +455,15 @@ class ConfigurationAPIUserV1(object):
     The APIs exposed here typically operate on cluster configuration.  They
     frequently return success results when a configuration change has been made
     durable but has not yet been deployed onto the cluster.
+
+    ``GET`` endpoints tag their responses with an ``ETag`` header and answer
+    ``If-None-Match`` requests for an unchanged configuration or cluster
+    state with ``304 Not Modified``.  Those listing datasets, containers and
+    nodes also give the generation of what they list in an ``X-Generation``
+    header, and can be asked to wait for it to change.
+
+    :ivar bytes state_tag_prefix: Distinguishes the tags of cluster state
+        seen through this instance from those of other instances.
     """
     app = Klein()
 
@@ -159,6 +482,42 @@ class ConfigurationAPIUserV1(object):
         self.persistence_service = persistence_service
         self.cluster_state_service = cluster_state_service
         self.clock = clock
+        self.state_tag_prefix = uuid4().hex.encode("ascii")
+        self._dataset_configuration = NodeListView(
+            _node_dataset_configuration)
+        self._container_configuration = NodeListView(
+            _node_container_configuration)
+        self._dataset_state = NodeListView(
+            _node_dataset_state, _nonmanifest_dataset_state)
+        self._container_state = NodeListView(_node_container_state)
+        self._metadata_index = MetadataIndex(
+            INDEXED_METADATA_KEYS, _node_dataset_configuration)
+        self.events = EventLog()
+        persistence_service.register(
+            self._configuration_changed, with_configurations=True)
+        cluster_state_service.register(self._state_changed)
+
+    def _configuration_changed(self, previous, written):
+        """
+        Record the events of a configuration change.
+
+        :param Deployment previous: The configuration before the change.
+        :param Deployment written: The configuration after it.
+        """
+        self.events.append(
+            dataset_configuration_events(
+                previous, written, _node_dataset_configuration) +
+            lease_events(previous.leases, written.leases))
+
+    def _state_changed(self, previous, state, expired):
+        """
+        Record the events of a cluster state change.
+
+        :param DeploymentState previous: The state before the change.
+        :param DeploymentState state: The state after it.
+        :param bool expired: Whether the change wiped expired information.
+        """
+        self.events.append(node_state_events(previous, state, expired))
 
     @app.route("/version", methods=['GET'])
     @user_documentation(
@@ -186,30 +545,48 @@ class ConfigurationAPIUserV1(object):
 
         Includes a ``X-Configuration-Tag`` header in the response for use
         with operations that support ``X-If-Configuration-Matches``.
+
+        The datasets listed can be narrowed down, and paged through, with
+        query parameters.
+
+        The ``X-Generation`` response header can be passed back as the
+        ``wait_for_generation`` query parameter to wait for a change.
         """,
         header=u"Get the cluster's dataset configuration",
         examples=[u"get configured datasets"],
         section=u"dataset",
     )
+    @_wait_for_generation(
+        _configuration_generation, _wait_for_configuration_change)
+    @_if_none_match(get_configuration_tag)
     @structured(
         inputSchema={},
         outputSchema={
             '$ref':
             '/v1/endpoints.json#/definitions/configuration_datasets_list',
         },
+        querySchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_query',
+        },
         schema_store=SCHEMAS,
     )
-    def get_dataset_configuration(self):
+    def get_dataset_configuration(self, query):
         """
         Get the configured datasets.
 
+        :param dict query: The query parameters.
+
         :return: A ``list`` of ``dict`` representing each of dataset
             that is configured to exist anywhere on the cluster.
         """
         tag = get_configuration_tag(self)
-        return EndpointResponse(
-            OK, list(datasets_from_deployment(self.persistence_service.get())),
-            headers={b"X-Configuration-Tag": tag})
+        return _list_response(
+            self._dataset_configuration.get(
+                tag, self.persistence_service.get()),
+            _list_query(
+                query, _DATASET_CONFIGURATION_FILTERS, _dataset_sort_key),
+            pmap({b"X-Configuration-Tag": tag}))
 
     @app.route("/configuration/datasets", methods=['POST'])
     @user_documentation(
@@ -269,46 +646,131 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        if dataset_id is None:
-            dataset_id = unicode(uuid4())
-        dataset_id = dataset_id.lower()
+        return self._create_dataset(
+            primary, dataset_id, maximum_size, metadata)
 
-        if metadata is None:
-            metadata = {}
+    def _create_dataset(self, primary, dataset_id, maximum_size, metadata):
+        """
+        Add a dataset to the cluster configuration.
 
-        primary = UUID(hex=primary)
+        The parameters are those of ``create_dataset_configuration``.
 
-        # Use persistence_service to get a Deployment for the cluster
-        # configuration.
-        deployment = self.persistence_service.get()
-        for node in deployment.nodes:
-            for manifestation in node.manifestations.values():
-                if manifestation.dataset.dataset_id == dataset_id:
-                    raise DATASET_ID_COLLISION
-
-        # XXX Check cluster state to determine if the given primary node
-        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
-        # See FLOC-1278
-
-        dataset = Dataset(
-            dataset_id=dataset_id,
-            maximum_size=maximum_size,
-            metadata=pmap(metadata)
-        )
-        manifestation = Manifestation(dataset=dataset, primary=True)
+        :return: A ``Deferred`` firing with the ``EndpointResponse`` for the
+            dataset once the configuration has been saved.
+        """
+        deployment, result = _add_dataset(
+            self.persistence_service.get(), primary, dataset_id,
+            maximum_size, metadata)
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(lambda _: EndpointResponse(CREATED, result))
+        return saving
 
-        primary_node = deployment.get_node(primary)
+    def _datasets_by_metadata(self, metadata_key, metadata_value):
+        """
+        Look up datasets in the metadata index.
 
-        new_node_config = primary_node.transform(
-            ("manifestations", manifestation.dataset_id), manifestation)
-        new_deployment = deployment.update_node(new_node_config)
-        saving = self.persistence_service.save(new_deployment)
+        :param unicode metadata_key: The metadata key.
+        :param unicode metadata_value: The value it must have.
 
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(dataset, primary)
-            return EndpointResponse(CREATED, result)
-        saving.addCallback(saved)
-        return saving
+        :raise METADATA_KEY_NOT_INDEXED: If ``metadata_key`` is not indexed.
+
+        :return: A ``list`` of the datasets, as ``dict`` instances, which
+            haven't been deleted and have that value.
+        """
+        if metadata_key not in INDEXED_METADATA_KEYS:
+            raise METADATA_KEY_NOT_INDEXED
+        return self._metadata_index.get(
+            get_configuration_tag(self), self.persistence_service.get(),
+            metadata_key, metadata_value)
+
+    @app.route(
+        "/configuration/datasets/by_metadata/<metadata_key>/<metadata_value>",
+        methods=['GET'])
+    @user_documentation(
+        u"""
+        Get the configuration of the datasets which have a particular value
+        for a metadata key, without listing all datasets.
+
+        Only the ``name`` metadata key is indexed; other keys get a 404 HTTP
+        response.  Deleted datasets are not included.  Since the value is
+        part of the path it can only contain ASCII characters.
+        """,
+        header=u"Get datasets by metadata",
+        examples=[u"get datasets by metadata"],
+        section=u"dataset",
+    )
+    @_if_none_match(get_configuration_tag)
+    @structured(
+        inputSchema={},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_list',
+        },
+        schema_store=SCHEMAS,
+    )
+    def get_datasets_by_metadata(self, metadata_key, metadata_value):
+        """
+        Get the configured datasets with a metadata value.
+
+        :param unicode metadata_key: An indexed metadata key.
+        :param unicode metadata_value: The value it must have.
+
+        :return: A ``list`` of ``dict`` representing each of the datasets.
+        """
+        return self._datasets_by_metadata(metadata_key, metadata_value)
+
+    @app.route(
+        "/configuration/datasets/by_metadata/<metadata_key>/<metadata_value>",
+        methods=['POST'])
+    @user_documentation(
+        u"""
+        Create a new dataset unless one which hasn't been deleted already has
+        a particular value for a metadata key.
+
+        The check and the creation happen atomically, so of several
+        concurrent requests for the same value only one creates a dataset.
+        The others get a 409 HTTP response.  The metadata key, which must be
+        indexed, is set to the value given in the path.
+        """,
+        header=u"Create new dataset with unique metadata",
+        examples=[
+            u"create dataset with unique metadata",
+            u"create dataset with duplicate metadata",
+        ],
+        section=u"dataset",
+    )
+    @_if_configuration_matches
+    @structured(
+        inputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_create'
+        },
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets'},
+        schema_store=SCHEMAS,
+    )
+    def create_dataset_with_unique_metadata(
+            self, metadata_key, metadata_value, primary, dataset_id=None,
+            maximum_size=None, metadata=None):
+        """
+        Create a new dataset with a metadata value no other dataset has.
+
+        :param unicode metadata_key: An indexed metadata key.
+        :param unicode metadata_value: The value it is given.
+
+        The other parameters are those of ``create_dataset_configuration``.
+
+        :return: A ``dict`` describing the dataset which has been added to the
+            cluster configuration or giving error information if this is not
+            possible.
+        """
+        if self._datasets_by_metadata(metadata_key, metadata_value):
+            raise DATASET_METADATA_COLLISION
+        metadata = dict(metadata or {})
+        metadata[metadata_key] = metadata_value
+        return self._create_dataset(
+            primary, dataset_id, maximum_size, metadata)
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['DELETE'])
     @user_documentation(
@@ -345,26 +807,10 @@ class ConfigurationAPIUserV1(object):
             as deleted in the cluster configuration or giving error
             information if this is not possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # XXX this doesn't handle replicas
-        # https://clusterhq.atlassian.net/browse/FLOC-1240
-        _, origin_node = _find_manifestation_and_node(
-            deployment, dataset_id)
-
-        new_node = origin_node.transform(
-            ("manifestations", dataset_id, "dataset", "deleted"), True)
-        deployment = deployment.update_node(new_node)
-
+        deployment, result = _delete_dataset(
+            self.persistence_service.get(), dataset_id)
         saving = self.persistence_service.save(deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                new_node.manifestations[dataset_id].dataset, new_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
+        saving.addCallback(lambda _: EndpointResponse(OK, result))
         return saving
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['POST'])
@@ -412,37 +858,70 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
+        deployment, result = _move_dataset(
+            self.persistence_service.get(), dataset_id, primary)
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(lambda _: EndpointResponse(OK, result))
+        return saving
 
-        if primary_manifestation.dataset.deleted:
-            raise DATASET_DELETED
+    @app.route("/configuration/datasets/_bulk", methods=['POST'])
+    @user_documentation(
+        u"""
+        Create, move, resize and delete many datasets in one request.
 
-        if primary is not None:
-            deployment = _update_dataset_primary(
-                deployment, dataset_id, UUID(hex=primary)
-            )
+        The operations are applied in order, each to the configuration left
+        by the ones before it, and the resulting configuration is saved
+        once.  An operation that fails, for example because its dataset
+        doesn't exist, leaves the configuration unchanged and the others
+        still apply.  The response lists the result of every operation,
+        with the response code the equivalent single dataset request would
+        have had.
 
-        saving = self.persistence_service.save(deployment)
+        Supports ``X-If-Configuration-Matches`` header in the request to
+        ensure the operations only happen if the configuration hasn't
+        changed.
+        """,
+        header=u"Change many datasets",
+        examples=[u"bulk dataset operations"],
+        section=u"dataset",
+    )
+    @_if_configuration_matches
+    @structured(
+        inputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/'
+            'configuration_datasets_bulk_results'},
+        schema_store=SCHEMAS,
+    )
+    def bulk_datasets(self, operations):
+        """
+        Apply many operations on datasets to the cluster configuration.
 
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
+        :param list operations: ``dict``\ s each with an ``operation`` of
+            ``create``, ``move``, ``resize`` or ``delete`` and the
+            parameters of that operation.
 
-        # Return an API response dictionary containing the dataset with updated
-        # primary address.
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                primary_manifestation.dataset,
-                current_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
+        :return: A ``dict`` with the ``list`` of the results of the
+            operations.
+        """
+        deployment = self.persistence_service.get()
+        results = []
+        for operation in operations:
+            arguments = operation.copy()
+            apply, code = _DATASET_OPERATIONS[arguments.pop(u"operation")]
+            try:
+                deployment, dataset = apply(deployment, **arguments)
+            except BadRequest as e:
+                result = {u"status": e.code}
+                result.update(e.result)
+            else:
+                result = {u"status": code, u"dataset": dataset}
+            results.append(result)
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(lambda _: {u"results": results})
         return saving
 
     @app.route("/state/datasets", methods=['GET'])
@@ -451,79 +930,82 @@ class ConfigurationAPIUserV1(object):
         The result reflects the control service's knowledge, which may be
         out of date or incomplete. E.g. a dataset agent has not connected
         or updated the control service yet.
+
+        The ``X-Generation`` response header can be passed back as the
+        ``wait_for_generation`` query parameter to wait for a change.
         """,
         header=u"Get current cluster datasets",
         examples=[u"get state datasets"],
         section=u"dataset",
     )
+    @_wait_for_generation(
+        _state_generation, _wait_for_state_change)
+    @_if_none_match(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={
             '$ref': '/v1/endpoints.json#/definitions/state_datasets_array'
             },
+        querySchema={
+            '$ref': '/v1/endpoints.json#/definitions/state_datasets_query'
+            },
         schema_store=SCHEMAS
     )
-    def state_datasets(self):
+    def state_datasets(self, query):
         """
         Return all primary manifest datasets and all non-manifest datasets in
         the cluster.
 
+        :param dict query: The query parameters.
+
         :return: A ``list`` containing all datasets in the cluster.
         """
-        # XXX This duplicates code in datasets_from_deployment, but that
-        # function is designed to operate on a Deployment rather than a
-        # DeploymentState instance and the dataset configuration result
-        # includes metadata and deleted flags which should not be part of the
-        # dataset state response.
-        # Refactor. See FLOC-2207.
-        response = []
-        deployment_state = self.cluster_state_service.as_deployment()
-        get_manifestation_path = self.cluster_state_service.manifestation_path
-
-        for dataset, node in deployment_state.all_datasets():
-            response_dataset = dict(
-                dataset_id=dataset.dataset_id,
-            )
-
-            if node is not None:
-                response_dataset[u"primary"] = unicode(node.uuid)
-                response_dataset[u"path"] = get_manifestation_path(
-                    node.uuid,
-                    dataset.dataset_id
-                ).path.decode("utf-8")
-
-            if dataset.maximum_size is not None:
-                response_dataset[u"maximum_size"] = dataset.maximum_size
-
-            response.append(response_dataset)
-        return response
+        return _list_response(
+            self._dataset_state.get(
+                self.cluster_state_service.state_generation(),
+                self.cluster_state_service.as_deployment()),
+            _list_query(query, _DATASET_STATE_FILTERS, _dataset_sort_key))
 
     @app.route("/configuration/containers", methods=['GET'])
     @user_documentation(
         u"""
         These containers may or may not actually exist on the
         cluster.
+
+        The ``X-Generation`` response header can be passed back as the
+        ``wait_for_generation`` query parameter to wait for a change.
         """,
         header=u"Get the cluster's container configuration",
         examples=[u"get configured containers"],
         section=u"container",
     )
+    @_wait_for_generation(
+        _configuration_generation, _wait_for_configuration_change)
+    @_if_none_match(get_configuration_tag)
     @structured(
         inputSchema={},
         outputSchema={
             '$ref':
             '/v1/endpoints.json#/definitions/configuration_containers_array',
         },
+        querySchema={
+            '$ref': '/v1/endpoints.json#/definitions/containers_query',
+        },
         schema_store=SCHEMAS,
     )
-    def get_containers_configuration(self):
+    def get_containers_configuration(self, query):
         """
         Get the configured containers.
 
+        :param dict query: The query parameters.
+
         :return: A ``list`` of ``dict`` representing each of the containers
             that are configured to exist anywhere on the cluster.
         """
-        return list(containers_from_deployment(self.persistence_service.get()))
+        return _list_response(
+            self._container_configuration.get(
+                get_configuration_tag(self), self.persistence_service.get()),
+            _list_query(query, _CONTAINER_FILTERS, _container_sort_key))
 
     @app.route("/state/containers", methods=['GET'])
     @user_documentation(
@@ -531,37 +1013,42 @@ class ConfigurationAPIUserV1(object):
         This reflects the control service's knowledge of the cluster,
         which may be out of date or incomplete, e.g. if a container agent
         has not connected or updated the control service yet.
+
+        The ``X-Generation`` response header can be passed back as the
+        ``wait_for_generation`` query parameter to wait for a change.
         """,
         header=u"Get the cluster's actual containers",
         examples=[u"get actual containers"],
         section=u"container",
     )
+    @_wait_for_generation(
+        _state_generation, _wait_for_state_change)
+    @_if_none_match(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={
             '$ref':
             '/v1/endpoints.json#/definitions/state_containers_array',
         },
+        querySchema={
+            '$ref': '/v1/endpoints.json#/definitions/containers_query',
+        },
         schema_store=SCHEMAS,
     )
-    def get_containers_state(self):
+    def get_containers_state(self, query):
         """
         Get the containers present in the cluster.
 
+        :param dict query: The query parameters.
+
         :return: A ``list`` of ``dict`` representing each of the containers
             that are configured to exist anywhere on the cluster.
         """
-        result = []
-        deployment_state = self.cluster_state_service.as_deployment()
-        for node in deployment_state.nodes:
-            if node.applications is None:
-                continue
-            for application in node.applications:
-                container = container_configuration_response(
-                    application, node.uuid)
-                container[u"running"] = application.running
-                result.append(container)
-        return result
+        return _list_response(
+            self._container_state.get(
+                self.cluster_state_service.state_generation(),
+                self.cluster_state_service.as_deployment()),
+            _list_query(query, _CONTAINER_FILTERS, _container_sort_key))
 
     def _get_attached_volume(self, node_uuid, volume):
         """
@@ -878,6 +1365,9 @@ class ConfigurationAPIUserV1(object):
         Some nodes may not be listed if their agents are disconnected from
         the cluster. IP addresses may be private IP addresses that are not
         publicly routable.
+
+        The ``X-Generation`` response header can be passed back as the
+        ``wait_for_generation`` query parameter to wait for a change.
         """,
         header=u"List known nodes in the cluster",
         examples=[
@@ -885,13 +1375,18 @@ class ConfigurationAPIUserV1(object):
         ],
         section=u"common",
     )
+    @_wait_for_generation(
+        _state_generation, _wait_for_state_change)
+    @_if_none_match(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={"$ref":
                       '/v1/endpoints.json#/definitions/nodes_array'},
+        querySchema={"$ref":
+                     '/v1/endpoints.json#/definitions/nodes_query'},
         schema_store=SCHEMAS
     )
-    def list_current_nodes(self):
+    def list_current_nodes(self, query):
         return [{u"host": node.hostname, u"uuid": unicode(node.uuid)}
                 for node in
                 self.cluster_state_service.as_deployment().nodes]
@@ -917,6 +1412,7 @@ class ConfigurationAPIUserV1(object):
         ],
         section=u"common",
     )
+    @_if_none_match(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={"$ref":
@@ -935,6 +1431,77 @@ class ConfigurationAPIUserV1(object):
             raise NODE_BY_ERA_NOT_FOUND
         return {u"uuid": unicode(node_uuid)}
 
+    @app.route("/events", methods=['GET'])
+    @user_documentation(
+        u"""
+        Follow changes to the cluster as they happen, over a single
+        long-lived response, instead of polling the listings.
+
+        With an ``Accept: text/event-stream`` header the events are sent as
+        Server-Sent Events; otherwise each is sent as a line of JSON with
+        ``cursor``, ``type`` and ``data`` fields.  The types are
+        ``dataset_configuration`` (a dataset was added or changed; the data
+        is the dataset, as listed by ``/configuration/datasets``),
+        ``dataset_removed``, ``lease``, ``lease_released``, ``node_state``,
+        ``node_expired`` and ``node_removed``.
+
+        Events start from the time of the request.  To resume after a
+        disconnection pass the cursor of the last event received in a
+        ``Last-Event-ID`` header or ``cursor`` query parameter.  If events
+        after it are no longer known, for example because the control
+        service restarted, a ``reset`` event is sent first: listings should
+        then be fetched again.
+
+        Idle streams are sent an empty line, or a comment, every 15
+        seconds.
+        """,
+        header=u"Follow changes to the cluster",
+        section=u"common",
+    )
+    def follow_events(self, request):
+        """
+        Stream events until the client disconnects.
+
+        :param request: The ``IRequest``.
+
+        :return: A ``Deferred`` which only stops when cancelled.
+        """
+        accept = b",".join(request.requestHeaders.getRawHeaders(b"accept", []))
+        if b"text/event-stream" in accept:
+            encode = _sse_event
+            keepalive = b": keepalive\n\n"
+            request.setHeader(b"content-type", b"text/event-stream")
+        else:
+            encode = _json_line_event
+            keepalive = b"\n"
+            request.setHeader(b"content-type", b"application/x-ndjson")
+        request.setHeader(b"cache-control", b"no-cache")
+
+        cursor = request.requestHeaders.getRawHeaders(
+            b"Last-Event-ID", request.args.get(b"cursor", [None]))[-1]
+        if cursor is not None:
+            cursor = cursor.decode("ascii", "replace")
+        past = self.events.since(cursor)
+        if past is None:
+            request.write(encode(self.events.cursor(), u"reset", {}))
+            past = []
+
+        def send(event):
+            request.write(
+                encode(self.events.cursor(event), event.type, event.data))
+        for event in past:
+            send(event)
+        self.events.subscribe(send)
+        keeping_alive = LoopingCall(request.write, keepalive)
+        keeping_alive.clock = self.clock
+        keeping_alive.start(EVENTS_KEEPALIVE_INTERVAL, now=False)
+
+        def stop(_):
+            self.events.unsubscribe(send)
+            keeping_alive.stop()
+        # Klein cancels this when the client disconnects:
+        return Deferred(stop)
+
     @app.route("/configuration/_compose", methods=['POST'])
     @private_api
     @structured(
@@ -979,6 +1546,7 @@ class ConfigurationAPIUserV1(object):
         ],
         section=u"dataset",
     )
+    @_if_none_match(_get_leases_tag)
     @structured(
         inputSchema={},
         outputSchema={
@@ -1112,27 +1680,19 @@ def _find_manifestation_and_node(deployment, dataset_id):
     :return: Tuple containing the primary ``Manifestation`` and the
         ``Node`` it is on.
     """
-    manifestations_and_nodes = manifestations_from_deployment(
-        deployment, dataset_id)
-    index = 0
-    for index, (manifestation, node) in enumerate(
-            manifestations_and_nodes):
-        if manifestation.primary:
-            primary_manifestation, origin_node = manifestation, node
-            break
-    else:
+    manifestations = deployment.get_dataset_manifestations(dataset_id)
+    if not manifestations:
         # There are no manifestations containing the requested dataset.
-        if index == 0:
-            raise DATASET_NOT_FOUND
-        else:
-            # There were no primary manifestations
-            raise IndexError(
-                'No primary manifestations for dataset: {!r}. See '
-                'https://clusterhq.atlassian.net/browse/FLOC-1403'.format(
-                    dataset_id)
-            )
-
-    return primary_manifestation, origin_node
+        raise DATASET_NOT_FOUND
+    for node_uuid, manifestation in manifestations.items():
+        if manifestation.primary:
+            return manifestation, deployment.get_node(node_uuid)
+    # There were no primary manifestations
+    raise IndexError(
+        'No primary manifestations for dataset: {!r}. See '
+        'https://clusterhq.atlassian.net/browse/FLOC-1403'.format(
+            dataset_id)
+    )
 
 
 def _update_dataset_primary(deployment, dataset_id, primary):
@@ -1179,12 +1739,148 @@ def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     :returns: An updated ``Deployment``.
     """
     _, node = _find_manifestation_and_node(deployment, dataset_id)
-    deployment = deployment.set(nodes=deployment.nodes.discard(node))
     node = node.transform(
         ['manifestations', dataset_id, 'dataset', 'maximum_size'],
         maximum_size
     )
-    return deployment.set(nodes=deployment.nodes.add(node))
+    return deployment.update_node(node)
+
+
+def _add_dataset(deployment, primary, dataset_id=None, maximum_size=None,
+                 metadata=None):
+    """
+    Add a dataset to a ``Deployment``.
+
+    The parameters other than ``deployment`` are those of
+    ``ConfigurationAPIUserV1.create_dataset_configuration``.
+
+    :raise DATASET_ID_COLLISION: If a dataset with the identifier exists.
+
+    :return: A tuple of the updated ``Deployment`` and the API ``dict`` of
+        the dataset.
+    """
+    if dataset_id is None:
+        dataset_id = unicode(uuid4())
+    dataset_id = dataset_id.lower()
+
+    if metadata is None:
+        metadata = {}
+
+    primary = UUID(hex=primary)
+
+    if deployment.get_dataset_manifestations(dataset_id):
+        raise DATASET_ID_COLLISION
+
+    # XXX Check cluster state to determine if the given primary node
+    # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
+    # See FLOC-1278
+
+    dataset = Dataset(
+        dataset_id=dataset_id,
+        maximum_size=maximum_size,
+        metadata=pmap(metadata)
+    )
+    manifestation = Manifestation(dataset=dataset, primary=True)
+
+    primary_node = deployment.get_node(primary)
+
+    new_node_config = primary_node.transform(
+        ("manifestations", manifestation.dataset_id), manifestation)
+    deployment = deployment.update_node(new_node_config)
+    return deployment, api_dataset_from_dataset_and_node(dataset, primary)
+
+
+def _delete_dataset(deployment, dataset_id):
+    """
+    Mark a dataset of a ``Deployment`` as deleted.
+
+    :param unicode dataset_id: The unique identifier of the dataset.
+
+    :raise DATASET_NOT_FOUND: If there is no such dataset.
+
+    :return: A tuple of the updated ``Deployment`` and the API ``dict`` of
+        the dataset.
+    """
+    # XXX this doesn't handle replicas
+    # https://clusterhq.atlassian.net/browse/FLOC-1240
+    _, origin_node = _find_manifestation_and_node(deployment, dataset_id)
+
+    new_node = origin_node.transform(
+        ("manifestations", dataset_id, "dataset", "deleted"), True)
+    deployment = deployment.update_node(new_node)
+    return deployment, api_dataset_from_dataset_and_node(
+        new_node.manifestations[dataset_id].dataset, new_node.uuid)
+
+
+def _existing_dataset(deployment, dataset_id):
+    """
+    :param unicode dataset_id: The unique identifier of a dataset.
+
+    :raise DATASET_NOT_FOUND: If there is no such dataset.
+    :raise DATASET_DELETED: If it has been deleted.
+    """
+    primary_manifestation, _ = _find_manifestation_and_node(
+        deployment, dataset_id)
+    if primary_manifestation.dataset.deleted:
+        raise DATASET_DELETED
+
+
+def _move_dataset(deployment, dataset_id, primary=None):
+    """
+    Move a dataset of a ``Deployment`` to another node.
+
+    :param unicode dataset_id: The unique identifier of the dataset.
+    :param primary: The UUID, as ``unicode``, of the node to which the
+        dataset will be moved, or ``None`` indicating no change.
+
+    :raise DATASET_NOT_FOUND: If there is no such dataset.
+    :raise DATASET_DELETED: If it has been deleted.
+
+    :return: A tuple of the updated ``Deployment`` and the API ``dict`` of
+        the dataset.
+    """
+    _existing_dataset(deployment, dataset_id)
+    if primary is not None:
+        deployment = _update_dataset_primary(
+            deployment, dataset_id, UUID(hex=primary))
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id)
+    return deployment, api_dataset_from_dataset_and_node(
+        primary_manifestation.dataset, current_node.uuid)
+
+
+def _resize_dataset(deployment, dataset_id, maximum_size):
+    """
+    Change the maximum size of a dataset of a ``Deployment``.
+
+    :param unicode dataset_id: The unique identifier of the dataset.
+    :param maximum_size: The new size of the dataset in bytes, or ``None``
+        to remove the size limit.
+
+    :raise DATASET_NOT_FOUND: If there is no such dataset.
+    :raise DATASET_DELETED: If it has been deleted.
+
+    :return: A tuple of the updated ``Deployment`` and the API ``dict`` of
+        the dataset.
+    """
+    _existing_dataset(deployment, dataset_id)
+    deployment = _update_dataset_maximum_size(
+        deployment, dataset_id, maximum_size)
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id)
+    return deployment, api_dataset_from_dataset_and_node(
+        primary_manifestation.dataset, current_node.uuid)
+
+
+# Map the names of the operations of a bulk dataset request to a function
+# applying the operation to a ``Deployment``, taking the other fields of the
+# operation as keyword arguments, and the response code of its result:
+_DATASET_OPERATIONS = {
+    u"create": (_add_dataset, CREATED),
+    u"move": (_move_dataset, OK),
+    u"resize": (_resize_dataset, OK),
+    u"delete": (_delete_dataset, OK),
+}
 
 
 def manifestations_from_deployment(deployment, dataset_id):
@@ -1199,9 +1895,9 @@ def manifestations_from_deployment(deployment, dataset_id):
     :return: Iterable returning all manifestations of the supplied
         ``dataset_id``.
     """
-    for node in deployment.nodes:
-        if dataset_id in node.manifestations:
-            yield node.manifestations[dataset_id], node
+    manifestations = deployment.get_dataset_manifestations(dataset_id)
+    for node_uuid, manifestation in manifestations.items():
+        yield manifestation, deployment.get_node(node_uuid)
 
 
 def datasets_from_deployment(deployment):
@@ -1218,17 +1914,77 @@ def datasets_from_deployment(deployment):
     :return: Iterable returning all datasets.
     """
     for node in deployment.nodes:
-        if node.manifestations is None:
-            continue
-        for manifestation in node.manifestations.values():
-            if manifestation.primary:
-                # There may be multiple datasets marked as primary until we
-                # implement consistency checking when state is reported by each
-                # node.
-                # See https://clusterhq.atlassian.net/browse/FLOC-1303
-                yield api_dataset_from_dataset_and_node(
-                    manifestation.dataset, node.uuid
-                )
+        for dataset in _node_dataset_configuration(node):
+            yield dataset
+
+
+def _node_dataset_configuration(node):
+    """
+    :param Node node: The configuration of a node.
+
+    :return: A ``list`` of ``dict`` describing the datasets configured to
+        have their primary manifestation on the node.
+    """
+    if node.manifestations is None:
+        return []
+    # There may be multiple datasets marked as primary until we implement
+    # consistency checking when state is reported by each node.
+    # See https://clusterhq.atlassian.net/browse/FLOC-1303
+    return [
+        api_dataset_from_dataset_and_node(manifestation.dataset, node.uuid)
+        for manifestation in node.manifestations.values()
+        if manifestation.primary
+    ]
+
+
+def _node_dataset_state(node):
+    """
+    :param NodeState node: The state of a node.
+
+    :return: A ``list`` of ``dict`` describing the datasets whose primary
+        manifestation is on the node.
+    """
+    if node.manifestations is None:
+        return []
+    # The dataset configuration result includes metadata and deleted flags
+    # which should not be part of the dataset state response, so this doesn't
+    # share the code for that.
+    result = []
+    for manifestation in node.manifestations.values():
+        if manifestation.primary:
+            dataset = manifestation.dataset
+            response_dataset = _api_dataset_state(dataset)
+            response_dataset[u"primary"] = unicode(node.uuid)
+            response_dataset[u"path"] = node.paths[
+                dataset.dataset_id].path.decode("utf-8")
+            result.append(response_dataset)
+    return result
+
+
+def _nonmanifest_dataset_state(deployment_state):
+    """
+    :param DeploymentState deployment_state: The cluster state.
+
+    :return: A ``list`` of ``dict`` describing the datasets which have no
+        manifestation anywhere in the cluster.
+    """
+    return [
+        _api_dataset_state(dataset)
+        for dataset in deployment_state.nonmanifest_datasets.values()
+    ]
+
+
+def _api_dataset_state(dataset):
+    """
+    :param Dataset dataset: A dataset present in the cluster.
+
+    :return: A ``dict`` describing the dataset, without the details of where
+        it is.
+    """
+    result = dict(dataset_id=dataset.dataset_id)
+    if dataset.maximum_size is not None:
+        result[u"maximum_size"] = dataset.maximum_size
+    return result
 
 
 def containers_from_deployment(deployment):
@@ -1241,8 +1997,37 @@ def containers_from_deployment(deployment):
     :return: Iterable returning all containers.
     """
     for node in deployment.nodes:
-        for application in node.applications:
-            yield container_configuration_response(application, node.uuid)
+        for container in _node_container_configuration(node):
+            yield container
+
+
+def _node_container_configuration(node):
+    """
+    :param Node node: The configuration of a node.
+
+    :return: A ``list`` of ``dict`` describing the containers configured to
+        run on the node.
+    """
+    return [
+        container_configuration_response(application, node.uuid)
+        for application in node.applications
+    ]
+
+
+def _node_container_state(node):
+    """
+    :param NodeState node: The state of a node.
+
+    :return: A ``list`` of ``dict`` describing the containers on the node.
+    """
+    if node.applications is None:
+        return []
+    result = []
+    for application in node.applications:
+        container = container_configuration_response(application, node.uuid)
+        container[u"running"] = application.running
+        result.append(container)
+    return result
 
 
 def container_configuration_response(application, node):
@@ -44,6 +44,12 @@ class ControlOptions(Options):
          ("Absolute path to directory containing the cluster "
           "root certificate (cluster.crt) and control service certificate "
           "and private key (control-service.crt and control-service.key).")],
+        ["broadcast-window", None, 0.1,
+         "Seconds to wait for further changes before sending the changed "
+         "configuration and state to the convergence agents.", float],
+        ["broadcast-max-staleness", None, 1.0,
+         "The most seconds a change waits for further changes before being "
+         "sent to the convergence agents.", float],
     ]
 
 
@@ -75,7 +81,9 @@ class ControlScript(object):
         amp_service = ControlAMPService(
             reactor, cluster_state, persistence, serverFromString(
                 reactor, options["agent-port"]),
-            amp_server_context_factory(ca, control_credential))
+            amp_server_context_factory(ca, control_credential),
+            broadcast_window=options["broadcast-window"],
+            broadcast_max_staleness=options["broadcast-max-staleness"])
         amp_service.setServiceParent(top_service)
         return main_for_service(reactor, top_service)
 
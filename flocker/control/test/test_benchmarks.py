@@ -0,0 +1,79 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._benchmarks``.
+"""
+
+from itertools import count
+
+from .._benchmarks import (
+    synthetic_cluster, compare_wire_codecs, measure_node_operations,
+)
+from ...testtools import TestCase
+
+
+class SyntheticClusterTests(TestCase):
+    """
+    Tests for ``synthetic_cluster``.
+    """
+    def test_size(self):
+        """
+        The configuration and state have the requested number of nodes, each
+        with the requested number of datasets.
+        """
+        configuration, state = synthetic_cluster(3, datasets_per_node=2)
+        self.assertEqual(
+            ([2, 2, 2], [2, 2, 2]),
+            ([len(node.manifestations) for node in configuration.nodes],
+             [len(node.manifestations) for node in state.nodes]),
+        )
+
+    def test_deterministic(self):
+        """
+        The same cluster is built every time.
+        """
+        self.assertEqual(synthetic_cluster(2), synthetic_cluster(2))
+
+
+class CompareWireCodecsTests(TestCase):
+    """
+    Tests for ``compare_wire_codecs``.
+    """
+    def test_measurements(self):
+        """
+        Each encoding is measured with the given timer.
+        """
+        ticks = count()
+        measurements = compare_wire_codecs(2, timer=lambda: float(next(ticks)))
+        self.assertEqual(
+            [(u"json", 1.0, 1.0, 1.0), (u"binary", 1.0, 1.0, 1.0)],
+            [(m.name, m.encode_seconds, m.decode_seconds, m.reencode_seconds)
+             for m in measurements],
+        )
+
+    def test_binary_smaller(self):
+        """
+        The binary encoding of the synthetic cluster state is smaller than the
+        JSON encoding.
+        """
+        json, binary = compare_wire_codecs(5)
+        self.assertTrue(binary.size < json.size)
+
+
+class MeasureNodeOperationsTests(TestCase):
+    """
+    Tests for ``measure_node_operations``.
+    """
+    def test_measurements(self):
+        """
+        Each operation is timed with the given timer in a cluster of each of
+        the given sizes, and the mean time reported.
+        """
+        ticks = count()
+        measurements = measure_node_operations(
+            [1, 3], repeat=2, timer=lambda: float(next(ticks)))
+        self.assertEqual(
+            [(1, 0.5, 0.5, 0.5), (3, 0.5, 0.5, 0.5)],
+            [(m.node_count, m.get_node_seconds, m.update_node_seconds,
+              m.update_configuration_seconds) for m in measurements],
+        )
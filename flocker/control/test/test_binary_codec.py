@@ -0,0 +1,199 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._binary_codec``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from hypothesis import given
+
+from pytz import UTC
+
+from twisted.python.filepath import FilePath
+
+from .. import (
+    NodeState, DeploymentState, Manifestation, Dataset, Lease, Leases,
+    Deployment,
+)
+from .._binary_codec import (
+    BINARY_MAGIC, BinaryDecodeError, binary_encode, binary_decode,
+)
+from .._persistence import wire_encode, FragmentCache
+from .._diffing import create_diff
+from ...testtools import TestCase
+from .test_persistence import DEPLOYMENTS
+
+MANIFESTATION = Manifestation(dataset=Dataset(dataset_id=unicode(uuid4())),
+                              primary=True)
+NODE_STATE = NodeState(
+    uuid=uuid4(), hostname=u"192.0.2.1", applications=None,
+    manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+    paths={MANIFESTATION.dataset_id: FilePath(b"/flocker/a")},
+    devices={uuid4(): FilePath(b"/dev/xvdb")},
+)
+
+
+class BinaryEncodeTests(TestCase):
+    """
+    Tests for ``binary_encode`` and ``binary_decode``.
+    """
+    def assert_round_trips(self, obj):
+        """
+        ``obj`` is equal to itself after being binary encoded and decoded.
+        """
+        self.assertEqual(obj, binary_decode(binary_encode(obj)))
+
+    @given(DEPLOYMENTS)
+    def test_deployments(self, deployment):
+        """
+        Arbitrary ``Deployment`` instances round-trip.
+        """
+        self.assert_round_trips(deployment)
+
+    def test_deployment_state(self):
+        """
+        ``DeploymentState`` instances round-trip.
+        """
+        self.assert_round_trips(DeploymentState(
+            nodes={NODE_STATE, NodeState(hostname=u"192.0.2.2")},
+            node_uuid_to_era={NODE_STATE.uuid: uuid4()},
+            nonmanifest_datasets={
+                MANIFESTATION.dataset_id: MANIFESTATION.dataset},
+        ))
+
+    def test_leases(self):
+        """
+        ``Leases`` with and without expiration times round-trip.
+        """
+        expiring = Lease(
+            dataset_id=uuid4(), node_id=uuid4(),
+            expiration=datetime(2016, 1, 2, 3, 4, 5, tzinfo=UTC),
+        )
+        forever = Lease(dataset_id=uuid4(), node_id=uuid4())
+        self.assert_round_trips(Deployment(leases=Leases({
+            expiring.dataset_id: expiring, forever.dataset_id: forever,
+        })))
+
+    def test_diff(self):
+        """
+        Diffs between cluster states round-trip.
+        """
+        self.assert_round_trips(create_diff(
+            DeploymentState(nodes={NODE_STATE}),
+            DeploymentState(nodes={NODE_STATE.set(hostname=u"192.0.2.3")}),
+        ))
+
+    def test_simple_values(self):
+        """
+        The simple types the model is built from round-trip.
+        """
+        self.assert_round_trips([
+            None, True, False, 0, -1, 2 ** 70, -(2 ** 70), 1.5, b"\xff",
+            u"\N{SNOWMAN}", {u"a": [1]},
+        ])
+
+    def test_magic(self):
+        """
+        The encoding starts with ``BINARY_MAGIC``.
+        """
+        self.assertTrue(binary_encode(NODE_STATE).startswith(BINARY_MAGIC))
+
+    def test_repeated_values_shared(self):
+        """
+        ``UUID`` instances and strings which occur more than once are only
+        encoded in full once.
+        """
+        node_uuid = uuid4()
+        once = binary_encode(DeploymentState(nodes={
+            NodeState(uuid=node_uuid, hostname=u"192.0.2.1"),
+        }))
+        twice = binary_encode(DeploymentState(
+            nodes={NodeState(uuid=node_uuid, hostname=u"192.0.2.1")},
+            node_uuid_to_era={node_uuid: node_uuid},
+        ))
+        # Two references to known UUIDs and the extra map entry's framing:
+        self.assertTrue(len(twice) - len(once) < 16)
+
+    def test_smaller_than_json(self):
+        """
+        The binary encoding of a typical cluster state is smaller than the
+        JSON encoding.
+        """
+        state = DeploymentState(nodes={NODE_STATE})
+        self.assertTrue(len(binary_encode(state)) < len(wire_encode(state)))
+
+    def test_fragments(self):
+        """
+        Given a ``FragmentCache`` the encodings of instances of its classes
+        are remembered and reused, and the result still round-trips.
+        """
+        fragments = FragmentCache([NodeState], 10)
+        state = DeploymentState(nodes={NODE_STATE})
+        first = binary_encode(state, fragments)
+        reused = binary_encode(
+            DeploymentState(
+                nodes={NODE_STATE},
+                node_uuid_to_era={NODE_STATE.uuid: uuid4()}),
+            fragments)
+        self.assertEqual(
+            (state, True),
+            (binary_decode(first),
+             binary_encode(NODE_STATE, FragmentCache([], 1))[
+                 len(BINARY_MAGIC):] in reused),
+        )
+
+    def test_naive_datetime(self):
+        """
+        A ``datetime`` without a timezone can't be encoded.
+        """
+        self.assertRaises(ValueError, binary_encode, datetime(2016, 1, 1))
+
+    def test_unknown_type(self):
+        """
+        Objects of unsupported types can't be encoded.
+        """
+        self.assertRaises(TypeError, binary_encode, object())
+
+
+class BinaryDecodeErrorTests(TestCase):
+    """
+    Tests for ``binary_decode`` given invalid data.
+    """
+    def test_not_binary(self):
+        """
+        Data not starting with ``BINARY_MAGIC`` is rejected.
+        """
+        self.assertRaises(
+            BinaryDecodeError, binary_decode, wire_encode(NODE_STATE))
+
+    def test_truncated(self):
+        """
+        Truncated data is rejected.
+        """
+        self.assertRaises(
+            BinaryDecodeError, binary_decode, binary_encode(NODE_STATE)[:-1])
+
+    def test_trailing_data(self):
+        """
+        Data following the encoded object is rejected.
+        """
+        self.assertRaises(
+            BinaryDecodeError, binary_decode, binary_encode(None) + b"N")
+
+    def test_unknown_tag(self):
+        """
+        Unknown type tags are rejected.
+        """
+        self.assertRaises(
+            BinaryDecodeError, binary_decode, BINARY_MAGIC + b"?")
+
+    def test_unknown_class(self):
+        """
+        Class names which are not part of the model are rejected.
+        """
+        self.assertRaises(
+            BinaryDecodeError, binary_decode,
+            BINARY_MAGIC + b"C" + b"S\x06object" + b"\x00",
+        )
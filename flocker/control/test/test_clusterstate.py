@@ -10,7 +10,7 @@ from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 
 from .._model import ChangeSource
-from .._clusterstate import ClusterStateService
+from .._clusterstate import ClusterStateService, EXPIRATION_TIME
 from .. import (
     Application, DockerImage, NodeState, DeploymentState, Manifestation,
     Dataset,
@@ -167,6 +167,66 @@ class ClusterStateServiceTests(TestCase):
             [DeploymentState(nodes=[self.WITH_APPS]), DeploymentState()],
         )
 
+    def test_generation_changes(self):
+        """
+        ``ClusterStateService.state_generation`` increases when the state
+        changes, including when information expires.
+        """
+        service = self.service()
+        generations = [service.state_generation()]
+        service.apply_changes([self.WITH_APPS])
+        generations.append(service.state_generation())
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        generations.append(service.state_generation())
+        self.assertEqual(sorted(set(generations)), generations)
+
+    def test_generation_unchanged(self):
+        """
+        ``ClusterStateService.state_generation`` stays the same when changes
+        don't alter the state.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        generation = service.state_generation()
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual(generation, service.state_generation())
+
+    def test_register(self):
+        """
+        Callbacks registered with ``ClusterStateService.register`` are called
+        with the previous and new state whenever the state changes, and
+        told whether the change wiped expired information.
+        """
+        service = self.service()
+        changes = []
+        service.register(
+            lambda *arguments: changes.append(arguments))
+        service.apply_changes([self.WITH_APPS])
+        service.apply_changes([self.WITH_APPS])
+        updated = service.as_deployment()
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertEqual(
+            [(DeploymentState(), updated, False),
+             (updated, service.as_deployment(), True)],
+            changes)
+
+    def test_wait_for_state_change(self):
+        """
+        ``ClusterStateService.wait_for_state_change`` fires with the new
+        generation once the state changes, and not for changes which don't
+        alter the state.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        d = service.wait_for_state_change(service.state_generation())
+        service.apply_changes([self.WITH_APPS])
+        self.assertNoResult(d)
+        service.apply_changes([self.WITH_MANIFESTATION])
+        self.assertEqual(
+            service.state_generation(), self.successResultOf(d))
+
     def test_expiration_from_inactivity(self):
         """
         Information updates from a source with no activity for more than the
@@ -253,3 +313,50 @@ class ClusterStateServiceTests(TestCase):
             service.as_deployment(),
             DeploymentState(nodes=[self.WITH_APPS]),
         )
+
+    def test_idle_without_information(self):
+        """
+        When there is no information to expire nothing is scheduled.
+        """
+        self.service()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_wakes_at_earliest_deadline(self):
+        """
+        A single call is scheduled, for when the earliest information
+        expires.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        advance_some(self.clock)
+        service.apply_changes([self.WITH_MANIFESTATION])
+        self.assertEqual(
+            [EXPIRATION_TIME.total_seconds()],
+            [call.getTime() for call in self.clock.getDelayedCalls()],
+        )
+
+    def test_activity_reschedules(self):
+        """
+        If the source of some information was active since the information
+        was applied, the next call is scheduled for when it expires given
+        that activity.
+        """
+        service = self.service()
+        source = ChangeSource()
+        service.apply_changes_from_source(source, [self.WITH_APPS])
+        advance_some(self.clock)
+        source.set_last_activity(self.clock.seconds())
+        advance_rest(self.clock)
+        self.assertEqual(
+            [self.clock.seconds() + 1],
+            [call.getTime() for call in self.clock.getDelayedCalls()],
+        )
+
+    def test_stop_cancels(self):
+        """
+        Stopping the service cancels the scheduled call.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        service.stopService()
+        self.assertEqual([], self.clock.getDelayedCalls())
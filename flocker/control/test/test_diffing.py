@@ -0,0 +1,187 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._diffing``.
+"""
+
+from uuid import uuid4
+
+from hypothesis import given
+
+from pyrsistent import PClass, field
+
+from twisted.python.filepath import FilePath
+
+from .. import (
+    Application, DockerImage, Node, NodeState, Deployment, DeploymentState,
+    Manifestation, Dataset,
+)
+from .._diffing import create_diff, _Diff, _Set, _Add, _Remove
+from .._persistence import wire_encode, wire_decode
+from ...testtools import TestCase
+from .test_persistence import DEPLOYMENTS
+
+
+def _dataset_and_manifestation():
+    """
+    :return: A new ``Manifestation`` with a random dataset identifier.
+    """
+    return Manifestation(dataset=Dataset(dataset_id=unicode(uuid4())),
+                         primary=True)
+
+APPLICATION = Application(
+    name=u"myapp", image=DockerImage.from_string(u"postgresql"),
+)
+MANIFESTATION = _dataset_and_manifestation()
+NODE = Node(uuid=uuid4(), applications={APPLICATION},
+            manifestations={MANIFESTATION.dataset_id: MANIFESTATION})
+NODE_STATE = NodeState(
+    uuid=uuid4(), hostname=u"192.0.2.1", applications=[],
+    manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+    paths={MANIFESTATION.dataset_id: FilePath(b"/flocker/a")},
+    devices={},
+)
+
+
+class _Optional(PClass):
+    """
+    A ``PClass`` with a field that may be left unset.
+    """
+    value = field()
+
+
+class CreateDiffTests(TestCase):
+    """
+    Tests for ``create_diff``.
+    """
+    def assert_diff_round_trips(self, object_a, object_b):
+        """
+        The diff from ``object_a`` to ``object_b`` survives wire encoding and
+        turns ``object_a`` into ``object_b`` when applied.
+
+        :return: The ``_Diff``.
+        """
+        diff = create_diff(object_a, object_b)
+        decoded = wire_decode(wire_encode(diff))
+        self.assertEqual(
+            (object_b, object_b),
+            (diff.apply(object_a), decoded.apply(object_a)),
+        )
+        return diff
+
+    def test_identical(self):
+        """
+        The diff between an object and itself contains no changes.
+        """
+        deployment = Deployment(nodes={NODE})
+        self.assertEqual(
+            _Diff(changes=[]), create_diff(deployment, deployment),
+        )
+
+    def test_equal(self):
+        """
+        The diff between equal but distinct objects contains no changes.
+        """
+        self.assertEqual(
+            _Diff(changes=[]),
+            create_diff(
+                Deployment(nodes={NODE}),
+                wire_decode(wire_encode(Deployment(nodes={NODE}))),
+            ),
+        )
+
+    def test_set_add(self):
+        """
+        Adding an element to a set results in an ``_Add`` of just that
+        element.
+        """
+        other = Node(uuid=uuid4())
+        diff = self.assert_diff_round_trips(
+            Deployment(nodes={NODE}), Deployment(nodes={NODE, other}),
+        )
+        self.assertEqual(
+            _Diff(changes=[_Add(path=[u"nodes"], item=other)]), diff,
+        )
+
+    def test_set_remove(self):
+        """
+        Removing an element from a set results in a ``_Remove`` of just that
+        element.
+        """
+        other = Node(uuid=uuid4())
+        diff = self.assert_diff_round_trips(
+            Deployment(nodes={NODE, other}), Deployment(nodes={NODE}),
+        )
+        self.assertEqual(
+            _Diff(changes=[_Remove(path=[u"nodes"], item=other)]), diff,
+        )
+
+    def test_nested_set_value(self):
+        """
+        Changing a value nested inside ``PClass`` and ``PMap`` instances only
+        replaces that value.
+        """
+        state = DeploymentState(nodes={NODE_STATE})
+        node_uuid = uuid4()
+        diff = self.assert_diff_round_trips(
+            state.set(node_uuid_to_era={node_uuid: uuid4()}),
+            state.set(node_uuid_to_era={node_uuid: uuid4()}),
+        )
+        self.assertEqual(
+            [_Set], [type(change) for change in diff.changes],
+        )
+
+    def test_map_add_and_remove(self):
+        """
+        Keys added to or removed from a ``PMap`` are reflected in the diff.
+        """
+        uuid_a, uuid_b = uuid4(), uuid4()
+        self.assert_diff_round_trips(
+            DeploymentState(node_uuid_to_era={uuid_a: uuid4()}),
+            DeploymentState(node_uuid_to_era={uuid_b: uuid4()}),
+        )
+
+    def test_node_state_attribute(self):
+        """
+        Changes to attributes of a ``NodeState`` in the cluster state,
+        including setting them to ``None``, round-trip.
+        """
+        other = _dataset_and_manifestation()
+        self.assert_diff_round_trips(
+            DeploymentState(nodes={NODE_STATE}),
+            DeploymentState(nodes={
+                NODE_STATE.set(
+                    applications=None,
+                    manifestations={other.dataset_id: other},
+                )
+            }),
+        )
+
+    def test_unset_optional_field(self):
+        """
+        Changes between a ``PClass`` with an optional field unset and one with
+        it set round-trip in both directions.
+        """
+        without = _Optional()
+        with_value = _Optional(value=1)
+        self.assertEqual(
+            (with_value, without),
+            (create_diff(without, with_value).apply(without),
+             create_diff(with_value, without).apply(with_value)),
+        )
+
+    def test_different_types(self):
+        """
+        Objects of different types are replaced wholesale.
+        """
+        diff = self.assert_diff_round_trips(NODE, NODE_STATE)
+        self.assertEqual(
+            _Diff(changes=[_Set(path=[], value=NODE_STATE)]), diff,
+        )
+
+    @given(DEPLOYMENTS, DEPLOYMENTS)
+    def test_deployments(self, deployment_a, deployment_b):
+        """
+        Diffs between arbitrary ``Deployment`` instances round-trip.
+        """
+        self.assert_diff_round_trips(deployment_a, deployment_b)
@@ -0,0 +1,251 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._events``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from pyrsistent import discard
+
+from .._model import (
+    Deployment, Node, NodeState, DeploymentState, Dataset, Manifestation,
+    Leases,
+)
+from .._events import (
+    EventLog, dataset_configuration_events, lease_events, node_state_events,
+)
+from ...testtools import TestCase
+
+
+def _node_datasets(node):
+    """
+    :return: The datasets of a node, as simplified API ``dict`` instances.
+    """
+    return [{u"dataset_id": manifestation.dataset.dataset_id,
+             u"metadata": dict(manifestation.dataset.metadata)}
+            for manifestation in node.manifestations.values()]
+
+
+def _node_with_dataset(name):
+    """
+    :return: A ``Node`` with one dataset of the given name.
+    """
+    dataset = Dataset(dataset_id=unicode(uuid4()), metadata={u"name": name})
+    return Node(uuid=uuid4(), manifestations={
+        dataset.dataset_id: Manifestation(dataset=dataset, primary=True)})
+
+
+class DatasetConfigurationEventsTests(TestCase):
+    """
+    Tests for ``dataset_configuration_events``.
+    """
+    def setUp(self):
+        super(DatasetConfigurationEventsTests, self).setUp()
+        self.calls = []
+
+        def node_datasets(node):
+            self.calls.append(node.uuid)
+            return _node_datasets(node)
+        self.node_datasets = node_datasets
+        self.nodes = [_node_with_dataset(name) for name in [u"db", u"web"]]
+        self.deployment = Deployment(nodes=self.nodes)
+
+    def test_unchanged(self):
+        """
+        No events are derived, and no datasets computed, for nodes which are
+        still the same objects.
+        """
+        self.assertEqual(
+            ([], []),
+            (dataset_configuration_events(
+                self.deployment, self.deployment, self.node_datasets),
+             self.calls))
+
+    def test_changed(self):
+        """
+        Datasets which were added or changed are reported with their new
+        configuration.
+        """
+        added = _node_with_dataset(u"logs")
+        [dataset_id] = self.nodes[0].manifestations
+        renamed = self.nodes[0].transform(
+            ["manifestations", dataset_id, "dataset", "metadata"],
+            {u"name": u"db2"})
+        new = Deployment(nodes=[renamed, self.nodes[1], added])
+        self.assertEqual(
+            sorted([(u"dataset_configuration", item)
+                    for item in _node_datasets(renamed) +
+                    _node_datasets(added)]),
+            dataset_configuration_events(
+                self.deployment, new, self.node_datasets))
+
+    def test_moved(self):
+        """
+        A dataset which moves to another node without otherwise changing is
+        not reported.
+        """
+        [dataset_id] = self.nodes[0].manifestations
+        manifestation = self.nodes[0].manifestations[dataset_id]
+        new = Deployment(nodes=[
+            self.nodes[0].transform(["manifestations", dataset_id], discard),
+            self.nodes[1].transform(
+                ["manifestations", dataset_id], manifestation)])
+        self.assertEqual(
+            [], dataset_configuration_events(
+                self.deployment, new, self.node_datasets))
+
+    def test_removed(self):
+        """
+        Datasets which are no longer configured, including those of removed
+        nodes, are reported as removed.
+        """
+        new = Deployment(nodes=[self.nodes[1]])
+        self.assertEqual(
+            [(u"dataset_removed", {u"dataset_id": dataset_id})
+             for dataset_id in self.nodes[0].manifestations],
+            dataset_configuration_events(
+                self.deployment, new, self.node_datasets))
+
+
+class LeaseEventsTests(TestCase):
+    """
+    Tests for ``lease_events``.
+    """
+    def test_changes(self):
+        """
+        Acquired and renewed leases are reported with their node and
+        expiration time, and released leases by dataset.
+        """
+        now = datetime.fromtimestamp(1000, UTC)
+        node_id = uuid4()
+        renewed, released, acquired = uuid4(), uuid4(), uuid4()
+        old = Leases().acquire(now, renewed, node_id, 10).acquire(
+            now, released, node_id)
+        new = old.acquire(now, renewed, node_id, 60).release(
+            released, node_id).acquire(now, acquired, node_id)
+        self.assertEqual(
+            sorted([
+                (u"lease", {u"dataset_id": unicode(renewed),
+                            u"node_uuid": unicode(node_id),
+                            u"expiration": 1060.0}),
+                (u"lease", {u"dataset_id": unicode(acquired),
+                            u"node_uuid": unicode(node_id),
+                            u"expiration": None}),
+                (u"lease_released", {u"dataset_id": unicode(released)}),
+            ]),
+            sorted(lease_events(old, new)))
+
+
+class NodeStateEventsTests(TestCase):
+    """
+    Tests for ``node_state_events``.
+    """
+    def setUp(self):
+        super(NodeStateEventsTests, self).setUp()
+        self.nodes = [NodeState(uuid=uuid4(), hostname=u"192.0.2.%d" % (i,))
+                      for i in range(2)]
+        self.state = DeploymentState(nodes=self.nodes)
+
+    def test_updated(self):
+        """
+        Nodes which were replaced are reported with their address, and
+        removed nodes by UUID.
+        """
+        changed = self.nodes[0].set(hostname=u"192.0.2.100")
+        new = DeploymentState(nodes=[changed])
+        self.assertEqual(
+            [(u"node_state", {u"uuid": unicode(changed.uuid),
+                              u"host": changed.hostname}),
+             (u"node_removed", {u"uuid": unicode(self.nodes[1].uuid)})],
+            node_state_events(self.state, new, False))
+
+    def test_expired(self):
+        """
+        When expired information is wiped the affected nodes are reported as
+        having expired.
+        """
+        changed = self.nodes[0].set(hostname=u"192.0.2.100")
+        new = DeploymentState(nodes=[changed])
+        self.assertEqual(
+            sorted([(u"node_expired", {u"uuid": unicode(node.uuid)})
+                    for node in self.nodes]),
+            sorted(node_state_events(self.state, new, True)))
+
+
+class EventLogTests(TestCase):
+    """
+    Tests for ``EventLog``.
+    """
+    def setUp(self):
+        super(EventLogTests, self).setUp()
+        self.log = EventLog(size=3)
+
+    def append(self, count):
+        """
+        Append ``count`` events numbered from zero.
+        """
+        self.log.append((u"test", {u"index": i}) for i in range(count))
+
+    def test_since(self):
+        """
+        ``EventLog.since`` returns the events after the one whose cursor it is
+        given.
+        """
+        self.append(1)
+        cursor = self.log.cursor()
+        self.append(2)
+        self.assertEqual(
+            [{u"index": 0}, {u"index": 1}],
+            [event.data for event in self.log.since(cursor)])
+
+    def test_since_latest(self):
+        """
+        No events are returned for the cursor of the latest event, or for no
+        cursor.
+        """
+        self.append(2)
+        self.assertEqual(
+            ([], []),
+            (self.log.since(self.log.cursor()), self.log.since(None)))
+
+    def test_forgotten(self):
+        """
+        ``EventLog.since`` returns ``None`` if events after the cursor have
+        been forgotten, but not if only earlier events have.
+        """
+        cursor = self.log.cursor()
+        self.append(1)
+        later = self.log.cursor()
+        self.append(3)
+        self.assertEqual(
+            (None, [2, 3, 4]),
+            (self.log.since(cursor),
+             [event.sequence for event in self.log.since(later)]))
+
+    def test_other_log(self):
+        """
+        ``EventLog.since`` returns ``None`` for cursors of another log and for
+        invalid cursors.
+        """
+        self.append(1)
+        self.assertEqual(
+            [None] * 3,
+            [self.log.since(cursor) for cursor in [
+                EventLog().cursor(), u"abc", u"%s-9" % (self.log.prefix,)]])
+
+    def test_subscribe(self):
+        """
+        Subscribers are called with each new event until they unsubscribe.
+        """
+        events = []
+        self.log.subscribe(events.append)
+        self.append(2)
+        self.log.unsubscribe(events.append)
+        self.append(1)
+        self.assertEqual(
+            [(1, {u"index": 0}), (2, {u"index": 1})],
+            [(event.sequence, event.data) for event in events])
@@ -0,0 +1,182 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._generations``.
+"""
+
+from uuid import uuid4
+
+from .. import Deployment, Node
+from twisted.internet.defer import CancelledError
+
+from .._generations import GenerationTracker, GenerationWaiters
+from ...testtools import TestCase
+
+DEPLOYMENT = Deployment(nodes={Node(uuid=uuid4())})
+CHANGED_DEPLOYMENT = DEPLOYMENT.transform(
+    ["nodes"], lambda nodes: nodes.add(Node(uuid=uuid4())),
+)
+
+
+class GenerationTrackerTests(TestCase):
+    """
+    Tests for ``GenerationTracker``.
+    """
+    def test_initial_generation(self):
+        """
+        Before anything is inserted the generation is ``0``; the first
+        inserted object gets generation ``1``.
+        """
+        tracker = GenerationTracker(10)
+        initial = tracker.latest_generation
+        self.assertEqual(
+            (0, 1, 1),
+            (initial, tracker.insert_latest(DEPLOYMENT),
+             tracker.latest_generation),
+        )
+
+    def test_equal_object_same_generation(self):
+        """
+        Inserting an object equal to the latest one doesn't change the
+        generation.
+        """
+        tracker = GenerationTracker(10)
+        first = tracker.insert_latest(DEPLOYMENT)
+        second = tracker.insert_latest(Deployment(nodes=DEPLOYMENT.nodes))
+        self.assertEqual(first, second)
+
+    def test_changed_object_increments_generation(self):
+        """
+        Inserting an object different from the latest one increments the
+        generation.
+        """
+        tracker = GenerationTracker(10)
+        first = tracker.insert_latest(DEPLOYMENT)
+        second = tracker.insert_latest(CHANGED_DEPLOYMENT)
+        self.assertEqual(first + 1, second)
+
+    def test_diff_to_latest(self):
+        """
+        ``get_diff_from_generation`` returns a diff which turns the object
+        with the given generation into the latest object.
+        """
+        tracker = GenerationTracker(10)
+        first = tracker.insert_latest(DEPLOYMENT)
+        tracker.insert_latest(CHANGED_DEPLOYMENT)
+        diff = tracker.get_diff_from_generation(first)
+        self.assertEqual(CHANGED_DEPLOYMENT, diff.apply(DEPLOYMENT))
+
+    def test_diff_from_latest(self):
+        """
+        The diff from the latest generation is empty.
+        """
+        tracker = GenerationTracker(10)
+        generation = tracker.insert_latest(DEPLOYMENT)
+        self.assertEqual(
+            [], list(tracker.get_diff_from_generation(generation).changes),
+        )
+
+    def test_diff_cached(self):
+        """
+        Diffs to the latest object are cached.
+        """
+        tracker = GenerationTracker(10)
+        first = tracker.insert_latest(DEPLOYMENT)
+        tracker.insert_latest(CHANGED_DEPLOYMENT)
+        self.assertIs(
+            tracker.get_diff_from_generation(first),
+            tracker.get_diff_from_generation(first),
+        )
+
+    def test_unknown_generation(self):
+        """
+        ``get_diff_from_generation`` returns ``None`` for a generation it
+        never assigned.
+        """
+        tracker = GenerationTracker(10)
+        generation = tracker.insert_latest(DEPLOYMENT)
+        self.assertIs(None, tracker.get_diff_from_generation(generation + 1))
+
+    def test_forgotten_generation(self):
+        """
+        ``get_diff_from_generation`` returns ``None`` for a generation which
+        is older than the cache size.
+        """
+        tracker = GenerationTracker(1)
+        first = tracker.insert_latest(DEPLOYMENT)
+        tracker.insert_latest(CHANGED_DEPLOYMENT)
+        self.assertIs(None, tracker.get_diff_from_generation(first))
+
+    def test_insert_with_generation(self):
+        """
+        ``insert_with_generation`` records the object as the latest one with
+        the given generation, so diffs can be computed from it.
+        """
+        tracker = GenerationTracker(10)
+        tracker.insert_with_generation(DEPLOYMENT, 5)
+        latest = tracker.insert_with_generation(CHANGED_DEPLOYMENT, 7)
+        diff = tracker.get_diff_from_generation(5)
+        self.assertEqual(
+            (7, 7, CHANGED_DEPLOYMENT),
+            (latest, tracker.latest_generation, diff.apply(DEPLOYMENT)),
+        )
+
+    def test_insert_same_generation(self):
+        """
+        Inserting an object with the latest generation again leaves the
+        latest object unchanged.
+        """
+        tracker = GenerationTracker(10)
+        tracker.insert_with_generation(DEPLOYMENT, 1)
+        tracker.insert_with_generation(CHANGED_DEPLOYMENT, 2)
+        tracker.insert_with_generation(DEPLOYMENT, 2)
+        self.assertEqual(
+            CHANGED_DEPLOYMENT,
+            tracker.get_diff_from_generation(1).apply(DEPLOYMENT),
+        )
+
+    def test_insert_older_generation(self):
+        """
+        ``insert_with_generation`` refuses a generation older than the
+        latest one.
+        """
+        tracker = GenerationTracker(10)
+        tracker.insert_with_generation(DEPLOYMENT, 2)
+        self.assertRaises(
+            ValueError, tracker.insert_with_generation, DEPLOYMENT, 1)
+
+
+class GenerationWaitersTests(TestCase):
+    """
+    Tests for ``GenerationWaiters``.
+    """
+    def test_different(self):
+        """
+        Waiting for a change from a generation other than the current one
+        succeeds straight away with the current generation.
+        """
+        waiters = GenerationWaiters()
+        self.assertEqual(3, self.successResultOf(waiters.wait(2, 3)))
+
+    def test_changed(self):
+        """
+        Waiting for a change from the current generation fires once a change
+        is reported, with the new generation.
+        """
+        waiters = GenerationWaiters()
+        waiting = [waiters.wait(3, 3), waiters.wait(3, 3)]
+        for d in waiting:
+            self.assertNoResult(d)
+        waiters.changed(4)
+        self.assertEqual([4, 4], [self.successResultOf(d) for d in waiting])
+
+    def test_cancel(self):
+        """
+        A cancelled wait is no longer fired by a change.
+        """
+        waiters = GenerationWaiters()
+        d = waiters.wait(3, 3)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        # Firing it again would raise AlreadyCalledError:
+        waiters.changed(4)
@@ -3,9 +3,11 @@
 Tests for ``flocker.control.httpapi``.
 """
 
-from uuid import uuid4
+from uuid import UUID, uuid4
 from copy import deepcopy
-from datetime import datetime
+from io import BytesIO
+from json import dumps
+from datetime import datetime, timedelta
 from unittest import skip
 
 from pyrsistent import pmap, thaw
@@ -15,21 +17,23 @@ from pytz import UTC
 from zope.interface.verify import verifyObject
 
 from twisted.internet import reactor
-from twisted.internet.defer import gatherResults
+from twisted.internet.defer import gatherResults, maybeDeferred
 from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.internet.error import ConnectionDone
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.http import (
     CREATED, OK, CONFLICT, BAD_REQUEST, NOT_FOUND,
-    NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED,
+    NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED, NOT_MODIFIED,
 )
-from twisted.web.client import readBody
+from twisted.web.client import FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
 from twisted.application.service import IService
 from twisted.python.filepath import FilePath
 from twisted.internet.ssl import ClientContextFactory
-from twisted.internet.task import Clock
+from twisted.internet.task import Clock, LoopingCall
 
 from ...restapi.testtools import (
-    buildIntegrationTests, loads, APIAssertionsMixin)
+    buildIntegrationTests, loads, APIAssertionsMixin, dummyRequest, render)
 
 from .. import (
     Application, Dataset, Manifestation, Node, NodeState,
@@ -40,7 +44,8 @@ from .. import (
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
     api_dataset_from_dataset_and_node, container_configuration_response,
-    IF_MATCHES_HEADER,
+    IF_MATCHES_HEADER, NEXT_CURSOR_HEADER, GENERATION_HEADER,
+    WAIT_FOR_GENERATION_TIMEOUT, EVENTS_KEEPALIVE_INTERVAL,
 )
 from .._persistence import ConfigurationPersistenceService
 from .._clusterstate import ClusterStateService
@@ -48,7 +53,7 @@ from .._config import (
     FlockerConfiguration, FigConfiguration, model_from_configuration)
 from .test_config import COMPLEX_APPLICATION_YAML, COMPLEX_DEPLOYMENT_YAML
 from ... import __version__
-from ...testtools import TestCase
+from ...testtools import TestCase, AsyncTestCase
 
 
 class APITestsMixin(APIAssertionsMixin):
@@ -3642,3 +3647,820 @@ class NodeByEraTestsMixin(APITestsMixin):
 
 RealNodeByEra, MemoryRealByEra = buildIntegrationTests(
     NodeByEraTestsMixin, "NodeByEra", _build_app)
+
+
+class ConditionalGetTestsMixin(APITestsMixin):
+    """
+    Tests for the ``ETag`` and ``If-None-Match`` handling of ``GET``
+    endpoints.
+    """
+    def get_etag(self, path):
+        """
+        :param bytes path: The endpoint to request.
+
+        :return: ``Deferred`` firing with the ``ETag`` of the response.
+        """
+        d = self.assertResponseCode(b"GET", path, None, OK)
+        d.addCallback(
+            lambda response: response.headers.getRawHeaders(b"ETag")[0])
+        return d
+
+    def assert_conditional_code(self, path, change, expected_code):
+        """
+        Request an endpoint, make a change, then request it again with the
+        ``ETag`` of the first response in an ``If-None-Match`` header.
+
+        :param bytes path: The endpoint to request.
+        :param change: No-argument callable making the change.
+        :param int expected_code: The expected code of the second response.
+
+        :return: ``Deferred`` that fires when test is done.
+        """
+        d = self.get_etag(path)
+
+        def got_etag(etag):
+            d = maybeDeferred(change)
+            d.addCallback(lambda _: self.assertResponseCode(
+                b"GET", path, None, expected_code,
+                {b"If-None-Match": [etag]}))
+            return d
+        d.addCallback(got_etag)
+        return d
+
+    def test_configuration_etag(self):
+        """
+        Configuration endpoints tag their responses with the configuration
+        hash.
+        """
+        d = self.get_etag(b"/configuration/containers")
+        d.addCallback(self.assertEqual, b'"%s"' % (
+            self.persistence_service.configuration_hash(),))
+        return d
+
+    def test_configuration_not_modified(self):
+        """
+        Configuration endpoints respond with ``NOT_MODIFIED`` if the
+        configuration hasn't changed since the tag was sent.
+        """
+        return self.assert_conditional_code(
+            b"/configuration/datasets", lambda: None, NOT_MODIFIED)
+
+    def test_configuration_modified(self):
+        """
+        Configuration endpoints respond normally if the configuration has
+        changed since the tag was sent.
+        """
+        return self.assert_conditional_code(
+            b"/configuration/datasets",
+            lambda: self.persistence_service.save(
+                Deployment(nodes={Node(uuid=self.NODE_A_UUID)})),
+            OK)
+
+    def test_state_not_modified(self):
+        """
+        State endpoints respond with ``NOT_MODIFIED`` if the cluster state
+        hasn't changed since the tag was sent, even if the configuration
+        has.
+        """
+        return self.assert_conditional_code(
+            b"/state/nodes",
+            lambda: self.persistence_service.save(
+                Deployment(nodes={Node(uuid=self.NODE_A_UUID)})),
+            NOT_MODIFIED)
+
+    def test_state_modified(self):
+        """
+        State endpoints respond normally if the cluster state has changed
+        since the tag was sent.
+        """
+        return self.assert_conditional_code(
+            b"/state/nodes",
+            lambda: self.cluster_state_service.apply_changes(
+                [NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP)]),
+            OK)
+
+    def test_other_tags(self):
+        """
+        An ``If-None-Match`` header listing other tags, or tags of a state
+        from a different control service, gets a normal response.
+        """
+        other = ConfigurationAPIUserV1(
+            self.persistence_service, self.cluster_state_service, self.clock)
+        return self.assertResponseCode(
+            b"GET", b"/state/nodes", None, OK,
+            {b"If-None-Match": [
+                b'"abc", "%s-%d"' % (
+                    other.state_tag_prefix,
+                    self.cluster_state_service.state_generation())]})
+
+    def test_expiring_leases_untagged(self):
+        """
+        The lease listing isn't tagged while it includes leases with an
+        expiration time, since the time left changes.
+        """
+        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
+        d = self.persistence_service.save(Deployment(leases=Leases({
+            UUID(self.NODE_A): Lease(
+                dataset_id=UUID(self.NODE_A), node_id=self.NODE_B_UUID,
+                expiration=now + timedelta(seconds=60)),
+        })))
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"GET", b"/configuration/leases", None, OK))
+        d.addCallback(lambda response: self.assertIsNone(
+            response.headers.getRawHeaders(b"ETag")))
+        return d
+
+
+RealTestsConditionalGet, MemoryTestsConditionalGet = buildIntegrationTests(
+    ConditionalGetTestsMixin, "ConditionalGet", _build_app)
+
+
+class WaitForGenerationTestsMixin(APITestsMixin):
+    """
+    Tests for the ``X-Generation`` header and ``wait_for_generation`` query
+    parameter of the endpoints listing datasets, containers and nodes.
+    """
+    def get(self, path, generation=None):
+        """
+        :param bytes path: The endpoint to request.
+        :param int generation: The generation to wait for a change from, or
+            ``None`` not to wait.
+
+        :return: ``Deferred`` firing with a tuple of the generation in the
+            response and the decoded body.
+        """
+        if generation is not None:
+            path += b"?wait_for_generation=%d" % (generation,)
+        d = self.assertResponseCode(b"GET", path, None, OK)
+
+        def got_response(response):
+            reading = readBody(response)
+            reading.addCallback(lambda body: (
+                int(response.headers.getRawHeaders(GENERATION_HEADER)[0]),
+                loads(body)))
+            return reading
+        d.addCallback(got_response)
+        return d
+
+    def test_generation_header(self):
+        """
+        Responses give the generation of the configuration or cluster state
+        they list.
+        """
+        self.cluster_state_service.apply_changes(
+            [NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP)])
+        d = gatherResults([
+            self.get(b"/configuration/datasets"),
+            self.get(b"/configuration/containers"),
+            self.get(b"/state/datasets"),
+            self.get(b"/state/containers"),
+            self.get(b"/state/nodes"),
+        ])
+        configuration = self.persistence_service.configuration_generation()
+        state = self.cluster_state_service.state_generation()
+        d.addCallback(lambda results: self.assertEqual(
+            [configuration] * 2 + [state] * 3,
+            [generation for generation, _ in results]))
+        return d
+
+    def test_other_generation(self):
+        """
+        Given a generation other than the current one the response isn't
+        delayed.
+        """
+        generation = self.cluster_state_service.state_generation()
+        d = self.get(b"/state/nodes", generation + 100)
+        d.addCallback(self.assertEqual, (generation, []))
+        return d
+
+    def test_configuration_change(self):
+        """
+        Given the current generation of the configuration the response lists
+        the configuration once it changes, with its new generation.
+        """
+        d = self.get(
+            b"/configuration/containers",
+            self.persistence_service.configuration_generation())
+        application = Application(
+            name=u"web", image=DockerImage.from_string(u"nginx"))
+        self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID, applications={application})}))
+        d.addCallback(lambda result: self.assertEqual(
+            (self.persistence_service.configuration_generation(),
+             [u"web"]),
+            (result[0], [container[u"name"] for container in result[1]])))
+        return d
+
+    def test_state_change(self):
+        """
+        Given the current generation of the cluster state the response lists
+        the state once it changes, with its new generation.
+        """
+        d = self.get(
+            b"/state/nodes", self.cluster_state_service.state_generation())
+        self.cluster_state_service.apply_changes(
+            [NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP)])
+        d.addCallback(self.assertEqual, (
+            self.cluster_state_service.state_generation(),
+            [{u"host": self.NODE_A_IP, u"uuid": unicode(self.NODE_A_UUID)}]))
+        return d
+
+    def test_timeout(self):
+        """
+        If nothing changes the unchanged listing is returned once
+        ``WAIT_FOR_GENERATION_TIMEOUT`` has passed.
+        """
+        generation = self.cluster_state_service.state_generation()
+        d = self.get(b"/state/datasets", generation)
+        # The request may not have reached the API yet, so keep advancing
+        # the clock until it is answered:
+        advancing = LoopingCall(
+            self.clock.advance, WAIT_FOR_GENERATION_TIMEOUT)
+        advancing.start(0.01)
+        d.addBoth(lambda result: (advancing.stop(), result)[1])
+        d.addCallback(self.assertEqual, (generation, []))
+        return d
+
+    def test_invalid_generation(self):
+        """
+        A ``wait_for_generation`` query parameter which isn't a generation is
+        rejected.
+        """
+        return self.assertResponseCode(
+            b"GET", b"/state/nodes?wait_for_generation=abc", None,
+            BAD_REQUEST)
+
+
+RealTestsWaitForGeneration, MemoryTestsWaitForGeneration = (
+    buildIntegrationTests(
+        WaitForGenerationTestsMixin, "WaitForGeneration", _build_app))
+
+
+class EventsTests(APITestsMixin, AsyncTestCase):
+    """
+    Tests for the event stream at ``/events``.
+    """
+    def setUp(self):
+        super(EventsTests, self).setUp()
+        self.initialize()
+        self.api = ConfigurationAPIUserV1(
+            self.persistence_service, self.cluster_state_service, self.clock)
+
+    def follow(self, path=b"/events", headers=None):
+        """
+        Start following the event stream.
+
+        :param bytes path: The path to request.
+        :param dict headers: Map header names to lists of values.
+
+        :return: The ``_DummyRequest`` whose response is the stream.
+        """
+        request = dummyRequest(b"GET", path, Headers(headers or {}))
+        rendering = render(self.api.app.resource(), request)
+        rendering.addErrback(lambda reason: reason.trap(ConnectionDone))
+        # Simulate the client disconnecting:
+        self.addCleanup(
+            lambda: request._finishedChannel.errback(ConnectionDone()))
+        return request
+
+    def json_events(self, request):
+        """
+        :return: The ``list`` of events sent as JSON lines so far.
+        """
+        return [loads(line) for line in
+                request._responseBody.splitlines() if line]
+
+    def test_configuration_events(self):
+        """
+        Once a configuration change has been written, an event for each
+        dataset it changed is sent as a line of JSON.
+        """
+        request = self.follow()
+        manifestation = _manifestation()
+        d = self.persistence_service.save(Deployment(nodes={Node(
+            uuid=self.NODE_A_UUID,
+            manifestations={manifestation.dataset_id: manifestation})}))
+
+        def saved(_):
+            [event] = self.json_events(request)
+            self.assertEqual(
+                (b"application/x-ndjson", u"dataset_configuration",
+                 manifestation.dataset_id, self.NODE_A),
+                (request.responseHeaders.getRawHeaders(b"content-type")[0],
+                 event[u"type"], event[u"data"][u"dataset_id"],
+                 event[u"data"][u"primary"]))
+        d.addCallback(saved)
+        return d
+
+    def test_server_sent_events(self):
+        """
+        Given an ``Accept: text/event-stream`` header, events are sent as
+        Server-Sent Events.
+        """
+        request = self.follow(headers={b"accept": [b"text/event-stream"]})
+        self.cluster_state_service.apply_changes(
+            [NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP)])
+        self.assertEqual(
+            (b"text/event-stream",
+             b"id: %s\nevent: node_state\ndata: %s\n\n" % (
+                 self.api.events.cursor().encode("ascii"),
+                 dumps({u"uuid": self.NODE_A, u"host": self.NODE_A_IP}))),
+            (request.responseHeaders.getRawHeaders(b"content-type")[0],
+             request._responseBody))
+
+    def test_resume(self):
+        """
+        Given the cursor of an earlier event, the events after it are sent
+        straight away, followed by new ones.
+        """
+        changes = [NodeState(uuid=node_uuid, hostname=ip) for node_uuid, ip in
+                   [(self.NODE_A_UUID, self.NODE_A_IP),
+                    (self.NODE_B_UUID, self.NODE_B_IP)]]
+        self.cluster_state_service.apply_changes(changes[:1])
+        cursor = self.api.events.cursor()
+        self.cluster_state_service.apply_changes(changes[1:])
+        request = self.follow(headers={b"Last-Event-ID": [cursor]})
+        self.cluster_state_service.apply_changes(
+            [changes[0].set(hostname=u"192.0.2.3")])
+        self.assertEqual(
+            [(u"node_state", self.NODE_B_IP), (u"node_state", u"192.0.2.3")],
+            [(event[u"type"], event[u"data"][u"host"])
+             for event in self.json_events(request)])
+
+    def test_reset(self):
+        """
+        Given a cursor whose following events aren't known, such as one from
+        before the control service restarted, a ``reset`` event is sent
+        first.
+        """
+        request = self.follow(b"/events?cursor=abc-1")
+        self.assertEqual(
+            [{u"cursor": self.api.events.cursor(), u"type": u"reset",
+              u"data": {}}],
+            self.json_events(request))
+
+    def test_keepalive(self):
+        """
+        An empty line is sent every ``EVENTS_KEEPALIVE_INTERVAL`` seconds.
+        """
+        request = self.follow()
+        self.clock.advance(EVENTS_KEEPALIVE_INTERVAL)
+        self.clock.advance(EVENTS_KEEPALIVE_INTERVAL)
+        self.assertEqual(b"\n\n", request._responseBody)
+
+    def test_disconnect(self):
+        """
+        Nothing more is sent once the client disconnects.
+        """
+        request = self.follow()
+        request._finishedChannel.errback(ConnectionDone())
+        self.cluster_state_service.apply_changes(
+            [NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP)])
+        self.clock.advance(EVENTS_KEEPALIVE_INTERVAL)
+        self.assertEqual(
+            (b"", []), (request._responseBody, self.clock.getDelayedCalls()))
+
+
+class ListQueryTestsMixin(APITestsMixin):
+    """
+    Tests for the query parameters of the endpoints listing datasets and
+    containers.
+    """
+    def initialize(self):
+        super(ListQueryTestsMixin, self).initialize()
+        self.manifestations = [
+            _manifestation(metadata={u"name": u"db"}),
+            _manifestation(metadata={u"name": u"web"}),
+            _manifestation(metadata={u"name": u"logs"}, deleted=True),
+        ]
+        self.application = Application(
+            name=u"postgres", image=DockerImage.from_string(u"postgres"),
+            volume=AttachedVolume(
+                manifestation=self.manifestations[1],
+                mountpoint=FilePath(b"/var/lib/data")))
+        self.deployment = Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations={self.manifestations[0].dataset_id:
+                                 self.manifestations[0]}),
+            Node(uuid=self.NODE_B_UUID,
+                 applications={self.application},
+                 manifestations={
+                     manifestation.dataset_id: manifestation
+                     for manifestation in self.manifestations[1:]}),
+        })
+
+    def assert_dataset_ids(self, path, manifestations):
+        """
+        Assert the datasets a listing of dataset configuration returns.
+
+        :param bytes path: The path, with query, to request.
+        :param list manifestations: The manifestations of the datasets
+            expected in the response.
+
+        :return: ``Deferred`` that fires when test is done.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(
+            lambda _: self.assertResponseCode(b"GET", path, None, OK))
+        d.addCallback(readBody)
+        d.addCallback(lambda body: self.assertItemsEqual(
+            [manifestation.dataset_id for manifestation in manifestations],
+            [dataset[u"dataset_id"] for dataset in loads(body)]))
+        return d
+
+    def test_node_uuid(self):
+        """
+        ``node_uuid`` selects the datasets whose primary manifestation is on
+        the given node.
+        """
+        return self.assert_dataset_ids(
+            b"/configuration/datasets?node_uuid=" + bytes(self.NODE_B).upper(),
+            self.manifestations[1:])
+
+    def test_metadata(self):
+        """
+        A parameter named after a metadata key selects the datasets with the
+        given value for it.
+        """
+        return self.assert_dataset_ids(
+            b"/configuration/datasets?metadata.name=web",
+            self.manifestations[1:2])
+
+    def test_deleted(self):
+        """
+        ``deleted`` selects the datasets which have or haven't been deleted.
+        """
+        return self.assert_dataset_ids(
+            b"/configuration/datasets?deleted=false&node_uuid=" +
+            bytes(self.NODE_B),
+            self.manifestations[1:2])
+
+    def test_state_dataset_id(self):
+        """
+        ``dataset_id`` selects a dataset from the dataset state.
+        """
+        manifestation = self.manifestations[0]
+        self.cluster_state_service.apply_changes([NodeState(
+            uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP,
+            applications=None,
+            manifestations={manifestation.dataset_id: manifestation},
+            paths={manifestation.dataset_id: FilePath(b"/mnt/db")},
+            devices={})])
+        return self.assertResult(
+            b"GET", b"/state/datasets?dataset_id=" +
+            manifestation.dataset_id.encode("ascii"), None, OK,
+            [{u"dataset_id": manifestation.dataset_id,
+              u"primary": self.NODE_A, u"path": u"/mnt/db"}])
+
+    def test_containers_dataset_id(self):
+        """
+        ``dataset_id`` selects the containers using a dataset.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/containers?dataset_id=" +
+            self.manifestations[1].dataset_id.encode("ascii"), None, OK,
+            [container_configuration_response(
+                self.application, self.NODE_B_UUID)]))
+        return d
+
+    def test_paging(self):
+        """
+        ``limit`` limits the number of items listed, and the cursor in the
+        ``X-Next-Cursor`` header of the response lists the rest in later
+        pages.
+        """
+        pages = []
+
+        def get_page(cursor):
+            path = b"/configuration/datasets?limit=2"
+            if cursor is not None:
+                path += b"&cursor=" + cursor
+            d = self.assertResponseCode(b"GET", path, None, OK)
+
+            def got_response(response):
+                cursor = response.headers.getRawHeaders(
+                    NEXT_CURSOR_HEADER, [None])[0]
+                d = readBody(response)
+                d.addCallback(lambda body: pages.append(
+                    [dataset[u"dataset_id"] for dataset in loads(body)]))
+                if cursor is not None:
+                    d.addCallback(lambda _: get_page(cursor))
+                return d
+            d.addCallback(got_response)
+            return d
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: get_page(None))
+        d.addCallback(lambda _: self.assertEqual(
+            [2, sorted(manifestation.dataset_id
+                       for manifestation in self.manifestations)],
+            [len(pages), sum(pages, [])]))
+        return d
+
+    def test_unknown_parameter(self):
+        """
+        Query parameters the endpoint doesn't understand result in a
+        ``BAD_REQUEST`` response.
+        """
+        return self.assertResponseCode(
+            b"GET", b"/state/containers?deleted=true", None, BAD_REQUEST)
+
+    def test_invalid_cursor(self):
+        """
+        A cursor which wasn't returned by the endpoint results in a
+        ``BAD_REQUEST`` response.
+        """
+        return self.assertResult(
+            b"GET", b"/state/datasets?cursor=abcd", None, BAD_REQUEST,
+            {u"description": u"The provided cursor is not valid."})
+
+
+RealTestsListQuery, MemoryTestsListQuery = buildIntegrationTests(
+    ListQueryTestsMixin, "ListQuery", _build_app)
+
+
+class DatasetsByMetadataTestsMixin(APITestsMixin):
+    """
+    Tests for the endpoints at
+    ``/configuration/datasets/by_metadata/<key>/<value>``.
+    """
+    def initialize(self):
+        super(DatasetsByMetadataTestsMixin, self).initialize()
+        self.manifestations = [
+            _manifestation(metadata={u"name": u"db"}),
+            _manifestation(metadata={u"name": u"web"}),
+            _manifestation(metadata={u"name": u"web"}, deleted=True),
+        ]
+        self.deployment = Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations={self.manifestations[0].dataset_id:
+                                 self.manifestations[0]}),
+            Node(uuid=self.NODE_B_UUID,
+                 manifestations={
+                     manifestation.dataset_id: manifestation
+                     for manifestation in self.manifestations[1:]}),
+        })
+
+    def test_get(self):
+        """
+        The datasets with the given value for an indexed metadata key which
+        haven't been deleted are returned.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/datasets/by_metadata/name/web", None, OK,
+            [api_dataset_from_dataset_and_node(
+                self.manifestations[1].dataset, self.NODE_B_UUID)]))
+        return d
+
+    def test_get_none(self):
+        """
+        If no dataset has the value an empty list is returned.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/datasets/by_metadata/name/logs", None,
+            OK, []))
+        return d
+
+    def test_get_updated(self):
+        """
+        Changes to the configuration are reflected by the lookup.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"GET", b"/configuration/datasets/by_metadata/name/db", None, OK))
+        d.addCallback(lambda _: self.persistence_service.save(
+            self.deployment.update_node(Node(uuid=self.NODE_A_UUID))))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/datasets/by_metadata/name/db", None, OK,
+            []))
+        return d
+
+    def test_get_not_indexed(self):
+        """
+        Looking up a metadata key which is not indexed results in a
+        ``NOT_FOUND`` response.
+        """
+        return self.assertResult(
+            b"GET", b"/configuration/datasets/by_metadata/owner/alice", None,
+            NOT_FOUND, {u"description": u"The metadata key is not indexed."})
+
+    def test_create(self):
+        """
+        If no dataset has the value a dataset with it is created.
+        """
+        dataset_id = unicode(uuid4())
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResult(
+            b"POST", b"/configuration/datasets/by_metadata/name/logs",
+            {u"primary": self.NODE_A, u"dataset_id": dataset_id,
+             u"metadata": {u"owner": u"alice"}},
+            CREATED,
+            {u"primary": self.NODE_A, u"dataset_id": dataset_id,
+             u"metadata": {u"owner": u"alice", u"name": u"logs"},
+             u"deleted": False}))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/datasets/by_metadata/name/logs", None,
+            OK,
+            [{u"primary": self.NODE_A, u"dataset_id": dataset_id,
+              u"metadata": {u"owner": u"alice", u"name": u"logs"},
+              u"deleted": False}]))
+        return d
+
+    def test_create_collision(self):
+        """
+        If a dataset already has the value the response is ``CONFLICT`` and
+        no dataset is created.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResult(
+            b"POST", b"/configuration/datasets/by_metadata/name/web",
+            {u"primary": self.NODE_A}, CONFLICT,
+            {u"description":
+             u"A dataset with the given metadata value already exists."}))
+        d.addCallback(
+            lambda _: self.assertEqual(
+                self.deployment, self.persistence_service.get()))
+        return d
+
+    def test_create_concurrently(self):
+        """
+        Of several concurrent requests creating a dataset with the same value
+        only one succeeds.
+        """
+        path = b"/configuration/datasets/by_metadata/name/logs"
+        d = gatherResults([
+            self.agent.request(
+                b"POST", path,
+                Headers({b"content-type": [b"application/json"]}),
+                FileBodyProducer(BytesIO(dumps({u"primary": self.NODE_A}))))
+            for _ in range(3)])
+        d.addCallback(lambda responses: self.assertEqual(
+            [CREATED, CONFLICT, CONFLICT],
+            sorted(response.code for response in responses)))
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"GET", path, None, OK))
+        d.addCallback(readBody)
+        d.addCallback(lambda body: self.assertEqual(1, len(loads(body))))
+        return d
+
+
+RealTestsDatasetsByMetadata, MemoryTestsDatasetsByMetadata = (
+    buildIntegrationTests(
+        DatasetsByMetadataTestsMixin, "DatasetsByMetadata", _build_app))
+
+
+class BulkDatasetsTestsMixin(APITestsMixin):
+    """
+    Tests for the bulk dataset endpoint at ``/configuration/datasets/_bulk``.
+    """
+    def initialize(self):
+        super(BulkDatasetsTestsMixin, self).initialize()
+        self.manifestations = [
+            _manifestation(), _manifestation(), _manifestation(deleted=True)]
+        self.deployment = Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations={
+                     manifestation.dataset_id: manifestation
+                     for manifestation in self.manifestations}),
+        })
+
+    def bulk(self, operations, results):
+        """
+        Save the initial configuration, then assert the results of a bulk
+        request.
+
+        :param list operations: The operations of the request.
+        :param list results: The expected results.
+
+        :return: ``Deferred`` that fires when test is done.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResult(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": operations}, OK, {u"results": results}))
+        return d
+
+    def test_operations(self):
+        """
+        Each kind of operation is applied to the configuration and its
+        result is returned.
+        """
+        new_id = unicode(uuid4())
+        moved, resized = [
+            manifestation.dataset for manifestation in self.manifestations[:2]]
+        d = self.bulk(
+            [{u"operation": u"create", u"primary": self.NODE_B,
+              u"dataset_id": new_id, u"metadata": {u"name": u"new"}},
+             {u"operation": u"move", u"dataset_id": moved.dataset_id,
+              u"primary": self.NODE_B},
+             {u"operation": u"resize", u"dataset_id": resized.dataset_id,
+              u"maximum_size": 1024 * 1024 * 1024},
+             {u"operation": u"delete", u"dataset_id": new_id}],
+            [{u"status": CREATED,
+              u"dataset": {u"dataset_id": new_id, u"primary": self.NODE_B,
+                           u"metadata": {u"name": u"new"},
+                           u"deleted": False}},
+             {u"status": OK,
+              u"dataset": api_dataset_from_dataset_and_node(
+                  moved, self.NODE_B_UUID)},
+             {u"status": OK,
+              u"dataset": api_dataset_from_dataset_and_node(
+                  resized.set(maximum_size=1024 * 1024 * 1024),
+                  self.NODE_A_UUID)},
+             {u"status": OK,
+              u"dataset": {u"dataset_id": new_id, u"primary": self.NODE_B,
+                           u"metadata": {u"name": u"new"},
+                           u"deleted": True}}])
+
+        def saved(_):
+            deployment = self.persistence_service.get()
+            self.assertEqual(
+                ({self.NODE_B_UUID}, 1024 * 1024 * 1024, True),
+                (set(deployment.get_dataset_manifestations(moved.dataset_id)),
+                 deployment.get_dataset_manifestations(resized.dataset_id)[
+                     self.NODE_A_UUID].dataset.maximum_size,
+                 deployment.get_dataset_manifestations(new_id)[
+                     self.NODE_B_UUID].dataset.deleted))
+        d.addCallback(saved)
+        return d
+
+    def test_failed_operations(self):
+        """
+        Operations that fail get the error the equivalent single dataset
+        request would get, without preventing the others.
+        """
+        existing, other, deleted = [
+            manifestation.dataset for manifestation in self.manifestations]
+        new_id = unicode(uuid4())
+        d = self.bulk(
+            [{u"operation": u"create", u"primary": self.NODE_B,
+              u"dataset_id": existing.dataset_id},
+             {u"operation": u"move", u"dataset_id": deleted.dataset_id,
+              u"primary": self.NODE_B},
+             {u"operation": u"delete", u"dataset_id": unicode(uuid4())},
+             {u"operation": u"create", u"primary": self.NODE_A,
+              u"dataset_id": new_id}],
+            [{u"status": CONFLICT,
+              u"description": u"The provided dataset_id is already in use."},
+             {u"status": METHOD_NOT_ALLOWED,
+              u"description": u"The dataset has been deleted."},
+             {u"status": NOT_FOUND, u"description": u"Dataset not found."},
+             {u"status": CREATED,
+              u"dataset": {u"dataset_id": new_id, u"primary": self.NODE_A,
+                           u"metadata": {}, u"deleted": False}}])
+        d.addCallback(lambda _: self.assertEqual(
+            set(self.deployment.get_node(
+                self.NODE_A_UUID).manifestations) | {new_id},
+            set(self.persistence_service.get().get_node(
+                self.NODE_A_UUID).manifestations)))
+        return d
+
+    def test_one_save(self):
+        """
+        The configuration is saved once for all of the operations.
+        """
+        generation = []
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: generation.append(
+            self.persistence_service.configuration_generation()))
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"operation": u"create", u"primary": self.NODE_A}
+                for i in range(5)]}, OK))
+        d.addCallback(lambda _: self.assertEqual(
+            generation[0] + 1,
+            self.persistence_service.configuration_generation()))
+        return d
+
+    def test_configuration_changed(self):
+        """
+        If ``X-If-Configuration-Matches`` doesn't match the configuration
+        none of the operations are applied.
+        """
+        d = self.persistence_service.save(self.deployment)
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"operation": u"create", u"primary": self.NODE_A}]},
+            PRECONDITION_FAILED, {IF_MATCHES_HEADER: [b"willnotmatch"]}))
+        d.addCallback(lambda _: self.assertEqual(
+            self.deployment, self.persistence_service.get()))
+        return d
+
+    def test_invalid_operation(self):
+        """
+        An operation which doesn't match the schema results in a
+        ``BAD_REQUEST`` response.
+        """
+        return self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"operation": u"move", u"dataset_id": unicode(uuid4())}]},
+            BAD_REQUEST)
+
+
+RealTestsBulkDatasets, MemoryTestsBulkDatasets = buildIntegrationTests(
+    BulkDatasetsTestsMixin, "BulkDatasets", _build_app)
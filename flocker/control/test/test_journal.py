@@ -0,0 +1,99 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._journal``.
+"""
+
+from twisted.python.filepath import FilePath
+
+from .._journal import Journal, atomic_write, read_journal
+from ...testtools import TestCase
+
+
+class AtomicWriteTests(TestCase):
+    """
+    Tests for ``atomic_write``.
+    """
+    def test_replaces(self):
+        """
+        The file's contents are replaced and no temporary file is left
+        behind.
+        """
+        directory = FilePath(self.mktemp())
+        directory.makedirs()
+        path = directory.child(b"file")
+        path.setContent(b"old")
+        atomic_write(path, b"new")
+        self.assertEqual(
+            (b"new", [b"file"]),
+            (path.getContent(), directory.listdir()))
+
+
+class JournalTests(TestCase):
+    """
+    Tests for ``Journal`` and ``read_journal``.
+    """
+    def setUp(self):
+        super(JournalTests, self).setUp()
+        directory = FilePath(self.mktemp())
+        directory.makedirs()
+        self.path = directory.child(b"journal")
+
+    def test_missing(self):
+        """
+        A journal that doesn't exist has no records.
+        """
+        self.assertEqual(([], 0), read_journal(self.path))
+
+    def test_records(self):
+        """
+        The records a journal was created with and those appended to it are
+        read back in order.
+        """
+        journal = Journal.create(self.path, [b"a", b"b"])
+        journal.append(b"c")
+        journal.close()
+        self.assertEqual(
+            ([b"a", b"b", b"c"], self.path.getsize()),
+            read_journal(self.path))
+
+    def test_create_replaces(self):
+        """
+        ``Journal.create`` discards the records of an existing journal.
+        """
+        Journal.create(self.path, [b"a"]).close()
+        Journal.create(self.path, [b"b"]).close()
+        self.assertEqual([b"b"], read_journal(self.path)[0])
+
+    def test_interrupted_append(self):
+        """
+        A partly written record at the end of the journal is not read.
+        """
+        Journal.create(self.path, [b"a"]).close()
+        length = self.path.getsize()
+        with self.path.open("a") as f:
+            f.write(b"0000")
+        self.assertEqual(([b"a"], length), read_journal(self.path))
+
+    def test_corrupt(self):
+        """
+        Records from one which fails its checksum onwards are not read.
+        """
+        journal = Journal.create(self.path, [b"a", b"b", b"c"])
+        journal.close()
+        content = self.path.getContent()
+        self.path.setContent(content.replace(b" b\n", b" x\n"))
+        self.assertEqual([b"a"], read_journal(self.path)[0])
+
+    def test_open_truncates(self):
+        """
+        ``Journal.open`` drops the remains of an interrupted append so that
+        further records follow the intact ones.
+        """
+        Journal.create(self.path, [b"a"]).close()
+        with self.path.open("a") as f:
+            f.write(b"0000")
+        journal = Journal.open(self.path, read_journal(self.path)[1])
+        journal.append(b"b")
+        journal.close()
+        self.assertEqual([b"a", b"b"], read_journal(self.path)[0])
@@ -21,7 +21,10 @@ from hypothesis.strategies import sampled_from
 from zope.interface.verify import verifyObject
 
 from ...testtools import make_with_init_tests, TestCase
-from .._model import pset_field, pmap_field, pvector_field, ip_to_uuid
+from .._model import (
+    pset_field, pmap_field, pvector_field, ip_to_uuid, uuid_indexed_pset_field,
+    _WipeNodeState,
+)
 
 from .. import (
     IClusterStateChange, IClusterStateWipe,
@@ -434,6 +437,17 @@ class NonManifestDatasetsTests(TestCase):
             datasets, thaw(updated.nonmanifest_datasets)
         )
 
+    def test_update_cluster_state_unchanged(self):
+        """
+        ``NonManifestDatasets.update_cluster_state`` returns the given
+        ``DeploymentState`` itself if it already has the same datasets.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        nonmanifest = NonManifestDatasets(
+            datasets={dataset.dataset_id: dataset})
+        deployment = nonmanifest.update_cluster_state(DeploymentState())
+        self.assertIs(deployment, nonmanifest.update_cluster_state(deployment))
+
 
 class DeploymentInitTests(make_with_init_tests(
         record_type=Deployment,
@@ -503,6 +517,115 @@ class GetNodeTests(TestCase):
         )
 
 
+class GetDatasetManifestationsTests(TestCase):
+    """
+    Tests for ``Deployment.get_dataset_manifestations`` and
+    ``DeploymentState.get_dataset_manifestations``.
+    """
+    def setUp(self):
+        super(GetDatasetManifestationsTests, self).setUp()
+        self.replica = MANIFESTATION.set(primary=False)
+        self.node_state = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.1",
+            manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+            paths={MANIFESTATION.dataset_id: FilePath(b"/flocker/a")},
+            devices={},
+        )
+        self.other_node_state = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.2",
+            manifestations={MANIFESTATION.dataset_id: self.replica},
+            paths={MANIFESTATION.dataset_id: FilePath(b"/flocker/a")},
+            devices={},
+        )
+
+    def assert_manifestations(self, expected, deployment):
+        """
+        ``get_dataset_manifestations`` of ``MANIFESTATION``'s dataset finds
+        the expected manifestations, both given ``deployment`` and given an
+        equal object whose index is built from scratch.
+        """
+        self.assertEqual(
+            (expected, expected),
+            (deployment.get_dataset_manifestations(MANIFESTATION.dataset_id),
+             deployment.set(nodes=list(deployment.nodes))
+             .get_dataset_manifestations(MANIFESTATION.dataset_id)),
+        )
+
+    def test_deployment(self):
+        """
+        The manifestations of a dataset in a ``Deployment`` are found, keyed
+        by node UUID.
+        """
+        node = Node(uuid=uuid4(), manifestations={
+            MANIFESTATION.dataset_id: MANIFESTATION})
+        self.assert_manifestations(
+            {node.uuid: MANIFESTATION},
+            Deployment(nodes={node, Node(uuid=uuid4())}))
+
+    def test_unknown_dataset(self):
+        """
+        A dataset that is not in the ``Deployment`` has no manifestations.
+        """
+        self.assertEqual(
+            {}, Deployment(nodes={Node(uuid=uuid4())})
+            .get_dataset_manifestations(MANIFESTATION.dataset_id))
+
+    def test_deployment_state(self):
+        """
+        The manifestations of a dataset in a ``DeploymentState`` are found,
+        ignoring nodes whose manifestations are unknown.
+        """
+        self.assert_manifestations(
+            {self.node_state.uuid: MANIFESTATION,
+             self.other_node_state.uuid: self.replica},
+            DeploymentState(nodes={
+                self.node_state, self.other_node_state,
+                NodeState(uuid=uuid4(), hostname=u"192.0.2.3"),
+            }))
+
+    def test_update_node(self):
+        """
+        The index of a ``Deployment`` updated by ``update_node`` reflects the
+        update.
+        """
+        node = Node(uuid=uuid4(), manifestations={
+            MANIFESTATION.dataset_id: MANIFESTATION})
+        deployment = Deployment(nodes={node})
+        deployment.get_dataset_manifestations(MANIFESTATION.dataset_id)
+        moved = Node(uuid=uuid4(), manifestations={
+            MANIFESTATION.dataset_id: MANIFESTATION})
+        deployment = deployment.update_node(
+            node.set(manifestations={})).update_node(moved)
+        self.assert_manifestations({moved.uuid: MANIFESTATION}, deployment)
+
+    def test_update_node_state(self):
+        """
+        The index of a ``DeploymentState`` updated by ``update_node`` or
+        ``remove_node`` reflects the update.
+        """
+        state = DeploymentState(nodes={self.node_state})
+        state.get_dataset_manifestations(MANIFESTATION.dataset_id)
+        state = state.update_node(self.other_node_state).remove_node(
+            self.node_state.uuid)
+        self.assert_manifestations(
+            {self.other_node_state.uuid: self.replica}, state)
+
+    def test_wipe(self):
+        """
+        The index of a ``DeploymentState`` with node information wiped
+        reflects the wipe.
+        """
+        state = DeploymentState(nodes={
+            self.node_state, self.other_node_state})
+        state.get_dataset_manifestations(MANIFESTATION.dataset_id)
+        state = _WipeNodeState(
+            node_uuid=self.node_state.uuid,
+            attributes=["manifestations", "paths", "devices"],
+        ).update_cluster_state(state)
+        self.assert_manifestations(
+            {self.other_node_state.uuid: self.replica}, state)
+
+
 class DeploymentTests(TestCase):
     """
     Tests for ``Deployment``.
@@ -918,6 +1041,93 @@ class PSetFieldTests(TestCase):
                 ("SomethingPSet", "IntPSet"))
 
 
+class UUIDIndexedPSetFieldTests(TestCase):
+    """
+    Tests for ``uuid_indexed_pset_field``.
+    """
+    def setUp(self):
+        super(UUIDIndexedPSetFieldTests, self).setUp()
+
+        class Record(PClass):
+            value = uuid_indexed_pset_field(Node)
+        self.record_class = Record
+        self.node = Node(uuid=uuid4())
+        self.other_node = Node(uuid=uuid4())
+
+    def test_set(self):
+        """
+        The field holds a ``PSet`` equal to a ``pset`` of the same nodes.
+        """
+        record = self.record_class(value=[self.node, self.other_node])
+        self.assertEqual(
+            (True, pset([self.node, self.other_node]), 2),
+            (isinstance(record.value, PSet), record.value, len(record.value)),
+        )
+
+    def test_get(self):
+        """
+        Nodes can be looked up by UUID.
+        """
+        record = self.record_class(value=[self.node])
+        self.assertEqual(
+            (self.node, None),
+            (record.value.get(self.node.uuid),
+             record.value.get(self.other_node.uuid)),
+        )
+
+    def test_add_replaces(self):
+        """
+        Adding a node replaces any node with the same UUID.
+        """
+        updated = self.node.transform(
+            ["applications"], lambda s: s.add(APP1))
+        record = self.record_class(value=[self.node, self.other_node])
+        self.assertEqual(
+            pset([updated, self.other_node]), record.value.add(updated))
+
+    def test_contains(self):
+        """
+        A node is only a member if it is equal to the node stored for its
+        UUID.
+        """
+        record = self.record_class(value=[self.node])
+        self.assertEqual(
+            (True, False, False),
+            (self.node in record.value,
+             self.node.set(applications=[APP1]) in record.value,
+             self.other_node in record.value),
+        )
+
+    def test_remove(self):
+        """
+        Removing a node that isn't a member raises ``KeyError``, while
+        discarding it does nothing.
+        """
+        record = self.record_class(value=[self.node])
+        self.assertEqual(
+            (pset(), record.value),
+            (record.value.remove(self.node),
+             record.value.discard(self.other_node)),
+        )
+        self.assertRaises(KeyError, record.value.remove, self.other_node)
+
+    def test_checked_set(self):
+        """
+        The set enforces its type.
+        """
+        record = self.record_class()
+        self.assertRaises(TypeError, record.value.add, NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.1"))
+
+    def test_not_rebuilt(self):
+        """
+        Setting the field to a set of the right type keeps that set.
+        """
+        record = self.record_class(value=[self.node])
+        self.assertIs(
+            record.value, self.record_class(value=record.value).value)
+
+
 class PVectorFieldTests(TestCase):
     """
     Tests for ``pvector_field``.
@@ -1353,7 +1563,7 @@ class DeploymentStateTests(TestCase):
         """
         original = DeploymentState(
             nodes=[NodeState(hostname=u"1.2.2.4", uuid=uuid4())])
-        self.assertEqual(original, original.remove_node(uuid4()))
+        self.assertIs(original, original.remove_node(uuid4()))
 
 
 class SameNodeTests(TestCase):
@@ -1765,7 +1975,7 @@ class UpdateNodeStateEraTests(TestCase):
         state = self.NODE_STATE.update_cluster_state(state)
 
         updated_state = self.UPDATE_ERA_1.update_cluster_state(state)
-        self.assertEqual(state, updated_state)
+        self.assertIs(state, updated_state)
 
     def test_different_era(self):
         """
@@ -12,13 +12,15 @@ from uuid import uuid4, UUID
 from pytz import UTC
 
 from eliot.testing import (
-    validate_logging, assertHasMessage, assertHasAction, capture_logging)
+    validate_logging, assertHasMessage, assertHasAction, capture_logging,
+    LoggedAction)
 
 from hypothesis import given
 from hypothesis import strategies as st
 from hypothesis.extra.datetime import datetimes
 
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
 
@@ -31,7 +33,10 @@ from .._persistence import (
     _CONFIG_VERSION, ConfigurationMigration, ConfigurationMigrationError,
     _LOG_UPGRADE, MissingMigrationError, update_leases, _LOG_EXPIRE,
     _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED, to_unserialized_json,
+    FragmentCache, splicing_wire_encode, _LOG_COMPACT,
+    _LOG_JOURNAL_DISCARDED,
     )
+from .._journal import read_journal
 from .._model import (
     Deployment, Application, DockerImage, Node, Dataset, Manifestation,
     AttachedVolume, SERIALIZABLE_CLASSES, NodeState, Configuration,
@@ -302,8 +307,11 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         loaded_configuration = wire_decode(config_path.getContent())
         self.assertEqual(loaded_configuration, persisted_configuration)
 
-    @validate_logging(assertHasAction, _LOG_SAVE, succeeded=True,
-                      startFields=dict(configuration=TEST_DEPLOYMENT))
+    @validate_logging(
+        lambda test, logger: assertHasAction(
+            test, logger, _LOG_SAVE, succeeded=True,
+            startFields=dict(generation=test.generation,
+                             configuration_hash=test.configuration_hash)))
     def test_save_then_get(self, logger):
         """
         A configuration that was saved can subsequently retrieved.
@@ -311,6 +319,8 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         service = self.service(FilePath(self.mktemp()), logger)
         logger.reset()
         d = service.save(TEST_DEPLOYMENT)
+        self.generation = service.configuration_generation()
+        self.configuration_hash = service.configuration_hash()
         d.addCallback(lambda _: service.get())
         d.addCallback(self.assertEqual, TEST_DEPLOYMENT)
         return d
@@ -357,6 +367,22 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         d.addCallback(saved_again)
         return d
 
+    def test_register_with_configurations(self):
+        """
+        Callbacks registered with ``with_configurations`` are called with the
+        configuration written before a change and the one written by it.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        original = service.get()
+        changes = []
+        service.register(
+            lambda previous, written: changes.append((previous, written)),
+            with_configurations=True)
+        d = service.save(TEST_DEPLOYMENT)
+        d.addCallback(lambda _: self.assertEqual(
+            [(original, TEST_DEPLOYMENT)], changes))
+        return d
+
     @validate_logging(
         lambda test, logger:
         test.assertEqual(len(logger.flush_tracebacks(ZeroDivisionError)), 1))
@@ -484,6 +510,371 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         d.addCallback(saved)
         return d
 
+    def test_generation_on_save(self):
+        """
+        The configuration generation increases when a new version is saved,
+        and stays the same when an unchanged configuration is saved.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        generations = [service.configuration_generation()]
+        d = service.save(TEST_DEPLOYMENT)
+
+        def saved(_):
+            generations.append(service.configuration_generation())
+            return service.save(TEST_DEPLOYMENT)
+        d.addCallback(saved)
+
+        def saved_again(_):
+            generations.append(service.configuration_generation())
+            self.assertEqual(
+                [generations[0], generations[0] + 1, generations[0] + 1],
+                generations,
+            )
+        d.addCallback(saved_again)
+        return d
+
+    def test_wait_for_configuration_change(self):
+        """
+        ``ConfigurationPersistenceService.wait_for_configuration_change``
+        fires with the new generation as soon as a changed configuration is
+        saved.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        d = service.wait_for_configuration_change(
+            service.configuration_generation())
+        self.assertNoResult(d)
+        service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (service.configuration_generation(), TEST_DEPLOYMENT),
+            (self.successResultOf(d), service.get()))
+
+
+class ConfigurationJournalTests(TestCase):
+    """
+    Tests for the journal of changes kept by
+    ``ConfigurationPersistenceService``.
+    """
+    def setUp(self):
+        super(ConfigurationJournalTests, self).setUp()
+        self.path = FilePath(self.mktemp())
+
+    def service(self, compaction_threshold=10, logger=None):
+        """
+        Start a service, schedule its stop.
+
+        :param int compaction_threshold: The number of changes after which the
+            configuration is written out in full.
+        :param logger: Optional eliot ``Logger`` to set before startup.
+
+        :return: Started ``ConfigurationPersistenceService``.
+        """
+        service = ConfigurationPersistenceService(
+            Clock(), self.path, compaction_threshold=compaction_threshold)
+        if logger is not None:
+            self.patch(service, "logger", logger)
+        service.startService()
+
+        def stop():
+            # Some tests stop the service themselves:
+            if service.running:
+                service.stopService()
+        self.addCleanup(stop)
+        return service
+
+    def restarted(self, service, logger=None):
+        """
+        :param service: A running ``ConfigurationPersistenceService``.
+        :param logger: Optional eliot ``Logger`` for the new service.
+
+        :return: The configuration loaded by a new service using the same
+            directory once ``service`` is stopped.
+        """
+        service.stopService()
+        return self.service(logger=logger).get()
+
+    def test_single_file_adopted(self):
+        """
+        A configuration stored by an earlier release without a journal is
+        loaded unchanged, and a journal is started for changes to it.
+        """
+        self.path.makedirs()
+        config_path = self.path.child(b"current_configuration.json")
+        data = wire_encode(Configuration(
+            version=_CONFIG_VERSION, deployment=TEST_DEPLOYMENT))
+        config_path.setContent(data)
+        service = self.service()
+        self.assertEqual(
+            (TEST_DEPLOYMENT, data, 1),
+            (service.get(), config_path.getContent(),
+             len(read_journal(self.path.child(b"configuration_journal"))[0])),
+        )
+
+    def test_save_appends(self):
+        """
+        Saving a change appends it to the journal rather than rewriting the
+        whole configuration.
+        """
+        service = self.service()
+        config_path = self.path.child(b"current_configuration.json")
+        original = config_path.getContent()
+        service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (original, 2),
+            (config_path.getContent(),
+             len(read_journal(self.path.child(b"configuration_journal"))[0])),
+        )
+
+    def test_replayed(self):
+        """
+        Changes in the journal are applied to the stored configuration at
+        startup.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        changed = TEST_DEPLOYMENT.transform(
+            ("nodes",), lambda nodes: nodes.add(Node(uuid=uuid4())))
+        service.save(changed)
+        self.assertEqual(changed, self.restarted(service))
+
+    @validate_logging(
+        lambda test, logger: test.assertEqual(
+            [0, 2],
+            [action.startMessage[u"journal_records"] for action in
+             LoggedAction.ofType(logger.messages, _LOG_COMPACT)]))
+    def test_compaction(self, logger):
+        """
+        Once the journal holds enough changes, the whole configuration is
+        written out and a new journal started, as it also is when the service
+        first starts.
+        """
+        service = self.service(compaction_threshold=2, logger=logger)
+        configurations = [TEST_DEPLOYMENT]
+        for i in range(2):
+            configurations.append(configurations[-1].transform(
+                ("nodes",), lambda nodes: nodes.add(Node(uuid=uuid4()))))
+        for configuration in configurations:
+            service.save(configuration)
+        stored = wire_decode(
+            self.path.child(b"current_configuration.json").getContent())
+        self.assertEqual(
+            (configurations[-1], 1),
+            (stored.deployment,
+             len(read_journal(self.path.child(b"configuration_journal"))[0])),
+        )
+
+    @validate_logging(assertHasMessage, _LOG_JOURNAL_DISCARDED,
+                      dict(discarded_bytes=5))
+    def test_interrupted_append(self, logger):
+        """
+        The remains of a change whose writing was interrupted are discarded
+        at startup.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        with self.path.child(b"configuration_journal").open("a") as f:
+            f.write(b"01234")
+        self.assertEqual(TEST_DEPLOYMENT, self.restarted(service, logger))
+
+    def test_superseded_journal(self):
+        """
+        A journal left behind by a crash after the configuration was written
+        out in full, but before a new journal replaced the old one, is
+        ignored.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        changed = TEST_DEPLOYMENT.transform(
+            ("nodes",), lambda nodes: nodes.add(Node(uuid=uuid4())))
+        self.path.child(b"current_configuration.json").setContent(
+            wire_encode(Configuration(
+                version=_CONFIG_VERSION, deployment=changed)))
+        self.assertEqual(changed, self.service().get())
+
+    def test_hash_after_compaction(self):
+        """
+        The configuration hash changes when a change causes the configuration
+        to be written out in full, and persists across restarts.
+        """
+        service = self.service(compaction_threshold=1)
+        service.save(TEST_DEPLOYMENT)
+        before = service.configuration_hash()
+        service.save(TEST_DEPLOYMENT.set(nodes=[]))
+        after = service.configuration_hash()
+        service.stopService()
+        self.assertEqual(
+            (True, after),
+            (before != after, self.service().configuration_hash()))
+
+    def test_hash_after_change(self):
+        """
+        The configuration hash changes as soon as a change is saved, and
+        persists across restarts.
+        """
+        service = self.service()
+        before = service.configuration_hash()
+        service.save(TEST_DEPLOYMENT)
+        after = service.configuration_hash()
+        service.stopService()
+        self.assertEqual(
+            (True, after),
+            (before != after, self.service().configuration_hash()))
+
+
+class GroupCommitTests(TestCase):
+    """
+    Tests for the batching of writes by ``ConfigurationPersistenceService``.
+    """
+    def setUp(self):
+        super(GroupCommitTests, self).setUp()
+        self.service = ConfigurationPersistenceService(
+            Clock(), FilePath(self.mktemp()))
+        self.service.startService()
+
+        def stop():
+            # Some tests stop the service themselves:
+            if self.service.running:
+                return self.service.stopService()
+        self.addCleanup(stop)
+        # Each write finishes only when the test says so:
+        self.writes = []
+        sync_save = self.service._sync_save
+
+        def write(previous, deployment, tag):
+            d = Deferred()
+            d.addCallback(
+                lambda _: sync_save(previous, deployment, tag))
+            self.writes.append((deployment, d))
+            return d
+        self.patch(self.service, "_sync_save", write)
+        self.configurations = [TEST_DEPLOYMENT]
+        for i in range(2):
+            self.configurations.append(self.configurations[-1].transform(
+                ("nodes",), lambda nodes: nodes.add(Node(uuid=uuid4()))))
+
+    def finish_write(self):
+        """
+        Finish the oldest write in progress.
+        """
+        self.writes.pop(0)[1].callback(None)
+
+    def test_batched(self):
+        """
+        Changes saved while a write is in progress are written together once
+        it finishes.
+        """
+        for configuration in self.configurations:
+            self.service.save(configuration)
+        self.finish_write()
+        self.assertEqual(
+            [self.configurations[-1]],
+            [deployment for (deployment, _) in self.writes])
+
+    def test_result_after_write(self):
+        """
+        The ``Deferred`` returned by ``save`` fires once the change is
+        written, though ``get`` returns it immediately.
+        """
+        first = self.service.save(self.configurations[0])
+        second = self.service.save(self.configurations[1])
+        self.finish_write()
+        self.assertEqual(
+            (None, self.configurations[1]),
+            (self.successResultOf(first), self.service.get()))
+        self.assertNoResult(second)
+        self.finish_write()
+        self.successResultOf(second)
+
+    def test_callbacks_after_write(self):
+        """
+        Registered callbacks are called once per write, after it finishes.
+        """
+        callbacks = []
+        self.service.register(lambda: callbacks.append(None))
+        for configuration in self.configurations:
+            self.service.save(configuration)
+        before = len(callbacks)
+        self.finish_write()
+        self.finish_write()
+        self.assertEqual((0, 2), (before, len(callbacks)))
+
+    def test_failed_write(self):
+        """
+        If a write fails the ``Deferred`` returned by ``save`` fails, as do
+        those of saves made since, which were based on the failed change.
+        """
+        first = self.service.save(self.configurations[0])
+        second = self.service.save(self.configurations[1])
+        self.writes.pop(0)[1].errback(ZeroDivisionError())
+        self.failureResultOf(first, ZeroDivisionError)
+        self.failureResultOf(second, ZeroDivisionError)
+        self.assertEqual([], self.writes)
+
+    def test_failed_write_reverts(self):
+        """
+        If a write fails, ``get``, ``configuration_hash`` and
+        ``configuration_generation`` return what they did before the failed
+        save.
+        """
+        service = self.service
+        before = (service.get(), service.configuration_hash(),
+                  service.configuration_generation())
+        saving = service.save(self.configurations[0])
+        self.writes.pop(0)[1].errback(ZeroDivisionError())
+        self.failureResultOf(saving, ZeroDivisionError)
+        self.assertEqual(
+            before,
+            (service.get(), service.configuration_hash(),
+             service.configuration_generation()))
+
+    def test_failed_write_generation(self):
+        """
+        Those waiting for the generation of a configuration whose write
+        failed are told of the reverted generation, and the generation isn't
+        given to a later save.
+        """
+        service = self.service
+        before = service.configuration_generation()
+        saving = service.save(self.configurations[0])
+        failed = service.configuration_generation()
+        waiting = service.wait_for_configuration_change(failed)
+        self.writes.pop(0)[1].errback(ZeroDivisionError())
+        self.failureResultOf(saving, ZeroDivisionError)
+        service.save(self.configurations[1])
+        self.assertEqual(
+            (before, True),
+            (self.successResultOf(waiting),
+             service.configuration_generation() > failed))
+
+    def test_written_configuration(self):
+        """
+        ``written_configuration`` and ``written_configuration_generation``
+        return the configuration last written and its generation, rather
+        than one still being written.
+        """
+        service = self.service
+        service.save(self.configurations[0])
+        self.finish_write()
+        generation = service.configuration_generation()
+        service.save(self.configurations[1])
+        self.assertEqual(
+            (self.configurations[0], generation),
+            (service.written_configuration(),
+             service.written_configuration_generation()))
+
+    def test_stop_waits(self):
+        """
+        Stopping the service waits for writes in progress to finish.
+        """
+        self.service.save(self.configurations[0])
+        self.service.save(self.configurations[1])
+        d = self.service.stopService()
+        self.assertNoResult(d)
+        self.finish_write()
+        self.assertNoResult(d)
+        self.finish_write()
+        self.successResultOf(d)
+
 
 class StubMigration(object):
     """
@@ -743,6 +1134,126 @@ class WireEncodeDecodeTests(TestCase):
         self.assertRaises(ValueError, wire_encode, datetime.now())
 
 
+class _RecordingFragmentCache(FragmentCache):
+    """
+    A ``FragmentCache`` which records the objects whose encodings it is
+    given.
+
+    :ivar list added: The objects given to ``put``.
+    """
+    def __init__(self, classes, size):
+        FragmentCache.__init__(self, classes, size)
+        self.added = []
+
+    def put(self, obj, fragment):
+        self.added.append(obj)
+        FragmentCache.put(self, obj, fragment)
+
+
+class FragmentCacheTests(TestCase):
+    """
+    Tests for ``FragmentCache``.
+    """
+    def test_identity(self):
+        """
+        Encodings are only found for the very objects they were given for,
+        not for objects which are merely equal.
+        """
+        fragments = FragmentCache([Node], 10)
+        node = Node(uuid=uuid4())
+        fragments.put(node, b"encoded")
+        self.assertEqual(
+            (b"encoded", None),
+            (fragments.get(node), fragments.get(Node(uuid=node.uuid))),
+        )
+
+    def test_size(self):
+        """
+        Only the given number of encodings is remembered.
+        """
+        fragments = FragmentCache([Node], 1)
+        node = Node(uuid=uuid4())
+        fragments.put(node, b"encoded")
+        fragments.put(Node(uuid=uuid4()), b"other")
+        self.assertIs(None, fragments.get(node))
+
+    def test_statistics(self):
+        """
+        ``FragmentCache`` counts the lookups which found an encoding and
+        those which didn't.
+        """
+        fragments = FragmentCache([Node], 10)
+        node = Node(uuid=uuid4())
+        fragments.get(node)
+        fragments.put(node, b"encoded")
+        fragments.get(node)
+        fragments.get(node)
+        self.assertEqual((2, 1), (fragments.hits, fragments.misses))
+
+
+class SplicingWireEncodeTests(TestCase):
+    """
+    Tests for ``splicing_wire_encode``.
+    """
+    @given(DEPLOYMENTS)
+    def test_roundtrip(self, deployment):
+        """
+        Objects encoded by ``splicing_wire_encode`` are decoded by
+        ``wire_decode``, whether or not encodings of their parts are reused.
+        """
+        fragments = FragmentCache([Node, Manifestation], 100)
+        self.assertEqual(
+            (deployment, deployment),
+            (wire_decode(splicing_wire_encode(deployment, fragments)),
+             wire_decode(splicing_wire_encode(deployment, fragments))),
+        )
+
+    def test_complex_keys(self):
+        """
+        ``PMap`` attributes with keys which are not strings are encoded.
+        """
+        node_state = NodeState(hostname=u'127.0.0.1', uuid=uuid4(),
+                               manifestations={}, paths={},
+                               devices={uuid4(): FilePath(b"/tmp")})
+        self.assertEqual(
+            node_state,
+            wire_decode(
+                splicing_wire_encode(node_state, FragmentCache([], 1))),
+        )
+
+    def test_datetime(self):
+        """
+        A datetime with a timezone is encoded like ``wire_encode`` does.
+        """
+        dt = datetime.now(tz=UTC)
+        self.assertEqual(
+            wire_decode(wire_encode(dt)),
+            wire_decode(splicing_wire_encode(dt, FragmentCache([], 1))),
+        )
+
+    def test_only_changes_encoded(self):
+        """
+        When an object containing instances of the remembered classes is
+        encoded after an earlier version of it was encoded, only the instances
+        which are new are encoded again.
+        """
+        fragments = _RecordingFragmentCache([Node], 100)
+        node = Node(uuid=uuid4())
+        unchanged = Node(
+            uuid=uuid4(),
+            manifestations={DATASET.dataset_id: MANIFESTATION})
+        splicing_wire_encode(Deployment(nodes={node, unchanged}), fragments)
+        changed = node.set(
+            manifestations={DATASET.dataset_id: MANIFESTATION})
+        del fragments.added[:]
+        result = splicing_wire_encode(
+            Deployment(nodes={changed, unchanged}), fragments)
+        self.assertEqual(
+            ([changed], Deployment(nodes={changed, unchanged})),
+            (fragments.added, wire_decode(result)),
+        )
+
+
 class ConfigurationMigrationTests(TestCase):
     """
     Tests for ``ConfigurationMigration`` class that performs individual
@@ -0,0 +1,196 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._projection``.
+"""
+
+from uuid import UUID, uuid4
+
+from twisted.python.filepath import FilePath
+
+from .. import (
+    Application, AttachedVolume, DockerImage, Node, NodeState, Deployment,
+    DeploymentState, Manifestation, Dataset, Port, Lease, Leases,
+)
+from .._projection import project_for_node
+from ...testtools import TestCase
+
+LOCAL = uuid4()
+REMOTE = uuid4()
+OTHER = uuid4()
+
+
+def _manifestation():
+    """
+    :return: A primary ``Manifestation`` of a new dataset.
+    """
+    return Manifestation(dataset=Dataset(dataset_id=unicode(uuid4())),
+                         primary=True)
+
+IMAGE = DockerImage.from_string(u"postgresql")
+LOCAL_MANIFESTATION = _manifestation()
+MOVING_MANIFESTATION = _manifestation()
+REMOTE_MANIFESTATION = _manifestation()
+PORTED_MANIFESTATION = _manifestation()
+LOCAL_APPLICATION = Application(name=u"local", image=IMAGE)
+PLAIN_APPLICATION = Application(name=u"plain", image=IMAGE)
+PORTED_APPLICATION = Application(
+    name=u"ported", image=IMAGE,
+    ports={Port(internal_port=5432, external_port=5432)},
+    volume=AttachedVolume(manifestation=PORTED_MANIFESTATION,
+                          mountpoint=FilePath(b"/data")),
+)
+
+DEPLOYMENT = Deployment(
+    nodes={
+        Node(uuid=LOCAL, applications={LOCAL_APPLICATION},
+             manifestations={
+                 LOCAL_MANIFESTATION.dataset_id: LOCAL_MANIFESTATION}),
+        Node(uuid=REMOTE,
+             applications={PLAIN_APPLICATION, PORTED_APPLICATION},
+             manifestations={
+                 m.dataset_id: m for m in [
+                     MOVING_MANIFESTATION, REMOTE_MANIFESTATION,
+                     PORTED_MANIFESTATION,
+                 ]}),
+        Node(uuid=OTHER, applications={PLAIN_APPLICATION}),
+    },
+)
+
+
+def _node_state(uuid, hostname, manifestations):
+    """
+    :return: A ``NodeState`` with the given manifestations.
+    """
+    return NodeState(
+        uuid=uuid, hostname=hostname, applications=[PLAIN_APPLICATION],
+        manifestations={m.dataset_id: m for m in manifestations},
+        paths={m.dataset_id: FilePath(b"/flocker").child(
+            m.dataset_id.encode("ascii")) for m in manifestations},
+        devices={},
+    )
+
+LOCAL_STATE = _node_state(LOCAL, u"192.0.2.1", [MOVING_MANIFESTATION])
+REMOTE_STATE = _node_state(
+    REMOTE, u"192.0.2.2", [REMOTE_MANIFESTATION, LOCAL_MANIFESTATION])
+OTHER_STATE = _node_state(OTHER, u"192.0.2.3", [])
+STATE = DeploymentState(
+    nodes={LOCAL_STATE, REMOTE_STATE, OTHER_STATE},
+    node_uuid_to_era={LOCAL: uuid4(), REMOTE: uuid4()},
+)
+
+
+class ProjectForNodeTests(TestCase):
+    """
+    Tests for ``project_for_node``.
+    """
+    def setUp(self):
+        super(ProjectForNodeTests, self).setUp()
+        self.configuration, self.state = project_for_node(
+            LOCAL, DEPLOYMENT, STATE)
+
+    def test_local_node_configuration(self):
+        """
+        The configuration of the node the projection is for is kept intact.
+        """
+        self.assertEqual(
+            DEPLOYMENT.get_node(LOCAL), self.configuration.get_node(LOCAL),
+        )
+
+    def test_local_node_state(self):
+        """
+        The state of the node the projection is for is kept intact.
+        """
+        self.assertEqual(LOCAL_STATE, self.state.get_node(LOCAL))
+
+    def test_remote_node_configuration(self):
+        """
+        Other nodes' configuration is reduced to the applications which expose
+        ports and the manifestations of datasets relevant to the node (or
+        used by those applications).
+        """
+        self.assertEqual(
+            Node(uuid=REMOTE, applications={PORTED_APPLICATION},
+                 manifestations={
+                     m.dataset_id: m for m in [
+                         MOVING_MANIFESTATION, PORTED_MANIFESTATION,
+                     ]}),
+            self.configuration.get_node(REMOTE),
+        )
+
+    def test_irrelevant_node_configuration(self):
+        """
+        Other nodes with nothing relevant to the node are dropped from the
+        configuration.
+        """
+        self.assertEqual(
+            {LOCAL, REMOTE},
+            {node.uuid for node in self.configuration.nodes},
+        )
+
+    def test_remote_node_state(self):
+        """
+        Other nodes' state is reduced to their hostname and the manifestations
+        of relevant datasets.
+        """
+        dataset_id = LOCAL_MANIFESTATION.dataset_id
+        self.assertEqual(
+            NodeState(
+                uuid=REMOTE, hostname=u"192.0.2.2", applications=None,
+                manifestations={dataset_id: LOCAL_MANIFESTATION},
+                paths={dataset_id: REMOTE_STATE.paths[dataset_id]},
+                devices={},
+            ),
+            self.state.get_node(REMOTE),
+        )
+
+    def test_irrelevant_node_state(self):
+        """
+        Other nodes which have nothing relevant to the node and are not in the
+        projected configuration are dropped from the state.
+        """
+        self.assertEqual(
+            {LOCAL, REMOTE},
+            {node.uuid for node in self.state.nodes},
+        )
+
+    def test_era(self):
+        """
+        Only the era of the node the projection is for is kept.
+        """
+        self.assertEqual(
+            {LOCAL: STATE.node_uuid_to_era[LOCAL]},
+            self.state.node_uuid_to_era,
+        )
+
+    def test_leases(self):
+        """
+        Only leases held by the node or on relevant datasets are kept.
+        """
+        mine = Lease(dataset_id=uuid4(), node_id=LOCAL)
+        relevant = Lease(
+            dataset_id=UUID(LOCAL_MANIFESTATION.dataset_id), node_id=REMOTE,
+        )
+        irrelevant = Lease(
+            dataset_id=UUID(REMOTE_MANIFESTATION.dataset_id), node_id=REMOTE,
+        )
+        deployment = DEPLOYMENT.set(leases=Leases({
+            lease.dataset_id: lease for lease in [mine, relevant, irrelevant]
+        }))
+        configuration, _ = project_for_node(LOCAL, deployment, STATE)
+        self.assertEqual(
+            {mine.dataset_id: mine, relevant.dataset_id: relevant},
+            dict(configuration.leases),
+        )
+
+    def test_unknown_node(self):
+        """
+        A node which has no configuration or state gets only what other nodes
+        expose to everyone.
+        """
+        configuration, state = project_for_node(uuid4(), DEPLOYMENT, STATE)
+        self.assertEqual(
+            ({REMOTE}, {REMOTE}),
+            ({node.uuid for node in configuration.nodes},
+             {node.uuid for node in state.nodes}),
+        )
@@ -14,18 +14,18 @@ from characteristic import attributes, Attribute
 
 from eliot import ActionType, start_action, MemoryLogger, Logger
 from eliot.testing import (
-    capture_logging, validate_logging, assertHasAction,
+    capture_logging, validate_logging, assertHasAction, assertHasMessage,
 )
 
 from twisted.internet.error import ConnectionDone
 from twisted.test.iosim import connectedServerAndClient
 from twisted.protocols.amp import (
     MAX_VALUE_LENGTH, IArgumentType, Command, String, ListOf, Integer,
-    CommandLocator, AMP, parseString,
+    CommandLocator, AMP, AmpBox, parseString,
 )
 from twisted.python.failure import Failure
 from twisted.internet.error import ConnectionLost
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, succeed
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet.task import Clock
 
@@ -42,13 +42,21 @@ from .._protocol import (
     NoOp, AgentAMP, ControlAMP, _AgentLocator,
     ControlServiceLocator, LOG_SEND_CLUSTER_STATE, LOG_SEND_TO_AGENT,
     AGENT_CONNECTED, caching_wire_encode, SetNodeEraCommand,
-    timeout_for_protocol,
+    timeout_for_protocol, ClusterStatusDiffCommand, GenerationMismatch,
+    BINARY_WIRE_FORMAT, encode_cache_statistics, ZLIB_COMPRESSION,
+    ZLIB_MAGIC, SUPPORTED_CAPABILITIES, LOG_COMPRESSED, LOG_BROADCAST,
+    _BroadcastScheduler, _serialize_arguments, SendQueueStatus,
+    _PreserializedBox,
+    AGENT_UPDATE_PAUSED,
 )
 from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
-    Dataset, DeploymentState, NonManifestDatasets,
+    Dataset, DeploymentState, NonManifestDatasets, ChangeSource,
 )
 from .._persistence import wire_encode
+from .._binary_codec import BINARY_MAGIC
+from .._diffing import create_diff
+from .._projection import project_for_node
 from .clusterstatetools import advance_some, advance_rest
 
 
@@ -247,6 +255,27 @@ class BigArgumentTests(TestCase):
 
         self.assert_roundtrips(self.CommandWithBigArgument, big=big_bytes)
 
+    def test_roundtrip_empty(self):
+        """
+        ``Big`` can serialize and unserialize an empty value.
+        """
+        self.assert_roundtrips(self.CommandWithBigArgument, big=b"")
+
+    def test_chunks(self):
+        """
+        ``Big`` sends the serialized value as consecutive chunks no larger
+        than ``MAX_VALUE_LENGTH``.
+        """
+        value = b"".join(chr(i % 256) for i in range(MAX_VALUE_LENGTH * 2 + 1))
+        strings = {}
+        Big(String()).toBox(b"big", strings, {b"big": value}, None)
+        self.assertEqual(
+            ([b"big.0", b"big.1", b"big.2"], [MAX_VALUE_LENGTH] * 2 + [1],
+             value),
+            (sorted(strings), [len(strings[key]) for key in sorted(strings)],
+             b"".join(strings[key] for key in sorted(strings))),
+        )
+
     def test_two_big_arguments(self):
         """
         AMP can serialize and unserialize a ``Command`` with multiple ``Big``
@@ -355,6 +384,159 @@ class SerializationTests(TestCase):
         self.assertIs(argument.toString(TEST_DEPLOYMENT),
                       argument.toString(TEST_DEPLOYMENT))
 
+    def test_binary_when_negotiated(self):
+        """
+        ``SerializableArgument`` uses the binary encoding when sending to a
+        peer that has agreed to ``BINARY_WIRE_FORMAT``, and decodes either
+        encoding.
+        """
+        argument = SerializableArgument(Deployment)
+        proto = _AgentLocator(FakeAgent(), lambda: None)
+        proto.capabilities = frozenset([BINARY_WIRE_FORMAT])
+        as_bytes = argument.toStringProto(TEST_DEPLOYMENT, proto)
+        self.assertEqual(
+            (True, TEST_DEPLOYMENT),
+            (as_bytes.startswith(BINARY_MAGIC),
+             argument.fromString(as_bytes)),
+        )
+
+    def test_json_by_default(self):
+        """
+        ``SerializableArgument`` uses the JSON encoding when sending to a peer
+        that has not agreed to ``BINARY_WIRE_FORMAT``.
+        """
+        argument = SerializableArgument(Deployment)
+        proto = _AgentLocator(FakeAgent(), lambda: None)
+        self.assertEqual(
+            loads(wire_encode(TEST_DEPLOYMENT)),
+            loads(argument.toStringProto(TEST_DEPLOYMENT, proto)),
+        )
+
+    def test_binary_wrong_type_serialization(self):
+        """
+        ``SerializableArgument`` throws a ``TypeError`` if one attempts to
+        binary encode an object of the wrong type.
+        """
+        argument = SerializableArgument(Deployment)
+        proto = _AgentLocator(FakeAgent(), lambda: None)
+        proto.capabilities = frozenset([BINARY_WIRE_FORMAT])
+        self.assertRaises(
+            TypeError, argument.toStringProto, NODE_STATE, proto)
+
+    def test_compressed_when_negotiated(self):
+        """
+        ``SerializableArgument`` compresses the encoding when sending to a
+        peer that has agreed to ``ZLIB_COMPRESSION``, and decodes the result.
+        """
+        argument = SerializableArgument(Deployment)
+        proto = _AgentLocator(FakeAgent(), lambda: None)
+        for capabilities in [[ZLIB_COMPRESSION],
+                             [ZLIB_COMPRESSION, BINARY_WIRE_FORMAT]]:
+            proto.capabilities = frozenset(capabilities)
+            as_bytes = argument.toStringProto(TEST_DEPLOYMENT, proto)
+            self.assertEqual(
+                (True, TEST_DEPLOYMENT),
+                (as_bytes.startswith(ZLIB_MAGIC),
+                 argument.fromString(as_bytes)),
+            )
+
+    def test_compressed_caches(self):
+        """
+        Compression results are cached.
+        """
+        argument = SerializableArgument(Deployment)
+        proto = _AgentLocator(FakeAgent(), lambda: None)
+        proto.capabilities = frozenset([ZLIB_COMPRESSION])
+        self.assertIs(argument.toStringProto(TEST_DEPLOYMENT, proto),
+                      argument.toStringProto(TEST_DEPLOYMENT, proto))
+
+    @capture_logging(None)
+    def test_compression_logged(self, logger):
+        """
+        The sizes before and after compression are logged.
+        """
+        argument = SerializableArgument(Deployment)
+        proto = _AgentLocator(FakeAgent(), lambda: None)
+        proto.capabilities = frozenset([ZLIB_COMPRESSION])
+        deployment = Deployment(nodes={Node(uuid=uuid4())})
+        compressed = argument.toStringProto(deployment, proto)
+        assertHasMessage(self, logger, LOG_COMPRESSED, {
+            u"encoding": u"json",
+            u"uncompressed_size": len(caching_wire_encode(deployment)),
+            u"compressed_size": len(compressed),
+        })
+
+
+class BroadcastSchedulerTests(TestCase):
+    """
+    Tests for ``_BroadcastScheduler``.
+    """
+    def setUp(self):
+        super(BroadcastSchedulerTests, self).setUp()
+        self.clock = Clock()
+        self.broadcasts = []
+        self.scheduler = _BroadcastScheduler(
+            self.clock, 1, 5, lambda: self.broadcasts.append(
+                self.clock.seconds()))
+
+    def test_no_window(self):
+        """
+        With a window of zero every request broadcasts immediately.
+        """
+        scheduler = _BroadcastScheduler(
+            self.clock, 0, 5, lambda: self.broadcasts.append(None))
+        scheduler.request()
+        scheduler.request()
+        self.assertEqual(2, len(self.broadcasts))
+
+    def test_window(self):
+        """
+        Requests within the window of each other are coalesced into one
+        broadcast once the window has passed since the last of them.
+        """
+        self.scheduler.request()
+        self.clock.advance(0.5)
+        self.scheduler.request()
+        self.clock.advance(0.9)
+        before = list(self.broadcasts)
+        self.clock.advance(0.1)
+        self.assertEqual(
+            ([], [1.5], 2, 1),
+            (before, self.broadcasts, self.scheduler.requests,
+             self.scheduler.broadcasts),
+        )
+
+    def test_max_staleness(self):
+        """
+        A steady stream of requests is broadcast no later than the maximum
+        staleness after the first request.
+        """
+        for _ in range(12):
+            self.scheduler.request()
+            self.clock.advance(0.5)
+        self.assertEqual([5], self.broadcasts)
+
+    def test_stop(self):
+        """
+        Stopping the scheduler cancels the pending broadcast.
+        """
+        self.scheduler.request()
+        self.scheduler.stop()
+        self.clock.advance(2)
+        self.assertEqual([], self.broadcasts)
+
+    @capture_logging(None)
+    def test_logged(self, logger):
+        """
+        Each broadcast logs how many requests it covered.
+        """
+        self.scheduler.request()
+        self.scheduler.request()
+        self.clock.advance(1)
+        assertHasMessage(self, logger, LOG_BROADCAST, {
+            u"requests": 2, u"total_requests": 2, u"total_broadcasts": 1,
+        })
+
 
 class ControlTestCase(TestCase):
     """
@@ -458,11 +640,154 @@ class ControlAMPTests(ControlTestCase):
 
         self.protocol.makeConnection(StringTransportWithAbort())
         cluster_state = self.control_amp_service.cluster_state.as_deployment()
+        configuration_tracker, state_tracker = (
+            self.control_amp_service._generation_trackers[None])
         self.assertEqual(
             sent[0],
             (((ClusterStatusCommand,),
               dict(configuration=TEST_DEPLOYMENT,
-                   state=cluster_state))))
+                   configuration_generation=(
+                       configuration_tracker.latest_generation),
+                   state=cluster_state,
+                   state_generation=state_tracker.latest_generation))))
+
+    def test_acknowledged_update_sends_diff(self):
+        """
+        Once the agent has acknowledged a cluster status update, later updates
+        are sent as a ``ClusterStatusDiffCommand`` against the acknowledged
+        generations.
+        """
+        sent = []
+        self.patch_call_remote(sent, self.protocol)
+        service = self.control_amp_service
+        self.protocol.makeConnection(StringTransportWithAbort())
+        original_configuration = service.configuration_service.get()
+        configuration_tracker, state_tracker = (
+            service._generation_trackers[None])
+        configuration_generation = configuration_tracker.latest_generation
+        state_generation = state_tracker.latest_generation
+
+        service.configuration_service.save(TEST_DEPLOYMENT)
+
+        configuration_diff = create_diff(
+            original_configuration, TEST_DEPLOYMENT)
+        self.assertEqual(
+            sent[1],
+            (((ClusterStatusDiffCommand,),
+              dict(configuration_diff=configuration_diff,
+                   start_configuration_generation=configuration_generation,
+                   end_configuration_generation=configuration_generation + 1,
+                   state_diff=create_diff(
+                       DeploymentState(), DeploymentState()),
+                   start_state_generation=state_generation,
+                   end_state_generation=state_generation))))
+
+    def test_unwritten_configuration_not_sent(self):
+        """
+        Agents are sent the configuration last written to disk, not one whose
+        write is still in progress.
+        """
+        sent = []
+        self.patch_call_remote(sent, self.protocol)
+        service = self.control_amp_service
+        writing = Deferred()
+        self.addCleanup(writing.callback, None)
+        self.patch(service.configuration_service, "_sync_save",
+                   lambda *args: writing)
+        original_configuration = service.configuration_service.get()
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        self.assertEqual(
+            original_configuration, sent[0][1]["configuration"])
+
+    def test_projected_after_set_node_era(self):
+        """
+        Once the agent has identified its node with ``SetNodeEraCommand`` it
+        is only sent the projection of the configuration and state for that
+        node.
+        """
+        sent = []
+        self.patch_call_remote(sent, self.protocol)
+        service = self.control_amp_service
+        self.protocol.makeConnection(StringTransportWithAbort())
+        node_uuid = uuid4()
+        era = uuid4()
+        self.successResultOf(
+            self.client.callRemote(SetNodeEraCommand,
+                                   node_uuid=unicode(node_uuid),
+                                   era=unicode(era)))
+        deployment = TEST_DEPLOYMENT.update_node(
+            Node(uuid=node_uuid, applications={APP1}))
+        service.configuration_service.save(deployment)
+
+        expected_configuration, expected_state = project_for_node(
+            node_uuid, deployment, service.cluster_state.as_deployment())
+        configuration_tracker, state_tracker = (
+            service._generation_trackers[node_uuid])
+        self.assertEqual(
+            sent[-1],
+            (((ClusterStatusCommand,),
+              dict(configuration=expected_configuration,
+                   configuration_generation=(
+                       configuration_tracker.latest_generation),
+                   state=expected_state,
+                   state_generation=state_tracker.latest_generation))))
+
+    def test_disconnect_forgets_generations(self):
+        """
+        When a connection is lost the generations acknowledged on it are
+        forgotten.
+        """
+        self.patch(self.protocol, "callRemote",
+                   lambda *args, **kwargs: succeed(None))
+        self.protocol.makeConnection(StringTransportWithAbort())
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual(
+            {}, self.control_amp_service._last_received_generation,
+        )
+
+    def set_node_era(self):
+        """
+        Identify the node of the connection under test, and send it an
+        update projected for the node.
+
+        :return: The ``UUID`` of the node.
+        """
+        self.patch(self.protocol, "callRemote",
+                   lambda *args, **kwargs: succeed(None))
+        self.protocol.makeConnection(StringTransportWithAbort())
+        node_uuid = uuid4()
+        self.successResultOf(
+            self.client.callRemote(SetNodeEraCommand,
+                                   node_uuid=unicode(node_uuid),
+                                   era=unicode(uuid4())))
+        self.control_amp_service.configuration_service.save(TEST_DEPLOYMENT)
+        return node_uuid
+
+    def test_disconnect_forgets_node(self):
+        """
+        When the last connection from a node is lost the generations tracked
+        for the node are dropped.
+        """
+        node_uuid = self.set_node_era()
+        service = self.control_amp_service
+        tracked = node_uuid in service._generation_trackers
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        forgotten = node_uuid not in service._generation_trackers
+        self.assertEqual((True, True), (tracked, forgotten))
+
+    def test_disconnect_other_connection_remembers_node(self):
+        """
+        While another connection from a node remains the generations tracked
+        for the node are kept.
+        """
+        node_uuid = self.set_node_era()
+        service = self.control_amp_service
+        other = ControlAMP(self.reactor, service)
+        other.locator.node_uuid = node_uuid
+        service.connections.add(other)
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        self.assertIn(node_uuid, service._generation_trackers)
 
     def test_connection_lost(self):
         """
@@ -691,6 +1016,31 @@ class ControlAMPServiceTests(ControlTestCase):
             dict(configuration=agent.desired, state=agent.actual),
         )
 
+    def test_changes_coalesced(self):
+        """
+        With a broadcast window, several changes within it are sent to
+        connected agents in one update.
+        """
+        reactor = Clock()
+        agent = FakeAgent()
+        client = AgentAMP(reactor, agent)
+        service = build_control_amp_service(
+            self, reactor, broadcast_window=0.1)
+        service.startService()
+        self.addCleanup(service.stopService)
+        service.connected(LoopbackAMPClient(client.locator))
+
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        service.node_changed(ChangeSource(), [NODE_STATE])
+        before = agent.desired
+        reactor.advance(0.1)
+        self.assertEqual(
+            (Deployment(), TEST_DEPLOYMENT,
+             DeploymentState(nodes=[NODE_STATE]), 1),
+            (before, agent.desired, agent.actual,
+             service.broadcast_scheduler.broadcasts),
+        )
+
     def test_second_configuration_change_waits_for_first_acknowledgement(self):
         """
         A second configuration change is only transmitted after acknowledgement
@@ -849,6 +1199,65 @@ class ControlAMPServiceTests(ControlTestCase):
              third_agent_desired],
         )
 
+    def test_diff_rejected_falls_back_to_full_update(self):
+        """
+        If an agent rejects a diff because it doesn't have the generation the
+        diff starts from, a full update is sent to it instead.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service = build_control_amp_service(self)
+        service.startService()
+        server = LoopbackAMPClient(client.locator)
+        service.connected(server)
+
+        # The agent somehow lost track of the state it was sent:
+        client.locator._configuration_generation = None
+
+        sent = []
+        original_call_remote = server.callRemote
+
+        def call_remote(command, **kwargs):
+            sent.append(command)
+            return original_call_remote(command, **kwargs)
+        self.patch(server, "callRemote", call_remote)
+
+        service.configuration_service.save(TEST_DEPLOYMENT)
+
+        self.assertEqual(
+            ([ClusterStatusDiffCommand, ClusterStatusCommand],
+             TEST_DEPLOYMENT),
+            (sent, agent.desired),
+        )
+
+    def test_many_updates_through_diffs(self):
+        """
+        After a series of configuration and state changes sent as diffs the
+        agent has the same configuration and state as the control service.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service = build_control_amp_service(self)
+        service.startService()
+        server = LoopbackAMPClient(client.locator)
+        service.connected(server)
+
+        configuration = TEST_DEPLOYMENT
+        for i in range(5):
+            configuration = arbitrary_transformation(configuration)
+            service.configuration_service.save(configuration)
+            service.node_changed(
+                ChangeSource(),
+                [NodeState(hostname=u"192.0.2.{}".format(i), uuid=uuid4(),
+                           applications=[APP1])],
+            )
+
+        self.assertEqual(
+            dict(configuration=configuration,
+                 state=service.cluster_state.as_deployment()),
+            dict(configuration=agent.desired, state=agent.actual),
+        )
+
 
 @implementer(IConvergenceAgent)
 @attributes([Attribute("is_connected", default_value=False),
@@ -991,6 +1400,69 @@ class AgentClientTests(TestCase):
                                                desired=TEST_DEPLOYMENT,
                                                actual=actual))
 
+    def test_cluster_updated_diff(self):
+        """
+        ``ClusterStatusDiffCommand`` sent to the ``AgentClient`` after a
+        ``ClusterStatusCommand`` result in the agent having the result of
+        applying the diffs.
+        """
+        actual = DeploymentState(nodes=[])
+        new_actual = DeploymentState(nodes=[NODE_STATE])
+        new_configuration = arbitrary_transformation(TEST_DEPLOYMENT)
+        self.server.callRemote(
+            ClusterStatusCommand,
+            configuration=TEST_DEPLOYMENT,
+            configuration_generation=1,
+            state=actual,
+            state_generation=1,
+            eliot_context=TEST_ACTION
+        )
+        d = self.server.callRemote(
+            ClusterStatusDiffCommand,
+            configuration_diff=create_diff(TEST_DEPLOYMENT, new_configuration),
+            start_configuration_generation=1,
+            end_configuration_generation=2,
+            state_diff=create_diff(actual, new_actual),
+            start_state_generation=1,
+            end_state_generation=2,
+            eliot_context=TEST_ACTION
+        )
+
+        self.successResultOf(d)
+        self.assertEqual(
+            dict(desired=new_configuration, actual=new_actual),
+            dict(desired=self.agent.desired, actual=self.agent.actual),
+        )
+
+    def test_cluster_updated_diff_generation_mismatch(self):
+        """
+        ``ClusterStatusDiffCommand`` fails with ``GenerationMismatch`` if the
+        agent doesn't have the generations the diff starts from, and the agent
+        isn't notified.
+        """
+        actual = DeploymentState(nodes=[])
+        self.server.callRemote(
+            ClusterStatusCommand,
+            configuration=TEST_DEPLOYMENT,
+            configuration_generation=1,
+            state=actual,
+            state_generation=1,
+            eliot_context=TEST_ACTION
+        )
+        d = self.server.callRemote(
+            ClusterStatusDiffCommand,
+            configuration_diff=create_diff(TEST_DEPLOYMENT, Deployment()),
+            start_configuration_generation=2,
+            end_configuration_generation=3,
+            state_diff=create_diff(actual, actual),
+            start_state_generation=1,
+            end_state_generation=1,
+            eliot_context=TEST_ACTION
+        )
+
+        self.failureResultOf(d, GenerationMismatch)
+        self.assertEqual(TEST_DEPLOYMENT, self.agent.desired)
+
 
 def iconvergence_agent_tests_factory(fixture):
     """
@@ -1057,6 +1529,52 @@ class FakeAgentInterfaceTests(iconvergence_agent_tests_factory(
     ``IConvergenceAgent`` tests for ``FakeAgent``.
     """
 
+
+class CapabilitiesTests(TestCase):
+    """
+    Tests for the negotiation of optional protocol features between
+    ``AgentAMP`` and ``ControlAMP``.
+    """
+    def test_negotiated(self):
+        """
+        Once connected, both ends have agreed to use all the capabilities they
+        support and the agent still receives the cluster status.
+        """
+        reactor = Clock()
+        control_amp_service = build_control_amp_service(self, reactor)
+        control_amp_service.startService()
+        self.addCleanup(control_amp_service.stopService)
+        server = ControlAMP(reactor, control_amp_service)
+        agent = FakeAgent()
+        client = AgentAMP(reactor, agent)
+        pump = connectedServerAndClient(lambda: server, lambda: client)[2]
+        pump.flush()
+        self.assertEqual(
+            (SUPPORTED_CAPABILITIES, SUPPORTED_CAPABILITIES, Deployment()),
+            (server.capabilities, client.capabilities, agent.desired),
+        )
+
+    def test_old_control_service(self):
+        """
+        If the control service does not understand ``CapabilitiesCommand`` the
+        agent uses no optional capabilities.
+        """
+        reactor = Clock()
+        client = AgentAMP(reactor, FakeAgent())
+        pump = connectedServerAndClient(
+            lambda: AMP(locator=CommandLocator()), lambda: client)[2]
+        pump.flush()
+        self.assertEqual(frozenset(), client.capabilities)
+
+    def test_old_agent(self):
+        """
+        Until an agent negotiates capabilities, the control service uses no
+        optional capabilities with it.
+        """
+        reactor = Clock()
+        server = ControlAMP(reactor, build_control_amp_service(self, reactor))
+        self.assertEqual(frozenset(), server.capabilities)
+
 SEND_REQUEST = ActionType(
     u'test:send_request',
     [],
@@ -1081,10 +1599,264 @@ class ClusterStatusCommandTests(TestCase):
         ClusterStatusCommand requires the following arguments.
         """
         self.assertItemsEqual(
-            ['configuration', 'state', 'eliot_context'],
+            ['configuration', 'configuration_generation',
+             'state', 'state_generation', 'eliot_context'],
             (v[0] for v in ClusterStatusCommand.arguments))
 
 
+class SharedSerializationTests(TestCase):
+    """
+    Tests for the sharing of the serialized configuration and state between
+    connections by ``ControlAMP.callRemote``.
+    """
+    def setUp(self):
+        super(SharedSerializationTests, self).setUp()
+        self.reactor = Clock()
+        self.control_amp_service = build_control_amp_service(
+            self, self.reactor)
+        self.arguments = dict(
+            configuration=TEST_DEPLOYMENT, state=DeploymentState(
+                nodes=[NODE_STATE]))
+
+    def protocol(self, capabilities=frozenset()):
+        """
+        :param capabilities: The capabilities negotiated by the protocol.
+
+        :return: A ``ControlAMP`` with the given capabilities.
+        """
+        protocol = ControlAMP(self.reactor, self.control_amp_service)
+        protocol.locator.negotiate_capabilities(capabilities)
+        return protocol
+
+    def test_shared(self):
+        """
+        Connections with the same capabilities sent the same objects share
+        one serialization of them.
+        """
+        self.assertIs(
+            _serialize_arguments(
+                ClusterStatusCommand, self.arguments, self.protocol()),
+            _serialize_arguments(
+                ClusterStatusCommand, self.arguments, self.protocol()),
+        )
+
+    def test_capabilities(self):
+        """
+        Connections with different capabilities get different serializations.
+        """
+        self.assertNotEqual(
+            _serialize_arguments(
+                ClusterStatusCommand, self.arguments, self.protocol()),
+            _serialize_arguments(
+                ClusterStatusCommand, self.arguments,
+                self.protocol(frozenset([BINARY_WIRE_FORMAT]))),
+        )
+
+    def test_sent(self):
+        """
+        ``ControlAMP.callRemote`` writes a box from which the receiving end
+        parses all the arguments of a ``ClusterStatusCommand``.
+        """
+        protocol = self.protocol()
+        protocol.makeConnection(StringTransportWithAbort())
+        protocol.transport.clear()
+        with start_action(MemoryLogger(), "test") as action:
+            protocol.callRemote(
+                ClusterStatusCommand, configuration_generation=3,
+                state_generation=4, eliot_context=action, **self.arguments)
+        [box] = parseString(protocol.transport.value())
+        receiver = AgentAMP(self.reactor, FakeAgent())
+        receiver.logger = MemoryLogger()
+        arguments = ClusterStatusCommand.parseArguments(box, receiver)
+        del arguments["eliot_context"]
+        self.assertEqual(
+            dict(configuration_generation=3, state_generation=4,
+                 **self.arguments),
+            arguments,
+        )
+
+    def test_send_box_command(self):
+        """
+        ``AMP._sendBoxCommand``, which ``ControlAMP.callRemote`` uses despite
+        it being private, writes the given box with the command name and a
+        new tag added and returns a ``Deferred`` firing with the box answering
+        that tag.
+        """
+        protocol = self.protocol()
+        protocol.makeConnection(StringTransportWithAbort())
+        protocol.transport.clear()
+        box = _PreserializedBox(_serialize_arguments(
+            ClusterStatusCommand, self.arguments, protocol))
+        box[b"state_generation"] = b"4"
+        d = protocol._sendBoxCommand(ClusterStatusCommand.commandName, box)
+        [sent] = parseString(protocol.transport.value())
+        protocol.ampBoxReceived(
+            AmpBox(_answer=sent[b"_ask"], result=b"ok"))
+        # ``Big`` arguments are sent as numbered chunks:
+        names = {key.split(b".")[0] for key in sent}
+        self.assertEqual(
+            ((ClusterStatusCommand.commandName, b"4"),
+             set(self.arguments), {b"_answer": sent[b"_ask"],
+                                   b"result": b"ok"}),
+            ((sent[b"_command"], sent[b"state_generation"]),
+             set(self.arguments) & names, dict(self.successResultOf(d))))
+
+    def test_error(self):
+        """
+        Errors declared by the command are reported by the ``Deferred``
+        returned by ``ControlAMP.callRemote``.
+        """
+        server = self.protocol()
+        pump = connectedServerAndClient(
+            lambda: server, lambda: AgentAMP(self.reactor, FakeAgent()))[2]
+        pump.flush()
+        diff = create_diff(Deployment(), Deployment())
+        with start_action(MemoryLogger(), "test") as action:
+            d = server.callRemote(
+                ClusterStatusDiffCommand,
+                configuration_diff=diff, state_diff=diff,
+                start_configuration_generation=100,
+                end_configuration_generation=101,
+                start_state_generation=100, end_state_generation=101,
+                eliot_context=action)
+        # Errors not handled by the time the response arrives are logged and
+        # the connection dropped, so catch them before flushing:
+        failures = []
+        d.addErrback(failures.append)
+        pump.flush()
+        self.assertEqual(
+            [GenerationMismatch], [failure.type for failure in failures])
+
+    def test_disconnected(self):
+        """
+        The ``Deferred`` returned by ``ControlAMP.callRemote`` fails if the
+        connection has been lost.
+        """
+        protocol = self.protocol()
+        protocol.makeConnection(StringTransportWithAbort())
+        protocol.connectionLost(Failure(ConnectionLost()))
+        with start_action(MemoryLogger(), "test") as action:
+            d = protocol.callRemote(
+                ClusterStatusCommand, configuration_generation=3,
+                state_generation=4, eliot_context=action, **self.arguments)
+        self.failureResultOf(d, ConnectionLost)
+
+
+class SendQueueTests(TestCase):
+    """
+    Tests for the queueing of updates to agents by ``ControlAMPService``.
+    """
+    def setUp(self):
+        super(SendQueueTests, self).setUp()
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(self)
+        self.service.startService()
+        self.server = LoopbackAMPClient(self.client.locator)
+
+    def test_registers_producer(self):
+        """
+        ``ControlAMP`` registers itself as a streaming producer with its
+        transport.
+        """
+        protocol = ControlAMP(Clock(), self.service)
+        protocol.makeConnection(StringTransportWithAbort())
+        self.assertEqual(
+            (protocol, True),
+            (protocol.transport.producer, protocol.transport.streaming))
+
+    @capture_logging(assertHasMessage, AGENT_UPDATE_PAUSED)
+    def test_paused(self, logger):
+        """
+        No update is sent to an agent whose transport has paused its producer.
+        """
+        self.service.connected(self.server)
+        self.server.paused = True
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (Deployment(), SendQueueStatus(
+                depth=1, bytes_in_flight=0, dropped=0, paused=True)),
+            (self.agent.desired, self.service.send_queue_status(self.server)),
+        )
+
+    def test_resumed(self):
+        """
+        When the transport resumes, the latest configuration is sent and
+        intermediate updates are dropped.
+        """
+        self.service.connected(self.server)
+        self.server.paused = True
+        configuration = TEST_DEPLOYMENT
+        for i in range(3):
+            configuration = arbitrary_transformation(configuration)
+            self.service.configuration_service.save(configuration)
+        self.server.paused = False
+        self.service.resumed(self.server)
+        self.assertEqual(
+            (configuration, SendQueueStatus(
+                depth=0, bytes_in_flight=0, dropped=2, paused=False)),
+            (self.agent.desired, self.service.send_queue_status(self.server)),
+        )
+
+    def test_resumed_while_unacknowledged(self):
+        """
+        If an update is still unacknowledged when the transport resumes, the
+        pending update waits for the acknowledgement.
+        """
+        delayed_server = DelayedAMPClient(self.server)
+        self.service.connected(delayed_server)
+        delayed_server.paused = True
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        delayed_server.paused = False
+        self.service.resumed(delayed_server)
+        depth = self.service.send_queue_status(delayed_server).depth
+        delayed_server.respond()
+        delayed_server.respond()
+        self.assertEqual((2, TEST_DEPLOYMENT), (depth, self.agent.desired))
+
+    def test_bytes_in_flight(self):
+        """
+        The size of the unacknowledged configuration and state sent over a
+        ``ControlAMP`` connection is reported.
+        """
+        protocol = ControlAMP(Clock(), self.service)
+        protocol.makeConnection(StringTransportWithAbort())
+        status = self.service.send_queue_status(protocol)
+        self.assertEqual(
+            (1, True),
+            (status.depth,
+             0 < status.bytes_in_flight < len(protocol.transport.value())))
+
+    def test_protocol_resumes(self):
+        """
+        ``ControlAMP.resumeProducing`` sends the update held back by
+        ``ControlAMP.pauseProducing``.
+        """
+        server = ControlAMP(Clock(), self.service)
+        pump = connectedServerAndClient(lambda: server, lambda: self.client)[2]
+        pump.flush()
+        server.pauseProducing()
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        pump.flush()
+        paused_desired = self.agent.desired
+        server.resumeProducing()
+        pump.flush()
+        self.assertEqual(
+            (Deployment(), TEST_DEPLOYMENT),
+            (paused_desired, self.agent.desired))
+
+    def test_disconnected(self):
+        """
+        The queue of a disconnected agent is discarded.
+        """
+        self.service.connected(self.server)
+        self.server.paused = True
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.service.disconnected(self.server)
+        self.assertEqual(
+            0, self.service.send_queue_status(self.server).depth)
+
+
 class AgentLocatorTests(TestCase):
     """
     Tests for ``_AgentLocator``.
@@ -1152,6 +1924,15 @@ class SendStateToConnectionsTests(TestCase):
             logger,
             LOG_SEND_CLUSTER_STATE,
             succeeded=True,
+            startFields={
+                "configuration_generation": (
+                    control_amp_service.configuration_service
+                    .configuration_generation()
+                ),
+                "state_generation": (
+                    control_amp_service.cluster_state.state_generation()
+                ),
+            },
             endFields={
                 "configuration": (
                     control_amp_service.configuration_service.get()
@@ -1249,6 +2030,23 @@ class CachingWireEncodeTests(TestCase):
             [loads(wire_encode(TEST_DEPLOYMENT)),
              loads(wire_encode(NODE_STATE))])
 
+    def test_statistics(self):
+        """
+        ``encode_cache_statistics`` counts the objects which
+        ``caching_wire_encode`` found already encoded, and those it had to
+        encode.
+        """
+        before = encode_cache_statistics()
+        deployment = arbitrary_transformation(TEST_DEPLOYMENT)
+        caching_wire_encode(deployment)
+        caching_wire_encode(deployment)
+        after = encode_cache_statistics()
+        self.assertEqual(
+            (1, 1),
+            (after["encode_cache_hits"] - before["encode_cache_hits"],
+             after["encode_cache_misses"] - before["encode_cache_misses"]),
+        )
+
     def test_caches(self):
         """
         ``CachingEncoder.encode`` caches the result of ``wire_encode`` for a
@@ -23,6 +23,7 @@ INVALID_OBJECT_PROPERTY_UNDEFINED = 'additionalProperties'
 INVALID_OBJECT_PROPERTIES_MAXIMUM = 'maxProperties'
 INVALID_OBJECT_NO_MATCH = 'oneOf'
 INVALID_WRONG_TYPE = 'type'
+INVALID_ENUM = 'enum'
 
 valid_uuid = unicode(uuid4())
 
@@ -1013,3 +1014,97 @@ LeaseResultTests = build_schema_test(
         LEASE_WITH_NEGATIVE_EXPIRATION,
     ],
 )
+
+
+ConfigurationDatasetsQueryTests = build_schema_test(
+    name="ConfigurationDatasetsQueryTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_query'},
+    schema_store=SCHEMAS,
+    failing_instances={
+        INVALID_OBJECT_PROPERTY_UNDEFINED: [
+            {u'name': u'db'},
+        ],
+        INVALID_STRING_PATTERN: [
+            {u'limit': u'0'},
+            {u'limit': u'ten'},
+            {u'node_uuid': bad_uuid_1},
+        ],
+        INVALID_ENUM: [
+            {u'deleted': u'yes'},
+        ],
+    },
+    passing_instances=[
+        {},
+        {u'node_uuid': valid_uuid, u'dataset_id': valid_uuid,
+         u'deleted': u'false', u'metadata.name': u'db', u'limit': u'10',
+         u'cursor': u'WyJhIl0=', u'wait_for_generation': u'7'},
+    ],
+)
+
+
+NodesQueryTests = build_schema_test(
+    name="NodesQueryTests",
+    schema={'$ref': '/v1/endpoints.json#/definitions/nodes_query'},
+    schema_store=SCHEMAS,
+    failing_instances={
+        INVALID_OBJECT_PROPERTY_UNDEFINED: [
+            {u'limit': u'10'},
+        ],
+        INVALID_STRING_PATTERN: [
+            {u'wait_for_generation': u''},
+            {u'wait_for_generation': u'-1'},
+            {u'wait_for_generation': u'1' * 19},
+        ],
+    },
+    passing_instances=[
+        {},
+        {u'wait_for_generation': u'0'},
+        {u'wait_for_generation': u'123'},
+    ],
+)
+
+
+ConfigurationDatasetsBulkTests = build_schema_test(
+    name="ConfigurationDatasetsBulkTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+    schema_store=SCHEMAS,
+    failing_instances={
+        INVALID_OBJECT_PROPERTY_MISSING: [
+            {},
+        ],
+        INVALID_ARRAY_ITEMS_MAXIMUM: [
+            {u'operations': [
+                {u'operation': u'delete', u'dataset_id': valid_uuid}] * 1001},
+        ],
+        INVALID_OBJECT_NO_MATCH: [
+            # Unknown operation:
+            {u'operations': [{u'operation': u'copy',
+                              u'dataset_id': valid_uuid}]},
+            # Missing primary:
+            {u'operations': [{u'operation': u'move',
+                              u'dataset_id': valid_uuid}]},
+            # Field of another operation:
+            {u'operations': [{u'operation': u'delete',
+                              u'dataset_id': valid_uuid,
+                              u'primary': valid_uuid}]},
+            {u'operations': [{u'operation': u'resize',
+                              u'dataset_id': bad_uuid_1,
+                              u'maximum_size': 1024 * 1024 * 1024}]},
+        ],
+    },
+    passing_instances=[
+        {u'operations': [
+            {u'operation': u'create', u'primary': valid_uuid},
+            {u'operation': u'create', u'primary': valid_uuid,
+             u'dataset_id': valid_uuid, u'metadata': {u'name': u'db'},
+             u'maximum_size': 1024 * 1024 * 1024},
+            {u'operation': u'move', u'dataset_id': valid_uuid,
+             u'primary': valid_uuid},
+            {u'operation': u'resize', u'dataset_id': valid_uuid,
+             u'maximum_size': None},
+            {u'operation': u'delete', u'dataset_id': valid_uuid},
+        ]},
+    ],
+)
@@ -69,6 +69,19 @@ class ControlOptionsTests(make_standard_options_test(ControlOptions)):
         options.parseOptions([b"--agent-port", b"tcp:1234"])
         self.assertEqual(options["agent-port"], b"tcp:1234")
 
+    def test_broadcast_coalescing(self):
+        """
+        The ``--broadcast-window`` and ``--broadcast-max-staleness``
+        command-line options configure how changes sent to agents are
+        coalesced.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--broadcast-window", b"0.5",
+                              b"--broadcast-max-staleness", b"3"])
+        self.assertEqual(
+            (0.5, 3.0),
+            (options["broadcast-window"], options["broadcast-max-staleness"]))
+
 
 class ControlScriptTests(TestCase):
     """
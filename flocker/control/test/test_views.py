@@ -0,0 +1,232 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._views``.
+"""
+
+from json import loads
+from uuid import uuid4
+
+from .._model import (
+    Deployment, Node, NodeState, DeploymentState, Dataset, Manifestation,
+)
+from .._views import (
+    NodeListView, ListQuery, MetadataIndex, encode_cursor, decode_cursor,
+)
+from ...testtools import TestCase
+
+
+class NodeListViewTests(TestCase):
+    """
+    Tests for ``NodeListView``.
+    """
+    def setUp(self):
+        super(NodeListViewTests, self).setUp()
+        self.calls = []
+
+        def node_items(node):
+            self.calls.append(node.uuid)
+            return [unicode(node.uuid), node.hostname]
+        self.view = NodeListView(
+            node_items, lambda state: [len(state.nodes)])
+        self.nodes = [NodeState(uuid=uuid4(), hostname=u"192.0.2.%d" % (i,))
+                      for i in range(3)]
+        self.state = DeploymentState(nodes=self.nodes)
+
+    def test_result(self):
+        """
+        The result lists the items of each node followed by the other items,
+        and its body is their JSON encoding.
+        """
+        result = self.view.get(1, self.state)
+        self.assertEqual(
+            (sorted(
+                [unicode(node.uuid) for node in self.nodes] +
+                [node.hostname for node in self.nodes] + [3]),
+             [3], result.result),
+            (sorted(result.result), result.result[-1:], loads(result.body)))
+
+    def test_empty_nodes(self):
+        """
+        Nodes without items don't affect the encoding.
+        """
+        view = NodeListView(lambda node: list(node.applications))
+        deployment = Deployment(nodes={Node(uuid=uuid4())})
+        self.assertEqual(b"[]", view.get(1, deployment).body)
+
+    def test_same_key(self):
+        """
+        The result isn't rebuilt if the key hasn't changed.
+        """
+        result = self.view.get(1, self.state)
+        del self.calls[:]
+        self.assertEqual(
+            (result, []), (self.view.get(1, self.state), self.calls))
+
+    def test_changed_nodes(self):
+        """
+        Only the items of nodes which are not the same objects as last time
+        are computed again.
+        """
+        self.view.get(1, self.state)
+        del self.calls[:]
+        changed = self.nodes[0].set(hostname=u"192.0.2.100")
+        result = self.view.get(2, self.state.update_node(changed))
+        self.assertEqual(
+            ([changed.uuid], [changed.hostname]),
+            (self.calls, [item for item in loads(result.body)
+                          if item == changed.hostname]))
+
+    def test_removed_nodes(self):
+        """
+        The items of nodes which have been removed are dropped.
+        """
+        self.view.get(1, self.state)
+        result = self.view.get(
+            2, self.state.remove_node(self.nodes[0].uuid))
+        self.assertNotIn(unicode(self.nodes[0].uuid), loads(result.body))
+
+
+class ListQueryTests(TestCase):
+    """
+    Tests for ``ListQuery``.
+    """
+    def setUp(self):
+        super(ListQueryTests, self).setUp()
+        view = NodeListView(lambda node: [node.hostname])
+        self.result = view.get(1, DeploymentState(nodes=[
+            NodeState(uuid=uuid4(), hostname=u"192.0.2.%d" % (i,))
+            for i in range(5)]))
+
+    def query(self, **kwargs):
+        """
+        :return: A ``ListQuery`` for host names with the given fields.
+        """
+        return ListQuery(sort_key=lambda item: [item], **kwargs)
+
+    def test_everything(self):
+        """
+        If nothing is filtered out and there is no paging, the given result is
+        returned.
+        """
+        self.assertEqual(
+            (self.result, None), self.query().select(self.result))
+
+    def test_predicates(self):
+        """
+        Only items matching every predicate are returned.
+        """
+        self.assertEqual(
+            ([u"192.0.2.3"], None),
+            self.query(predicates=[
+                lambda item: item > u"192.0.2.2",
+                lambda item: item < u"192.0.2.4",
+            ]).select(self.result))
+
+    def test_pages(self):
+        """
+        Paging through the results with a limit returns every item once, in
+        order.
+        """
+        pages = []
+        cursor = None
+        while True:
+            page, next_cursor = self.query(
+                limit=2, cursor=cursor).select(self.result)
+            pages.append(page)
+            if next_cursor is None:
+                break
+            cursor = decode_cursor(next_cursor)
+        self.assertEqual(
+            [[u"192.0.2.0", u"192.0.2.1"], [u"192.0.2.2", u"192.0.2.3"],
+             [u"192.0.2.4"]],
+            pages)
+
+    def test_invalid_cursor(self):
+        """
+        ``decode_cursor`` raises ``ValueError`` if given something other than
+        a cursor.
+        """
+        for cursor in [u"abc", encode_cursor([1])[:-2], u"e30="]:
+            self.assertRaises(ValueError, decode_cursor, cursor)
+
+
+def _node_datasets(node):
+    """
+    :return: The datasets of a node, as simplified API ``dict`` instances.
+    """
+    return [{u"dataset_id": manifestation.dataset.dataset_id,
+             u"metadata": dict(manifestation.dataset.metadata),
+             u"deleted": manifestation.dataset.deleted}
+            for manifestation in node.manifestations.values()]
+
+
+def _node_with_dataset(name, deleted=False):
+    """
+    :return: A ``Node`` with one dataset of the given name.
+    """
+    dataset = Dataset(dataset_id=unicode(uuid4()), deleted=deleted,
+                      metadata={u"name": name, u"owner": u"alice"})
+    return Node(uuid=uuid4(), manifestations={
+        dataset.dataset_id: Manifestation(dataset=dataset, primary=True)})
+
+
+class MetadataIndexTests(TestCase):
+    """
+    Tests for ``MetadataIndex``.
+    """
+    def setUp(self):
+        super(MetadataIndexTests, self).setUp()
+        self.calls = []
+
+        def node_items(node):
+            self.calls.append(node.uuid)
+            return _node_datasets(node)
+        self.index = MetadataIndex([u"name"], node_items)
+        self.nodes = [_node_with_dataset(name)
+                      for name in [u"db", u"web", u"web"]]
+        self.deployment = Deployment(nodes=self.nodes)
+
+    def dataset_ids(self, key, deployment, metadata_key, value):
+        """
+        :return: The ``set`` of identifiers of the datasets the index returns.
+        """
+        return {item[u"dataset_id"] for item in
+                self.index.get(key, deployment, metadata_key, value)}
+
+    def test_lookup(self):
+        """
+        The datasets with the given value for an indexed key are returned.
+        """
+        self.assertEqual(
+            (set(self.nodes[1].manifestations) |
+             set(self.nodes[2].manifestations), set(), set()),
+            (self.dataset_ids(1, self.deployment, u"name", u"web"),
+             self.dataset_ids(1, self.deployment, u"name", u"logs"),
+             self.dataset_ids(1, self.deployment, u"owner", u"alice")))
+
+    def test_deleted(self):
+        """
+        Deleted datasets are not indexed.
+        """
+        node = _node_with_dataset(u"logs", deleted=True)
+        self.assertEqual(
+            set(),
+            self.dataset_ids(1, Deployment(nodes=[node]), u"name", u"logs"))
+
+    def test_changed_nodes(self):
+        """
+        Only the entries of nodes which are not the same objects as last time
+        are computed again, and those of removed nodes are dropped.
+        """
+        self.index.get(1, self.deployment, u"name", u"db")
+        del self.calls[:]
+        replacement = _node_with_dataset(u"db").set(uuid=self.nodes[1].uuid)
+        deployment = Deployment(nodes=[replacement, self.nodes[2]])
+        self.assertEqual(
+            (set(replacement.manifestations),
+             set(self.nodes[2].manifestations),
+             [replacement.uuid]),
+            (self.dataset_ids(2, deployment, u"name", u"db"),
+             self.dataset_ids(2, deployment, u"name", u"web"),
+             self.calls))
@@ -6,7 +6,6 @@ An HTTP API implementing the Docker Volumes Plugin API.
 See https://github.com/docker/docker/tree/master/docs/extend for details.
 """
 
-from itertools import repeat
 from functools import wraps
 
 import yaml
@@ -19,6 +18,7 @@ from eliot.twisted import DeferredContext
 
 from twisted.python.filepath import FilePath
 from twisted.internet.defer import CancelledError, gatherResults, maybeDeferred
+from twisted.internet.task import deferLater
 from twisted.web.http import OK
 
 from klein import Klein
@@ -26,11 +26,11 @@ from klein import Klein
 from ..restapi import (
     structured, EndpointResponse, BadRequest, make_bad_request,
 )
-from ..apiclient import DatasetAlreadyExists, conditional_create
+from ..apiclient import DatasetAlreadyExists
 from ..node.agents.blockdevice import PROFILE_METADATA_KEY
 from ..common import (
     RACKSPACE_MINIMUM_VOLUME_SIZE, DEVICEMAPPER_LOOPBACK_SIZE,
-    loop_until, timeout,
+    timeout,
 )
 
 
@@ -224,12 +224,12 @@ class VolumePlugin(object):
         :return: ``Deferred`` firing with dataset ID as ``UUID``, or
             errbacks with ``_NotFound`` if no dataset was found.
         """
-        listing = self._flocker_client.list_datasets_configuration()
+        listing = self._flocker_client.list_datasets_by_metadata(
+            NAME_FIELD, name)
 
         def got_configured(configured):
             for dataset in configured:
-                if dataset.metadata.get(NAME_FIELD) == name:
-                    return dataset.dataset_id
+                return dataset.dataset_id
             raise NOT_FOUND_RESPONSE
 
         listing.addCallback(got_configured)
@@ -241,14 +241,12 @@ class VolumePlugin(object):
         """
         Create a volume with the given name.
 
-        We hash the name to give a consistent dataset. This ensures that
-        if due to race condition we attempt to create two volumes with
-        same name only one will be created.
-
-        We also check for existence of matching dataset based on
-        ``"name"`` field in metadata, in case we're talking to cluster
-        that has datasets that weren't created with this hashing
-        mechanism.
+        The name is stored in the ``"name"`` field of the dataset metadata,
+        which the control service keeps unique: the dataset is only created
+        if no other dataset has the same name, atomically, so if due to race
+        condition we attempt to create two volumes with same name only one
+        will be created.  With control services predating the name index
+        the client checks the configuration instead, retrying if it changes.
 
         If there is a duplicate we don't return an error, but rather
         success: we will likely get unneeded creates from Docker since it
@@ -277,14 +275,9 @@ class VolumePlugin(object):
         else:
             size = DEFAULT_SIZE
 
-        def ensure_unique_name(configured):
-            for dataset in configured:
-                if dataset.metadata.get(NAME_FIELD) == Name:
-                    raise DatasetAlreadyExists
-
-        creating = conditional_create(
-            self._flocker_client, self._reactor, ensure_unique_name,
-            self._node_id, int(size.to_Byte()), metadata=metadata)
+        creating = self._flocker_client.create_dataset(
+            self._node_id, int(size.to_Byte()), metadata=metadata,
+            unique_key=NAME_FIELD)
         creating.addErrback(lambda reason: reason.trap(DatasetAlreadyExists))
         creating.addCallback(lambda _: {u"Err": u""})
         return creating
@@ -300,14 +293,51 @@ class VolumePlugin(object):
             with ``_NotFound`` if it is does not exist at all.
         """
         d = self._flocker_client.list_datasets_state()
+        d.addCallback(self._local_path, dataset_id)
+        return d
+
+    def _local_path(self, datasets, dataset_id):
+        """
+        :param datasets: The ``DatasetState`` of every dataset.
+        :param UUID dataset_id: The dataset to lookup.
+
+        :return: The mountpoint ``FilePath`` of the dataset, or ``None`` if
+            it is not locally mounted.
+        """
+        datasets = [dataset for dataset in datasets
+                    if dataset.dataset_id == dataset_id]
+        if datasets and datasets[0].primary == self._node_id:
+            return datasets[0].path
+        else:
+            return None
+
+    def _wait_for_path(self, dataset_id):
+        """
+        Wait for a dataset to be mounted locally.
 
-        def got_state(datasets):
-            datasets = [dataset for dataset in datasets
-                        if dataset.dataset_id == dataset_id]
-            if datasets and datasets[0].primary == self._node_id:
-                return datasets[0].path
+        Rather than polling, the cluster state is watched so that each
+        request only returns once the state has changed.  Servers which
+        can't wait for changes are polled every ``_POLL_INTERVAL`` seconds.
+
+        :param UUID dataset_id: The dataset to wait for.
+
+        :return: Cancellable ``Deferred`` that fires with the mountpoint
+            ``FilePath``.
+        """
+        def got_state(watched):
+            path = self._local_path(watched.value, dataset_id)
+            if path is not None:
+                return path
+            if watched.generation is None:
+                d = deferLater(
+                    self._reactor, self._POLL_INTERVAL,
+                    self._flocker_client.watch_datasets_state)
             else:
-                return None
+                d = self._flocker_client.watch_datasets_state(
+                    watched.generation)
+            d.addCallback(got_state)
+            return d
+        d = self._flocker_client.watch_datasets_state()
         d.addCallback(got_state)
         return d
 
@@ -330,10 +360,7 @@ class VolumePlugin(object):
                                                         dataset_id))
         d.addCallback(lambda dataset: dataset.dataset_id)
 
-        d.addCallback(lambda dataset_id: loop_until(
-            self._reactor,
-            lambda: self._get_path_from_dataset_id(dataset_id),
-            repeat(self._POLL_INTERVAL)))
+        d.addCallback(self._wait_for_path)
         d.addCallback(lambda p: {u"Err": u"", u"Mountpoint": p.path})
 
         timeout(self._reactor, d.result, self._MOUNT_TIMEOUT)
@@ -68,7 +68,11 @@ class DockerPluginScript(object):
         flocker_client = FlockerClient(reactor, control_host, control_port,
                                        certificates_path.child(b"cluster.crt"),
                                        certificates_path.child(b"plugin.crt"),
-                                       certificates_path.child(b"plugin.key"))
+                                       certificates_path.child(b"plugin.key"),
+                                       persistent=True,
+                                       # Volumes may be created through other
+                                       # nodes, so always revalidate:
+                                       cache_ttl=0)
 
         self._create_listening_directory(PLUGIN_PATH.parent())
 
@@ -22,7 +22,7 @@ from pyrsistent import pmap
 from eliot.testing import capture_logging
 
 from .._api import VolumePlugin, DEFAULT_SIZE, parse_num, NAME_FIELD
-from ...apiclient import FakeFlockerClient, Dataset, DatasetsConfiguration
+from ...apiclient import FakeFlockerClient, Dataset
 from ...testtools import CustomException, random_name
 
 from ...restapi import make_bad_request
@@ -85,9 +85,9 @@ class APITestsMixin(APIAssertionsMixin):
         """
         self.volume_plugin_reactor = Clock()
         self.flocker_client = SimpleCountingProxy(FakeFlockerClient())
-        # The conditional_create operation used by the plugin relies on
-        # the passage of time... so make sure time passes! We still use a
-        # fake clock since some tests want to skip ahead.
+        # Waiting for a dataset to be mounted relies on the passage of
+        # time... so make sure time passes! We still use a fake clock since
+        # some tests want to skip ahead.
         self.looping = LoopingCall(
             lambda: self.volume_plugin_reactor.advance(0.001))
         self.looping.start(0.001)
@@ -270,28 +270,16 @@ class APITestsMixin(APIAssertionsMixin):
 
     def test_create_duplicate_name_race_condition(self):
         """
-        If a dataset with the given name is created while the
-        ``/VolumeDriver.Create`` call is in flight, the call does not
-        result in an error.
+        If two ``/VolumeDriver.Create`` calls for the same name are in
+        flight at once, neither results in an error and only one dataset is
+        created.
         """
         name = u"thename"
-
-        # Create a dataset out-of-band with matching dataset ID and name
-        # which the docker plugin won't be able to see.
-        def create_after_list():
-            # Clean up the patched version:
-            del self.flocker_client.list_datasets_configuration
-            # But first time we're called, we create dataset and lie about
-            # its existence:
-            d = self.flocker_client.create_dataset(
-                self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
-                metadata={NAME_FIELD: name})
-            d.addCallback(lambda _: DatasetsConfiguration(
-                tag=u"1234", datasets={}))
-            return d
-        self.flocker_client.list_datasets_configuration = create_after_list
-
-        return self.create(name)
+        d = gatherResults([self.create(name), self.create(name)])
+        d.addCallback(
+            lambda _: self.flocker_client.list_datasets_configuration())
+        d.addCallback(lambda results: self.assertEqual(len(list(results)), 1))
+        return d
 
     def _flush_volume_plugin_reactor_on_endpoint_render(self):
         """
@@ -346,14 +334,51 @@ class APITestsMixin(APIAssertionsMixin):
             self.assertEqual([self.NODE_A],
                              [d.primary for d in datasets
                               if d.dataset_id == dataset_id])
-            # There should be less than 20 calls to list_datasets_state over
-            # the course of 5 seconds.
-            self.assertLess(
-                self.flocker_client.num_calls('list_datasets_state'), 20)
+            # Rather than polling, the state is retrieved once and then
+            # watched until it changes:
+            self.assertEqual(
+                2, self.flocker_client.num_calls('watch_datasets_state'))
         d.addCallback(final_assertions)
 
         return d
 
+    def test_mount_polls_without_generations(self):
+        """
+        If the control service can't wait for the cluster state to change,
+        ``/VolumeDriver.Mount`` polls it until the dataset arrives.
+        """
+        name = u"myvol"
+        dataset_id = uuid4()
+        calls = []
+        watch = self.flocker_client.watch_datasets_state
+
+        def watch_without_generation(generation=None):
+            calls.append(generation)
+            d = watch()
+            d.addCallback(lambda watched: watched.set(generation=None))
+            return d
+        self.patch(self.flocker_client, "watch_datasets_state",
+                   watch_without_generation)
+
+        d = self.flocker_client.create_dataset(
+            self.NODE_B, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name},
+            dataset_id=dataset_id)
+
+        self._flush_volume_plugin_reactor_on_endpoint_render()
+        self.volume_plugin_reactor.callLater(
+            5.0, self.flocker_client.synchronize_state)
+
+        d.addCallback(lambda _:
+                      self.assertResult(
+                          b"POST", b"/VolumeDriver.Mount",
+                          {u"Name": name}, OK,
+                          {u"Err": u"",
+                           u"Mountpoint": u"/flocker/{}".format(dataset_id)}))
+        # Once a second over the course of 5 seconds:
+        d.addCallback(lambda _: self.assertEqual([None] * 6, calls))
+        return d
+
     def test_mount_timeout(self):
         """
         ``/VolumeDriver.Mount`` sets the primary of the dataset with matching
@@ -519,9 +544,9 @@ class APITestsMixin(APIAssertionsMixin):
         """
         If an unexpected error occurs Docker gets back a useful error message.
         """
-        def error():
+        def error(key, value):
             raise CustomException("I've made a terrible mistake")
-        self.patch(self.flocker_client, "list_datasets_configuration",
+        self.patch(self.flocker_client, "list_datasets_by_metadata",
                    error)
         return self.assertResult(
             b"POST", b"/VolumeDriver.Path",
@@ -534,9 +559,9 @@ class APITestsMixin(APIAssertionsMixin):
         If a ``BadRequest`` exception is raised it is converted to appropriate
         JSON.
         """
-        def error():
+        def error(key, value):
             raise make_bad_request(code=423, Err=u"no good")
-        self.patch(self.flocker_client, "list_datasets_configuration",
+        self.patch(self.flocker_client, "list_datasets_by_metadata",
                    error)
         return self.assertResult(
             b"POST", b"/VolumeDriver.Path",
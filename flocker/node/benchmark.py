@@ -10,6 +10,9 @@ from pyrsistent import PClass
 from zope.interface import implementer
 
 from .diagnostics import list_hardware
+from ..control._benchmarks import (
+    compare_wire_codecs, measure_node_operations,
+)
 
 from ..common.script import (
     ICommandLineScript,
@@ -25,6 +28,36 @@ class HardwareReportOptions(Options):
     """
 
 
+class WireCodecsOptions(Options):
+    """
+    Command line options for ``flocker-benchmark wire-codecs``.
+    """
+    longdesc = """\
+    Compare the size and speed of the encodings of the cluster state sent to
+    the convergence agents.
+    """
+
+    optParameters = [
+        ['nodes', None, 1000, "The number of nodes in the cluster.", int],
+    ]
+
+
+class NodeScalingOptions(Options):
+    """
+    Command line options for ``flocker-benchmark node-scaling``.
+    """
+    longdesc = """\
+    Measure how the time taken to look up and update one node in the cluster
+    configuration and state grows with the number of nodes.
+    """
+
+    optParameters = [
+        ['nodes', None, [10, 100, 1000, 5000],
+         "Comma separated numbers of nodes in the clusters to measure.",
+         lambda value: [int(count) for count in value.split(",")]],
+    ]
+
+
 @flocker_standard_options
 class BenchmarkOptions(Options):
     """
@@ -39,6 +72,10 @@ class BenchmarkOptions(Options):
     subCommands = [
         ['hardware-report', None, HardwareReportOptions,
          "Print a hardware report."],
+        ['wire-codecs', None, WireCodecsOptions,
+         "Compare the wire encodings of the cluster state."],
+        ['node-scaling', None, NodeScalingOptions,
+         "Measure node lookup and update times as the cluster grows."],
     ]
 
     def postOptions(self):
@@ -56,6 +93,44 @@ def hardware_report(options):
     return succeed(None)
 
 
+def wire_codecs(options):
+    """
+    Print the size and encode and decode times of each wire encoding of the
+    state of a synthetic cluster to stdout, along with the time to encode it
+    again after one node changes.
+    """
+    for measurement in compare_wire_codecs(options['nodes']):
+        sys.stdout.write(
+            "{name}: {size} bytes, encode {encode:.3f}s, "
+            "decode {decode:.3f}s, "
+            "encode after one node changed {reencode:.3f}s\n".format(
+                name=measurement.name, size=measurement.size,
+                encode=measurement.encode_seconds,
+                decode=measurement.decode_seconds,
+                reencode=measurement.reencode_seconds,
+            )
+        )
+    return succeed(None)
+
+
+def node_scaling(options):
+    """
+    Print the mean time taken to look up and update a node for each cluster
+    size to stdout.
+    """
+    for measurement in measure_node_operations(options['nodes']):
+        sys.stdout.write(
+            "{nodes} nodes: get_node {get:.6f}s, update_node {update:.6f}s, "
+            "configuration update_node {configuration:.6f}s\n".format(
+                nodes=measurement.node_count,
+                get=measurement.get_node_seconds,
+                update=measurement.update_node_seconds,
+                configuration=measurement.update_configuration_seconds,
+            )
+        )
+    return succeed(None)
+
+
 @implementer(ICommandLineScript)
 class BenchmarkScript(PClass):
     """
@@ -63,6 +138,8 @@ class BenchmarkScript(PClass):
     """
     _subcommands = {
         'hardware-report': hardware_report,
+        'wire-codecs': wire_codecs,
+        'node-scaling': node_scaling,
     }
 
     def main(self, reactor, options):
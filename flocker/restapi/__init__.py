@@ -5,13 +5,14 @@ Infrastructure for publishing a REST HTTP API.
 """
 
 from ._infrastructure import (
-    structured, EndpointResponse, user_documentation, private_api,
+    structured, EndpointResponse, SerializedResult, user_documentation,
+    private_api,
     )
 
 from ._error import makeBadRequest as make_bad_request, BadRequest
 
 
 __all__ = [
-    "structured", "EndpointResponse", "user_documentation",
+    "structured", "EndpointResponse", "SerializedResult", "user_documentation",
     "make_bad_request", "private_api", "BadRequest",
 ]
@@ -11,7 +11,8 @@ from eliot import register_exception_extractor
 from twisted.web.http import BAD_REQUEST, FORBIDDEN, NOT_FOUND
 
 __all__ = [
-    "BadRequest", "InvalidRequestJSON", "makeBadRequest",
+    "BadRequest", "InvalidRequestJSON", "InvalidRequestQuery",
+    "makeBadRequest",
 
     "DECODING_ERROR_DESCRIPTION",
 
@@ -99,6 +100,20 @@ class InvalidRequestJSON(BadRequest):
             {u"description": self.description, u"errors": errors})
 
 
+class InvalidRequestQuery(BadRequest):
+    description = cleandoc(u"""
+    The provided query parameters don't match the required schema.
+    """)
+
+    __doc__ = description
+
+    def __init__(self, errors, schema):
+        BadRequest.__init__(
+            self,
+            BAD_REQUEST,
+            {u"description": self.description, u"errors": errors})
+
+
 class NameCollision(Exception):
     """
     An entity was created with a name that already exists.
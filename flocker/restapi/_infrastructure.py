@@ -8,6 +8,8 @@ from __future__ import absolute_import
 from functools import wraps
 import os
 import sys
+from time import time
+from weakref import WeakSet
 
 from json import loads, dumps
 
@@ -21,8 +23,10 @@ from eliot.twisted import DeferredContext
 
 from pyrsistent import pmap
 
-from ._error import DECODING_ERROR, BadRequest, InvalidRequestJSON
-from ._logging import LOG_SYSTEM, REQUEST, JSON_REQUEST
+from ._error import (
+    DECODING_ERROR, BadRequest, InvalidRequestJSON, InvalidRequestQuery,
+)
+from ._logging import LOG_SYSTEM, REQUEST, JSON_REQUEST, REQUEST_PHASE
 from ._schema import getValidator
 
 _ASCENDING = b"ascending"
@@ -52,6 +56,27 @@ class EndpointResponse(object):
         self.headers = headers
 
 
+class SerializedResult(object):
+    """
+    An endpoint can return a L{SerializedResult} instance, directly or as the
+    result of an L{EndpointResponse}, to supply the JSON encoding of its
+    result rather than have it encoded for every request.
+
+    The same instance may be returned for many requests; it is only
+    validated against the output schema the first time.  Neither the result
+    nor the encoding may change afterwards.
+    """
+    def __init__(self, result, body):
+        """
+        @param result: The (structured) value the response body encodes.
+
+        @param body: The JSON encoding of C{result}.
+        @type body: L{bytes}
+        """
+        self.result = result
+        self.body = body
+
+
 def _get_logger(self):
     """
     Find the specific or default ``Logger``.
@@ -68,6 +93,23 @@ def _get_logger(self):
         return logger
 
 
+def _timed(logger, phase, f, *args, **kwargs):
+    """
+    Call a function, logging how long it took.
+
+    :param logger: The ``Logger`` to log to.
+    :param unicode phase: The part of handling a request ``f`` implements.
+    :param f: The function to call with the remaining arguments.
+
+    :return: The result of ``f``.
+    """
+    start = time()
+    try:
+        return f(*args, **kwargs)
+    finally:
+        REQUEST_PHASE(phase=phase, duration=time() - start).write(logger)
+
+
 def _logging(original):
     """
     Decorate a method which implements an API endpoint to add Eliot-based
@@ -175,33 +217,85 @@ def _serialize(outputValidator):
         of a Klein route endpoint that may return a Deferred.
     """
     def deco(original):
-        def success(result, request):
+        # The SerializedResult instances already validated:
+        validated = WeakSet()
+
+        def success(result, request, logger):
             code = OK
             headers = {}
             if isinstance(result, EndpointResponse):
                 code = result.code
                 headers = result.headers
                 result = result.result
-            if _validate_responses:
-                outputValidator.validate(result)
+            body = None
+            serialized = None
+            if isinstance(result, SerializedResult):
+                serialized = result
+                body = result.body
+                result = result.result
+            if _validate_responses and serialized not in validated:
+                _timed(logger, u"validate_output",
+                       outputValidator.validate, result)
+                if serialized is not None:
+                    validated.add(serialized)
             request.responseHeaders.setRawHeaders(
                 b"content-type", [b"application/json"])
             for key, value in headers.items():
                 request.responseHeaders.setRawHeaders(key, [value])
             request.setResponseCode(code)
-            return dumps(result)
+            if body is None:
+                body = _timed(logger, u"encode", dumps, result)
+            return body
 
         def doit(self, request, **routeArguments):
-            result = maybeDeferred(original, self, request, **routeArguments)
-            result.addCallback(success, request)
-            return result
+            result = DeferredContext(
+                maybeDeferred(original, self, request, **routeArguments))
+            result.addCallback(success, request, _get_logger(self))
+            return result.result
 
         return doit
     return deco
 
 
+def _decode_query(args):
+    """
+    Decode the query parameters of a request.
+
+    :param dict args: ``request.args``.
+
+    :return: A tuple of a ``dict`` mapping the ``unicode`` name of each
+        parameter to its ``unicode`` value, and a ``list`` of ``unicode``
+        descriptions of problems with the parameters.
+    """
+    query = {}
+    errors = []
+    for name, values in args.items():
+        try:
+            name = name.decode("utf-8")
+            values = [value.decode("utf-8") for value in values]
+        except UnicodeDecodeError:
+            errors.append(u"Query parameters must be UTF-8 encoded.")
+            continue
+        if len(values) > 1:
+            errors.append(u"Query parameter {} was given more than once."
+                          .format(name))
+        query[name] = values[-1]
+    return query, errors
+
+
+def _error_messages(validator, instance):
+    """
+    :param validator: A L{jsonschema} validator.
+    :param instance: The JSON to validate.
+
+    :return: A ``list`` of the ``unicode`` messages describing how
+        ``instance`` doesn't match the schema.
+    """
+    return [error.message for error in validator.iter_errors(instance)]
+
+
 def structured(inputSchema, outputSchema, schema_store=None,
-               ignore_body=False):
+               ignore_body=False, querySchema=None):
     """
     Decorate a Klein-style endpoint method so that the request body is
     automatically decoded and the response body is automatically encoded.
@@ -227,11 +321,23 @@ def structured(inputSchema, outputSchema, schema_store=None,
     :param ignore_body: If true, the body is not passed to the endpoint
         regardless of HTTP method, in particular including ``POST``. By
         default the body is only ignored for ``GET`` and ``HEAD``.
+    :param querySchema: JSON Schema describing the query parameters, as an
+        object mapping their names to their string values, or ``None`` to
+        ignore them.  If given, the object is passed to the endpoint as the
+        ``query`` argument.
+
+    The validators are built once, when the endpoint is decorated.  The time
+    taken to decode and validate the request, run the endpoint, and validate
+    and encode the response is logged as ``REQUEST_PHASE`` messages.
     """
     if schema_store is None:
         schema_store = {}
     inputValidator = getValidator(inputSchema, schema_store)
     outputValidator = getValidator(outputSchema, schema_store)
+    if querySchema is None:
+        queryValidator = None
+    else:
+        queryValidator = getValidator(querySchema, schema_store)
 
     def deco(original):
         @wraps(original)
@@ -239,22 +345,33 @@ def structured(inputSchema, outputSchema, schema_store=None,
         @_logging
         @_serialize(outputValidator)
         def loadAndDispatch(self, request, **routeArguments):
+            logger = _get_logger(self)
             if request.method in (b"GET", b"DELETE") or ignore_body:
                 objects = {}
             else:
                 body = request.content.read()
                 try:
-                    objects = loads(body)
+                    objects = _timed(logger, u"decode", loads, body)
                 except ValueError:
                     raise DECODING_ERROR
 
-                errors = []
-                for error in inputValidator.iter_errors(objects):
-                    errors.append(error.message)
+                errors = _timed(
+                    logger, u"validate_input", _error_messages,
+                    inputValidator, objects)
                 if errors:
                     raise InvalidRequestJSON(errors=errors, schema=inputSchema)
 
-            eliot_action = JSON_REQUEST(_get_logger(self), json=objects.copy())
+            if queryValidator is not None:
+                query, errors = _decode_query(request.args)
+                errors.extend(_timed(
+                    logger, u"validate_query", _error_messages,
+                    queryValidator, query))
+                if errors:
+                    raise InvalidRequestQuery(
+                        errors=errors, schema=querySchema)
+                objects[u"query"] = query
+
+            eliot_action = JSON_REQUEST(logger, json=objects.copy())
             with eliot_action.context():
                 # Just assume there are no conflicts between these collections
                 # of arguments right now.  When there is a schema for the JSON
@@ -263,8 +380,15 @@ def structured(inputSchema, outputSchema, schema_store=None,
                 # body and then we can be sure there are no conflicts here.
                 objects.update(routeArguments)
 
+                start = time()
                 d = DeferredContext(maybeDeferred(original, self, **objects))
 
+                def handled(result):
+                    REQUEST_PHASE(
+                        phase=u"handle", duration=time() - start).write(logger)
+                    return result
+                d.addBoth(handled)
+
                 def got_result(result):
                     code = OK
                     if isinstance(result, EndpointResponse):
@@ -277,6 +401,7 @@ def structured(inputSchema, outputSchema, schema_store=None,
 
         loadAndDispatch.inputSchema = inputSchema
         loadAndDispatch.outputSchema = outputSchema
+        loadAndDispatch.querySchema = querySchema
         return loadAndDispatch
     return deco
 
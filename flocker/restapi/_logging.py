@@ -4,11 +4,12 @@
 This module defines the Eliot log events emitted by the API implementation.
 """
 
-from eliot import Field, ActionType
+from eliot import Field, ActionType, MessageType
 
 __all__ = [
     "JSON_REQUEST",
     "REQUEST",
+    "REQUEST_PHASE",
     ]
 
 LOG_SYSTEM = u"api"
@@ -24,6 +25,13 @@ JSON = Field.forTypes(
 RESPONSE_CODE = Field.forTypes(
     u"code", [int],
     u"The response code for the request.")
+PHASE = Field.forTypes(
+    u"phase", [unicode],
+    u"The part of handling the request: decode, validate_input, "
+    u"validate_query, handle, validate_output or encode.")
+DURATION = Field.forTypes(
+    u"duration", [float],
+    u"The time taken, in seconds.")
 
 
 # It would be nice if RESPONSE_CODE was in REQUEST instead of
@@ -43,3 +51,8 @@ JSON_REQUEST = ActionType(
     [JSON],
     [RESPONSE_CODE],
     u"A request containing JSON request body and HTTP response code.")
+
+REQUEST_PHASE = MessageType(
+    LOG_SYSTEM + u":request:phase",
+    [PHASE, DURATION],
+    u"The time taken by one part of handling a request.")
@@ -7,6 +7,7 @@ See https://python-jsonschema.readthedocs.org/en/v2.3.0/.
 """
 
 import copy
+from contextlib import contextmanager
 
 from jsonschema.validators import RefResolver, validator_for
 from jsonschema import draft4_format_checker
@@ -28,10 +29,40 @@ class SchemaNotProvided(Exception):
 class LocalRefResolver(RefResolver):
     """
     A L{RefResolver} that doesn't try to resolve remote schema.
+
+    Resolving a reference means joining and splitting URIs and walking the
+    referenced document, and validating a large listing resolves the same
+    few references over and over.  Each resolution is therefore remembered,
+    which relies on the schemas in the store not changing.
+
+    @ivar _resolved: A L{dict} mapping the base URI, resolution scope and
+        reference of each resolution to the resulting base URI, resolution
+        scope and schema.
     """
+    def __init__(self, *args, **kwargs):
+        RefResolver.__init__(self, *args, **kwargs)
+        self._resolved = {}
+
     def resolve_remote(self, uri):
         raise SchemaNotProvided(uri)
 
+    @contextmanager
+    def resolving(self, ref):
+        key = (self.base_uri, self.resolution_scope, ref)
+        cached = self._resolved.get(key)
+        if cached is None:
+            with RefResolver.resolving(self, ref) as resolved:
+                self._resolved[key] = (
+                    self.base_uri, self.resolution_scope, resolved)
+                yield resolved
+            return
+        old_base_uri, old_scope = self.base_uri, self.resolution_scope
+        self.base_uri, self.resolution_scope, resolved = cached
+        try:
+            yield resolved
+        finally:
+            self.base_uri, self.resolution_scope = old_base_uri, old_scope
+
 
 def getValidator(schema, schema_store):
     """
@@ -41,7 +72,9 @@ def getValidator(schema, schema_store):
     @type schema: L{dict}
 
     @param dict schema_store: A mapping between schema paths
-        (e.g. ``b/v1/types.json``) and the JSON schema structure.
+        (e.g. ``b/v1/types.json``) and the JSON schema structure.  Neither it
+        nor C{schema} may change afterwards, since the validator remembers
+        how it resolved references.
     """
     # The base_uri here isn't correct for the schema,
     # but does give proper relative paths.
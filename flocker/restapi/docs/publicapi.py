@@ -181,6 +181,8 @@ def _introspectRoute(route, exampleByIdentifier, schema_store):
             see C{'input'}.
       - C{'output_schema'} I{(optional)}:
              L{dict} including the verbatim output JSON Schema.
+      - C{'query'} I{(optional)}:
+            see C{'input'}, describing the query parameters.
       - C{'paged'} I{(optional)}:
             If present, the endpoint is paged.
             L{dict} with keys C{'defaultKey'} and C{'otherKeys'} giving the
@@ -209,6 +211,10 @@ def _introspectRoute(route, exampleByIdentifier, schema_store):
         result['output'] = _parseSchema(outputSchema, schema_store)
         result["output_schema"] = outputSchema
 
+    querySchema = route.attributes.get('querySchema', None)
+    if querySchema:
+        result['query'] = _parseSchema(querySchema, schema_store)
+
     examples = user_documentation.examples
     result['examples'] = list(
         Example.fromDictionary(exampleByIdentifier(identifier))
@@ -249,6 +255,19 @@ def _formatSchema(data, incoming):
             yield '   ' + line
 
 
+def _formatQuery(data):
+    """
+    Generate the rst documenting the query parameters of an endpoint.
+
+    :param data: The C{'query'} item of the result of L{_introspectRoute}.
+    """
+    for prop, attr in sorted(data[u'properties'].iteritems()):
+        yield ':query %s %s: %s' % (attr['type'], prop, attr['title'])
+        yield ''
+        for line in attr['description']:
+            yield '   ' + line
+
+
 def _formatActualSchema(schema, title, schema_store):
     """
     Format a schema to reStructuredText.
@@ -347,6 +366,10 @@ def _formatRouteBody(data, schema_store):
         for line in _formatExample(example, substitutions):
             yield line
 
+    if 'query' in data:
+        for line in _formatQuery(data['query']):
+            yield line
+
     if 'input' in data:
         for line in _formatSchema(data['input'], True):
             yield line
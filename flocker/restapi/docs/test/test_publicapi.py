@@ -322,6 +322,51 @@ class MakeRstTests(TestCase):
             '',
             ])
 
+    def test_querySchema(self):
+        """
+        The generated API documentation describes the query parameters.
+        """
+        app = Klein()
+
+        @app.route(b"/", methods=[b"GET"])
+        @structured(
+            inputSchema={},
+            outputSchema={},
+            querySchema={'$ref': '/v0/test.json#/endpoint'},
+            schema_store=self.INPUT_SCHEMAS,
+        )
+        @user_documentation(
+            u"Undocumented.", header=u"Header", section=u'section')
+        def dummy_f():
+            """
+            Developer docs,
+            """
+
+        rest = list(makeRst(
+            b"/prefix", 'section', app, None, self.INPUT_SCHEMAS))
+
+        self.assertEqual(rest, [
+            u'Header',
+            u'------',
+            u'',
+            u'',
+            '.. http:get:: /prefix/',
+            '',
+            '   Undocumented.',
+            '   ',
+            '   :query string optional: TITLE',
+            '   ',
+            '      one',
+            '      two',
+            '      ',
+            '   :query string param: TITLE',
+            '   ',
+            '      one',
+            '      two',
+            '      ',
+            '',
+            ])
+
     INPUT_ARRAY_SCHEMAS = {
         b'/v0/test.json': {
             'endpoint': {
@@ -8,7 +8,8 @@ from klein import Klein
 
 from eliot import ActionType
 from eliot.testing import (
-    assertHasAction, capture_logging, LoggedAction, validateLogging,
+    assertHasAction, capture_logging, LoggedAction, LoggedMessage,
+    validateLogging,
 )
 
 from pyrsistent import pvector
@@ -23,8 +24,9 @@ from twisted.web.http import (
 
 from .. import _infrastructure
 from .._infrastructure import (
-    EndpointResponse, user_documentation, structured, UserDocumentation)
-from .._logging import REQUEST, JSON_REQUEST
+    EndpointResponse, SerializedResult, user_documentation, structured,
+    UserDocumentation)
+from .._logging import REQUEST, JSON_REQUEST, REQUEST_PHASE
 from .._error import DECODING_ERROR_DESCRIPTION, BadRequest
 
 from ..testtools import (EventChannel, dumps, loads,
@@ -32,7 +34,8 @@ from ..testtools import (EventChannel, dumps, loads,
                          asResponse)
 from ...testtools import TestCase
 from .utils import (
-    _assertRequestLogged, _assertTracebackLogged, FAILED_INPUT_VALIDATION)
+    _assertRequestLogged, _assertTracebackLogged, FAILED_INPUT_VALIDATION,
+    FAILED_QUERY_VALIDATION)
 
 
 class ArbitraryException(Exception):
@@ -119,6 +122,15 @@ class ResultHandlingApplication(object):
         self.kwargs = kwargs
         return self._constructSuccess(self.result)
 
+    @app.route(b"/foo/query")
+    @structured({}, {}, querySchema={
+        u'properties': {u'int': {u'type': u'string', u'pattern': u'^[0-9]+$'}},
+        u'additionalProperties': False,
+        })
+    def query(self, **kwargs):
+        self.kwargs = kwargs
+        return self._constructSuccess(self.result)
+
     @app.route(b"/foo/badrequest")
     @structured({}, {})
     def badrequest(self):
@@ -138,6 +150,18 @@ class ResultHandlingApplication(object):
             self.EXPLICIT_RESPONSE_CODE, self.EXPLICIT_RESPONSE_RESULT,
             headers={"x-key": "value"}))
 
+    @app.route(b"/foo/serialized")
+    @structured({}, {'type': 'string'})
+    def serialized(self):
+        return self._constructSuccess(EndpointResponse(
+            self.EXPLICIT_RESPONSE_CODE,
+            SerializedResult(u"result", b'"serialized result"')))
+
+    @app.route(b"/foo/serializedresult")
+    @structured({}, {'type': 'string'})
+    def serializedresult(self):
+        return self._constructSuccess(self.result)
+
     @app.route(b"/baz/<routingValue>")
     @structured({}, {})
     def baz(self, **kwargs):
@@ -269,6 +293,21 @@ class StructuredResultHandlingMixin(object):
         response = asResponse(request)
         self.assertEqual(response.headers.getRawHeaders("x-key"), ["value"])
 
+    @validateLogging(
+        assertJSONLogged, b"GET", b"/foo/serialized", {},
+        ResultHandlingApplication.EXPLICIT_RESPONSE_CODE)
+    def test_serializedResult(self, logger):
+        """
+        If the result of the decorated function is a L{SerializedResult}
+        then its encoding is written as the response body as it is.
+        """
+        application = self.application(logger, {})
+        request = dummyRequest(b"GET", b"/foo/serialized", Headers(), b"")
+        self.render(application.app.resource(), request)
+        self.assertEqual(
+            (application.EXPLICIT_RESPONSE_CODE, b'"serialized result"'),
+            (request._code, request._responseBody))
+
     @validateLogging(assertHasAction, JSON_REQUEST, False,
                      {},
                      {"code":
@@ -546,6 +585,53 @@ class StructuredJSONTests(TestCase):
              len(response[u'errors'])),
             (BAD_REQUEST, FAILED_INPUT_VALIDATION, 2))
 
+    @validateLogging(
+        assertJSONLogged, b"GET", b"/foo/query", {u"query": {u"int": u"5"}},
+        OK)
+    def test_query(self, logger):
+        """
+        If the endpoint has a query schema, the query parameters are passed
+        to the decorated function as the C{query} argument.
+        """
+        request = dummyRequest(b"GET", b"/foo/query?int=5", Headers(), b"")
+        app = self.Application(logger, None)
+        render(app.app.resource(), request)
+        self.assertEqual({u"query": {u"int": u"5"}}, app.kwargs)
+
+    def assertInvalidQuery(self, logger, path, error_count):
+        """
+        Assert that a request to the query endpoint receives a I{BAD
+        REQUEST} response without the endpoint being called.
+
+        @param bytes path: The path, including the query, to request.
+        @param int error_count: The expected number of errors in the
+            response.
+        """
+        request = dummyRequest(b"GET", path, Headers(), b"")
+        app = self.Application(logger, None)
+        render(app.app.resource(), request)
+        response = loads(request._responseBody)
+        self.assertEqual(
+            (None, request._code, FAILED_QUERY_VALIDATION, error_count),
+            (app.kwargs, BAD_REQUEST, response[u'description'],
+             len(response[u'errors'])))
+
+    @validateLogging(_assertRequestLogged(b"/foo/query"))
+    def test_queryValidationError(self, logger):
+        """
+        If the query parameters don't match the query schema, then the request
+        automatically receives a I{BAD REQUEST} response.
+        """
+        self.assertInvalidQuery(logger, b"/foo/query?int=x&other=y", 2)
+
+    @validateLogging(_assertRequestLogged(b"/foo/query"))
+    def test_queryRepeated(self, logger):
+        """
+        If a query parameter is given more than once, then the request
+        automatically receives a I{BAD REQUEST} response.
+        """
+        self.assertInvalidQuery(logger, b"/foo/query?int=1&int=2", 1)
+
     @validateLogging(_assertTracebackLogged(ValidationError))
     # See above
     # @validateLogging(_assertRequestLogged(b"/foo/badresponse"))
@@ -582,6 +668,43 @@ class StructuredJSONTests(TestCase):
 
         self.assertEqual(request._code, OK)
 
+    @capture_logging(None)
+    def test_serializedResultValidatedOnce(self, logger):
+        """
+        A L{SerializedResult} returned for several requests is only validated
+        against the output schema for the first of them.
+        """
+        result = SerializedResult(u"result", b'"result"')
+        app = self.Application(logger, result)
+        codes = []
+        for i in range(2):
+            request = dummyRequest(b"GET", b"/foo/serializedresult",
+                                   Headers(), b"")
+            render(app.app.resource(), request)
+            codes.append(request._code)
+            # The second request would fail validation if it was done:
+            result.result = {}
+        self.assertEqual([OK, OK], codes)
+
+    @capture_logging(None)
+    def test_phases(self, logger):
+        """
+        The time taken by each part of handling a request is logged within
+        the request action.
+        """
+        request = dummyRequest(
+            b"PUT", b"/foo/bar",
+            Headers({b"content-type": [b"application/json"]}), dumps({}))
+        render(self.Application(logger, {}).app.resource(), request)
+        [action] = LoggedAction.ofType(logger.messages, REQUEST)
+        descendants = list(action.descendants())
+        self.assertEqual(
+            [u"decode", u"validate_input", u"handle", u"validate_output",
+             u"encode"],
+            [message.message[u"phase"] for message in
+             LoggedMessage.ofType(logger.messages, REQUEST_PHASE)
+             if message in descendants])
+
     @validateLogging(_assertRequestLogged(b"/baz/quux", b"POST"))
     def test_onlyArgumentsFromRoute(self, logger):
         """
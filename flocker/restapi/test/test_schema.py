@@ -37,6 +37,31 @@ class LocalResolverTests(TestCase):
 
         self.assertIsInstance(e.args[0], SchemaNotProvided)
 
+    def test_resolvingCached(self):
+        """
+        L{LocalRefResolver.resolving} only resolves a reference the first
+        time, and restores the resolution scope afterwards either way.
+        """
+        store = {b"/types.json": {u"a": {u"$ref": u"#/b"}, u"b": {}}}
+        resolver = LocalRefResolver(base_uri=b'', referrer={}, store=store)
+        fragments = []
+        self.patch(
+            resolver, "resolve_fragment",
+            lambda document, fragment: fragments.append(fragment) or
+            LocalRefResolver.resolve_fragment(resolver, document, fragment))
+        results = []
+        for i in range(2):
+            with resolver.resolving(b"/types.json#/a") as resolved:
+                with resolver.resolving(resolved[u"$ref"]) as nested:
+                    results.append(
+                        (nested, resolver.base_uri,
+                         resolver.resolution_scope))
+            results.append((resolver.base_uri, resolver.resolution_scope))
+        self.assertEqual(
+            ([({}, b"/types.json", b"/types.json"), (b"", b"")] * 2,
+             [u"/a", u"/b"]),
+            (results, fragments))
+
 
 class GetValidatorTests(TestCase):
     """
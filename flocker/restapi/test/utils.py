@@ -38,6 +38,9 @@ del __eq__
 FAILED_INPUT_VALIDATION = (
     u"The provided JSON doesn't match the required schema.")
 
+FAILED_QUERY_VALIDATION = (
+    u"The provided query parameters don't match the required schema.")
+
 
 def _assertRequestLogged(path, method=b"GET"):
     def actuallyAssert(self, logger):